@@ -0,0 +1,411 @@
+"""Benchmark and scaling suite for the policy decision path (pq.decide / rule.decide).
+
+Each case fills the server state with N tracked IPs (70% trusted with trust
+in 0.3-1.0, the rest below TRUST_THRESHOLD; pq also rebuilds its top-25%
+heap), then drives decisions for `--seconds` from C threads / keep-alive
+connections. A fraction of the decisions are trust-crossing events: a
+trusted IP sends a burst-like delta (ATTACK_DELTA, p-value far below the
+threshold) so its trust drops below TRUST_THRESHOLD, which in pq.py forces
+a full update_top_ips_heap(); the other decisions use exponential deltas
+around EXPECTED_INTERVAL, which mostly take the update_single_ip_in_heap()
+path. Attacks go round-robin over the trusted IPs and each attacked IP is
+put back to its populated trust right before it is hit (outside the timed
+call; over HTTP this is one extra /_bench/restore request), so every attack
+starts above the threshold and the measured crossing share tracks the
+requested one. Every case reports ops/sec, latency percentiles (us) and the share of
+decisions that actually crossed the threshold. Each case is run --repeat
+times (state rebuilt each time) and the run with the median ops/sec is
+kept; the 1M-IP cases take minutes, since every decision scans the state.
+
+  python3 bench_policy.py                          in-process, full matrix
+  python3 bench_policy.py --http                   same over HTTP (a server
+                                                   process is started here)
+  python3 bench_policy.py --url http://host:5000   against a running server
+  python3 bench_policy.py --baseline base.json     run, then flag regressions
+  python3 bench_policy.py --compare base.json new.json
+
+Results go to a JSON file (-o). A case regresses when its ops/sec fell, or
+its p99 rose, by more than --threshold relative to the baseline case with
+the same target, mode, IP count, crossing mix and concurrency; the exit
+status is 1 when any case regressed. Keep the threshold above the run-to-run
+noise of the machine (compare two runs of the same commit first).
+"""
+import argparse
+import http.client
+import importlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+DEFAULT_SIZES = (10, 100, 1000, 10000, 100000, 1000000)
+DEFAULT_CROSSING = (0.0, 0.01, 0.1)
+DEFAULT_CONCURRENCY = (1, 4, 16)
+TRUSTED_FRACTION = 0.7
+ATTACK_DELTA = 1e-4       # 雙尾 p-value ≈ 2e-4 < P_TRUST_TH：trust 乘 0.2，跌破門檻
+WORKLOAD_SIZE = 100000    # 預先產生的 (ip, delta)，執行緒依序循環使用
+SERVE_PORT = 5099
+KEYS = ('target', 'mode', 'ips', 'crossing', 'concurrency')
+
+
+def ip_for(i):
+    return f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+
+
+def populate(module, n, seed=1):
+    """Replace the module's state with n IPs; returns the trusted IPs as [ip, trust] pairs."""
+    rng = random.Random(seed)
+    trusted = []
+    with module.lock:
+        module.state.clear()
+        for i in range(n):
+            ip = ip_for(i)
+            if rng.random() < TRUSTED_FRACTION:
+                module.state[ip] = {'success_count': 60, 'trust': rng.uniform(0.3, 1.0), 'p_value': 0.5}
+                trusted.append([ip, module.state[ip]['trust']])
+            else:
+                module.state[ip] = {'success_count': 0, 'trust': rng.uniform(0.0, module.TRUST_THRESHOLD),
+                                    'p_value': 0.001}
+        if hasattr(module, 'update_top_ips_heap'):
+            module.update_top_ips_heap()
+    return trusted
+
+
+def restore(module, ip, trust):
+    """Put an attacked IP back to its populated trust. pq's heap is left as is: the attack
+    that follows crosses the threshold and rebuilds it."""
+    with module.lock:
+        module.state[ip] = {'success_count': 60, 'trust': trust, 'p_value': 0.5}
+
+
+def workload(n, trusted, crossing, seed=2):
+    """(ip, delta, restore_trust) ops; restore_trust is set only on attacks."""
+    rng = random.Random(seed)
+    targets = list(trusted)
+    rng.shuffle(targets)
+    ops = []
+    hits = 0
+    for _ in range(WORKLOAD_SIZE):
+        if targets and rng.random() < crossing:
+            # 依序輪流攻擊不同的 trusted IP，同一個 IP 要等其他 IP 都被攻擊過才會再被攻擊
+            ip, trust = targets[hits % len(targets)]
+            ops.append((ip, ATTACK_DELTA, trust))
+            hits += 1
+        else:
+            ops.append((ip_for(rng.randrange(n)), rng.expovariate(1.0), None))
+    return ops
+
+
+class InProcess:
+    mode = 'inproc'
+
+    def __init__(self, module):
+        self.module = module
+
+    def setup(self, n):
+        return populate(self.module, n)
+
+    def client(self):
+        state = self.module.state
+        threshold = self.module.TRUST_THRESHOLD
+        decide = self.module.decide
+
+        def call(ip, delta):
+            # 回傳此決策是否跨越 TRUST_THRESHOLD
+            entry = state.get(ip)
+            before = entry['trust'] > threshold if entry else False
+            return (decide(ip, delta)['trust'] > threshold) != before
+
+        def reset(ip, trust):
+            restore(self.module, ip, trust)
+        return call, reset, None
+
+
+class OverHttp:
+    mode = 'http'
+
+    def __init__(self, url, module):
+        parsed = urlparse(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.threshold = module.TRUST_THRESHOLD
+
+    def _post(self, conn, path, body):
+        conn.request('POST', path, json.dumps(body), {'Content-Type': 'application/json'})
+        resp = conn.getresponse()
+        return resp.status, resp.read()
+
+    def setup(self, n):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=600)
+        status, body = self._post(conn, '/_bench/populate', {'ips': n})
+        if status == 200:
+            trusted = json.loads(body)['trusted']
+        else:
+            # 外部伺服器：以一般請求建立 n 個 IP（trust 皆低於門檻，沒有可送 ATTACK_DELTA 的 trusted IP）
+            if self._post(conn, '/reset', {})[0] != 200:
+                print("  (no /reset on this server: state from earlier cases is kept)")
+            for i in range(n):
+                self._post(conn, '/policy', {'ip': ip_for(i), 'time_delta': 1.0})
+            trusted = []
+        conn.close()
+        return trusted
+
+    def client(self):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=600)
+        last = {}
+        threshold = self.threshold
+
+        def call(ip, delta):
+            status, body = self._post(conn, '/policy', {'ip': ip, 'time_delta': delta})
+            trust = json.loads(body)['trust']
+            crossed = ip in last and (trust > threshold) != last[ip]
+            last[ip] = trust > threshold
+            return crossed
+
+        def reset(ip, trust):
+            self._post(conn, '/_bench/restore', {'ip': ip, 'trust': trust})
+            last[ip] = trust > threshold
+        return call, reset, conn.close
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def run_case(target, ops, concurrency, seconds, max_ops):
+    latencies = [[] for _ in range(concurrency)]
+    crossings = [0] * concurrency
+    barrier = threading.Barrier(concurrency + 1)
+    deadline = [0.0]
+
+    def worker(k):
+        call, reset, close = target.client()
+        lat = latencies[k]
+        crossed = 0
+        i = k * (len(ops) // concurrency)
+        limit = max_ops // concurrency or 1
+        perf_counter = time.perf_counter
+        barrier.wait()
+        while len(lat) < limit and perf_counter() < deadline[0]:
+            ip, delta, trust = ops[i % len(ops)]
+            if trust is not None:
+                reset(ip, trust)
+            t0 = perf_counter()
+            crossed += call(ip, delta)
+            lat.append(perf_counter() - t0)
+            i += 1
+        crossings[k] = crossed
+        if close:
+            close()
+
+    threads = [threading.Thread(target=worker, args=(k,)) for k in range(concurrency)]
+    for t in threads:
+        t.start()
+    deadline[0] = time.perf_counter() + seconds
+    t0 = time.perf_counter()
+    barrier.wait()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    values = sorted(v * 1e6 for lat in latencies for v in lat)
+    count = len(values)
+    return {
+        'ops': count,
+        'seconds': round(elapsed, 3),
+        'ops_per_sec': round(count / elapsed, 1) if elapsed > 0 else 0.0,
+        'p50_us': round(percentile(values, 0.50), 2),
+        'p90_us': round(percentile(values, 0.90), 2),
+        'p99_us': round(percentile(values, 0.99), 2),
+        'p999_us': round(percentile(values, 0.999), 2),
+        'max_us': round(values[-1], 2) if values else 0.0,
+        'crossing_measured': round(sum(crossings) / count, 4) if count else 0.0,
+    }
+
+
+def start_server(target, port):
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', target, '--port', str(port)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/_bench/ping')
+            conn.getresponse().read()
+            conn.close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"benchmark server on port {port} did not start")
+
+
+def serve_target(name, port):
+    """--serve：在獨立程序中提供 target 的 app，另加 /_bench/populate 與 /_bench/restore 以便直接建立狀態"""
+    from flask import jsonify, request
+    import serve
+
+    module = importlib.import_module(name)
+
+    @module.app.route('/_bench/populate', methods=['POST'])
+    def bench_populate():
+        return jsonify({'trusted': populate(module, int(request.get_json(force=True)['ips']))})
+
+    @module.app.route('/_bench/restore', methods=['POST'])
+    def bench_restore():
+        data = request.get_json(force=True)
+        restore(module, data['ip'], float(data['trust']))
+        return 'ok'
+
+    @module.app.route('/_bench/ping', methods=['GET'])
+    def bench_ping():
+        return 'ok'
+
+    serve.run(module.app, host='127.0.0.1', port=port)
+
+
+def run_suite(args):
+    module = importlib.import_module(args.target)
+    server = None
+    if args.url:
+        target = OverHttp(args.url, module)
+    elif args.http:
+        server = start_server(args.target, args.port)
+        target = OverHttp(f'http://127.0.0.1:{args.port}', module)
+    else:
+        target = InProcess(module)
+
+    results = []
+    try:
+        for n in args.sizes:
+            for crossing in args.crossing:
+                for concurrency in args.concurrency:
+                    runs = []
+                    for _ in range(args.repeat):
+                        trusted = target.setup(n)
+                        ops = workload(n, trusted, crossing)
+                        runs.append(run_case(target, ops, concurrency, args.seconds, args.max_ops))
+                    # 重複執行取 ops/sec 的中位數那一次，降低單次干擾造成的誤判
+                    runs.sort(key=lambda r: r['ops_per_sec'])
+                    row = {'target': args.target, 'mode': target.mode, 'ips': n, 'crossing': crossing,
+                           'concurrency': concurrency}
+                    row.update(runs[len(runs) // 2])
+                    row['ops_per_sec_runs'] = [r['ops_per_sec'] for r in runs]
+                    results.append(row)
+                    print(f"{row['mode']:<6} ips={n:<8} crossing={crossing:<5} c={concurrency:<3} "
+                          f"{row['ops_per_sec']:>10.1f} ops/s  p50={row['p50_us']:>9.1f}us  "
+                          f"p99={row['p99_us']:>9.1f}us  crossed={row['crossing_measured']:.3f}")
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+    return results
+
+
+def metadata(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'seconds': args.seconds,
+        'repeat': args.repeat,
+        'max_ops': args.max_ops,
+    }
+
+
+def compare(baseline, current, threshold):
+    """Return (regressions, report lines) for cases present in both result sets."""
+    base = {tuple(r[k] for k in KEYS): r for r in baseline['results']}
+    regressions = 0
+    lines = []
+    for row in current['results']:
+        key = tuple(row[k] for k in KEYS)
+        old = base.get(key)
+        if old is None:
+            continue
+        ops_change = row['ops_per_sec'] / old['ops_per_sec'] - 1.0 if old['ops_per_sec'] else 0.0
+        p99_change = row['p99_us'] / old['p99_us'] - 1.0 if old['p99_us'] else 0.0
+        regressed = ops_change < -threshold or p99_change > threshold
+        improved = ops_change > threshold and p99_change <= threshold
+        regressions += regressed
+        flag = 'REGRESSION' if regressed else 'improved' if improved else 'ok'
+        lines.append(f"{row['mode']:<6} ips={row['ips']:<8} crossing={row['crossing']:<5} c={row['concurrency']:<3} "
+                     f"ops/s {old['ops_per_sec']:>10.1f} -> {row['ops_per_sec']:>10.1f} ({ops_change * 100:+6.1f}%)  "
+                     f"p99 {old['p99_us']:>9.1f} -> {row['p99_us']:>9.1f}us ({p99_change * 100:+6.1f}%)  {flag}")
+    return regressions, lines
+
+
+def report_compare(baseline, current, threshold):
+    regressions, lines = compare(baseline, current, threshold)
+    print(f"\nBaseline {baseline['meta'].get('commit') or '?'} ({baseline['meta'].get('timestamp')}) vs "
+          f"{current['meta'].get('commit') or '?'} ({current['meta'].get('timestamp')}), "
+          f"threshold {threshold * 100:.0f}%:")
+    for line in lines:
+        print(line)
+    print(f"{regressions} regression(s) in {len(lines)} matching case(s)")
+    return 1 if regressions else 0
+
+
+def load(path):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"找不到檔案：{path}")
+    with open(path) as f:
+        return json.load(f)
+
+
+def parse_list(text, kind):
+    return tuple(kind(v) for v in text.split(','))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='政策決策路徑的效能與擴展性測試')
+    parser.add_argument('--target', default='pq', choices=['pq', 'rule'], help='測試的政策模組 (預設: pq)')
+    parser.add_argument('--http', action='store_true', help='啟動伺服器程序並經由 HTTP 測試')
+    parser.add_argument('--url', help='改對執行中的伺服器測試，例如 http://127.0.0.1:5000')
+    parser.add_argument('--port', type=int, default=SERVE_PORT, help=f'--http 使用的埠 (預設: {SERVE_PORT})')
+    parser.add_argument('--sizes', type=lambda s: parse_list(s, int), default=DEFAULT_SIZES,
+                        help='追蹤的 IP 數，以逗號分隔 (預設: 10,100,1000,10000,100000,1000000)')
+    parser.add_argument('--crossing', type=lambda s: parse_list(s, float), default=DEFAULT_CROSSING,
+                        help='跨越信任門檻的請求比例，以逗號分隔 (預設: 0,0.01,0.1)')
+    parser.add_argument('--concurrency', type=lambda s: parse_list(s, int), default=DEFAULT_CONCURRENCY,
+                        help='同時執行的執行緒 / 連線數，以逗號分隔 (預設: 1,4,16)')
+    parser.add_argument('--seconds', type=float, default=1.0, help='每種組合的測試秒數 (預設: 1)')
+    parser.add_argument('--repeat', type=int, default=3, help='每種組合重複次數，取 ops/sec 中位數 (預設: 3)')
+    parser.add_argument('--max-ops', type=int, default=200000, help='每種組合的決策次數上限 (預設: 200000)')
+    parser.add_argument('--output', '-o', default='bench_results.json', help='結果 JSON (預設: bench_results.json)')
+    parser.add_argument('--baseline', help='測試完成後與此結果比較')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='只比較兩個結果檔，不執行測試')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='ops/sec 下降或 p99 上升超過此比例即視為退步 (預設: 0.2)')
+    parser.add_argument('--serve', choices=['pq', 'rule'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_target(args.serve, args.port)
+        return 0
+    if args.compare:
+        return report_compare(load(args.compare[0]), load(args.compare[1]), args.threshold)
+
+    baseline = load(args.baseline) if args.baseline else None
+    current = {'meta': metadata(args), 'results': run_suite(args)}
+    with open(args.output, 'w') as f:
+        json.dump(current, f, indent=2)
+    print(f"Results written to {args.output}")
+    if baseline:
+        return report_compare(baseline, current, args.threshold)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
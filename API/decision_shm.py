@@ -0,0 +1,434 @@
+"""Shared-memory decision table and delta ring between the policy server and the edge plugin.
+
+Two memory-mapped files, both created (and re-initialised in place) by the
+policy server; the layouts must match mqtt-edge_fifo/common/decision_shm.h.
+
+* Decision table (DecisionTable, default /dev/shm/edge_decisions): the server
+  publishes the current action/trust of every IP, the plugin only reads.
+  Open-addressing hash table (FNV-1a of the IP string, linear probing) of
+  80-byte slots; a slot is never moved or freed until reset(). Each slot is
+  guarded by a seqlock: the single writer makes `seq` odd, writes the fields,
+  then makes it even again; a reader copies the slot and retries while `seq`
+  was odd or changed during the copy. The header carries a heartbeat so the
+  plugin can tell a live server from a stale table.
+
+* Delta ring (DeltaRing, default /dev/shm/edge_deltas): one-way ring of
+  72-byte (recv_ts, delta, packet_count, ip) reports from the plugin (single
+  producer; the plugin's workers serialise on a mutex) to the server (single
+  consumer). head and tail live on separate cache lines; the producer never
+  blocks and counts the reports it had to drop when the ring was full. The
+  server moves head only after it has applied a batch (poll(release=False)
+  then release()), so the plugin can wait for its own reports to be applied
+  before it falls back to HTTP for the same IP.
+
+The Python writer relies on x86-64 store ordering (stores are not reordered
+with other stores, loads not with other loads); 4- and 8-byte counters are
+written through aligned memoryview casts, i.e. single machine stores.
+
+`python decision_shm.py --selftest` runs a consistency test under concurrent
+load: one writer process republishing slots as fast as it can while reader
+processes verify that no torn slot is ever returned, plus a producer process
+streaming numbered reports through the ring.
+"""
+import argparse
+import mmap
+import multiprocessing as mp
+import os
+import random
+import struct
+import tempfile
+import time
+
+TABLE_PATH = '/dev/shm/edge_decisions'
+RING_PATH = '/dev/shm/edge_deltas'
+
+TABLE_MAGIC = b'EDGEDEC1'
+RING_MAGIC = b'EDGEDLT1'
+SHM_VERSION = 1
+DEFAULT_SLOTS = 65536
+DEFAULT_RING_CAPACITY = 65536
+
+# 與 decision_shm.h 相同的動作代碼
+ACTION_NONE, ACTION_DROP, ACTION_LOW, ACTION_HIGH = 0, 1, 2, 3
+ACTIONS = {'drop': ACTION_DROP, 'low': ACTION_LOW, 'high': ACTION_HIGH}
+ACTION_NAMES = {v: k for k, v in ACTIONS.items()}
+
+# DecisionShmHeader (64 bytes): magic, version, slot_count, slot_size, _pad, generation, heartbeat_ts, writer_pid
+TABLE_HEADER = struct.Struct('<8sIIIIQdI20x')
+TABLE_HEADER_SIZE = 64
+GENERATION_OFF, HEARTBEAT_OFF = 24, 32
+# DecisionSlot (80 bytes): seq, action, _pad[3], trust, p_value, updated_ts, ip[48]
+SLOT_SIZE = 80
+SLOT_FIELDS = struct.Struct('<B3xddd48s')      # 位移 4 起，seq 之後的欄位
+SLOT_FIELDS_OFF = 4
+SLOT_IP_OFF = 28                               # ip 相對於 SLOT_FIELDS_OFF 的位移
+IP_SIZE = 48
+
+# DeltaRingHeader (192 bytes): line 0 magic/version/capacity/record_size, line 1 head, line 2 tail/dropped
+RING_HEADER = struct.Struct('<8sIII44x')
+RING_HEADER_SIZE = 192
+HEAD_OFF, TAIL_OFF, DROPPED_OFF = 64, 128, 136
+# DeltaReport (72 bytes)
+REPORT = struct.Struct('<ddQ48s')
+
+assert TABLE_HEADER.size == TABLE_HEADER_SIZE and SLOT_FIELDS_OFF + SLOT_FIELDS.size == SLOT_SIZE
+assert RING_HEADER.size == 64 and REPORT.size == 72
+
+
+def fnv1a(ip):
+    h = 2166136261
+    for c in ip.encode():
+        h = ((h ^ c) * 16777619) & 0xFFFFFFFF
+    return h
+
+
+def _round_pow2(n):
+    c = 1
+    while c < n:
+        c <<= 1
+    return c
+
+
+def _map(path, size, create):
+    """mmap of `path`; with create the file is sized in place (same inode, so readers stay attached)."""
+    fd = os.open(path, os.O_RDWR | (os.O_CREAT if create else 0), 0o666)
+    try:
+        if create and os.fstat(fd).st_size != size:
+            os.ftruncate(fd, size)
+        size = size or os.fstat(fd).st_size
+        return mmap.mmap(fd, size)
+    finally:
+        os.close(fd)
+
+
+class DecisionTable:
+    """create=True: the (single) writer, normally the policy server. create=False: a reader."""
+
+    def __init__(self, path=TABLE_PATH, slots=DEFAULT_SLOTS, create=False):
+        self.path = path
+        if create:
+            slots = _round_pow2(slots)
+            self.mm = _map(path, TABLE_HEADER_SIZE + slots * SLOT_SIZE, True)
+        else:
+            self.mm = _map(path, 0, False)
+            magic, version, slots, slot_size = TABLE_HEADER.unpack_from(self.mm)[:4]
+            if magic != TABLE_MAGIC or version != SHM_VERSION or slot_size != SLOT_SIZE:
+                raise ValueError(f"{path}: not a decision table (magic={magic!r}, version={version})")
+        self.slots = slots
+        self.mask = slots - 1
+        self.seq = memoryview(self.mm)[TABLE_HEADER_SIZE:].cast('I')    # 每個 slot 的第一個 uint32
+        self.header_q = memoryview(self.mm)[:TABLE_HEADER_SIZE].cast('Q')
+        self.index = {}     # writer：ip -> slot
+        if create:
+            self.reset()
+
+    def close(self):
+        self.seq.release()
+        self.header_q.release()
+        self.mm.close()
+
+    # ----- writer -----
+    def reset(self):
+        """Clear every slot and bump the generation.
+
+        Used slots are cleared under their seqlock and keep counting up: a reader that
+        copied a slot before the reset must never see the same seq again on a new IP.
+        """
+        if self.mm[:8] == TABLE_MAGIC:
+            generation = self.generation() + 1
+            empty = bytes(SLOT_FIELDS.size)
+            for slot in range(self.slots):
+                i = slot * (SLOT_SIZE // 4)
+                base = TABLE_HEADER_SIZE + slot * SLOT_SIZE + SLOT_FIELDS_OFF
+                if self.mm[base + SLOT_IP_OFF] == 0 and not self.seq[i] & 1:
+                    continue
+                seq = self.seq[i] | 1
+                self.seq[i] = seq                                # 奇數：寫入中
+                self.mm[base:base + SLOT_FIELDS.size] = empty
+                self.seq[i] = seq + 1                            # 偶數：完成
+        else:
+            # 新建立（或不是決策表）的檔案：還沒有 reader 接上，整段清空
+            generation = 1
+            self.mm[TABLE_HEADER_SIZE:] = bytes(len(self.mm) - TABLE_HEADER_SIZE)
+        TABLE_HEADER.pack_into(self.mm, 0, TABLE_MAGIC, SHM_VERSION, self.slots, SLOT_SIZE, 0,
+                               generation, time.time(), os.getpid())
+        self.index.clear()
+
+    def heartbeat(self, now=None):
+        struct.pack_into('<d', self.mm, HEARTBEAT_OFF, time.time() if now is None else now)
+
+    def publish(self, ip, action, trust, p_value, now=None):
+        """Write one IP's decision; False when the table is full (the plugin then keeps asking over HTTP)."""
+        slot = self.index.get(ip)
+        if slot is None:
+            slot = self._claim(ip)
+            if slot is None:
+                return False
+        base = TABLE_HEADER_SIZE + slot * SLOT_SIZE
+        seq = self.seq[slot * (SLOT_SIZE // 4)]
+        self.seq[slot * (SLOT_SIZE // 4)] = seq + 1          # 奇數：寫入中
+        SLOT_FIELDS.pack_into(self.mm, base + SLOT_FIELDS_OFF, ACTIONS.get(action, ACTION_NONE),
+                              trust, p_value, time.time() if now is None else now, ip.encode())
+        self.seq[slot * (SLOT_SIZE // 4)] = seq + 2          # 偶數：完成
+        return True
+
+    def _claim(self, ip):
+        key = ip.encode()
+        h = fnv1a(ip)
+        for i in range(self.slots):
+            slot = (h + i) & self.mask
+            base = TABLE_HEADER_SIZE + slot * SLOT_SIZE + SLOT_FIELDS_OFF + SLOT_IP_OFF
+            slot_ip = self.mm[base:base + IP_SIZE].rstrip(b'\0')
+            if not slot_ip or slot_ip == key:
+                self.index[ip] = slot
+                return slot
+        return None
+
+    # ----- reader -----
+    def generation(self):
+        return self.header_q[GENERATION_OFF // 8]
+
+    def heartbeat_ts(self):
+        return struct.unpack_from('<d', self.mm, HEARTBEAT_OFF)[0]
+
+    def read_slot(self, slot, retries=100):
+        """(action, trust, p_value, updated_ts, ip) of a consistent copy of the slot, or None on contention."""
+        seq = self.seq
+        i = slot * (SLOT_SIZE // 4)
+        base = TABLE_HEADER_SIZE + slot * SLOT_SIZE + SLOT_FIELDS_OFF
+        for _ in range(retries):
+            s1 = seq[i]
+            if s1 & 1:
+                continue
+            fields = SLOT_FIELDS.unpack_from(self.mm, base)
+            if seq[i] == s1:
+                return fields
+        return None
+
+    def lookup(self, ip):
+        """{'action', 'trust', 'p_value', 'updated_ts'} for ip, or None if it is not in the table."""
+        key = ip.encode()
+        h = fnv1a(ip)
+        for i in range(self.slots):
+            fields = self.read_slot((h + i) & self.mask)
+            if fields is None:
+                raise TimeoutError(f"slot of {ip} kept changing")
+            action, trust, p_value, updated_ts, slot_ip = fields
+            slot_ip = slot_ip.rstrip(b'\0')
+            if not slot_ip:
+                return None
+            if slot_ip == key:
+                return {'action': ACTION_NAMES.get(action), 'trust': trust, 'p_value': p_value,
+                        'updated_ts': updated_ts}
+        return None
+
+    def items(self):
+        for slot in range(self.slots):
+            fields = self.read_slot(slot)
+            if fields and fields[4][0]:
+                action, trust, p_value, updated_ts, ip = fields
+                yield ip.rstrip(b'\0').decode(), ACTION_NAMES.get(action), trust, p_value, updated_ts
+
+
+class DeltaRing:
+    """create=True: the consumer (policy server) that owns the ring. create=False: a producer."""
+
+    def __init__(self, path=RING_PATH, capacity=DEFAULT_RING_CAPACITY, create=False):
+        self.path = path
+        if create:
+            capacity = _round_pow2(capacity)
+            self.mm = _map(path, RING_HEADER_SIZE + capacity * REPORT.size, True)
+        else:
+            self.mm = _map(path, 0, False)
+            magic, version, capacity, record_size = RING_HEADER.unpack_from(self.mm)
+            if magic != RING_MAGIC or version != SHM_VERSION or record_size != REPORT.size:
+                raise ValueError(f"{path}: not a delta ring (magic={magic!r}, version={version})")
+        self.capacity = capacity
+        self.mask = capacity - 1
+        self.q = memoryview(self.mm)[:RING_HEADER_SIZE].cast('Q')
+        self.polled = None        # poll(release=False) 讀到的位置，release() 時才寫入 head
+        if create:
+            # 保留 tail（插件可能仍在寫入），丟棄舊的未讀報告
+            if self.mm[:8] != RING_MAGIC:
+                self.mm[:RING_HEADER_SIZE] = bytes(RING_HEADER_SIZE)
+            RING_HEADER.pack_into(self.mm, 0, RING_MAGIC, SHM_VERSION, capacity, REPORT.size)
+            self.q[HEAD_OFF // 8] = self.q[TAIL_OFF // 8]
+
+    def close(self):
+        self.q.release()
+        self.mm.close()
+
+    def dropped(self):
+        return self.q[DROPPED_OFF // 8]
+
+    def depth(self):
+        return self.q[TAIL_OFF // 8] - self.q[HEAD_OFF // 8]
+
+    def push(self, ip, delta, recv_ts, packet_count=0):
+        """Producer side (the plugin does this in C); False when the ring is full."""
+        head, tail = self.q[HEAD_OFF // 8], self.q[TAIL_OFF // 8]
+        if tail - head >= self.capacity:
+            self.q[DROPPED_OFF // 8] += 1
+            return False
+        REPORT.pack_into(self.mm, RING_HEADER_SIZE + (tail & self.mask) * REPORT.size,
+                         recv_ts, delta, packet_count, ip.encode())
+        self.q[TAIL_OFF // 8] = tail + 1
+        return True
+
+    def poll(self, max_reports=4096, release=True):
+        """List of (ip, delta, recv_ts, packet_count) reports in the order they were pushed.
+
+        With release=False head stays put until release(): the producer sees the
+        reports as pending until the caller has applied them.
+        """
+        head = self.polled if self.polled is not None else self.q[HEAD_OFF // 8]
+        n = min(self.q[TAIL_OFF // 8] - head, max_reports)
+        out = []
+        for k in range(head, head + n):
+            recv_ts, delta, count, ip = REPORT.unpack_from(self.mm, RING_HEADER_SIZE + (k & self.mask) * REPORT.size)
+            out.append((ip.rstrip(b'\0').decode(), delta, recv_ts, count))
+        self.polled = head + n
+        if release:
+            self.release()
+        return out
+
+    def release(self):
+        """Free the slots of every polled report (moves head)."""
+        if self.polled is not None:
+            self.q[HEAD_OFF // 8] = self.polled      # 讀完才釋放位置
+            self.polled = None
+
+
+# ===== 自我測試：併發負載下的一致性 =====
+ST_IPS = [f'10.{i // 250}.{i % 250}.1' for i in range(256)]
+
+
+def _st_writer(table_path, duration, out):
+    table = DecisionTable(table_path, create=False)
+    writes = 0
+    version = {}
+    end = time.time() + duration
+    while time.time() < end:
+        for ip in random.sample(ST_IPS, 32):
+            v = version.get(ip, 0) + 1
+            version[ip] = v
+            # 每個欄位都由同一個 v 推出；讀到混合兩次寫入的 slot 就會違反關係式
+            table.publish(ip, ('drop', 'low', 'high')[v % 3], float(v), 2.0 * v, now=3.0 * v)
+            writes += 1
+        table.heartbeat()
+    out.put(('writer', writes))
+
+
+def _st_reader(table_path, duration, out):
+    table = DecisionTable(table_path)
+    reads = misses = torn = regress = contended = 0
+    last = {}
+    end = time.time() + duration
+    while time.time() < end:
+        ip = random.choice(ST_IPS)
+        try:
+            d = table.lookup(ip)
+        except TimeoutError:
+            contended += 1
+            continue
+        if d is None:
+            misses += 1
+            continue
+        reads += 1
+        v = d['trust']
+        if (d['p_value'] != 2.0 * v or d['updated_ts'] != 3.0 * v
+                or d['action'] != ('drop', 'low', 'high')[int(v) % 3]):
+            torn += 1
+        if v < last.get(ip, 0):
+            regress += 1
+        last[ip] = v
+    out.put(('reader', reads, misses, torn, regress, contended))
+
+
+def _st_producer(ring_path, n, out):
+    ring = DeltaRing(ring_path)
+    pushed = 0
+    for k in range(n):
+        while ring.depth() >= ring.capacity:
+            pass     # 測試中等待消費者，以檢查沒有遺失；插件則計數後丟棄
+        pushed += ring.push(ST_IPS[k % len(ST_IPS)], float(k), time.time(), k)
+    out.put(('producer', pushed))
+
+
+def selftest(duration=5.0, readers=3, reports=200000):
+    shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    tmp = tempfile.mkdtemp(prefix='decision_shm_', dir=shm_dir)
+    table_path, ring_path = os.path.join(tmp, 'table'), os.path.join(tmp, 'ring')
+    table = DecisionTable(table_path, slots=1024, create=True)
+    ring = DeltaRing(ring_path, capacity=1024, create=True)
+
+    out = mp.Queue()
+    procs = [mp.Process(target=_st_writer, args=(table_path, duration, out)),
+             mp.Process(target=_st_producer, args=(ring_path, reports, out))]
+    procs += [mp.Process(target=_st_reader, args=(table_path, duration, out)) for _ in range(readers)]
+    for p in procs:
+        p.start()
+
+    # 主程序為 ring 的消費者：報告必須依序、不重複、不遺失
+    expected, out_of_order = 0, 0
+    while expected < reports:
+        batch = ring.poll()
+        if not batch:
+            time.sleep(0.0005)
+            continue
+        for ip, delta, _, count in batch:
+            if count != expected or delta != float(count) or ip != ST_IPS[count % len(ST_IPS)]:
+                out_of_order += 1
+            expected = count + 1
+    for p in procs:
+        p.join()
+    results = [out.get() for _ in procs]
+
+    writes = sum(r[1] for r in results if r[0] == 'writer')
+    reads = sum(r[1] for r in results if r[0] == 'reader')
+    torn = sum(r[3] for r in results if r[0] == 'reader')
+    regress = sum(r[4] for r in results if r[0] == 'reader')
+    contended = sum(r[5] for r in results if r[0] == 'reader')
+    print(f"table: {writes} writes, {reads} reads by {readers} readers in {duration:.1f}s, "
+          f"torn={torn}, went_backwards={regress}, gave_up={contended}")
+    print(f"ring:  {expected} reports consumed, out_of_order/corrupt={out_of_order}, dropped={ring.dropped()}")
+
+    table.close()
+    ring.close()
+    for name in (table_path, ring_path):
+        os.unlink(name)
+    os.rmdir(tmp)
+    ok = torn == 0 and regress == 0 and out_of_order == 0 and reads > 0
+    print('PASS' if ok else 'FAIL')
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='共享記憶體決策表 / delta ring 工具')
+    parser.add_argument('--selftest', action='store_true', help='併發負載下的一致性測試')
+    parser.add_argument('--duration', type=float, default=5.0, help='自我測試秒數 (預設: 5)')
+    parser.add_argument('--readers', type=int, default=3, help='自我測試的讀取程序數 (預設: 3)')
+    parser.add_argument('--dump', action='store_true', help='列出決策表內容')
+    parser.add_argument('--table', default=TABLE_PATH, help=f'決策表路徑 (預設: {TABLE_PATH})')
+    parser.add_argument('--ring', default=RING_PATH, help=f'delta ring 路徑 (預設: {RING_PATH})')
+    args = parser.parse_args()
+
+    if args.selftest:
+        raise SystemExit(0 if selftest(args.duration, args.readers) else 1)
+
+    if not os.path.exists(args.table):
+        raise FileNotFoundError(f"找不到檔案：{args.table}")
+    table = DecisionTable(args.table)
+    entries = list(table.items())
+    print(f"{args.table}: {len(entries)}/{table.slots} IPs, generation {table.generation()}, "
+          f"heartbeat {time.time() - table.heartbeat_ts():.3f}s ago")
+    if os.path.exists(args.ring):
+        ring = DeltaRing(args.ring)
+        print(f"{args.ring}: depth {ring.depth()}/{ring.capacity}, dropped {ring.dropped()}")
+    if args.dump:
+        for ip, action, trust, p_value, updated_ts in sorted(entries):
+            print(f"  {ip:<16} {action or '-':<5} trust={trust:.4f} p={p_value:.6f} updated={updated_ts:.6f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,19 @@ from flask import Flask, request, jsonify
 import threading
 import math
 import heapq
+import os
+import time
 from collections import defaultdict
 
+import decision_shm
+import metrics
+import profiler
+import serve
+import tracelog
+
 app = Flask(__name__)
+# /profile/start、/profile/stop、/profile：依端點取樣的 profiler（見 profiler.py）
+profiler.install(app)
 
 # 全域狀態
 state = {}
@@ -21,7 +31,32 @@ P_SUCCESS_TH      = 0.005  # p-value 成功閾值
 P_TRUST_TH        = 0.005  # p-value 信任更新閾值
 TRUST_THRESHOLD   = 0.2    # trust 放行閾值
 TOP_PERCENT       = 0.25   # 前 25% 為 high priority
+SHM_POLL_INTERVAL = 0.0005 # delta ring 為空時的等待 (s)
+
+# POLICY_SHM=on：決策同時發布到共享記憶體決策表，插件 (plugin_opt_decision_source shm)
+# 無鎖讀取，delta 經 delta ring 回報（見 decision_shm.py）
+shm_table = None
+delta_ring = None
+
+# 日誌等級與逐則決策追蹤（POLICY_LOG_LEVEL、POLICY_TRACE_SAMPLE，執行中可由 /loglevel 調整），
+# 由背景執行緒寫出，不佔用決策時間
+tracer = tracelog.Tracer()
+
+# GET /metrics：計數與 histogram 以執行緒為單位累加，不需取得 lock
+registry = metrics.Registry()
+decision_seconds = registry.histogram(
+    'policy_decision_seconds', 'Time spent in decide(), lock wait included')
+lock_wait_seconds = registry.histogram(
+    'policy_lock_wait_seconds', 'Time decide() waited to acquire the state lock')
+heap_rebuild_seconds = registry.histogram(
+    'policy_heap_rebuild_seconds', 'Duration of full top-25% heap rebuilds (update_top_ips_heap)')
+decisions_total = registry.counter(
+    'policy_decisions_total', 'Decisions returned, by action', label='action')
+registry.gauge('policy_tracked_ips', 'IPs with trust state', lambda: len(state))
+registry.gauge('policy_high_ips', 'IPs currently in the top-25% heap', lambda: len(top_ips_heap))
+registry.gauge('policy_high_threshold', 'Lowest trust in the top-25% heap', lambda: high_threshold)
 
+@heap_rebuild_seconds.time()
 def update_top_ips_heap():
     """重建前 25% IP 的 heap"""
     global top_ips_heap, high_threshold
@@ -109,13 +144,21 @@ def get_action_from_trust(trust_value, ip):
     is_high_priority = any(item[1] == ip for item in top_ips_heap)
     return 'high' if is_high_priority else 'low'
 
-@app.route('/policy', methods=['POST'])
-def policy():
-    data = request.get_json(force=True)
-    ip = data.get('ip')
-    delta = data.get('time_delta', 0.0)
-    
+def publish_decisions(ips):
+    """把 ips 目前的決策寫入共享記憶體決策表（需持有 lock）"""
+    for ip in ips:
+        entry = state[ip]
+        shm_table.publish(ip, get_action_from_trust(entry['trust'], ip), entry['trust'],
+                          entry.get('p_value', 0.0))
+
+def decide(ip, delta):
+    """以一則訊息的 time_delta 更新 ip 的 trust 與前 25% heap，回傳決策（/policy 的回應內容）"""
+    t0 = time.perf_counter()
     with lock:
+        lock_wait_seconds.observe(time.perf_counter() - t0)
+        # 排名改變時其他 IP 的 high/low 也會改變，發布決策表時一併更新
+        before = {item[1] for item in top_ips_heap} if shm_table else None
+
         # 獲取或創建 IP 狀態
         entry = state.get(ip, {'success_count': 0, 'trust': 0.0})
         old_trust = entry['trust']
@@ -144,6 +187,7 @@ def policy():
             entry['trust'] *= 0.2
         
         # 儲存狀態
+        entry['p_value'] = p_val
         state[ip] = entry
         new_trust = entry['trust']
         
@@ -163,20 +207,59 @@ def policy():
         
         # 統計資訊
         qualified_count = sum(1 for entry in state.values() if entry['trust'] > TRUST_THRESHOLD)
-        high_count = len(top_ips_heap)
-        
-        print(f"[policy] IP: {ip}, trust: {new_trust:.4f} → {action}")
-        print(f"         qualified: {qualified_count}, high: {high_count}, threshold: {high_threshold:.4f}")
-    
-    return jsonify({
-        'action': action,
-        'trust': new_trust,
-        'p_value': p_val,
-        'high_threshold': high_threshold,
-        'qualified_count': qualified_count,
-        'high_count': len(top_ips_heap),
-        'is_in_top_25': action == 'high'
-    })
+
+        if shm_table:
+            after = {item[1] for item in top_ips_heap}
+            publish_decisions((before ^ after) | {ip})
+
+        decisions_total.inc(action)
+        decision_seconds.observe(time.perf_counter() - t0)
+        return {
+            'action': action,
+            'trust': new_trust,
+            'p_value': p_val,
+            'high_threshold': high_threshold,
+            'qualified_count': qualified_count,
+            'high_count': len(top_ips_heap),
+            'is_in_top_25': action == 'high'
+        }
+
+@app.route('/policy', methods=['POST'])
+def policy():
+    data = request.get_json(force=True)
+    result = decide(data.get('ip'), data.get('time_delta', 0.0))
+
+    if tracer.sampled():
+        tracer.trace("[policy] IP: %s, trust: %.4f → %s", data.get('ip'), result['trust'], result['action'])
+        tracer.trace("         qualified: %d, high: %d, threshold: %.4f",
+                     result['qualified_count'], result['high_count'], result['high_threshold'])
+    return jsonify(result)
+
+def shm_consumer():
+    """依序處理插件經 delta ring 回報的 delta，並更新決策表的 heartbeat；
+    處理完才釋放 ring 位置，插件改走 HTTP 前會等 head 越過自己的回報"""
+    while True:
+        reports = delta_ring.poll(release=False)
+        for ip, delta, _, _ in reports:
+            result = decide(ip, delta)
+            if tracer.sampled():
+                tracer.trace("[policy] shm IP: %s, delta: %.6f, trust: %.4f → %s",
+                             ip, delta, result['trust'], result['action'])
+        delta_ring.release()
+        shm_table.heartbeat()
+        if not reports:
+            time.sleep(SHM_POLL_INTERVAL)
+
+def enable_shm(table_path=None, ring_path=None):
+    """建立（或在原檔案上重設）決策表與 delta ring，並啟動消費執行緒"""
+    global shm_table, delta_ring
+    with lock:
+        shm_table = decision_shm.DecisionTable(table_path or decision_shm.TABLE_PATH, create=True)
+        delta_ring = decision_shm.DeltaRing(ring_path or decision_shm.RING_PATH, create=True)
+        publish_decisions(list(state))
+    threading.Thread(target=shm_consumer, name='shm_consumer', daemon=True).start()
+    print(f"[policy] Shared-memory decisions: {shm_table.path} ({shm_table.slots} slots), "
+          f"deltas: {delta_ring.path} ({delta_ring.capacity} reports)")
 
 @app.route('/stats', methods=['GET'])
 def stats():
@@ -250,14 +333,40 @@ def reset():
         state.clear()
         top_ips_heap.clear()
         high_threshold = 0.0
-        print("[policy] All state reset")
+        if shm_table:
+            shm_table.reset()
+    tracer.info("[policy] All state reset")
     return jsonify({'status': 'reset_complete'})
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus 格式的決策延遲、lock 等待、heap 重建與各 action 計數"""
+    return registry.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+
+@app.route('/loglevel', methods=['GET', 'POST'])
+def loglevel():
+    """查詢或調整日誌等級與抽樣追蹤，例如 POST {"level": "info", "trace_sample": 100}"""
+    if request.method == 'POST':
+        data = request.get_json(force=True)
+        if 'level' in data and str(data['level']).lower() not in tracelog.LEVELS:
+            return jsonify({'error': f"unknown level {data['level']!r}",
+                            'levels': list(tracelog.LEVELS)}), 400
+        tracer.set(data.get('level'), data.get('trace_sample'))
+        tracer.emit("[policy] Log level: %s", tracer.describe())
+    return jsonify(tracer.config())
+
 if __name__ == '__main__':
     print(f"[policy] Starting policy server with top 25% IP tracking:")
     print(f"  - TRUST_THRESHOLD: {TRUST_THRESHOLD}")
     print(f"  - TOP_PERCENT: {TOP_PERCENT * 100}%")
     print(f"  - Logic: Top 25% of qualified IPs → HIGH, rest → LOW")
     print(f"  - Example: 4 qualified IPs → top 1 is HIGH, other 3 are LOW")
+    print(f"  - Log level: {tracer.describe()}")
+
+    shm = os.environ.get('POLICY_SHM') == 'on'
+    if shm:
+        enable_shm(os.environ.get('POLICY_SHM_TABLE'), os.environ.get('POLICY_SHM_RING'))
     
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Flask 的 reloader 會在另一個程序再執行一次本模組；開啟 shm 時兩個程序會各自消費同一個
+    # delta ring 並寫入同一張決策表，因此只保留 debug、不啟動 reloader
+    serve.run(app, host='0.0.0.0', port=5000, debug=True, use_reloader=not shm)
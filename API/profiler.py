@@ -0,0 +1,294 @@
+"""On-demand sampling profiler for the policy servers, per endpoint, no restart needed.
+
+install(app) wraps the WSGI app and adds three admin endpoints:
+
+  POST /profile/start   {"duration": 30, "interval_ms": 5, "all_threads": false,
+                         "switch_interval_ms": 0}
+  POST /profile/stop
+  GET  /profile         status and the hottest frames per endpoint;
+                        ?format=collapsed[&endpoint=/policy] returns
+                        flamegraph.pl / speedscope input
+
+While a profile runs, a sampler thread reads sys._current_frames() every
+interval and counts the stack of each thread that is inside a request,
+keyed by the request path, so time in Werkzeug/Flask, JSON handling,
+update_top_ips_heap or waiting on `lock` (the `with lock:` line of decide)
+shows up under the endpoint that spent it. With all_threads the other
+threads (waitress workers between requests, shm_consumer, the log writer)
+are sampled too, under "[thread <name>]". When no profile is running a
+request pays one attribute check. The sampler only runs when the thread
+holding the GIL lets go of it, so with the default 5ms switch interval
+short requests are mostly caught where they block on I/O; switch_interval_ms
+(opt-in, e.g. 0.2) lowers the interpreter-wide GIL switch interval for the
+duration of the profile to remove that bias, at the cost of more switching
+in the server, and is reported in the summary. A profile always stops after its
+duration (at most MAX_DURATION) and keeps at most MAX_STACKS distinct
+stacks; the result stays available until the next start.
+
+`python profiler.py --url http://host:5000 --duration 30 -o prof/` runs a
+profile against a live server and writes one collapsed file per endpoint.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+from flask import jsonify, request
+
+DEFAULT_DURATION = 30.0   # s
+MAX_DURATION = 600.0
+DEFAULT_INTERVAL = 0.005  # s
+MIN_INTERVAL = 0.001
+MAX_STACKS = 20000        # 每個 profile 不同 stack 數的上限，超過的樣本計入 [truncated]
+MIN_SWITCH_INTERVAL = 0.0001  # switch_interval_ms 的下限 (s)
+TOP_FRAMES = 10
+
+
+def _frame_name(code, lineno):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{lineno})"
+
+
+class Profiler:
+    def __init__(self):
+        self.active = None        # {thread ident: request path}，只在 profile 進行中存在
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.stacks = {}          # (label, ((code, lineno), ...)) -> samples
+        self.samples = {}         # label -> samples
+        self.truncated = 0
+        self.started = None
+        self.finished = None
+        self.duration = 0.0
+        self.interval = DEFAULT_INTERVAL
+        self.all_threads = False
+        self.switch_interval = None   # profile 期間設定的 GIL 切換間隔 (s)；None = 不更改
+        self.sample_time = 0.0    # 取樣執行緒本身花費的時間
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, duration=DEFAULT_DURATION, interval=DEFAULT_INTERVAL, all_threads=False,
+              switch_interval=None):
+        with self.lock:
+            if self.running:
+                return False
+            self.duration = min(max(float(duration), 0.1), MAX_DURATION)
+            self.interval = max(float(interval), MIN_INTERVAL)
+            self.all_threads = bool(all_threads)
+            self.switch_interval = max(float(switch_interval), MIN_SWITCH_INTERVAL) if switch_interval else None
+            self.stacks = {}
+            self.samples = {}
+            self.truncated = 0
+            self.sample_time = 0.0
+            self.started = time.time()
+            self.finished = None
+            self.stop_event.clear()
+            self.active = {}
+            self.thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        self.stop_event.set()
+        thread = self.thread
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+        deadline = time.monotonic() + self.duration
+        # 取樣執行緒要等持有 GIL 的執行緒釋放才能取樣；預設 5ms 的切換間隔下短請求幾乎都已跑到
+        # I/O 才釋放，取樣會偏向閒置的位置。縮短切換間隔會影響整個伺服器，因此只在明確指定時才更改
+        switch_interval = sys.getswitchinterval()
+        if self.switch_interval is not None:
+            sys.setswitchinterval(self.switch_interval)
+        try:
+            while not self.stop_event.is_set() and time.monotonic() < deadline:
+                t0 = time.perf_counter()
+                self._sample(me)
+                self.sample_time += time.perf_counter() - t0
+                self.stop_event.wait(self.interval)
+        finally:
+            sys.setswitchinterval(switch_interval)
+            self.active = None
+            self.finished = time.time()
+
+    def _sample(self, me):
+        frames = sys._current_frames()
+        active = dict(self.active)
+        names = {t.ident: t.name for t in threading.enumerate()} if self.all_threads else None
+        for ident, frame in frames.items():
+            if ident == me:
+                continue
+            label = active.get(ident)
+            if label is None:
+                if not self.all_threads:
+                    continue
+                label = f"[thread {names.get(ident, ident)}]"
+            stack = []
+            while frame is not None:
+                stack.append((frame.f_code, frame.f_lineno))
+                frame = frame.f_back
+            key = (label, tuple(reversed(stack)))
+            self.samples[label] = self.samples.get(label, 0) + 1
+            if key in self.stacks:
+                self.stacks[key] += 1
+            elif len(self.stacks) < MAX_STACKS:
+                self.stacks[key] = 1
+            else:
+                self.truncated += 1
+
+    def collapsed(self, endpoint=None):
+        """One "frame;frame;... count" line per stack; without endpoint the first frame is the endpoint."""
+        lines = []
+        for (label, stack), count in list(self.stacks.items()):
+            if endpoint is not None and label != endpoint:
+                continue
+            frames = [_frame_name(code, lineno) for code, lineno in stack]
+            if endpoint is None:
+                frames.insert(0, label)
+            lines.append(f"{';'.join(frames)} {count}")
+        lines.sort()
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def summary(self):
+        """Samples and the frames with the most self samples for each endpoint."""
+        leaves = {}
+        for (label, stack), count in list(self.stacks.items()):
+            name = _frame_name(*stack[-1]) if stack else '?'
+            per_label = leaves.setdefault(label, {})
+            per_label[name] = per_label.get(name, 0) + count
+        endpoints = {}
+        for label, total in sorted(self.samples.items(), key=lambda kv: -kv[1]):
+            top = sorted(leaves.get(label, {}).items(), key=lambda kv: -kv[1])[:TOP_FRAMES]
+            endpoints[label] = {
+                'samples': total,
+                'top_self': [{'frame': name, 'samples': n, 'percent': round(n * 100.0 / total, 1)}
+                             for name, n in top],
+            }
+        end = self.finished or time.time()
+        return {
+            'running': self.running,
+            'started': self.started,
+            'elapsed': round(end - self.started, 3) if self.started else 0.0,
+            'duration': self.duration,
+            'interval_ms': self.interval * 1000,
+            'all_threads': self.all_threads,
+            'switch_interval_ms': self.switch_interval * 1000 if self.switch_interval is not None else None,
+            'stacks': len(self.stacks),
+            'truncated': self.truncated,
+            'sampler_ms': round(self.sample_time * 1000, 3),
+            'endpoints': endpoints,
+        }
+
+
+class _ProfiledApp:
+    """WSGI middleware: records which request path each thread is serving while a profile runs."""
+
+    def __init__(self, wsgi_app, profiler):
+        self.wsgi_app = wsgi_app
+        self.profiler = profiler
+
+    def __call__(self, environ, start_response):
+        active = self.profiler.active
+        if active is None:
+            return self.wsgi_app(environ, start_response)
+        ident = threading.get_ident()
+        active[ident] = environ.get('PATH_INFO', '')
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            active.pop(ident, None)
+
+
+def install(app, profiler=None):
+    """Add the profiling middleware and /profile endpoints to a Flask app; returns the Profiler."""
+    profiler = profiler or Profiler()
+    app.wsgi_app = _ProfiledApp(app.wsgi_app, profiler)
+
+    @app.route('/profile/start', methods=['POST'])
+    def profile_start():
+        """開始取樣，例如 POST {"duration": 30, "interval_ms": 5, "all_threads": false}；
+        "switch_interval_ms": 0.2 會在 profile 期間縮短 GIL 切換間隔（預設不更改）"""
+        data = request.get_json(force=True, silent=True) or {}
+        try:
+            switch_ms = data.get('switch_interval_ms')
+            started = profiler.start(data.get('duration', DEFAULT_DURATION),
+                                     data.get('interval_ms', DEFAULT_INTERVAL * 1000) / 1000.0,
+                                     data.get('all_threads', False),
+                                     switch_ms / 1000.0 if switch_ms else None)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'duration, interval_ms and switch_interval_ms must be numbers'}), 400
+        if not started:
+            return jsonify({'error': 'profile already running', **profiler.summary()}), 409
+        switch = (f", GIL switch interval {profiler.switch_interval * 1000:.2f}ms"
+                  if profiler.switch_interval is not None else "")
+        print(f"[policy] Profiling for {profiler.duration:.1f}s every {profiler.interval * 1000:.1f}ms{switch}")
+        return jsonify(profiler.summary())
+
+    @app.route('/profile/stop', methods=['POST'])
+    def profile_stop():
+        profiler.stop()
+        return jsonify(profiler.summary())
+
+    @app.route('/profile', methods=['GET'])
+    def profile():
+        """目前或上一次 profile 的摘要；?format=collapsed 輸出 flamegraph 格式"""
+        if request.args.get('format') == 'collapsed':
+            return profiler.collapsed(request.args.get('endpoint')), 200, {'Content-Type': 'text/plain'}
+        return jsonify(profiler.summary())
+
+    return profiler
+
+
+def _request(url, data=None):
+    body = json.dumps(data).encode() if data is not None else None
+    req = urllib.request.Request(url, data=body, method='POST' if body is not None else 'GET',
+                                 headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        return resp.read().decode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='對執行中的政策伺服器取樣，輸出每個端點的 collapsed stacks')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='政策伺服器位址 (預設: http://127.0.0.1:5000)')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help='取樣秒數 (預設: 30)')
+    parser.add_argument('--interval-ms', type=float, default=DEFAULT_INTERVAL * 1000, help='取樣間隔 ms (預設: 5)')
+    parser.add_argument('--all-threads', action='store_true', help='一併取樣請求以外的執行緒')
+    parser.add_argument('--switch-interval-ms', type=float, default=0,
+                        help='profile 期間把伺服器的 GIL 切換間隔改為此值，減少取樣偏差，例如 0.2 (預設: 0 = 不更改)')
+    parser.add_argument('--output', '-o', default='profile', help='輸出目錄 (預設: profile)')
+    args = parser.parse_args()
+
+    base = args.url.rstrip('/')
+    _request(base + '/profile/start', {'duration': args.duration, 'interval_ms': args.interval_ms,
+                                       'all_threads': args.all_threads,
+                                       'switch_interval_ms': args.switch_interval_ms})
+    print(f"Profiling {base} for {args.duration:.1f}s ...")
+    time.sleep(args.duration)
+    summary = json.loads(_request(base + '/profile/stop', {}))
+
+    os.makedirs(args.output, exist_ok=True)
+    with open(os.path.join(args.output, 'all.collapsed'), 'w') as f:
+        f.write(_request(base + '/profile?format=collapsed'))
+    for label, info in summary['endpoints'].items():
+        name = label.strip('/[]').replace('/', '_').replace(' ', '_') or 'root'
+        query = urllib.parse.urlencode({'format': 'collapsed', 'endpoint': label})
+        with open(os.path.join(args.output, f'{name}.collapsed'), 'w') as f:
+            f.write(_request(f'{base}/profile?{query}'))
+        print(f"{label:<28} {info['samples']:>8} samples")
+        for frame in info['top_self'][:5]:
+            print(f"    {frame['percent']:5.1f}%  {frame['frame']}")
+    print(f"Collapsed stacks in {args.output}/ (flamegraph.pl {args.output}/all.collapsed > flame.svg)")
+    with open(os.path.join(args.output, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""Replay a recorded edge_plugin.csv against a running policy API and check the decisions.
+
+Every row of the plugin log is one /policy call (ip, delta). The rows are
+sorted by recv_ts and sent again with the recorded delta, either on the
+recorded schedule (--speed 1 is real time, --speed 10 ten times faster)
+or as fast as possible (--speed 0). IPs are partitioned over --connections
+keep-alive connections (crc32 of the IP), so the calls of one IP keep their
+order and the per-IP trust state evolves exactly as it did when recorded;
+with --processes the connections are spread over several client processes.
+
+Each response is compared with the recorded `action` (and `trust`, which the
+log keeps to 3 decimals). A drop/admit mismatch means the per-IP trust
+diverged; a high/low mismatch can also come from a different interleaving
+of IPs, which moves the top-25% ranking. Rows the plugin answered from its
+decision cache or the shared-memory table (cache_hit = 1) and rows where the
+API call failed (the plugin's default: low, trust 1.0, p_value 0) are sent
+but counted separately. The report gives throughput, latency percentiles,
+how far sends fell behind the schedule, and the mismatches; --mismatches
+writes them to a CSV.
+
+  python3 replay.py logs/edge_plugin.csv --url http://127.0.0.1:5000 --speed 0
+  python3 replay.py edge_plugin.csv --speed 5 --connections 32 --processes 4 --mismatches mm.csv
+
+Binary logs (edge_plugin.bin) can be converted first with
+`python Post_Process/binlog.py edge_plugin.bin -o edge_plugin.csv`.
+"""
+import argparse
+import csv
+import http.client
+import json
+import multiprocessing as mp
+import os
+import threading
+import time
+import zlib
+from collections import Counter
+from urllib.parse import urlparse
+
+REQUIRED_COLUMNS = ('recv_ts', 'ip', 'delta', 'action')
+TRUST_TOLERANCE = 0.0015    # edge_plugin.csv 的 trust 只保留 3 位小數
+START_DELAY = 0.5           # 所有程序一起開始前的準備時間 (s)
+
+
+def load_rows(path):
+    """Rows of the plugin log as (recv_ts, ip, delta, action, trust, cache_hit, failed), sorted by recv_ts."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"找不到檔案：{path}")
+    rows = []
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        missing = [c for c in REQUIRED_COLUMNS if c not in (reader.fieldnames or ())]
+        if missing:
+            raise ValueError(f"{path} 缺少欄位：{', '.join(missing)}")
+        for row in reader:
+            action = row['action']
+            trust = float(row['trust']) if row.get('trust') else None
+            failed = action == 'low' and trust == 1.0 and float(row.get('p_value') or 1.0) == 0.0
+            rows.append((float(row['recv_ts']), row['ip'], float(row['delta']), action, trust,
+                         row.get('cache_hit') == '1', failed))
+    rows.sort(key=lambda r: r[0])
+    return rows
+
+
+def partition(rows, connections):
+    """Row indexes per connection; all rows of one IP go to the same connection."""
+    parts = [[] for _ in range(connections)]
+    for i, row in enumerate(rows):
+        parts[zlib.crc32(row[1].encode()) % connections].append(i)
+    return parts
+
+
+def _replay_connection(host, port, rows, indexes, start, speed, timeout, out):
+    """One keep-alive connection: send its rows in order, on schedule unless speed is 0."""
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    headers = {'Content-Type': 'application/json'}
+    first_ts = rows[0][0] if rows else 0.0
+    for i in indexes:
+        recv_ts, ip, delta = rows[i][0], rows[i][1], rows[i][2]
+        due = start + (recv_ts - first_ts) / speed if speed > 0 else start
+        now = time.time()
+        if now < due:
+            time.sleep(due - now)
+        t0 = time.time()
+        try:
+            conn.request('POST', '/policy', json.dumps({'ip': ip, 'time_delta': delta}), headers)
+            resp = conn.getresponse()
+            body = resp.read()
+            t1 = time.time()
+            if resp.status != 200:
+                out.append((i, t0 - due, t1 - t0, None, None, f"HTTP {resp.status}"))
+                continue
+            result = json.loads(body)
+            out.append((i, t0 - due, t1 - t0, result.get('action'), result.get('trust'), None))
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            out.append((i, t0 - due, time.time() - t0, None, None, type(e).__name__))
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    conn.close()
+
+
+def _replay_process(args):
+    """Client process: one thread per connection assigned to it."""
+    host, port, rows, parts, start, speed, timeout = args
+    outs = [[] for _ in parts]
+    threads = [threading.Thread(target=_replay_connection,
+                                args=(host, port, rows, indexes, start, speed, timeout, out))
+               for indexes, out in zip(parts, outs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return [r for out in outs for r in out]
+
+
+def replay(rows, url, connections, processes, speed, timeout=30.0):
+    parsed = urlparse(url)
+    host, port = parsed.hostname, parsed.port or 80
+    parts = partition(rows, connections)
+    start = time.time() + START_DELAY
+    groups = [parts[p::processes] for p in range(processes)]
+    jobs = [(host, port, rows, group, start, speed, timeout) for group in groups if group]
+    if processes > 1:
+        with mp.Pool(len(jobs)) as pool:
+            chunks = pool.map(_replay_process, jobs)
+    else:
+        chunks = [_replay_process(job) for job in jobs]
+    results = [r for chunk in chunks for r in chunk]
+    end = max((start + r[1] + r[2] for r in results), default=start)
+    results.sort(key=lambda r: r[0])
+    return results, max(end - start, 1e-9)
+
+
+def percentiles(values, qs=(0.5, 0.9, 0.99, 0.999)):
+    values = sorted(values)
+    if not values:
+        return {q: 0.0 for q in qs}, 0.0
+    return {q: values[min(len(values) - 1, int(q * len(values)))] for q in qs}, values[-1]
+
+
+def summarize(rows, results, elapsed):
+    """Report counters and the list of mismatching rows."""
+    ok = [r for r in results if r[5] is None]
+    errors = Counter(r[5] for r in results if r[5] is not None)
+    pairs = Counter()
+    kinds = Counter()
+    trust_diff = 0
+    mismatches = []
+    for i, lag, latency, action, trust, _ in ok:
+        recv_ts, ip, delta, recorded, recorded_trust, cache_hit, failed = rows[i]
+        kind = 'api_failed' if failed else 'cached' if cache_hit else 'api'
+        kinds[kind] += 1
+        if kind == 'api' and recorded_trust is not None and trust is not None \
+                and abs(trust - recorded_trust) > TRUST_TOLERANCE:
+            trust_diff += 1
+        if action != recorded:
+            pairs[(kind, recorded, action)] += 1
+            mismatches.append((recv_ts, ip, delta, kind, recorded, action, recorded_trust, trust))
+    return {
+        'ok': len(ok), 'errors': errors, 'kinds': kinds, 'pairs': pairs,
+        'trust_diff': trust_diff, 'mismatches': mismatches,
+        'latency': percentiles([r[2] for r in ok]),
+        'lag': percentiles([max(r[1], 0.0) for r in results]),
+        'elapsed': elapsed,
+    }
+
+
+def print_report(rows, results, summary, args):
+    elapsed = summary['elapsed']
+    recorded = rows[-1][0] - rows[0][0] if rows else 0.0
+    print(f"Replayed {len(results)} requests ({len({r[1] for r in rows})} IPs) to {args.url} "
+          f"over {args.connections} connections in {args.processes} process(es), "
+          f"speed {'max' if args.speed <= 0 else f'{args.speed:g}x'}")
+    print(f"  recorded span {recorded:.3f}s, replay {elapsed:.3f}s, throughput {len(results) / elapsed:.1f} req/s")
+    (lat, lat_max), (lag, lag_max) = summary['latency'], summary['lag']
+    print("  latency ms: " + ", ".join(f"p{q * 100:g}={v * 1000:.3f}" for q, v in lat.items())
+          + f", max={lat_max * 1000:.3f}")
+    if args.speed > 0:
+        print("  behind schedule ms: " + ", ".join(f"p{q * 100:g}={v * 1000:.3f}" for q, v in lag.items())
+              + f", max={lag_max * 1000:.3f}")
+    if summary['errors']:
+        print("  errors: " + ", ".join(f"{k}={v}" for k, v in summary['errors'].most_common()))
+    kinds = summary['kinds']
+    for kind, label in (('api', 'answered by the API'), ('cached', 'cache / shm hits'),
+                        ('api_failed', 'API failed when recorded')):
+        n = kinds.get(kind, 0)
+        if not n:
+            continue
+        bad = sum(v for (k, _, _), v in summary['pairs'].items() if k == kind)
+        print(f"  {label:<26} {n:>9} rows, {bad:>7} action mismatches ({bad * 100.0 / n:.3f}%)")
+    if kinds.get('api'):
+        drop = sum(v for (k, old, new), v in summary['pairs'].items() if k == 'api' and 'drop' in (old, new))
+        ranking = sum(v for (k, _, _), v in summary['pairs'].items() if k == 'api') - drop
+        print(f"  API rows: {drop} drop/admit mismatches (per-IP trust), {ranking} other (e.g. high/low ranking)")
+    if kinds.get('api'):
+        print(f"  trust differs by more than {TRUST_TOLERANCE} on {summary['trust_diff']} API rows")
+    for (kind, old, new), n in summary['pairs'].most_common(10):
+        print(f"    [{kind}] recorded {old} -> replayed {new}: {n}")
+
+
+def write_mismatches(path, mismatches):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['recv_ts', 'ip', 'delta', 'kind', 'recorded_action', 'replayed_action',
+                         'recorded_trust', 'replayed_trust'])
+        writer.writerows(mismatches)
+
+
+def reset(url):
+    parsed = urlparse(url)
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=10)
+    conn.request('POST', '/reset', '{}', {'Content-Type': 'application/json'})
+    status = conn.getresponse().status
+    conn.close()
+    return status == 200
+
+
+def main():
+    parser = argparse.ArgumentParser(description='以 edge_plugin.csv 重播 /policy 請求並比對決策')
+    parser.add_argument('log', help='插件日誌 edge_plugin.csv')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='政策伺服器位址 (預設: http://127.0.0.1:5000)')
+    parser.add_argument('--speed', type=float, default=1.0, help='時間壓縮倍數，1 = 原速，0 = 盡快送出 (預設: 1)')
+    parser.add_argument('--connections', type=int, default=16, help='keep-alive 連線數 (預設: 16)')
+    parser.add_argument('--processes', type=int, default=1, help='送出請求的程序數 (預設: 1)')
+    parser.add_argument('--limit', type=int, default=0, help='只重播前 N 筆 (依 recv_ts)')
+    parser.add_argument('--no-reset', action='store_true', help='開始前不呼叫 /reset')
+    parser.add_argument('--mismatches', help='把決策不一致的請求寫入此 CSV')
+    parser.add_argument('--json', help='把摘要寫入此 JSON 檔')
+    args = parser.parse_args()
+    args.connections = max(1, args.connections)
+    args.processes = max(1, min(args.processes, args.connections))
+
+    rows = load_rows(args.log)
+    if args.limit:
+        rows = rows[:args.limit]
+    if not rows:
+        print(f"{args.log}: no rows")
+        return
+    if not args.no_reset and not reset(args.url):
+        print("(no /reset on this server: replaying on top of its current state)")
+
+    results, elapsed = replay(rows, args.url, args.connections, args.processes, args.speed)
+    summary = summarize(rows, results, elapsed)
+    print_report(rows, results, summary, args)
+
+    if args.mismatches:
+        write_mismatches(args.mismatches, summary['mismatches'])
+        print(f"Mismatches written to {args.mismatches}")
+    if args.json:
+        (lat, lat_max), (lag, lag_max) = summary['latency'], summary['lag']
+        with open(args.json, 'w') as f:
+            json.dump({
+                'log': args.log, 'url': args.url, 'speed': args.speed, 'connections': args.connections,
+                'processes': args.processes, 'requests': len(results), 'ok': summary['ok'],
+                'errors': dict(summary['errors']), 'seconds': round(elapsed, 3),
+                'throughput': round(len(results) / elapsed, 1),
+                'latency_ms': {f"p{q * 100:g}": round(v * 1000, 3) for q, v in lat.items()} | {'max': round(lat_max * 1000, 3)},
+                'lag_ms': {f"p{q * 100:g}": round(v * 1000, 3) for q, v in lag.items()} | {'max': round(lag_max * 1000, 3)}
+                          if args.speed > 0 else None,
+                'rows': dict(summary['kinds']),
+                'mismatches': {f"{k}:{old}->{new}": n for (k, old, new), n in summary['pairs'].items()},
+                'trust_diff': summary['trust_diff'],
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 from flask import Flask, request, jsonify
 import threading, math
 
+import profiler
+import serve
+
 app = Flask(__name__)
+profiler.install(app)
 state = {}
 lock  = threading.Lock()
 
@@ -10,12 +14,8 @@ P_SUCCESS_TH      = 0.005   # p-value 成功阈值
 P_TRUST_TH        = 0.005   # p-value 信任更新阈值
 TRUST_THRESHOLD   = 0.2    # trust 放行阈值
 
-@app.route('/policy', methods=['POST'])
-def policy():
-    data = request.get_json(force=True)
-    ip    = data.get('ip')
-    delta = data.get('time_delta', 0.0)
-
+def decide(ip, delta):
+    """以一则消息的 time_delta 更新 ip 的 trust，返回决策（/policy 的响应内容）"""
     with lock:
         entry = state.get(ip, {'success_count': 0, 'trust': 0.0})
 
@@ -46,12 +46,17 @@ def policy():
         action = 'forward' if entry['trust'] > TRUST_THRESHOLD else 'drop'
         trust  = entry['trust']
 
-    return jsonify({
+    return {
         'action' : action,
         'trust'  : trust,
         'p_value': p_val
-    })
+    }
+
+@app.route('/policy', methods=['POST'])
+def policy():
+    data = request.get_json(force=True)
+    return jsonify(decide(data.get('ip'), data.get('time_delta', 0.0)))
 
 if __name__ == '__main__':
-    # 安装依赖： pip3 install flask
-    app.run(host='0.0.0.0', port=5000)
+    # 安装依赖： pip3 install flask (建議另裝 waitress 以支援 keep-alive)
+    serve.run(app, host='0.0.0.0', port=5000)
@@ -0,0 +1,27 @@
+"""Start a policy app on a server that keeps HTTP/1.1 connections alive.
+
+Werkzeug's development server (app.run) sends "Connection: close" on every
+response, so the plugin's persistent curl handle would still reconnect for
+each message. When waitress is installed (pip3 install waitress) it is used
+instead: it is multi-threaded and keeps connections open. Otherwise this
+falls back to app.run() with the arguments the scripts used before.
+"""
+import os
+
+try:
+    from waitress import serve as _waitress_serve
+except ImportError:
+    _waitress_serve = None
+
+
+def run(app, host='0.0.0.0', port=5000, threads=None, **flask_kwargs):
+    """POLICY_SERVER=flask forces the Flask development server."""
+    backend = os.environ.get('POLICY_SERVER', 'waitress')
+    threads = threads or int(os.environ.get('POLICY_THREADS', '8'))
+    if backend == 'waitress' and _waitress_serve is not None:
+        print(f"[policy] Serving with waitress on {host}:{port} (keep-alive, {threads} threads)")
+        _waitress_serve(app, host=host, port=port, threads=threads)
+        return
+    if backend == 'waitress':
+        print("[policy] waitress not installed, falling back to Flask server (no keep-alive)")
+    app.run(host=host, port=port, threaded=True, **flask_kwargs)
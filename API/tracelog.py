@@ -0,0 +1,183 @@
+"""Leveled, sampled logging for the policy servers (same levels as mqtt-edge_fifo/common/trace_log.h).
+
+A request thread never writes to stdout itself: it appends (format, args) to a
+bounded deque and a writer thread formats the lines and writes them out in
+one write per batch, so neither the formatting nor a slow terminal or pipe is
+part of the decision time. When the deque is full the line is dropped and
+counted. A line below the current level costs one comparison; the
+per-decision lines of pq.py are traced only at level `trace`, or for one
+decision in `trace_sample` (Tracer.sampled()).
+
+Levels: error, warn, info, debug, trace. POLICY_LOG_LEVEL and
+POLICY_TRACE_SAMPLE set the initial values; pq.py exposes GET/POST /loglevel
+to change them while the server runs.
+
+`python tracelog.py --bench` measures the cost per decision of the old
+per-decision print() and of each level / sample rate.
+"""
+import argparse
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+ERROR, WARN, INFO, DEBUG, TRACE = range(5)
+LEVELS = {'error': ERROR, 'warn': WARN, 'info': INFO, 'debug': DEBUG, 'trace': TRACE}
+LEVEL_NAMES = {v: k for k, v in LEVELS.items()}
+DEFAULT_CAPACITY = 16384      # 尚未寫出的行數上限
+FLUSH_INTERVAL = 0.005        # 沒有待寫出的行時 writer 的等待 (s)
+
+
+def parse_level(name, fallback=INFO):
+    if name is None:
+        return fallback
+    name = str(name).lower()
+    return LEVELS.get('warn' if name == 'warning' else name, fallback)
+
+
+class Tracer:
+    """Level + 1-in-N decision sampling + non-blocking sink, changeable at runtime."""
+
+    def __init__(self, level=None, sample=None, stream=None, capacity=DEFAULT_CAPACITY):
+        self.stream = stream or sys.stdout
+        self.capacity = capacity
+        self.level = parse_level(level if level is not None else os.environ.get('POLICY_LOG_LEVEL'))
+        self.sample = max(0, int(sample if sample is not None else os.environ.get('POLICY_TRACE_SAMPLE', '0')))
+        self.written = 0
+        self.dropped = 0
+        self.writes = 0
+        self._lines = deque()
+        self._counter = itertools.count()
+        self._running = True
+        self._thread = threading.Thread(target=self._writer, name='tracelog', daemon=True)
+        self._thread.start()
+
+    def set(self, level=None, sample=None):
+        if level is not None:
+            self.level = parse_level(level, self.level)
+        if sample is not None:
+            self.sample = max(0, int(sample))
+
+    def sampled(self):
+        """Once per decision: True when all of its lines should be traced."""
+        if self.level >= TRACE:
+            return True
+        return self.sample > 0 and next(self._counter) % self.sample == 0
+
+    def emit(self, fmt, *args):
+        """Queue one line regardless of level (callers check the level or sampled())."""
+        if len(self._lines) >= self.capacity:
+            self.dropped += 1
+            return
+        self._lines.append((fmt, args))
+
+    def error(self, fmt, *args):
+        self.emit(fmt, *args)
+
+    def warn(self, fmt, *args):
+        if self.level >= WARN:
+            self.emit(fmt, *args)
+
+    def info(self, fmt, *args):
+        if self.level >= INFO:
+            self.emit(fmt, *args)
+
+    def debug(self, fmt, *args):
+        if self.level >= DEBUG:
+            self.emit(fmt, *args)
+
+    trace = emit      # 逐則追蹤的行：是否輸出已由 sampled() 決定
+
+    def _drain(self):
+        out = []
+        while self._lines:
+            fmt, args = self._lines.popleft()
+            out.append((fmt % args if args else fmt) + '\n')
+        if out:
+            self.stream.write(''.join(out))
+            self.stream.flush()
+            self.written += len(out)
+            self.writes += 1
+        return len(out)
+
+    def _writer(self):
+        while self._running:
+            if not self._drain():
+                time.sleep(FLUSH_INTERVAL)
+        self._drain()
+
+    def describe(self):
+        if self.level >= TRACE:
+            trace = 'every decision'
+        else:
+            trace = f'1 in {self.sample} decisions' if self.sample else 'off'
+        return f'{LEVEL_NAMES[self.level]}, per-decision trace: {trace}'
+
+    def config(self):
+        return {'level': LEVEL_NAMES[self.level], 'trace_sample': self.sample, 'pending': len(self._lines),
+                'written': self.written, 'writes': self.writes, 'dropped': self.dropped}
+
+    def close(self):
+        self._running = False
+        self._thread.join()
+
+
+def _decision(i):
+    return f'10.0.{i % 256}.{i % 200}', 0.98765, 'high', 12, 3, 0.9123
+
+
+def bench(n, stream):
+    """Cost per decision (us) of the two per-decision lines of pq.policy() under each configuration."""
+    rows = []
+
+    def run(label, fn):
+        t0 = time.perf_counter()
+        for i in range(n):
+            fn(i)
+        rows.append([label, (time.perf_counter() - t0) / n * 1e6, ''])
+
+    def old_print(i):
+        ip, trust, action, qualified, high, threshold = _decision(i)
+        print(f"[policy] IP: {ip}, trust: {trust:.4f} → {action}", file=stream)
+        print(f"         qualified: {qualified}, high: {high}, threshold: {threshold:.4f}", file=stream)
+
+    run('print (before)', old_print)
+    stream.flush()
+    for level, sample in (('info', 0), ('info', 1000), ('info', 100), ('info', 10), ('trace', 0)):
+        tracer = Tracer(level, sample, stream=stream)
+
+        def traced(i, tracer=tracer):
+            if tracer.sampled():
+                ip, trust, action, qualified, high, threshold = _decision(i)
+                tracer.trace("[policy] IP: %s, trust: %.4f → %s", ip, trust, action)
+                tracer.trace("         qualified: %d, high: %d, threshold: %.4f", qualified, high, threshold)
+
+        label = 'trace (every decision)' if level == 'trace' else \
+            f'{level}, sample 1/{sample}' if sample else f'{level}, no trace'
+        run(label, traced)
+        tracer.close()
+        rows[-1][2] = f'{tracer.written} lines in {tracer.writes} writes, {tracer.dropped} dropped'
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='政策伺服器日誌等級與抽樣追蹤的開銷測試')
+    parser.add_argument('--bench', action='store_true', help='測量各等級 / 抽樣率下每次決策的日誌開銷')
+    parser.add_argument('-n', type=int, default=200000, help='每種設定的決策次數 (預設: 200000)')
+    parser.add_argument('--output', '-o', default=os.devnull,
+                        help='日誌輸出位置，例如 /dev/null、檔案或 /dev/tty (預設: /dev/null)')
+    args = parser.parse_args()
+    if not args.bench:
+        parser.print_help()
+        return
+    with open(args.output, 'w') as stream:
+        rows = bench(args.n, stream)
+    base = rows[0][1]
+    for label, us, note in rows:
+        print(f"{label:<24} {us:8.3f} us/decision ({us / base * 100:5.1f}% of print)  {note}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,16 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.patches import Patch
+from plot_utils import save_figure
+from service_fit import service_moments
 
 # 讀取標準佇列模擬結果 (無優先級)
-df_standard = pd.read_csv("merged_performance_att_1hrs_1tm.csv")
+STANDARD_CSV = "merged_performance_att_1hrs_1tm.csv"
+df_standard = pd.read_csv(STANDARD_CSV)
 
 # 讀取優先級佇列模擬結果
-df_priority = pd.read_csv("merged_performance_att_1hrs_1tm_pq_rev.csv")
+PRIORITY_CSV = "merged_performance_att_1hrs_1tm_pq_rev.csv"
+df_priority = pd.read_csv(PRIORITY_CSV)
 
 print(f"標準佇列數據載入: {len(df_standard)} 筆記錄")
 print(f"優先級佇列數據載入: {len(df_priority)} 筆記錄")
@@ -58,9 +62,8 @@ print(f"優先級佇列 CV² = {Ca2_priority:.4f}")
 # 標準佇列理論值計算
 std_interarrival = diffs_std.mean()
 lambda_std = 1.0 / std_interarrival
-E_S_std = df_standard['service_time'].mean()
-Var_S_std = df_standard['service_time'].var()
-Cs2_std = Var_S_std / (E_S_std**2)
+# E[S] 與 Cs² 優先使用 service_fit.py 對該 CSV 擬合的模型
+E_S_std, Cs2_std, service_source_std = service_moments(df_standard['service_time'], STANDARD_CSV)
 rho_std = lambda_std * E_S_std
 
 if rho_std < 1:
@@ -75,12 +78,10 @@ else:
 # 計算總系統參數
 all_interarrival = diffs_priority.mean()
 lambda_total = 1.0 / all_interarrival
-service_time_total = df_priority['service_time'].mean()
+# 服務時間與系統級變異係數
+service_time_total, Cs2_total, service_source_priority = service_moments(df_priority['service_time'], PRIORITY_CSV)
 rho_total = lambda_total * service_time_total
 
-# 計算系統級變異係數
-Cs2_total = df_priority['service_time'].var() / (service_time_total**2)
-
 # 計算高優先級參數
 if len(df_high) > 1:
     high_interarrival = df_high.sort_values('original_ts_numeric')['original_ts_numeric'].diff().dropna()
@@ -106,6 +107,7 @@ else:
     sys_low_theory = float('inf')
 
 print("\n理論值計算結果 (G/G/1):")
+print(f"服務時間模型 - 標準佇列: {service_source_std}, 優先級佇列: {service_source_priority}")
 print(f"標準佇列 - 實際到達率: {lambda_std:.6f}, 使用率: {rho_std:.4f}")
 if std_theory_wait != float('inf'):
     print(f"標準佇列 G/G/1 理論等待時間: {std_theory_wait:.6f}s, 系統時間: {std_theory_system:.6f}s")
@@ -237,9 +239,8 @@ legend_elements = [
 plt.legend(handles=legend_elements, loc='upper left')
 
 plt.tight_layout()
-plt.savefig("queue_comparison_bar_chart_gg1.svg", format='svg', dpi=300, bbox_inches="tight")
-plt.show()
+bar_fig_path = save_figure("queue_comparison_bar_chart_gg1.svg", dpi=300)
 
 print("\n分析完成! 包含 G/G/1 理論值的長條圖已生成。")
 print("生成的檔案:")
-print("- queue_comparison_bar_chart_gg1.svg")
\ No newline at end of file
+print(f"- {bar_fig_path}")
\ No newline at end of file
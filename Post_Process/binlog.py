@@ -0,0 +1,152 @@
+"""Read the fixed-width binary logs written with log_format binary.
+
+The plugin (plugin_opt_log_format binary) and the forwarder (--log-format
+binary) can write edge_plugin.bin / forwarder_performance.bin instead of CSV.
+Layout (mqtt-edge_fifo/common/log_records.h): a 32-byte header followed by
+back-to-back little-endian records. The dtypes below must match those structs.
+
+open_binlog() memory-maps the records straight into a NumPy structured array
+(no parsing, no copy); to_frame() turns them into the same columns as the CSV
+logs, so the existing scripts can consume them via read_log() or a CSV export.
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b'EDGEBIN1'
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u4'), ('record_size', '<u4'), ('kind', 'S16')])
+
+PLUGIN_DTYPE = np.dtype([
+    ('packet_count', '<u8'),
+    ('recv_ts', '<f8'),
+    ('service_start_ts', '<f8'),
+    ('api_start_ts', '<f8'),
+    ('api_end_ts', '<f8'),
+    ('service_end_ts', '<f8'),
+    ('delta', '<f8'),
+    ('p_value', '<f8'),
+    ('trust', '<f8'),
+    ('actual_api_time_ms', '<f8'),
+    ('wait_time_ms', '<f8'),
+    ('total_service_time_ms', '<f8'),
+    ('worker_id', '<i4'),
+    ('action', 'S8'),
+    ('ip', 'S46'),
+    ('cache_hit', 'u1'),
+    ('_pad', 'V5'),
+])
+
+FORWARDER_DTYPE = np.dtype([
+    ('enqueue_ts', '<f8'),
+    ('start_forward_ts', '<f8'),
+    ('end_forward_ts', '<f8'),
+    ('original_timestamp', '<f8'),
+    ('forward_duration_ms', '<f8'),
+    ('send_ts', '<f8'),
+    ('ack_ts', '<f8'),
+    ('packet_count', '<u8'),
+    ('forward_success', '<i4'),
+    ('priority', 'S8'),
+    ('original_ip', 'S46'),
+    ('_pad', 'V2'),
+    ('conn_id', '<i4'),
+    ('batch_size', '<i4'),
+    ('_pad2', 'V4'),
+])
+
+DTYPES = {'plugin': PLUGIN_DTYPE, 'forwarder': FORWARDER_DTYPE}
+
+# 與 C 端 CSV 表頭相同的欄位順序
+PLUGIN_COLUMNS = ['packet_count', 'recv_ts', 'service_start_ts', 'api_start_ts', 'api_end_ts',
+                  'service_end_ts', 'ip', 'delta', 'p_value', 'trust', 'packet_count_dup', 'action',
+                  'actual_api_time_ms', 'wait_time_ms', 'total_service_time_ms', 'worker_id',
+                  'cache_hit']
+FORWARDER_COLUMNS = ['enqueue_ts', 'start_forward_ts', 'end_forward_ts', 'original_ip', 'packet_count',
+                     'original_timestamp', 'forward_result', 'forward_duration_ms', 'priority',
+                     'send_ts', 'ack_ts', 'enqueue_to_send_ms', 'send_to_ack_ms', 'queue_wait_ms',
+                     'conn_id', 'batch_size']
+
+
+def is_binlog(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def read_header(path):
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+    if header.size == 0 or header['magic'][0] != MAGIC:
+        raise ValueError(f"{path} is not a binary edge log")
+    kind = header['kind'][0].decode()
+    dtype = DTYPES.get(kind)
+    if dtype is None:
+        raise ValueError(f"{path}: unknown log kind {kind!r}")
+    if header['record_size'][0] != dtype.itemsize:
+        raise ValueError(f"{path}: record size {header['record_size'][0]} != {dtype.itemsize} "
+                         f"(version {header['version'][0]}); update binlog.py to match log_records.h")
+    return kind, dtype
+
+
+def open_binlog(path):
+    """(kind, structured memmap of all complete records). A partly written last record is ignored."""
+    kind, dtype = read_header(path)
+    n = (os.path.getsize(path) - HEADER_DTYPE.itemsize) // dtype.itemsize
+    if n <= 0:
+        return kind, np.zeros(0, dtype=dtype)
+    return kind, np.memmap(path, dtype=dtype, mode='r', offset=HEADER_DTYPE.itemsize, shape=(n,))
+
+
+def _decode(col):
+    return pd.Series(col).str.decode('utf-8')
+
+
+def to_frame(kind, records):
+    """DataFrame with the same columns (and order) as the CSV log of that component."""
+    cols = {}
+    for name in records.dtype.names:
+        if name.startswith('_pad'):
+            continue
+        col = records[name]
+        cols[name] = _decode(col) if col.dtype.kind == 'S' else np.asarray(col)
+    if kind == 'plugin':
+        cols['packet_count_dup'] = cols['packet_count']
+        return pd.DataFrame(cols)[PLUGIN_COLUMNS]
+    cols['forward_result'] = np.where(cols.pop('forward_success') == 1, 'SUCCESS', 'FAILED')
+    # 與 CSV 相同：沒有 PUBACK 時間（同步模式或失敗）的欄位為空
+    cols['ack_ts'] = np.where(cols['ack_ts'] > 0, cols['ack_ts'], np.nan)
+    enqueued = np.where(cols['original_timestamp'] > 0, cols['original_timestamp'], cols['enqueue_ts'])
+    cols['enqueue_to_send_ms'] = (cols['send_ts'] - enqueued) * 1000.0
+    cols['send_to_ack_ms'] = (cols['ack_ts'] - cols['send_ts']) * 1000.0
+    cols['queue_wait_ms'] = np.where(cols['original_timestamp'] > 0,
+                                     (cols['enqueue_ts'] - cols['original_timestamp']) * 1000.0, np.nan)
+    return pd.DataFrame(cols)[FORWARDER_COLUMNS]
+
+
+def read_log(path):
+    """Plugin/forwarder log as a DataFrame, whether it was written as CSV or binary."""
+    if is_binlog(path):
+        return to_frame(*open_binlog(path))
+    return pd.read_csv(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='讀取插件/轉發器的二進位日誌，顯示摘要或轉成 CSV')
+    parser.add_argument('path', help='edge_plugin.bin 或 forwarder_performance.bin')
+    parser.add_argument('--output', '-o', help='轉成與原 CSV 相同欄位的 CSV（可直接給 merge_2.5.py 使用）')
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.path):
+        raise FileNotFoundError(f"找不到檔案：{args.path}")
+    kind, records = open_binlog(args.path)
+    print(f"{args.path}: {kind} log, {len(records)} records x {records.dtype.itemsize} bytes")
+    df = to_frame(kind, records)
+    if len(df):
+        print(df.head().to_string())
+    if args.output:
+        df.to_csv(args.output, index=False, float_format='%.6f')
+        print(f"已輸出 CSV: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
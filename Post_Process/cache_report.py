@@ -0,0 +1,128 @@
+"""Report the edge plugin's decision cache (plugin_opt_decision_cache) run by run.
+
+Each argument is one edge_plugin log (CSV or .bin). Per run it reports the
+cache hit rate (overall and per action) with the decision time of hits and
+misses, and for the attackers the time-to-drop: from the onset of a flood
+(the first of --onset-run consecutive messages whose inter-arrival p-value,
+computed from `delta` exactly as API/pq.py does, is <= --p-th) to the first
+message the plugin dropped, plus how many flood messages were let through
+in between. Runs without the cache (no cache_hit column) are the baseline.
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from binlog import read_log
+
+EXPECTED_INTERVAL = 1.0    # API/pq.py EXPECTED_INTERVAL
+P_TRUST_TH = 0.005         # API/pq.py P_TRUST_TH
+
+
+def p_values(delta, expected_interval=EXPECTED_INTERVAL):
+    """Two-sided exponential p-value of each inter-arrival time (same formula as API/pq.py)."""
+    cdf_fast = 1.0 - np.exp(-np.asarray(delta, dtype=np.float64) / expected_interval)
+    return np.minimum(cdf_fast, 1.0 - cdf_fast) * 2.0
+
+
+def hit_stats(df):
+    """Hit rate overall and per action, with mean decision time (ms) of hits and misses."""
+    hit = df['cache_hit'].astype(bool)
+    rows = {'all': {'n': len(df), 'hit_rate': hit.mean(),
+                    'hit_ms': df.loc[hit, 'actual_api_time_ms'].mean(),
+                    'miss_ms': df.loc[~hit, 'actual_api_time_ms'].mean()}}
+    for action, g in df.groupby('action'):
+        h = g['cache_hit'].astype(bool)
+        rows[action] = {'n': len(g), 'hit_rate': h.mean(),
+                        'hit_ms': g.loc[h, 'actual_api_time_ms'].mean(),
+                        'miss_ms': g.loc[~h, 'actual_api_time_ms'].mean()}
+    return pd.DataFrame(rows).T
+
+
+def flood_onset(g, p_th, run):
+    """Index label of the first message of the first run of `run` low p-value deltas, or None."""
+    low = (g['p'] <= p_th) & (g['packet_count'] > 1)    # 每個 IP 的第一則訊息 delta 為 0
+    streak = low.groupby((~low).cumsum()).cumsum()
+    hits = streak.index[streak.to_numpy() >= run]
+    if not len(hits):
+        return None
+    return g.index[g.index.get_loc(hits[0]) - run + 1]
+
+
+def time_to_drop(df, p_th=P_TRUST_TH, run=3, expected_interval=EXPECTED_INTERVAL, attackers=None):
+    """One row per attacking IP that was admitted before its flood started."""
+    df = df.assign(p=p_values(df['delta'], expected_interval))
+    if attackers:
+        df = df[df['ip'].isin(attackers)]
+    rows = []
+    for ip, g in df.sort_values(['ip', 'packet_count']).groupby('ip'):
+        onset = flood_onset(g, p_th, run)
+        if onset is None:
+            continue
+        pos = g.index.get_loc(onset)
+        if pos == 0 or g['action'].iloc[pos - 1] == 'drop':
+            continue    # 洪泛開始前就已被丟棄，沒有可比較的 time-to-drop
+        after = g.iloc[pos:]
+        dropped = after['action'].to_numpy() == 'drop'
+        first = int(np.argmax(dropped)) if dropped.any() else None
+        rows.append({
+            'ip': ip,
+            'onset_ts': after['recv_ts'].iloc[0],
+            'time_to_drop_ms': (after['recv_ts'].iloc[first] - after['recv_ts'].iloc[0]) * 1000.0
+                               if first is not None else np.nan,
+            'leaked': first if first is not None else len(after),
+            'leaked_from_cache': int(after['cache_hit'].iloc[:first].sum()) if first is not None
+                                 else int(after['cache_hit'].sum()),
+        })
+    return pd.DataFrame(rows, columns=['ip', 'onset_ts', 'time_to_drop_ms', 'leaked', 'leaked_from_cache'])
+
+
+def load(path):
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"找不到檔案：{path}")
+    df = read_log(path)
+    if 'cache_hit' not in df:
+        df['cache_hit'] = 0
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比較決策快取的命中率與攻擊者被丟棄所需時間 (time-to-drop)')
+    parser.add_argument('logs', nargs='+', help='edge_plugin.csv / .bin（例如未快取與快取各一份）')
+    parser.add_argument('--labels', nargs='+', help='各日誌的名稱（預設使用檔名）')
+    parser.add_argument('--p-th', type=float, default=P_TRUST_TH, help='判定洪泛的 p-value 門檻 (預設: 0.005)')
+    parser.add_argument('--onset-run', type=int, default=3, help='連續幾則低 p-value 訊息視為洪泛開始 (預設: 3)')
+    parser.add_argument('--expected-interval', type=float, default=EXPECTED_INTERVAL,
+                        help='API 的期望間隔秒數 (預設: 1)')
+    parser.add_argument('--attackers', nargs='+', help='只計算這些攻擊者 IP')
+    parser.add_argument('--output', '-o', help='將每個攻擊者的 time-to-drop 輸出為 CSV')
+    args = parser.parse_args()
+
+    labels = args.labels or [os.path.basename(p) for p in args.logs]
+    if len(labels) != len(args.logs):
+        parser.error('--labels 數量必須與日誌數量相同')
+
+    frames = []
+    for label, path in zip(labels, args.logs):
+        df = load(path)
+        print(f"== {label}: {len(df)} messages, {df['ip'].nunique()} IPs")
+        print(hit_stats(df).to_string(float_format=lambda v: f'{v:.3f}'))
+        ttd = time_to_drop(df, args.p_th, args.onset_run, args.expected_interval, args.attackers)
+        never = int(ttd['time_to_drop_ms'].isna().sum())
+        if len(ttd):
+            t = ttd['time_to_drop_ms'].dropna()
+            print(f"  attackers: {len(ttd)} (never dropped: {never}), time-to-drop mean {t.mean():.1f} ms, "
+                  f"p50 {t.median():.1f} ms, max {t.max():.1f} ms; leaked mean {ttd['leaked'].mean():.2f}, "
+                  f"max {ttd['leaked'].max()} (from cache: {ttd['leaked_from_cache'].sum()})")
+        else:
+            print("  attackers: none admitted before a flood onset")
+        frames.append(ttd.assign(run=label))
+
+    if args.output:
+        pd.concat(frames, ignore_index=True).to_csv(args.output, index=False, float_format='%.6f')
+        print(f"已輸出 CSV: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
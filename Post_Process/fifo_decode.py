@@ -0,0 +1,104 @@
+"""Decode a capture of the HIGH/LOW FIFO traffic.
+
+Accepts either format the plugin can write (plugin_opt_fifo_format):
+  * json   – one {"ip","count","timestamp","priority"} object per line
+  * binary – back-to-back 72-byte FifoRecord structs (common/fifo_record.h)
+
+A capture can be taken with e.g. `cat high_priority_queue.fifo > high.cap`
+while the forwarder is stopped (reading a FIFO consumes its data).
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+FIFO_RECORD_MAGIC = 0xED6E
+FIFO_RECORD_VERSION = 1
+PRIORITIES = np.array(['low', 'high'])
+
+FIFO_DTYPE = np.dtype([
+    ('magic', '<u2'),
+    ('version', 'u1'),
+    ('priority', 'u1'),
+    ('_reserved', '<u4'),
+    ('count', '<u8'),
+    ('timestamp', '<f8'),
+    ('ip', 'S48'),
+])
+assert FIFO_DTYPE.itemsize == 72
+
+
+def is_binary_capture(data):
+    return len(data) >= 2 and int.from_bytes(data[:2], 'little') == FIFO_RECORD_MAGIC
+
+
+def decode_binary(data):
+    """DataFrame of the valid records; a trailing partial record is ignored."""
+    n = len(data) // FIFO_DTYPE.itemsize
+    recs = np.frombuffer(data, dtype=FIFO_DTYPE, count=n)
+    valid = (recs['magic'] == FIFO_RECORD_MAGIC) & (recs['version'] == FIFO_RECORD_VERSION)
+    recs = recs[valid]
+    df = pd.DataFrame({
+        'ip': pd.Series(recs['ip']).str.decode('utf-8'),
+        'count': recs['count'].astype(np.int64),
+        'timestamp': recs['timestamp'],
+        'priority': PRIORITIES[np.minimum(recs['priority'], 1)],
+    })
+    df.attrs['invalid'] = int((~valid).sum())
+    df.attrs['trailing_bytes'] = len(data) - n * FIFO_DTYPE.itemsize
+    return df
+
+
+def decode_json(data):
+    rows, invalid = [], 0
+    for line in data.decode('utf-8', 'replace').splitlines():
+        if not line.strip():
+            continue
+        try:
+            obj = json.loads(line)
+        except ValueError:
+            invalid += 1
+            continue
+        rows.append({k: obj.get(k) for k in ('ip', 'count', 'timestamp', 'priority')})
+    df = pd.DataFrame(rows, columns=['ip', 'count', 'timestamp', 'priority'])
+    df.attrs['invalid'] = invalid
+    return df
+
+
+def decode(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if is_binary_capture(data):
+        return 'binary', decode_binary(data)
+    return 'json', decode_json(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='解碼 HIGH/LOW FIFO 擷取內容 (JSON 行或二進位 FifoRecord)')
+    parser.add_argument('capture', nargs='+', help='FIFO 擷取檔')
+    parser.add_argument('--output', '-o', help='將所有記錄輸出為 CSV')
+    args = parser.parse_args()
+
+    frames = []
+    for path in args.capture:
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"找不到檔案：{path}")
+        fmt, df = decode(path)
+        size = os.path.getsize(path)
+        print(f"{path}: {fmt}, {len(df)} records, {size / max(len(df), 1):.1f} bytes/record, "
+              f"invalid={df.attrs.get('invalid', 0)}")
+        if len(df):
+            print(df['priority'].value_counts().to_string())
+            print(f"  IPs: {df['ip'].nunique()}, "
+                  f"timestamps {df['timestamp'].min():.6f} - {df['timestamp'].max():.6f}")
+        frames.append(df.assign(source=os.path.basename(path)))
+
+    if args.output:
+        pd.concat(frames, ignore_index=True).to_csv(args.output, index=False)
+        print(f"已輸出 CSV: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+
+from plot_utils import plot_series, save_figure
+
+# 預設的對數分桶：1µs ~ 100s，每個十倍區間 100 桶（相對誤差約 2.3%）
+DEFAULT_MIN_VALUE = 1e-6
+DEFAULT_MAX_VALUE = 100.0
+DEFAULT_BUCKETS_PER_DECADE = 100
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+CLASSES = ('standard', 'high', 'low')
+
+
+class LogHistogram:
+    """Fixed-memory, log-bucketed latency histogram.
+
+    Bucket i covers [min_value * r**i, min_value * r**(i+1)) with
+    r = 10 ** (1 / buckets_per_decade). Two histograms with the same layout
+    can be merged by adding their counts, so summaries from several runs or
+    shards combine exactly.
+    """
+
+    def __init__(self, min_value=DEFAULT_MIN_VALUE, max_value=DEFAULT_MAX_VALUE,
+                 buckets_per_decade=DEFAULT_BUCKETS_PER_DECADE):
+        self.min_value = float(min_value)
+        self.max_value = float(max_value)
+        self.buckets_per_decade = int(buckets_per_decade)
+        decades = np.log10(self.max_value / self.min_value)
+        self.n_buckets = int(np.ceil(decades * self.buckets_per_decade))
+        # 0 = underflow, 1..n_buckets = 正常桶, n_buckets+1 = overflow
+        self.counts = np.zeros(self.n_buckets + 2, dtype=np.int64)
+        self.total = 0.0
+        self.vmin = np.inf
+        self.vmax = -np.inf
+
+    @property
+    def layout(self):
+        return (self.min_value, self.max_value, self.buckets_per_decade)
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def bucket_index(self, values):
+        """Map values to bucket slots (vectorized)."""
+        values = np.asarray(values, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            idx = np.floor(np.log10(values / self.min_value) * self.buckets_per_decade) + 1
+        idx = np.where(values < self.min_value, 0, idx)
+        idx = np.where(values >= self.max_value, self.n_buckets + 1, idx)
+        return idx.astype(np.int64)
+
+    def bucket_values(self):
+        """Representative value of every slot (geometric midpoint)."""
+        r = 10.0 ** (1.0 / self.buckets_per_decade)
+        lower = self.min_value * r ** np.arange(self.n_buckets)
+        mids = lower * np.sqrt(r)
+        return np.concatenate(([self.min_value], mids, [self.max_value]))
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return self
+        self.counts += np.bincount(self.bucket_index(values), minlength=self.counts.size)
+        self.total += float(values.sum())
+        self.vmin = min(self.vmin, float(values.min()))
+        self.vmax = max(self.vmax, float(values.max()))
+        return self
+
+    def merge(self, other):
+        if self.layout != other.layout:
+            raise ValueError(f"histogram layout mismatch: {self.layout} vs {other.layout}")
+        self.counts += other.counts
+        self.total += other.total
+        self.vmin = min(self.vmin, other.vmin)
+        self.vmax = max(self.vmax, other.vmax)
+        return self
+
+    def mean(self):
+        n = self.count
+        return self.total / n if n else float('nan')
+
+    def quantiles(self, qs=DEFAULT_QUANTILES):
+        n = self.count
+        if n == 0:
+            return np.full(len(qs), np.nan)
+        cum = np.cumsum(self.counts)
+        ranks = np.ceil(np.asarray(qs) * n).clip(1, n)
+        idx = np.searchsorted(cum, ranks)
+        # 以實際觀測的 min/max 夾住，避免頭尾桶的代表值超出資料範圍
+        return np.clip(self.bucket_values()[idx], self.vmin, self.vmax)
+
+    def summary(self, qs=DEFAULT_QUANTILES):
+        row = {'count': self.count, 'mean': self.mean(),
+               'min': self.vmin if self.count else np.nan,
+               'max': self.vmax if self.count else np.nan}
+        for q, v in zip(qs, self.quantiles(qs)):
+            row[quantile_label(q)] = v
+        return row
+
+
+class WindowedHistogram:
+    """Log-bucketed histograms for consecutive, epoch-aligned time windows.
+
+    Windows are keyed by floor(ts / window_sec), so histograms built from
+    different shards of the same run line up and merge by addition.
+    """
+
+    def __init__(self, window_sec=10.0, **layout):
+        self.window_sec = float(window_sec)
+        self.proto = LogHistogram(**layout)
+        self.first_window = None
+        self.counts = np.zeros((0, self.proto.counts.size), dtype=np.int64)
+
+    @property
+    def layout(self):
+        return self.proto.layout + (self.window_sec,)
+
+    def _ensure(self, lo, hi):
+        if self.first_window is None:
+            self.first_window = lo
+            self.counts = np.zeros((hi - lo + 1, self.proto.counts.size), dtype=np.int64)
+            return
+        start = min(self.first_window, lo)
+        stop = max(self.first_window + len(self.counts) - 1, hi)
+        if start == self.first_window and stop == self.first_window + len(self.counts) - 1:
+            return
+        grown = np.zeros((stop - start + 1, self.proto.counts.size), dtype=np.int64)
+        off = self.first_window - start
+        grown[off:off + len(self.counts)] = self.counts
+        self.first_window, self.counts = start, grown
+
+    def add(self, timestamps, values):
+        ts = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        ok = np.isfinite(ts) & np.isfinite(values)
+        ts, values = ts[ok], values[ok]
+        if ts.size == 0:
+            return self
+        win = np.floor(ts / self.window_sec).astype(np.int64)
+        self._ensure(int(win.min()), int(win.max()))
+        row = win - self.first_window
+        col = self.proto.bucket_index(values)
+        width = self.counts.shape[1]
+        flat = np.bincount(row * width + col, minlength=self.counts.size)
+        self.counts += flat.reshape(self.counts.shape)
+        return self
+
+    def merge(self, other):
+        if self.layout != other.layout:
+            raise ValueError(f"histogram layout mismatch: {self.layout} vs {other.layout}")
+        if other.first_window is None:
+            return self
+        lo = other.first_window
+        self._ensure(lo, lo + len(other.counts) - 1)
+        off = lo - self.first_window
+        self.counts[off:off + len(other.counts)] += other.counts
+        return self
+
+    def window_starts(self):
+        if self.first_window is None:
+            return np.zeros(0)
+        return (self.first_window + np.arange(len(self.counts))) * self.window_sec
+
+    def quantile_series(self, qs=DEFAULT_QUANTILES):
+        """Return a DataFrame indexed by window start with one column per quantile."""
+        n = self.counts.sum(axis=1)
+        cum = np.cumsum(self.counts, axis=1)
+        values = self.proto.bucket_values()
+        out = {'count': n}
+        for q in qs:
+            rank = np.ceil(q * n).clip(1, None)
+            idx = (cum < rank[:, None]).sum(axis=1).clip(0, len(values) - 1)
+            out[quantile_label(q)] = np.where(n > 0, values[idx], np.nan)
+        return pd.DataFrame(out, index=pd.Index(self.window_starts(), name='window_start'))
+
+    def collapse(self):
+        """Fold all windows into a single LogHistogram."""
+        h = LogHistogram(*self.proto.layout)
+        h.counts = self.counts.sum(axis=0)
+        values = h.bucket_values()
+        nz = np.nonzero(h.counts)[0]
+        if nz.size:
+            h.total = float((h.counts * values).sum())
+            h.vmin, h.vmax = values[nz[0]], values[nz[-1]]
+        return h
+
+
+def quantile_label(q):
+    return 'p' + f"{q * 100:g}"
+
+
+def compute_times(df):
+    """Add queue_wait/service_time/system_time columns the same way bar_chart.py does."""
+    df = df.copy()
+    df['original_ts_numeric'] = pd.to_numeric(df['original_timestamp'], errors='coerce')
+    df = df.dropna(subset=['original_ts_numeric'])
+    df['queue_wait'] = df['start_forward_ts'] - df['original_ts_numeric']
+    df['service_time'] = df['end_forward_ts'] - df['start_forward_ts']
+    df['system_time'] = df['queue_wait'] + df['service_time']
+    return df
+
+
+def build_class_histograms(frames, metric='system_time', window_sec=10.0, **layout):
+    """frames: {class_name: DataFrame}. Returns {class_name: (LogHistogram, WindowedHistogram)}."""
+    result = {}
+    for name, df in frames.items():
+        df = compute_times(df)
+        total = LogHistogram(**layout).add(df[metric].values)
+        windowed = WindowedHistogram(window_sec, **layout).add(df['start_forward_ts'].values,
+                                                                df[metric].values)
+        result[name] = (total, windowed)
+    return result
+
+
+def save_summary(path, histograms, metric):
+    """Write a mergeable .npz with one total + windowed histogram per class."""
+    arrays = {'metric': np.array(metric)}
+    for name, (total, windowed) in histograms.items():
+        arrays[f'{name}/layout'] = np.array(windowed.layout)
+        arrays[f'{name}/counts'] = total.counts
+        arrays[f'{name}/stats'] = np.array([total.total, total.vmin, total.vmax])
+        arrays[f'{name}/first_window'] = np.array(-1 if windowed.first_window is None
+                                                  else windowed.first_window)
+        arrays[f'{name}/window_counts'] = windowed.counts
+    np.savez_compressed(path, **arrays)
+
+
+def load_summary(path):
+    data = np.load(path)
+    metric = str(data['metric'])
+    histograms = {}
+    for name in sorted({k.split('/')[0] for k in data.files if '/' in k}):
+        min_value, max_value, bpd, window_sec = data[f'{name}/layout']
+        total = LogHistogram(min_value, max_value, int(bpd))
+        total.counts = data[f'{name}/counts'].astype(np.int64)
+        total.total, total.vmin, total.vmax = data[f'{name}/stats']
+        windowed = WindowedHistogram(window_sec, min_value=min_value, max_value=max_value,
+                                     buckets_per_decade=int(bpd))
+        first = int(data[f'{name}/first_window'])
+        if first >= 0:
+            windowed.first_window = first
+            windowed.counts = data[f'{name}/window_counts'].astype(np.int64)
+        histograms[name] = (total, windowed)
+    return histograms, metric
+
+
+def merge_summaries(paths):
+    merged, metric = load_summary(paths[0])
+    for path in paths[1:]:
+        other, other_metric = load_summary(path)
+        if other_metric != metric:
+            raise ValueError(f"cannot merge {metric} with {other_metric} ({path})")
+        for name, (total, windowed) in other.items():
+            if name in merged:
+                merged[name][0].merge(total)
+                merged[name][1].merge(windowed)
+            else:
+                merged[name] = (total, windowed)
+    return merged, metric
+
+
+def report(histograms, metric, out_dir, qs=DEFAULT_QUANTILES):
+    os.makedirs(out_dir, exist_ok=True)
+
+    rows = []
+    for name, (total, _) in histograms.items():
+        row = {'class': name}
+        row.update(total.summary(qs))
+        rows.append(row)
+    summary = pd.DataFrame(rows).set_index('class')
+    print(f"\n=== {metric} tail latency summary (s) ===")
+    print(summary.to_string(float_format=lambda v: f"{v:.6f}"))
+    summary.to_csv(os.path.join(out_dir, f'{metric}_tail_summary.csv'))
+
+    for name, (_, windowed) in histograms.items():
+        windowed.quantile_series(qs).to_csv(os.path.join(out_dir, f'{metric}_quantiles_{name}.csv'))
+
+    plt.rcParams.update({
+        'axes.labelsize': 20,
+        'legend.fontsize': 18,
+        'xtick.labelsize': 18,
+        'ytick.labelsize': 18
+    })
+    colors = {'standard': '#339933', 'high': '#cc0000', 'low': '#ff9933'}
+    styles = {'p50': ':', 'p90': '-.', 'p99': '-', 'p99.9': '--'}
+
+    start = min((w.window_starts()[0] for _, w in histograms.values() if w.first_window is not None), default=None)
+    if start is None:
+        print("所有類別都沒有資料，略過繪圖")
+        return
+
+    plt.figure(figsize=(15, 8))
+    for name, (_, windowed) in histograms.items():
+        series = windowed.quantile_series(qs)
+        t = series.index.values - start
+        for label in ('p50', 'p99', 'p99.9'):
+            if label in series:
+                plot_series(t, series[label], label=f"{name.capitalize()} {label}",
+                            color=colors.get(name), linestyle=styles[label], linewidth=1.5)
+
+    plt.yscale('log')
+    plt.xlabel("Time (s)")
+    plt.ylabel(f"{metric.replace('_', ' ').title()} (s)")
+    plt.legend(loc='upper right', ncol=2)
+    plt.grid(True, alpha=0.3, which='both')
+    plt.tight_layout()
+    fig_path = save_figure(os.path.join(out_dir, f'{metric}_tail_latency.svg'))
+    print(f"圖表已保存為: {fig_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='依優先級計算對數分桶延遲直方圖與 p50/p90/p99/p99.9')
+    parser.add_argument('--standard', default='merged_performance_att_1hrs_1tm.csv',
+                        help='標準佇列合併 CSV (預設: merged_performance_att_1hrs_1tm.csv)')
+    parser.add_argument('--priority', default='merged_performance_att_1hrs_1tm_pq_rev.csv',
+                        help='優先級佇列合併 CSV (預設: merged_performance_att_1hrs_1tm_pq_rev.csv)')
+    parser.add_argument('--metric', default='system_time',
+                        choices=['system_time', 'queue_wait', 'service_time'],
+                        help='分析欄位 (預設: system_time)')
+    parser.add_argument('--window', type=float, default=10.0,
+                        help='時間窗口長度，秒 (預設: 10)')
+    parser.add_argument('--buckets-per-decade', type=int, default=DEFAULT_BUCKETS_PER_DECADE,
+                        help=f'每十倍區間的桶數 (預設: {DEFAULT_BUCKETS_PER_DECADE})')
+    parser.add_argument('--save', default='Result/latency_hist.npz',
+                        help='可合併摘要輸出路徑 (預設: Result/latency_hist.npz)')
+    parser.add_argument('--merge', nargs='+', metavar='NPZ',
+                        help='合併多個已存的摘要，而不是讀取 CSV')
+    parser.add_argument('--out-dir', default='Result', help='輸出目錄 (預設: Result)')
+    args = parser.parse_args()
+
+    if args.merge:
+        histograms, metric = merge_summaries(args.merge)
+        print(f"已合併 {len(args.merge)} 份摘要")
+    else:
+        metric = args.metric
+        frames = {}
+        if os.path.isfile(args.standard):
+            frames['standard'] = pd.read_csv(args.standard)
+        if os.path.isfile(args.priority):
+            df_priority = pd.read_csv(args.priority)
+            frames['high'] = df_priority[df_priority['priority'] == 'high']
+            frames['low'] = df_priority[df_priority['priority'] == 'low']
+        if not frames:
+            raise FileNotFoundError(f"找不到檔案：{args.standard} / {args.priority}")
+        histograms = build_class_histograms(frames, metric, args.window,
+                                            buckets_per_decade=args.buckets_per_decade)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or '.', exist_ok=True)
+        save_summary(args.save, histograms, metric)
+        print(f"摘要已保存為: {args.save}")
+
+    report(histograms, metric, args.out_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+import argparse
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from latency_hist import LogHistogram
+from log_tail import LogTailer
+
+PLUGIN_LOG = '/home/jason/mqtt-edge/logs/edge_plugin.csv'
+FORWARDER_LOG = '/home/jason/mqtt-edge/logs/forwarder_performance.csv'
+
+
+class Welford:
+    """Online mean/variance (Welford) with Chan's merge, O(1) memory."""
+
+    __slots__ = ('n', 'mean', 'm2')
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        d = x - self.mean
+        self.mean += d / self.n
+        self.m2 += d * (x - self.mean)
+
+    def merge(self, other):
+        if other.n == 0:
+            return self
+        n = self.n + other.n
+        d = other.mean - self.mean
+        self.mean += d * other.n / n
+        self.m2 += other.m2 + d * d * self.n * other.n / n
+        self.n = n
+        return self
+
+    @property
+    def var(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else float('nan')
+
+    @property
+    def cv2(self):
+        return self.var / self.mean ** 2 if self.n > 1 and self.mean else float('nan')
+
+
+class SlidingWelford:
+    """Welford statistics over the last window_sec, kept as a ring of per-bucket accumulators."""
+
+    def __init__(self, window_sec=60.0, bucket_sec=1.0):
+        self.bucket_sec = bucket_sec
+        self.n_buckets = max(1, int(math.ceil(window_sec / bucket_sec)))
+        self.buckets = [Welford() for _ in range(self.n_buckets)]
+        self.keys = [None] * self.n_buckets
+
+    def add(self, ts, x):
+        key = int(ts // self.bucket_sec)
+        slot = key % self.n_buckets
+        if self.keys[slot] != key:
+            self.buckets[slot] = Welford()
+            self.keys[slot] = key
+        self.buckets[slot].add(x)
+
+    def snapshot(self, now_ts):
+        newest = int(now_ts // self.bucket_sec)
+        total = Welford()
+        for key, acc in zip(self.keys, self.buckets):
+            if key is not None and newest - key < self.n_buckets:
+                total.merge(acc)
+        return total
+
+
+class SlidingHistogram:
+    """Ring of LogHistograms giving quantiles over the last window_sec."""
+
+    def __init__(self, window_sec=60.0, bucket_sec=5.0):
+        self.bucket_sec = bucket_sec
+        self.n_buckets = max(1, int(math.ceil(window_sec / bucket_sec)))
+        self.hists = [LogHistogram() for _ in range(self.n_buckets)]
+        self.keys = [None] * self.n_buckets
+        self.slots = self.hists[0].bucket_index  # 共用同一分桶配置
+
+    def add(self, ts, x):
+        key = int(ts // self.bucket_sec)
+        slot = key % self.n_buckets
+        h = self.hists[slot]
+        if self.keys[slot] != key:
+            h.counts[:] = 0
+            h.total, h.vmin, h.vmax = 0.0, np.inf, -np.inf
+            self.keys[slot] = key
+        # 單筆更新避免 np.bincount 的配置成本
+        h.counts[int(self.slots(x))] += 1
+        h.total += x
+        h.vmin = min(h.vmin, x)
+        h.vmax = max(h.vmax, x)
+
+    def quantile(self, now_ts, q):
+        newest = int(now_ts // self.bucket_sec)
+        merged = LogHistogram()
+        for key, h in zip(self.keys, self.hists):
+            if key is not None and newest - key < self.n_buckets:
+                merged.merge(h)
+        return float(merged.quantiles([q])[0]), merged.count
+
+
+class ArrivalStats:
+    """Interarrival statistics (λ, Ca²) for a monotonic arrival stream."""
+
+    def __init__(self, window_sec):
+        self.last = None
+        self.cumulative = Welford()
+        self.sliding = SlidingWelford(window_sec)
+
+    def add(self, ts):
+        if self.last is not None and ts >= self.last:
+            gap = ts - self.last
+            self.cumulative.add(gap)
+            self.sliding.add(ts, gap)
+        if self.last is None or ts > self.last:
+            self.last = ts
+
+
+def kingman(lam, es, ca2, cs2):
+    """G/G/1 Kingman waiting time and system time (inf when unstable)."""
+    rho = lam * es
+    if not (rho < 1) or math.isnan(rho):
+        return rho, float('inf'), float('inf')
+    w = (rho / (1 - rho)) * ((ca2 + cs2) / 2) * es
+    return rho, w, w + es
+
+
+def priority_high(lam_total, lam_high, es, ca2, cs2):
+    """High-priority G/G/1 approximation as used in bar_chart.py."""
+    rho_total = lam_total * es
+    rho_high = lam_high * es
+    if not (rho_total < 1 and rho_high < 1):
+        return float('inf'), float('inf')
+    w = (rho_total / (1 - rho_high)) * ((ca2 + cs2) / 2) * es
+    return w, w + es
+
+
+class LiveMonitor:
+    """Online estimators fed from the plugin and forwarder logs."""
+
+    def __init__(self, window_sec=60.0, rho_alert=0.9, p99_drift=0.5):
+        self.window_sec = window_sec
+        self.rho_alert = rho_alert
+        self.p99_drift = p99_drift
+        self.lock = threading.Lock()
+        self.arrivals = {'all': ArrivalStats(window_sec), 'high': ArrivalStats(window_sec)}
+        self.service = Welford()
+        self.service_sliding = SlidingWelford(window_sec)
+        self.high_system = Welford()
+        self.high_p99 = SlidingHistogram(window_sec)
+        self.actions = {}
+        self.rows = {'plugin': 0, 'forwarder': 0}
+        self.latest_ts = 0.0
+        self.alerts = []
+
+    def on_plugin_row(self, row):
+        try:
+            ts = float(row['service_end_ts'])
+        except (KeyError, ValueError):
+            return
+        action = row.get('action', '')
+        self.rows['plugin'] += 1
+        self.actions[action] = self.actions.get(action, 0) + 1
+        self.latest_ts = max(self.latest_ts, ts)
+        if action == 'drop':
+            return
+        # 轉發器的到達 = 插件 Stage 2 結束時間（與 queu.py 一致）
+        self.arrivals['all'].add(ts)
+        if action == 'high':
+            self.arrivals['high'].add(ts)
+
+    def on_forwarder_row(self, row):
+        try:
+            start = float(row['start_forward_ts'])
+            end = float(row['end_forward_ts'])
+            orig = float(row['original_timestamp'])
+        except (KeyError, ValueError):
+            return
+        self.rows['forwarder'] += 1
+        self.latest_ts = max(self.latest_ts, end)
+        s = end - start
+        self.service.add(s)
+        self.service_sliding.add(end, s)
+        if row.get('priority') == 'high':
+            system = end - orig
+            self.high_system.add(system)
+            self.high_p99.add(end, system)
+
+    def _estimates(self, arrival_all, arrival_high, service):
+        lam = 1.0 / arrival_all.mean if arrival_all.n and arrival_all.mean > 0 else float('nan')
+        lam_high = 1.0 / arrival_high.mean if arrival_high.n and arrival_high.mean > 0 else 0.0
+        es = service.mean if service.n else float('nan')
+        ca2, cs2 = arrival_all.cv2, service.cv2
+        rho, w, t = kingman(lam, es, ca2, cs2)
+        w_high, t_high = priority_high(lam, lam_high, es, ca2, cs2)
+        return {'lambda': lam, 'lambda_high': lam_high, 'E_S': es, 'Ca2': ca2, 'Cs2': cs2,
+                'rho': rho, 'W_kingman': w, 'T_kingman': t, 'W_high': w_high, 'T_high': t_high}
+
+    def snapshot(self):
+        with self.lock:
+            now = self.latest_ts
+            cumulative = self._estimates(self.arrivals['all'].cumulative,
+                                         self.arrivals['high'].cumulative, self.service)
+            sliding = self._estimates(self.arrivals['all'].sliding.snapshot(now),
+                                      self.arrivals['high'].sliding.snapshot(now),
+                                      self.service_sliding.snapshot(now))
+            p99, n_high = self.high_p99.quantile(now, 0.99)
+            # 以指數分佈近似系統時間（M/M/1 時為精確值）：p99 ≈ T·ln(100)
+            p99_pred = sliding['T_high'] * math.log(100)
+            alerts = []
+            if sliding['rho'] >= self.rho_alert:
+                alerts.append(f"rho={sliding['rho']:.3f} >= {self.rho_alert}")
+            if n_high >= 100 and math.isfinite(p99_pred) and p99_pred > 0:
+                drift = (p99 - p99_pred) / p99_pred
+                if abs(drift) > self.p99_drift:
+                    alerts.append(f"high p99={p99 * 1000:.2f}ms drifts {drift * 100:+.0f}% "
+                                  f"from G/G/1 prediction {p99_pred * 1000:.2f}ms")
+            self.alerts = alerts
+            return {
+                'timestamp': now,
+                'rows': dict(self.rows),
+                'actions': dict(self.actions),
+                'window_sec': self.window_sec,
+                'cumulative': cumulative,
+                'sliding': sliding,
+                'high_p99_window': p99,
+                'high_p99_predicted': p99_pred,
+                'high_mean_system': self.high_system.mean if self.high_system.n else float('nan'),
+                'alerts': alerts,
+            }
+
+
+def run_tailers(monitor, plugin_path, forwarder_path, interval, stop_event):
+    tailers = [(LogTailer(plugin_path), monitor.on_plugin_row),
+               (LogTailer(forwarder_path), monitor.on_forwarder_row)]
+    while not stop_event.is_set():
+        got = False
+        for tailer, handler in tailers:
+            rows = tailer.poll()
+            if rows:
+                got = True
+                with monitor.lock:
+                    for row in rows:
+                        handler(row)
+        if not got:
+            stop_event.wait(interval)
+
+
+def make_handler(monitor):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = json.dumps(monitor.snapshot(), default=float).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+
+def format_dashboard(snap):
+    c, s = snap['cumulative'], snap['sliding']
+    lines = [
+        f"=== Live edge metrics @ {time.strftime('%H:%M:%S', time.localtime(snap['timestamp'] or time.time()))} "
+        f"(plugin rows {snap['rows']['plugin']}, forwarder rows {snap['rows']['forwarder']}) ===",
+        f"{'':14}{'cumulative':>14}{'last ' + format(snap['window_sec'], 'g') + 's':>14}",
+    ]
+    for key, label, scale in [('lambda', 'λ (1/s)', 1), ('lambda_high', 'λ high (1/s)', 1),
+                              ('E_S', 'E[S] (ms)', 1000), ('Ca2', 'Ca²', 1), ('Cs2', 'Cs²', 1),
+                              ('rho', 'ρ', 1), ('W_kingman', 'W G/G/1 (ms)', 1000),
+                              ('T_high', 'T high (ms)', 1000)]:
+        lines.append(f"{label:<14}{c[key] * scale:>14.4f}{s[key] * scale:>14.4f}")
+    lines.append(f"high p99 (ms)  measured {snap['high_p99_window'] * 1000:.3f}, "
+                 f"predicted {snap['high_p99_predicted'] * 1000:.3f}")
+    lines.append(f"actions: {snap['actions']}")
+    for alert in snap['alerts']:
+        lines.append(f"[ALERT] {alert}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='實驗進行中即時追蹤日誌並估計 λ、ρ、Ca²、Cs² 與 G/G/1 預測')
+    parser.add_argument('--plugin-log', default=PLUGIN_LOG, help=f'插件 CSV (預設: {PLUGIN_LOG})')
+    parser.add_argument('--forwarder-log', default=FORWARDER_LOG, help=f'轉發器 CSV (預設: {FORWARDER_LOG})')
+    parser.add_argument('--window', type=float, default=60.0, help='滑動窗口長度，秒 (預設: 60)')
+    parser.add_argument('--interval', type=float, default=0.5, help='輪詢日誌間隔，秒 (預設: 0.5)')
+    parser.add_argument('--refresh', type=float, default=2.0, help='儀表板刷新間隔，秒 (預設: 2)')
+    parser.add_argument('--port', type=int, default=0, help='在 127.0.0.1:PORT 提供 JSON 端點 (預設: 關閉)')
+    parser.add_argument('--no-dashboard', action='store_true', help='不在終端機顯示儀表板')
+    parser.add_argument('--rho-alert', type=float, default=0.9, help='ρ 警示門檻 (預設: 0.9)')
+    parser.add_argument('--p99-drift', type=float, default=0.5,
+                        help='高優先 p99 與預測相對誤差警示門檻 (預設: 0.5)')
+    args = parser.parse_args()
+
+    monitor = LiveMonitor(args.window, args.rho_alert, args.p99_drift)
+    stop = threading.Event()
+    tail_thread = threading.Thread(target=run_tailers, daemon=True,
+                                   args=(monitor, args.plugin_log, args.forwarder_log, args.interval, stop))
+    tail_thread.start()
+
+    server = None
+    if args.port:
+        server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(monitor))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"JSON 端點: http://127.0.0.1:{args.port}/metrics")
+
+    try:
+        while True:
+            time.sleep(args.refresh)
+            snap = monitor.snapshot()
+            if not args.no_dashboard:
+                print("\033[2J\033[H" + format_dashboard(snap), flush=True)
+            elif snap['alerts']:
+                for alert in snap['alerts']:
+                    print(f"[ALERT] {alert}", flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        if server:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
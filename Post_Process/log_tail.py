@@ -0,0 +1,88 @@
+"""Follow CSV logs while the plugin and forwarder are still writing them.
+
+The C components open their logs with fopen(..., "w") at start-up, so a file
+may not exist yet, may be truncated when a new run starts, and its last line
+may be half written. LogTailer copes with all three: it waits for the file,
+restarts from the header after truncation and only returns complete lines.
+"""
+import csv
+import os
+import time
+
+
+class LogTailer:
+    """Incrementally read rows appended to a CSV file.
+
+    poll() returns the rows (dicts keyed by the header) that were completed
+    since the previous call; it never blocks. The tailer keeps only the
+    current file offset and one partial line in memory.
+    """
+
+    def __init__(self, path, from_start=True):
+        self.path = path
+        self.from_start = from_start
+        self.header = None
+        self.offset = 0
+        self.partial = b''
+        self.inode = None
+        self.restarts = 0
+
+    def _reset(self):
+        self.header = None
+        self.offset = 0
+        self.partial = b''
+
+    def _read_new_bytes(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return b''
+        if self.inode is not None and (st.st_ino != self.inode or st.st_size < self.offset):
+            # 新一輪實驗重新建立或截斷了檔案
+            self._reset()
+            self.restarts += 1
+        if self.inode is None and not self.from_start:
+            self.offset = st.st_size
+        self.inode = st.st_ino
+        if st.st_size == self.offset:
+            return b''
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(st.st_size - self.offset)
+        self.offset += len(data)
+        return data
+
+    def poll_lines(self):
+        data = self._read_new_bytes()
+        if not data:
+            return []
+        data = self.partial + data
+        lines = data.split(b'\n')
+        self.partial = lines.pop()
+        return [line.decode('utf-8', 'replace').rstrip('\r') for line in lines if line]
+
+    def poll(self):
+        lines = self.poll_lines()
+        if not lines:
+            return []
+        if self.header is None:
+            if self.offset > 0 and not self.from_start and self.restarts == 0:
+                # 從檔尾開始跟讀時仍需要表頭
+                with open(self.path, 'r') as f:
+                    self.header = next(csv.reader([f.readline().strip()]))
+            else:
+                self.header = next(csv.reader([lines.pop(0)]))
+        rows = []
+        for values in csv.reader(lines):
+            if len(values) == len(self.header):
+                rows.append(dict(zip(self.header, values)))
+        return rows
+
+    def follow(self, interval=0.5, stop=None):
+        """Generator yielding batches of new rows until stop() returns True."""
+        while stop is None or not stop():
+            rows = self.poll()
+            if rows:
+                yield rows
+            else:
+                time.sleep(interval)
@@ -0,0 +1,94 @@
+"""Shared plotting helpers for the Post_Process scripts.
+
+Long runs produce hundreds of thousands of rolling-window points; drawing each
+one as an SVG vector makes the figures slow to write and to open. Series are
+therefore downsampled with LTTB (Largest-Triangle-Three-Buckets), which keeps
+peaks and dips, and dense lines can be rasterized inside an otherwise vector
+figure. Behaviour is controlled by environment variables so the existing
+scripts keep their plain top-to-bottom form:
+
+    PLOT_MAX_POINTS   points kept per series (default 2000, 0 = no downsampling)
+    PLOT_FORMAT       svg | png (default: the extension given to save_figure)
+    PLOT_RASTERIZE    1 = rasterize data lines (default 1)
+    PLOT_DPI          resolution for PNG output and rasterized lines (default 150)
+    PLOT_HEADLESS     1 = never call plt.show() (set by render_all.py)
+"""
+import os
+
+import numpy as np
+
+if os.environ.get('PLOT_HEADLESS') == '1':
+    import matplotlib
+    matplotlib.use('Agg')
+
+import matplotlib.pyplot as plt
+
+MAX_POINTS = int(os.environ.get('PLOT_MAX_POINTS', '2000'))
+PLOT_FORMAT = os.environ.get('PLOT_FORMAT', '')
+RASTERIZE = os.environ.get('PLOT_RASTERIZE', '1') == '1'
+DPI = int(os.environ.get('PLOT_DPI', '150'))
+HEADLESS = os.environ.get('PLOT_HEADLESS') == '1'
+
+
+def lttb(x, y, n_out=MAX_POINTS):
+    """Largest-Triangle-Three-Buckets downsampling.
+
+    Returns (x, y) with at most n_out points. The first and last points are
+    always kept; from every bucket in between the point forming the largest
+    triangle with the previous pick and the next bucket's mean is chosen.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    ok = np.isfinite(x) & np.isfinite(y)
+    x, y = x[ok], y[ok]
+    n = x.size
+    if n_out <= 0 or n <= n_out or n_out < 3:
+        return x, y
+
+    # 中間 n-2 個點平均分到 n_out-2 個桶
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+
+    # 每個桶的平均值（供前一個桶選點使用），一次算完
+    csx = np.concatenate(([0.0], np.cumsum(x)))
+    csy = np.concatenate(([0.0], np.cumsum(y)))
+    lo, hi = edges[:-1], edges[1:]
+    mean_x = (csx[hi] - csx[lo]) / (hi - lo)
+    mean_y = (csy[hi] - csy[lo]) / (hi - lo)
+    mean_x = np.append(mean_x, x[-1])
+    mean_y = np.append(mean_y, y[-1])
+
+    a = 0
+    for i in range(n_out - 2):
+        s, e = lo[i], hi[i]
+        ax, ay = x[a], y[a]
+        area = np.abs((ax - mean_x[i + 1]) * (y[s:e] - ay) - (ax - x[s:e]) * (mean_y[i + 1] - ay))
+        a = s + int(np.argmax(area))
+        keep[i + 1] = a
+    return x[keep], y[keep]
+
+
+def plot_series(x, y, max_points=None, **kwargs):
+    """plt.plot() with LTTB downsampling and optional line rasterization."""
+    xs, ys = lttb(x, y, MAX_POINTS if max_points is None else max_points)
+    kwargs.setdefault('rasterized', RASTERIZE)
+    return plt.plot(xs, ys, **kwargs)
+
+
+def save_figure(filename, **kwargs):
+    """Save the current figure honouring PLOT_FORMAT, then show or close it.
+
+    Returns the path actually written.
+    """
+    root, ext = os.path.splitext(filename)
+    fmt = PLOT_FORMAT or ext.lstrip('.') or 'svg'
+    path = f"{root}.{fmt}"
+    kwargs.setdefault('bbox_inches', 'tight')
+    kwargs.setdefault('dpi', DPI)
+    plt.savefig(path, format=fmt, **kwargs)
+    if HEADLESS:
+        plt.close()
+    else:
+        plt.show()
+    return path
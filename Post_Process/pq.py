@@ -1,9 +1,12 @@
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+from plot_utils import plot_series, save_figure
+from service_fit import service_moments
 
 # 1. Read the CSV file
-df = pd.read_csv('merged_performance_att_1hrs_1tm_pq_rev.csv')
+CSV_FILE = 'merged_performance_att_1hrs_1tm_pq_rev.csv'
+df = pd.read_csv(CSV_FILE)
 
 # 2. Compute waiting time and service time
 df['queue_wait'] = df['start_forward_ts'] - df['original_timestamp']
@@ -46,13 +49,14 @@ def calculate_priority_gg1_metrics(priority_df, priority_name, all_data):
     all_sorted = all_data.sort_values('original_ts_numeric')
     all_interarrival = all_sorted['original_ts_numeric'].diff().dropna()
     lambda_total = 1.0 / all_interarrival.mean()
-    service_time_total = all_data['service_time'].mean()
+    # E[S] and Cs^2 from the service_fit.py model when one has been fitted to this CSV
+    service_time_total, Cs2_total, service_source = service_moments(all_data['service_time'], CSV_FILE)
     rho_total = lambda_total * service_time_total
     
     # Calculate system-wide coefficients of variation
     Ca2_total = all_interarrival.var() / (all_interarrival.mean()**2)
-    Cs2_total = all_data['service_time'].var() / (service_time_total**2)
     
+    print(f"Service time model: {service_source}")
     print(f"Total system lambda: {lambda_total:.6f}")
     print(f"Total system rho: {rho_total:.6f}")
     print(f"Total Ca^2: {Ca2_total:.6f}")
@@ -139,20 +143,20 @@ plt.rcParams.update({
 plt.figure(figsize=(15, 8))
 
 # Plot sliding window averages for system time (High=red, Low=orange)
-plt.plot(high_window_time, high_window_avg['system_time'], 
-         label=f"High Priority Window Avg", 
-         linewidth=1.5, color='#ffaaaa')  # Light red for High
-plt.plot(low_window_time, low_window_avg['system_time'], 
-         label=f"Low Priority Window Avg", 
-         linewidth=1.5, color='#ffcc99')  # Light orange for Low
+plot_series(high_window_time, high_window_avg['system_time'], 
+            label=f"High Priority Window Avg", 
+            linewidth=1.5, color='#ffaaaa')  # Light red for High
+plot_series(low_window_time, low_window_avg['system_time'], 
+            label=f"Low Priority Window Avg", 
+            linewidth=1.5, color='#ffcc99')  # Light orange for Low
 
 # Plot cumulative averages for system time (High=red, Low=orange, dashed)
-plt.plot(high_cum_time, high_cum_avg['system_time'], 
-         label=f"High Priority Cumulative Avg ({high_metrics['avg_system']:.6f}s)", 
-         linewidth=2.0, color='#cc0000', linestyle='--')  # Medium red for High
-plt.plot(low_cum_time, low_cum_avg['system_time'], 
-         label=f"Low Priority Cumulative Avg ({low_metrics['avg_system']:.6f}s)", 
-         linewidth=2.0, color='#ff9933', linestyle='--')  # Medium orange for Low
+plot_series(high_cum_time, high_cum_avg['system_time'], 
+            label=f"High Priority Cumulative Avg ({high_metrics['avg_system']:.6f}s)", 
+            linewidth=2.0, color='#cc0000', linestyle='--')  # Medium red for High
+plot_series(low_cum_time, low_cum_avg['system_time'], 
+            label=f"Low Priority Cumulative Avg ({low_metrics['avg_system']:.6f}s)", 
+            linewidth=2.0, color='#ff9933', linestyle='--')  # Medium orange for Low
 
 # Add theoretical Priority G/G/1 reference lines for system time (High=red, Low=orange, dash-dot)
 if not np.isinf(high_metrics['T_priority']):
@@ -169,27 +173,26 @@ plt.grid(True, alpha=0.3)
 
 plt.tight_layout()
 plt.ylim(0, 0.3)
-plt.savefig("priority_system_time_analysis_gg1.svg", format='svg', bbox_inches="tight")
-plt.show()
+system_fig_path = save_figure("priority_system_time_analysis_gg1.svg")
 
 # Plot 2: Queue Waiting Time Only 
 plt.figure(figsize=(15, 8))
 
 # Plot sliding window averages for queue wait time (High=red, Low=orange)
-plt.plot(high_window_time, high_window_avg['queue_wait'], 
-         label=f"High Priority Window Avg", 
-         linewidth=1.5, color='#ffaaaa')  # Light red for High
-plt.plot(low_window_time, low_window_avg['queue_wait'], 
-         label=f"Low Priority Window Avg", 
-         linewidth=1.5, color='#ffcc99')  # Light orange for Low
+plot_series(high_window_time, high_window_avg['queue_wait'], 
+            label=f"High Priority Window Avg", 
+            linewidth=1.5, color='#ffaaaa')  # Light red for High
+plot_series(low_window_time, low_window_avg['queue_wait'], 
+            label=f"Low Priority Window Avg", 
+            linewidth=1.5, color='#ffcc99')  # Light orange for Low
 
 # Plot cumulative averages for queue wait time (High=red, Low=orange, dashed)
-plt.plot(high_cum_time, high_cum_avg['queue_wait'], 
-         label=f"High Priority Cumulative Avg ({high_metrics['avg_queue']:.6f}s)", 
-         linewidth=2.0, color='#cc0000', linestyle='--')  # Medium red for High
-plt.plot(low_cum_time, low_cum_avg['queue_wait'], 
-         label=f"Low Priority Cumulative Avg ({low_metrics['avg_queue']:.6f}s)", 
-         linewidth=2.0, color='#ff9933', linestyle='--')  # Medium orange for Low
+plot_series(high_cum_time, high_cum_avg['queue_wait'], 
+            label=f"High Priority Cumulative Avg ({high_metrics['avg_queue']:.6f}s)", 
+            linewidth=2.0, color='#cc0000', linestyle='--')  # Medium red for High
+plot_series(low_cum_time, low_cum_avg['queue_wait'], 
+            label=f"Low Priority Cumulative Avg ({low_metrics['avg_queue']:.6f}s)", 
+            linewidth=2.0, color='#ff9933', linestyle='--')  # Medium orange for Low
 
 # Add theoretical Priority G/G/1 reference lines for queue wait time (High=red, Low=orange, dash-dot)
 if not np.isinf(high_metrics['W_priority']):
@@ -206,8 +209,7 @@ plt.grid(True, alpha=0.3)
 
 plt.tight_layout()
 plt.ylim(0, 0.2)
-plt.savefig("priority_queue_wait_time_analysis_gg1.svg", format='svg', bbox_inches="tight")
-plt.show()
+queue_fig_path = save_figure("priority_queue_wait_time_analysis_gg1.svg")
 
 # Summary comparison
 print("\n" + "="*60)
@@ -241,5 +243,5 @@ if not np.isinf(low_metrics['W_priority']):
     print(f"Low Priority - Difference: {low_queue_diff:.2f}%")
 
 print("\n分析完成！")
-print("圖表已保存為: priority_system_time_analysis_gg1_att.svg")
-print("圖表已保存為: priority_queue_wait_time_analysis_gg1_att.svg")
\ No newline at end of file
+print(f"圖表已保存為: {system_fig_path}")
+print(f"圖表已保存為: {queue_fig_path}")
\ No newline at end of file
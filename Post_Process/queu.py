@@ -1,9 +1,12 @@
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+from plot_utils import plot_series, save_figure
+from service_fit import service_moments
 
 # 1. Read the merged CSV containing service_end_ts, start_forward_ts, end_forward_ts
-df = pd.read_csv('merged_performance_att_1hrs_1tm.csv')
+CSV_FILE = 'merged_performance_att_1hrs_1tm.csv'
+df = pd.read_csv(CSV_FILE)
 
 print(f"讀入 {len(df)} 筆排隊數據")
 
@@ -33,10 +36,8 @@ print(f"Lambda calculated from 'original_timestamp': {lambda_from_original:.6f}
 Ca2 = interarrival_from_original.var() / (interarrival_from_original.mean()**2)
 print(f"到達流程 CV² = {Ca2:.4f}")
 
-# Service time statistics
-E_S = df['service_time'].mean()
-Var_S = df['service_time'].var()
-Cs2 = Var_S / (E_S**2)  # Service CV²
+# Service time statistics (service_fit.py 的擬合模型，尚未擬合時用樣本 mean/var)
+E_S, Cs2, service_source = service_moments(df['service_time'], CSV_FILE)  # Cs2: Service CV²
 
 # System parameters
 lambda_theoretical = lambda_from_original
@@ -44,6 +45,7 @@ rho = lambda_theoretical * E_S
 
 print(f"\n系統參數分析:")
 print(f"實際到達率 (λ): {lambda_theoretical:.6f} events/second")
+print(f"服務時間模型: {service_source}")
 print(f"平均服務時間 (E[S]): {E_S:.6f} seconds")
 print(f"流量強度 (ρ): {rho:.6f}")
 print(f"服務流程 CV² = {Cs2:.4f}")
@@ -107,20 +109,20 @@ relative_time_window = (window_avg.index.astype(np.int64) / 1e9) - start_time
 relative_time_cum = (cum_avg.index.astype(np.int64) / 1e9) - start_time
 
 # Plot sliding window averages (light colors)
-plt.plot(relative_time_window, window_avg['queue_wait'], 
-         label=f"Window Avg Queue Wait (10s window)", 
-         linewidth=1.5, color='#ffaaaa')  # Light red
-plt.plot(relative_time_window, window_avg['system_time'], 
-         label=f"Window Avg System Time (10s window)", 
-         linewidth=1.5, color='#ffcc99')  # Light orange
+plot_series(relative_time_window, window_avg['queue_wait'], 
+            label=f"Window Avg Queue Wait (10s window)", 
+            linewidth=1.5, color='#ffaaaa')  # Light red
+plot_series(relative_time_window, window_avg['system_time'], 
+            label=f"Window Avg System Time (10s window)", 
+            linewidth=1.5, color='#ffcc99')  # Light orange
 
 # Plot cumulative averages (medium colors, dashed)
-plt.plot(relative_time_cum, cum_avg['queue_wait'], 
-         label=f"Cumulative Avg Queue Wait ({actual_avg_wait:.6f}s)", 
-         linewidth=2.0, color='#cc0000', linestyle='--')  # Medium red
-plt.plot(relative_time_cum, cum_avg['system_time'], 
-         label=f"Cumulative Avg System Time ({actual_avg_system:.6f}s)", 
-         linewidth=2.0, color='#ff9933', linestyle='--')  # Medium orange
+plot_series(relative_time_cum, cum_avg['queue_wait'], 
+            label=f"Cumulative Avg Queue Wait ({actual_avg_wait:.6f}s)", 
+            linewidth=2.0, color='#cc0000', linestyle='--')  # Medium red
+plot_series(relative_time_cum, cum_avg['system_time'], 
+            label=f"Cumulative Avg System Time ({actual_avg_system:.6f}s)", 
+            linewidth=2.0, color='#ff9933', linestyle='--')  # Medium orange
 
 # Add theoretical G/G/1 reference lines (dark colors, dash-dot)
 if rho < 1 and W_GG1 != float('inf'):
@@ -140,8 +142,7 @@ plt.grid(True, alpha=0.3)
 plt.tight_layout()
 
 # Save chart as SVG
-plt.savefig("queue_time_analysis_gg1_theoretical.svg", format='svg', bbox_inches="tight")
-plt.show()
+saved_path = save_figure("queue_time_analysis_gg1_theoretical.svg")
 
 print("\n分析完成！")
-print("圖表已保存為: queue_time_analysis_gg1_theoretical_att_normal.svg")
\ No newline at end of file
+print(f"圖表已保存為: {saved_path}")
\ No newline at end of file
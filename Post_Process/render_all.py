@@ -0,0 +1,69 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 預設批次繪製的腳本（皆讀取當前目錄下的合併 CSV）
+DEFAULT_SCRIPTS = ['queu.py', 'pq.py', 'bar_chart.py', 'latency_hist.py', 'stage_latency.py']
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def render_one(script, data_dir, env, log_dir):
+    """Run one plotting script headless and return (script, returncode, seconds)."""
+    start = time.perf_counter()
+    log_path = os.path.join(log_dir, f"{os.path.splitext(os.path.basename(script))[0]}.log")
+    with open(log_path, 'w') as log:
+        rc = subprocess.run([sys.executable, os.path.join(HERE, script)],
+                            cwd=data_dir, env=env, stdout=log, stderr=subprocess.STDOUT).returncode
+    return script, rc, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='以無視窗模式平行產生所有後處理圖表')
+    parser.add_argument('scripts', nargs='*', default=DEFAULT_SCRIPTS,
+                        help=f'要執行的腳本 (預設: {" ".join(DEFAULT_SCRIPTS)})')
+    parser.add_argument('--data-dir', default='.', help='合併 CSV 所在目錄，圖表也輸出於此 (預設: .)')
+    parser.add_argument('--format', choices=['svg', 'png'], help='輸出格式 (預設: 各腳本原本的 svg)')
+    parser.add_argument('--max-points', type=int, default=2000,
+                        help='每條曲線 LTTB 降採樣後保留的點數，0 表示不降採樣 (預設: 2000)')
+    parser.add_argument('--no-rasterize', action='store_true', help='SVG 中的曲線保持向量格式')
+    parser.add_argument('--dpi', type=int, default=150, help='PNG 與點陣化曲線的解析度 (預設: 150)')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 1,
+                        help='平行執行數 (預設: CPU 核心數)')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['PLOT_HEADLESS'] = '1'
+    env['MPLBACKEND'] = 'Agg'
+    env['PLOT_MAX_POINTS'] = str(args.max_points)
+    env['PLOT_RASTERIZE'] = '0' if args.no_rasterize else '1'
+    env['PLOT_DPI'] = str(args.dpi)
+    env['PYTHONPATH'] = HERE + os.pathsep + env.get('PYTHONPATH', '')
+    if args.format:
+        env['PLOT_FORMAT'] = args.format
+
+    data_dir = os.path.abspath(args.data_dir)
+    log_dir = os.path.join(data_dir, 'render_logs')
+    os.makedirs(log_dir, exist_ok=True)
+
+    print(f"平行繪製 {len(args.scripts)} 個腳本 (jobs={args.jobs}, 降採樣={args.max_points} 點)")
+    start = time.perf_counter()
+    failed = 0
+    # 每個腳本本身是獨立行程，執行緒池只負責等待子行程
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(render_one, s, data_dir, env, log_dir) for s in args.scripts]
+        for fut in futures:
+            script, rc, elapsed = fut.result()
+            status = 'OK' if rc == 0 else f'FAILED (code {rc})'
+            print(f"  {script:<20} {elapsed:7.2f}s  {status}")
+            failed += rc != 0
+
+    print(f"總耗時: {time.perf_counter() - start:.2f}s，日誌位於 {log_dir}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Compare forwarder scheduling disciplines (pq_forwarder --sched) run by run.
+
+Each argument is one forwarder log (CSV or .bin) from the same flood scenario
+run under a different discipline. Per priority class it reports the share of
+forwarded messages and the queue wait (FIFO write -> forwarder dequeue):
+HIGH latency vs. LOW starvation is the trade-off the disciplines move along.
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from binlog import read_log
+
+QUANTILES = [0.5, 0.99]
+
+
+def queue_wait_ms(df):
+    if 'queue_wait_ms' in df:
+        return pd.to_numeric(df['queue_wait_ms'], errors='coerce')
+    # 舊日誌沒有 queue_wait_ms 欄位：由時間戳計算
+    wait = (df['enqueue_ts'] - df['original_timestamp']) * 1000.0
+    return wait.where(df['original_timestamp'] > 0)
+
+
+def class_stats(path):
+    """One row per priority class: n, share, throughput and queue-wait mean/p50/p99/max (ms)."""
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"找不到檔案：{path}")
+    df = read_log(path)
+    df = df[df['forward_result'] == 'SUCCESS']
+    df = df.assign(wait=queue_wait_ms(df), cls=df['priority'].str.upper())
+    span = df['enqueue_ts'].max() - df['enqueue_ts'].min() if len(df) > 1 else np.nan
+    rows = {}
+    for cls, g in df.groupby('cls'):
+        w = g['wait'].dropna()
+        rows[cls] = {'n': len(g), 'share': len(g) / len(df), 'rate': len(g) / span if span else np.nan,
+                     'mean': w.mean(), **{f'p{int(q * 100)}': w.quantile(q) for q in QUANTILES},
+                     'max': w.max()}
+    return pd.DataFrame(rows).T
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比較不同排程規則下各優先級的排隊時間與處理比例')
+    parser.add_argument('logs', nargs='+', help='forwarder_performance.csv / .bin（每個排程規則一份）')
+    parser.add_argument('--labels', nargs='+', help='各日誌的名稱（預設使用檔名）')
+    args = parser.parse_args()
+
+    labels = args.labels or [os.path.basename(p) for p in args.logs]
+    if len(labels) != len(args.logs):
+        parser.error('--labels 數量必須與日誌數量相同')
+
+    print(f"{'run':<24}{'class':<6}{'n':>8}{'share':>8}{'msg/s':>9}"
+          f"{'mean':>10}{'p50':>10}{'p99':>10}{'max':>10}  (queue wait, ms)")
+    for label, path in zip(labels, args.logs):
+        stats = class_stats(path)
+        for cls, r in stats.iterrows():
+            print(f"{label:<24}{cls:<6}{int(r['n']):>8}{r['share']:>8.1%}{r['rate']:>9.1f}"
+                  f"{r['mean']:>10.2f}{r['p50']:>10.2f}{r['p99']:>10.2f}{r['max']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
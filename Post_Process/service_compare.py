@@ -0,0 +1,50 @@
+import argparse
+import os
+
+import pandas as pd
+
+# 插件 CSV 中與政策服務時間相關的欄位 (ms)
+SERVICE_COLUMNS = ['actual_api_time_ms', 'total_service_time_ms', 'wait_time_ms']
+QUANTILES = [0.5, 0.9, 0.99]
+
+
+def service_stats(path):
+    """mean/p50/p90/p99 of the plugin service-time columns, plus E[S] and μ of the policy stage."""
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"找不到檔案：{path}")
+    df = pd.read_csv(path)
+    rows = {}
+    for col in SERVICE_COLUMNS:
+        if col not in df:
+            continue
+        x = pd.to_numeric(df[col], errors='coerce').dropna()
+        rows[col] = {'n': len(x), 'mean': x.mean(),
+                     **{f'p{int(q * 100)}': x.quantile(q) for q in QUANTILES}}
+    out = pd.DataFrame(rows).T
+    if 'total_service_time_ms' in rows:
+        out.attrs['mu'] = 1000.0 / rows['total_service_time_ms']['mean']
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比較兩次實驗插件端政策服務時間 (例如 keep-alive 前後)')
+    parser.add_argument('before', help='修改前的 edge_plugin.csv')
+    parser.add_argument('after', help='修改後的 edge_plugin.csv')
+    args = parser.parse_args()
+
+    before, after = service_stats(args.before), service_stats(args.after)
+    stats = ['mean'] + [f'p{int(q * 100)}' for q in QUANTILES]
+    print(f"{'column':<24}{'stat':<6}{'before':>12}{'after':>12}{'change':>10}")
+    for col in before.index.intersection(after.index):
+        for stat in stats:
+            b, a = before.loc[col, stat], after.loc[col, stat]
+            change = (a - b) / b * 100 if b else float('nan')
+            print(f"{col:<24}{stat:<6}{b:>12.3f}{a:>12.3f}{change:>9.1f}%")
+
+    if 'mu' in before.attrs and 'mu' in after.attrs:
+        # μ = 1 / E[S]，Kingman / 優先權公式中的服務率
+        print(f"\n政策階段服務率 μ: {before.attrs['mu']:.1f} -> {after.attrs['mu']:.1f} msg/s")
+
+
+if __name__ == "__main__":
+    main()
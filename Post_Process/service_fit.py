@@ -0,0 +1,323 @@
+"""Fit reusable service-time models to measured service times.
+
+Candidates are exponential, lognormal, gamma and an empirical body with an
+exponential tail above a high quantile (peaks-over-threshold). Each model is
+fitted on one random half of the data and scored by the Kolmogorov-Smirnov
+distance to the other half, so the empirical model gets no free advantage.
+Models expose vectorized sample(), cdf(), mean, var and cs2 (= Var/E²), and
+round-trip through JSON so the Kingman/priority formulas and simulator.py
+can share the same fitted model: the models for a CSV are written to
+Result/<csv name>_service_models.json, and service_moments() gives pq.py,
+queu.py and bar_chart.py E[S] and Cs² from them (sample moments until this
+script has been run on that CSV).
+"""
+import abc
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+CANDIDATES = ('exponential', 'lognormal', 'gamma', 'empirical_tail')
+
+
+class ServiceModel(abc.ABC):
+    name = None
+
+    @abc.abstractmethod
+    def sample(self, n, rng):
+        """n independent draws as a float64 array."""
+
+    @abc.abstractmethod
+    def cdf(self, x):
+        """P(S <= x), vectorized over x."""
+
+    @property
+    @abc.abstractmethod
+    def mean(self):
+        """E[S]."""
+
+    @property
+    @abc.abstractmethod
+    def var(self):
+        """Var[S]."""
+
+    @property
+    def cs2(self):
+        return self.var / self.mean ** 2
+
+    @abc.abstractmethod
+    def params(self):
+        """Keyword arguments that rebuild the model (JSON-serializable)."""
+
+    def to_dict(self):
+        return {'name': self.name, 'params': self.params(), 'mean': self.mean, 'cs2': self.cs2}
+
+
+class ExponentialModel(ServiceModel):
+    name = 'exponential'
+
+    def __init__(self, scale):
+        self.scale = float(scale)
+
+    @classmethod
+    def fit(cls, x):
+        return cls(x.mean())
+
+    def sample(self, n, rng):
+        return rng.exponential(self.scale, n)
+
+    def cdf(self, x):
+        return 1.0 - np.exp(-np.asarray(x) / self.scale)
+
+    @property
+    def mean(self):
+        return self.scale
+
+    @property
+    def var(self):
+        return self.scale ** 2
+
+    def params(self):
+        return {'scale': self.scale}
+
+
+class LognormalModel(ServiceModel):
+    name = 'lognormal'
+
+    def __init__(self, mu, sigma):
+        self.mu, self.sigma = float(mu), float(sigma)
+
+    @classmethod
+    def fit(cls, x):
+        logx = np.log(x[x > 0])
+        return cls(logx.mean(), logx.std())
+
+    def sample(self, n, rng):
+        return rng.lognormal(self.mu, self.sigma, n)
+
+    def cdf(self, x):
+        return stats.lognorm.cdf(x, self.sigma, scale=np.exp(self.mu))
+
+    @property
+    def mean(self):
+        return float(np.exp(self.mu + self.sigma ** 2 / 2))
+
+    @property
+    def var(self):
+        return float((np.exp(self.sigma ** 2) - 1) * np.exp(2 * self.mu + self.sigma ** 2))
+
+    def params(self):
+        return {'mu': self.mu, 'sigma': self.sigma}
+
+
+class GammaModel(ServiceModel):
+    name = 'gamma'
+
+    def __init__(self, shape, scale):
+        self.shape, self.scale = float(shape), float(scale)
+
+    @classmethod
+    def fit(cls, x):
+        shape, _, scale = stats.gamma.fit(x[x > 0], floc=0)
+        return cls(shape, scale)
+
+    def sample(self, n, rng):
+        return rng.gamma(self.shape, self.scale, n)
+
+    def cdf(self, x):
+        return stats.gamma.cdf(x, self.shape, scale=self.scale)
+
+    @property
+    def mean(self):
+        return self.shape * self.scale
+
+    @property
+    def var(self):
+        return self.shape * self.scale ** 2
+
+    def params(self):
+        return {'shape': self.shape, 'scale': self.scale}
+
+
+class EmpiricalTailModel(ServiceModel):
+    """Empirical distribution below the tail_q quantile, exponential excess above it."""
+    name = 'empirical_tail'
+
+    def __init__(self, body, threshold, tail_q, tail_scale):
+        self.body = np.sort(np.asarray(body, dtype=np.float64))
+        self.threshold = float(threshold)
+        self.tail_q = float(tail_q)
+        self.tail_scale = float(tail_scale)
+
+    @classmethod
+    def fit(cls, x, tail_q=0.95):
+        u = np.quantile(x, tail_q)
+        excess = x[x > u] - u
+        return cls(x[x <= u], u, tail_q, excess.mean() if excess.size else 0.0)
+
+    def sample(self, n, rng):
+        out = rng.choice(self.body, n)
+        tail = rng.random(n) >= self.tail_q
+        out[tail] = self.threshold + rng.exponential(self.tail_scale, int(tail.sum()))
+        return out
+
+    def cdf(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        body = np.searchsorted(self.body, x, side='right') / self.body.size * self.tail_q
+        excess = np.clip(x - self.threshold, 0, None)
+        tail = self.tail_q + (1 - self.tail_q) * (1 - np.exp(-excess / self.tail_scale)) \
+            if self.tail_scale > 0 else np.ones_like(x)
+        return np.where(x <= self.threshold, body, tail)
+
+    @property
+    def mean(self):
+        return self.tail_q * self.body.mean() + (1 - self.tail_q) * (self.threshold + self.tail_scale)
+
+    @property
+    def var(self):
+        body_m2 = (self.body ** 2).mean()
+        # E[(u+E)^2] = u^2 + 2u·s + 2s^2，E ~ Exp(scale=s)
+        tail_m2 = self.threshold ** 2 + 2 * self.threshold * self.tail_scale + 2 * self.tail_scale ** 2
+        return self.tail_q * body_m2 + (1 - self.tail_q) * tail_m2 - self.mean ** 2
+
+    def params(self):
+        return {'threshold': self.threshold, 'tail_q': self.tail_q, 'tail_scale': self.tail_scale,
+                'body': self.body.tolist()}
+
+
+MODELS = {cls.name: cls for cls in (ExponentialModel, LognormalModel, GammaModel, EmpiricalTailModel)}
+
+
+def model_from_dict(d):
+    cls = MODELS[d['name']]
+    return cls(**d['params'])
+
+
+def load_models(path):
+    """{column: best model} from a JSON written by this script."""
+    with open(path) as f:
+        return {col: model_from_dict(entry['best']) for col, entry in json.load(f).items()}
+
+
+def models_path(csv):
+    """Where main() writes the models fitted to csv."""
+    return os.path.join('Result', f"{os.path.splitext(os.path.basename(csv))[0]}_service_models.json")
+
+
+def service_moments(values, csv, column='service_time'):
+    """(E[S], Cs², source) for the queueing formulas: the fitted model of column when
+    models_path(csv) exists, otherwise the sample moments of values."""
+    path = models_path(csv)
+    if os.path.isfile(path):
+        model = load_models(path).get(column)
+        if model is not None:
+            return model.mean, model.cs2, f"{model.name} ({path})"
+    mean = values.mean()
+    return mean, values.var() / mean ** 2, 'sample'
+
+
+def ks_distance(model, x):
+    x = np.sort(x)
+    n = x.size
+    cdf = model.cdf(x)
+    return float(max((np.arange(1, n + 1) / n - cdf).max(), (cdf - np.arange(n) / n).max()))
+
+
+def _fit_one(task):
+    name, train, test = task
+    model = MODELS[name].fit(train)
+    return name, model, ks_distance(model, test)
+
+
+def fit_candidates(values, candidates=CANDIDATES, seed=0, max_workers=None):
+    """Fit every candidate in parallel; return [(name, model, ks)] sorted by KS on held-out data."""
+    x = np.asarray(values, dtype=np.float64)
+    x = x[np.isfinite(x) & (x > 0)]
+    if x.size < 10:
+        raise ValueError(f"need at least 10 positive samples, got {x.size}")
+    perm = np.random.default_rng(seed).permutation(x.size)
+    train, test = x[perm[::2]], x[perm[1::2]]
+    tasks = [(name, train, test) for name in candidates]
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(_fit_one, tasks))
+    return sorted(results, key=lambda r: r[2])
+
+
+def fit_best(values, candidates=CANDIDATES, seed=0, max_workers=None):
+    """Best candidate refitted on all samples."""
+    name = fit_candidates(values, candidates, seed, max_workers)[0][0]
+    x = np.asarray(values, dtype=np.float64)
+    return MODELS[name].fit(x[np.isfinite(x) & (x > 0)])
+
+
+class BufferedSampler:
+    """Scalar draws for event-by-event simulation, refilled in vectorized batches."""
+
+    def __init__(self, model, rng, batch=65536):
+        self.model = model
+        self.rng = rng
+        self.batch = batch
+        self.buf = []
+
+    def __call__(self):
+        if not self.buf:
+            self.buf = self.model.sample(self.batch, self.rng).tolist()
+        return self.buf.pop()
+
+    @property
+    def mean(self):
+        return self.model.mean
+
+
+def service_columns(df):
+    """The service-time series this module is usually pointed at."""
+    cols = {}
+    if {'start_forward_ts', 'end_forward_ts'} <= set(df.columns):
+        cols['service_time'] = (df['end_forward_ts'] - df['start_forward_ts']).dropna().to_numpy()
+    if 'actual_api_time_ms' in df:
+        cols['actual_api_time_ms'] = df['actual_api_time_ms'].dropna().to_numpy()
+    return cols
+
+
+def main():
+    parser = argparse.ArgumentParser(description='擬合服務時間分佈並輸出可重用的模型 (E[S], Cs², 抽樣器)')
+    parser.add_argument('--csv', default='merged_performance_att_1hrs_1tm_pq_rev.csv',
+                        help='合併 CSV 或插件 CSV (預設: merged_performance_att_1hrs_1tm_pq_rev.csv)')
+    parser.add_argument('--output', '-o', default=None,
+                        help='模型輸出 JSON (預設: Result/<CSV 檔名>_service_models.json，pq.py 等會自動讀取)')
+    parser.add_argument('--jobs', '-j', type=int, default=None, help='平行擬合的行程數 (預設: CPU 核心數)')
+    parser.add_argument('--seed', type=int, default=0, help='訓練/驗證切分的隨機種子 (預設: 0)')
+    args = parser.parse_args()
+    args.output = args.output or models_path(args.csv)
+
+    if not os.path.isfile(args.csv):
+        raise FileNotFoundError(f"找不到檔案：{args.csv}")
+    columns = service_columns(pd.read_csv(args.csv))
+    if not columns:
+        raise ValueError("CSV 中沒有 service_time 或 actual_api_time_ms 可擬合")
+
+    out = {}
+    for col, values in columns.items():
+        ranked = fit_candidates(values, seed=args.seed, max_workers=args.jobs)
+        x = values[np.isfinite(values) & (values > 0)]
+        print(f"\n=== {col} (n={x.size}, 樣本 mean={x.mean():.6f}, Cs²={x.var(ddof=1) / x.mean() ** 2:.4f}) ===")
+        print(f"{'model':<16}{'KS':>10}{'E[S]':>14}{'Cs²':>10}")
+        for name, model, ks in ranked:
+            print(f"{name:<16}{ks:>10.4f}{model.mean:>14.6f}{model.cs2:>10.4f}")
+        best = MODELS[ranked[0][0]].fit(x)
+        print(f"最佳模型: {best.name} (E[S]={best.mean:.6f}, Cs²={best.cs2:.4f})")
+        out[col] = {'best': best.to_dict(),
+                    'ranking': [{'name': n, 'ks': ks} for n, _, ks in ranked]}
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(out, f, indent=2)
+    print(f"\n模型已保存為: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import argparse
+import heapq
+import os
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from service_fit import BufferedSampler, fit_best
+from stage_latency import to_epoch
+
+# 事件種類（heap 中同時間以序號排序）
+ARRIVAL, POLICY_DONE, FIFO_READY, PUBLISH_DONE = 0, 1, 2, 3
+
+ACTIONS = np.array(['high', 'low', 'drop'])
+
+
+class EmpiricalSampler:
+    """Draw from recorded values with replacement, pre-sampled in NumPy batches."""
+
+    def __init__(self, values, rng, batch=65536):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values) & (values >= 0)]
+        if values.size == 0:
+            raise ValueError("no samples to build an empirical distribution from")
+        self.values = values
+        self.rng = rng
+        self.batch = batch
+        self.buf = []
+
+    def __call__(self):
+        if not self.buf:
+            self.buf = self.rng.choice(self.values, self.batch).tolist()
+        return self.buf.pop()
+
+    def sample(self, n):
+        return self.rng.choice(self.values, n)
+
+    @property
+    def mean(self):
+        return float(self.values.mean())
+
+
+class Calibration:
+    """Arrival trace, per-IP behaviour and service samples taken from a merged run."""
+
+    def __init__(self, df):
+        df = df.copy()
+        for col in ('recv_ts', 'service_start_ts', 'service_end_ts', 'start_forward_ts',
+                    'end_forward_ts', 'original_timestamp'):
+            df[col] = to_epoch(df[col])
+        df = df.dropna(subset=['recv_ts']).sort_values('recv_ts').reset_index(drop=True)
+        self.df = df
+        self.start = float(df['recv_ts'].iloc[0])
+        self.duration = float(df['recv_ts'].iloc[-1] - self.start)
+        # 非 high/low/drop 的 action（例如 rule.py 的 forward）一律視為 low
+        self.actions = df['action'].where(df['action'].isin(ACTIONS), 'low').to_numpy()
+        self.ips = df['ip'].to_numpy()
+        self.policy_service = (df['service_end_ts'] - df['service_start_ts']).to_numpy()
+        self.publish_service = (df['end_forward_ts'] - df['start_forward_ts']).dropna().to_numpy()
+        # FIFO 寫入到轉發器讀到的固定交接延遲：取 FIFO 等待的第 5 百分位
+        fifo_wait = (df['start_forward_ts'] - df['service_end_ts']).dropna()
+        self.handoff = float(max(fifo_wait.quantile(0.05), 0.0)) if len(fifo_wait) else 0.0
+
+    def trace_arrivals(self):
+        """Recorded arrivals and decisions, relative to the first packet."""
+        return self.df['recv_ts'].to_numpy() - self.start, self.ips, self.actions
+
+    def sampled_arrivals(self, duration, rng):
+        """Per-IP arrivals bootstrapped from recorded interarrival gaps; actions drawn
+        from each IP's recorded action mix (trust dynamics are not re-simulated)."""
+        times, ips, actions = [], [], []
+        for ip, group in self.df.groupby('ip', sort=False):
+            gaps = np.diff(group['recv_ts'].to_numpy())
+            # 只有一筆，或所有封包同一時間戳（間隔全為 0）時無法推出到達率
+            if gaps.size == 0 or gaps.mean() <= 0:
+                continue
+            n = int(duration / gaps.mean() * 1.2) + 10
+            t = np.cumsum(rng.choice(gaps, n)) + rng.uniform(0, gaps.mean())
+            while t[-1] < duration:
+                t = np.concatenate((t, t[-1] + np.cumsum(rng.choice(gaps, n))))
+            t = t[t < duration]
+            mix = group['action'].where(group['action'].isin(ACTIONS), 'low').value_counts(normalize=True)
+            times.append(t)
+            ips.append(np.full(t.size, ip, dtype=object))
+            actions.append(rng.choice(mix.index.to_numpy(), t.size, p=mix.to_numpy()))
+        if not times:
+            return np.empty(0), np.empty(0, dtype=object), np.empty(0, dtype=object)
+        order = np.argsort(np.concatenate(times), kind='stable')
+        return (np.concatenate(times)[order], np.concatenate(ips)[order],
+                np.concatenate(actions)[order])
+
+
+def simulate(arrival_times, ips, actions, policy_sampler, publish_sampler, discipline='alternate',
+             handoff=0.0):
+    """Heap-scheduled discrete-event simulation of the edge pipeline.
+
+    Stage 1/2: one receive queue served FIFO by the single policy thread.
+    Stage 3:   HIGH/LOW FIFOs drained by one forwarder. 'alternate' mirrors the
+               pq_forwarder.c loop (one HIGH line, then one LOW line per cycle);
+               'strict' always serves HIGH first.
+    handoff is the constant FIFO write-to-read delay between the two stages.
+    Returns per-packet timestamps as a DataFrame in the merged-CSV column layout.
+    """
+    n = len(arrival_times)
+    service_start = np.full(n, np.nan)
+    service_end = np.full(n, np.nan)
+    fwd_start = np.full(n, np.nan)
+    fwd_end = np.full(n, np.nan)
+
+    events = []
+    seq = 0
+    if n:
+        heapq.heappush(events, (arrival_times[0], seq, ARRIVAL, 0))
+    receive_q = deque()
+    policy_busy = False
+    fifo = {'high': deque(), 'low': deque()}
+    fwd_busy = False
+    turn = 'high'
+
+    while events:
+        now, _, kind, i = heapq.heappop(events)
+
+        if kind == ARRIVAL:
+            receive_q.append(i)
+            if i + 1 < n:
+                seq += 1
+                heapq.heappush(events, (arrival_times[i + 1], seq, ARRIVAL, i + 1))
+        elif kind == POLICY_DONE:
+            policy_busy = False
+            service_end[i] = now
+            if actions[i] != 'drop':
+                seq += 1
+                heapq.heappush(events, (now + handoff, seq, FIFO_READY, i))
+        elif kind == FIFO_READY:
+            fifo['high' if actions[i] == 'high' else 'low'].append(i)
+        else:
+            fwd_busy = False
+            fwd_end[i] = now
+
+        if not policy_busy and receive_q:
+            j = receive_q.popleft()
+            service_start[j] = now
+            policy_busy = True
+            seq += 1
+            heapq.heappush(events, (now + policy_sampler(), seq, POLICY_DONE, j))
+
+        if not fwd_busy and (fifo['high'] or fifo['low']):
+            if discipline == 'strict':
+                cls = 'high' if fifo['high'] else 'low'
+            else:
+                cls = turn if fifo[turn] else ('low' if turn == 'high' else 'high')
+                turn = 'low' if cls == 'high' else 'high'
+            j = fifo[cls].popleft()
+            fwd_start[j] = now
+            fwd_busy = True
+            seq += 1
+            heapq.heappush(events, (now + publish_sampler(), seq, PUBLISH_DONE, j))
+
+    forwarded = actions != 'drop'
+    return pd.DataFrame({
+        'ip': ips,
+        'recv_ts': arrival_times,
+        'service_start_ts': service_start,
+        'service_end_ts': service_end,
+        'action': actions,
+        'start_forward_ts': fwd_start,
+        'end_forward_ts': fwd_end,
+        'original_timestamp': np.where(forwarded, service_end, np.nan),
+        'priority': np.where(forwarded, actions, None),
+    })
+
+
+def latency_table(df):
+    """Per-class mean/p50/p99 of queue wait and system time (definitions of pq.py)."""
+    fwd = df.dropna(subset=['start_forward_ts', 'end_forward_ts', 'original_timestamp'])
+    fwd = fwd.assign(queue_wait=fwd['start_forward_ts'] - fwd['original_timestamp'],
+                     system_time=fwd['end_forward_ts'] - fwd['original_timestamp'],
+                     end_to_end=fwd['end_forward_ts'] - fwd['recv_ts'])
+    cls = fwd['priority'].where(fwd['priority'].isin(['high', 'low']), 'low')
+    metrics = ['queue_wait', 'system_time', 'end_to_end']
+    grouped = fwd.groupby(cls)[metrics]
+    return pd.concat({'mean': grouped.mean(), 'p50': grouped.quantile(0.5),
+                      'p99': grouped.quantile(0.99)}, axis=1)
+
+
+def validate(recorded, simulated):
+    rec = latency_table(recorded)
+    sim = latency_table(simulated)
+    print("\n=== 模擬 vs 實測 (ms) ===")
+    print(f"{'class':<6}{'metric':<13}{'stat':<6}{'recorded':>12}{'simulated':>12}{'error':>9}")
+    for cls in rec.index.intersection(sim.index):
+        for stat, metric in rec.columns:
+            r, s = rec.loc[cls, (stat, metric)], sim.loc[cls, (stat, metric)]
+            err = (s - r) / r * 100 if r else float('nan')
+            print(f"{cls:<6}{metric:<13}{stat:<6}{r * 1000:>12.3f}{s * 1000:>12.3f}{err:>8.1f}%")
+    return rec, sim
+
+
+def main():
+    parser = argparse.ArgumentParser(description='以實測日誌校正的邊緣優先權管線離散事件模擬器')
+    parser.add_argument('--calibrate', default='merged_performance_att_1hrs_1tm_pq_rev.csv',
+                        help='用於校正的合併 CSV (預設: merged_performance_att_1hrs_1tm_pq_rev.csv)')
+    parser.add_argument('--mode', choices=['trace', 'sampled'], default='sampled',
+                        help='trace = 重播實測到達與決策；sampled = 依各 IP 實測間隔重新抽樣 (預設: sampled)')
+    parser.add_argument('--duration', type=float, default=3600.0, help='sampled 模式模擬秒數 (預設: 3600)')
+    parser.add_argument('--discipline', choices=['alternate', 'strict'], default='alternate',
+                        help='轉發器排程；alternate 與 pq_forwarder.c 相同 (預設: alternate)')
+    parser.add_argument('--service-model', choices=['empirical', 'fit'], default='empirical',
+                        help='服務時間抽樣：empirical = 直接重抽實測值；fit = service_fit.py 選出的最佳分佈 (預設: empirical)')
+    parser.add_argument('--seed', type=int, default=1, help='隨機種子 (預設: 1)')
+    parser.add_argument('--validate', action='store_true', help='以 trace 模式重播並與實測結果比較')
+    parser.add_argument('--output', '-o', help='輸出模擬的逐封包 CSV（可直接給 latency_hist.py 等使用）')
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.calibrate):
+        raise FileNotFoundError(f"找不到檔案：{args.calibrate}")
+    rng = np.random.default_rng(args.seed)
+    calib = Calibration(pd.read_csv(args.calibrate))
+    if args.service_model == 'fit':
+        policy_model, publish_model = fit_best(calib.policy_service), fit_best(calib.publish_service)
+        print(f"服務模型: policy={policy_model.name}, publish={publish_model.name}")
+        policy, publish = BufferedSampler(policy_model, rng), BufferedSampler(publish_model, rng)
+    else:
+        policy = EmpiricalSampler(calib.policy_service, rng)
+        publish = EmpiricalSampler(calib.publish_service, rng)
+    print(f"校正資料: {len(calib.df)} 筆, {calib.duration:.1f}s, "
+          f"E[S_policy]={policy.mean * 1000:.3f}ms, E[S_publish]={publish.mean * 1000:.3f}ms, "
+          f"handoff={calib.handoff * 1000:.3f}ms")
+
+    mode = 'trace' if args.validate else args.mode
+    if mode == 'trace':
+        times, ips, actions = calib.trace_arrivals()
+    else:
+        times, ips, actions = calib.sampled_arrivals(args.duration, rng)
+
+    wall = time.perf_counter()
+    sim = simulate(times, ips, actions, policy, publish, args.discipline, calib.handoff)
+    wall = time.perf_counter() - wall
+    span = times[-1] - times[0] if len(times) else 0.0
+    print(f"模擬 {len(sim)} 筆封包 ({span:.0f}s 流量, {args.discipline}) 耗時 {wall:.2f}s")
+
+    if args.validate:
+        recorded = calib.df.assign(recv_ts=calib.df['recv_ts'] - calib.start,
+                                   original_timestamp=calib.df['original_timestamp'] - calib.start,
+                                   start_forward_ts=calib.df['start_forward_ts'] - calib.start,
+                                   end_forward_ts=calib.df['end_forward_ts'] - calib.start)
+        validate(recorded, sim)
+    else:
+        print(latency_table(sim).mul(1000).round(3).to_string())
+
+    if args.output:
+        sim.to_csv(args.output, index=False)
+        print(f"模擬結果已保存為: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
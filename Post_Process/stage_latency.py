@@ -0,0 +1,180 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+
+from plot_utils import RASTERIZE, save_figure
+
+# 管線各階段（依封包流經順序），每段 = 後一個時間戳 - 前一個時間戳
+STAGES = [
+    ('receive_wait',    'recv_ts',          'service_start_ts'),  # 接收佇列等待
+    ('api_time',        'api_start_ts',     'api_end_ts'),        # 政策 API 往返
+    ('policy_overhead', None,               None),                # 服務中 API 以外的時間
+    ('fifo_wait',       'service_end_ts',   'start_forward_ts'),  # HIGH/LOW FIFO 等待
+    ('publish',         'start_forward_ts', 'end_forward_ts'),    # 發佈到主 broker
+]
+STAGE_NAMES = [name for name, _, _ in STAGES]
+STAGE_COLORS = ['#90EE90', '#ADD8E6', '#D3D3D3', '#FFCC99', '#ffaaaa']
+
+
+def to_epoch(series):
+    """merge_2.5.py 會把 recv_ts 轉成 datetime 字串，這裡統一轉回 epoch 秒。"""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(np.float64)
+    numeric = pd.to_numeric(series, errors='coerce')
+    if numeric.notna().sum() == series.notna().sum():
+        return numeric.astype(np.float64)
+    parsed = pd.to_datetime(series, errors='coerce')
+    return (parsed - pd.Timestamp('1970-01-01')) / pd.Timedelta(seconds=1)
+
+
+def compute_stages(df):
+    """Return a frame with one column per stage (seconds) plus class/ts/total.
+
+    Only packets that reached the forwarder are kept, so the stages add up to
+    end_forward_ts - recv_ts for every row.
+    """
+    ts = {col: to_epoch(df[col]) for col in
+          ('recv_ts', 'service_start_ts', 'api_start_ts', 'api_end_ts', 'service_end_ts',
+           'start_forward_ts', 'end_forward_ts')}
+
+    out = pd.DataFrame(index=df.index)
+    for name, start, end in STAGES:
+        if start is not None:
+            out[name] = ts[end] - ts[start]
+    out['policy_overhead'] = (ts['service_end_ts'] - ts['service_start_ts']) - out['api_time']
+    out = out[STAGE_NAMES]
+    out['total'] = ts['end_forward_ts'] - ts['recv_ts']
+    out['ts'] = ts['recv_ts']
+
+    if 'priority' in df:
+        cls = df['priority'].astype(str)
+        cls = cls.where(df['priority'].notna(), df['action'].astype(str))
+    else:
+        cls = df['action'].astype(str)
+    out['class'] = cls.replace({'forward': 'standard'})
+
+    return out.dropna(subset=STAGE_NAMES + ['total'])
+
+
+def dominant_stage(stage_frame):
+    """Name of the largest stage column for every row (vectorized argmax)."""
+    values = stage_frame[STAGE_NAMES].to_numpy()
+    return pd.Series(np.array(STAGE_NAMES)[np.nanargmax(values, axis=1)], index=stage_frame.index)
+
+
+def summarize_by_class(stages):
+    mean = stages.groupby('class')[STAGE_NAMES + ['total']].mean()
+    p99 = stages.groupby('class')[STAGE_NAMES + ['total']].quantile(0.99)
+    share = mean[STAGE_NAMES].div(mean[STAGE_NAMES].sum(axis=1), axis=0) * 100
+    summary = pd.concat({'mean_s': mean, 'p99_s': p99, 'share_pct': share}, axis=1)
+    summary[('dominant', 'stage')] = dominant_stage(mean)
+    # 各封包自己的主導階段分佈
+    per_packet = dominant_stage(stages).groupby(stages['class']).value_counts(normalize=True) * 100
+    return summary, per_packet.unstack(fill_value=0.0)
+
+
+def summarize_by_window(stages, window_sec):
+    start = stages['ts'].min()
+    window = np.floor((stages['ts'] - start) / window_sec).astype(np.int64) * window_sec
+    grouped = stages.groupby(['class', window.rename('window_start')])[STAGE_NAMES].mean()
+    grouped['count'] = stages.groupby(['class', window.rename('window_start')]).size()
+    grouped['dominant'] = dominant_stage(grouped)
+    return grouped
+
+
+def plot_waterfall(class_summary, out_path):
+    """Horizontal waterfall: each stage starts where the previous one ended."""
+    mean = class_summary['mean_s'][STAGE_NAMES]
+    classes = list(mean.index)
+
+    plt.figure(figsize=(15, 2.5 + 1.5 * len(classes)))
+    left = np.zeros(len(classes))
+    for name, color in zip(STAGE_NAMES, STAGE_COLORS):
+        width = mean[name].to_numpy()
+        plt.barh(classes, width, left=left, color=color, edgecolor='black', linewidth=1.0,
+                 label=name.replace('_', ' ').title())
+        left += width
+
+    for y, total in enumerate(left):
+        plt.text(total, y, f" {total * 1000:.2f} ms", va='center', fontsize=16, fontweight='bold')
+
+    plt.xlabel("Mean Latency (s)")
+    plt.legend(loc='lower right', ncol=len(STAGE_NAMES) // 2 + 1)
+    plt.grid(True, alpha=0.3, axis='x')
+    plt.xlim(0, left.max() * 1.25 if left.max() > 0 else 1)
+    plt.tight_layout()
+    return save_figure(out_path)
+
+
+def plot_stacked_area(window_summary, out_path):
+    classes = list(window_summary.index.get_level_values('class').unique())
+    fig, axes = plt.subplots(len(classes), 1, figsize=(15, 5 * len(classes)), sharex=True, squeeze=False)
+    for ax, cls in zip(axes[:, 0], classes):
+        data = window_summary.loc[cls]
+        polys = ax.stackplot(data.index.to_numpy(), *[data[name].to_numpy() for name in STAGE_NAMES],
+                             labels=[name.replace('_', ' ').title() for name in STAGE_NAMES],
+                             colors=STAGE_COLORS, alpha=0.9)
+        for poly in polys:
+            poly.set_rasterized(RASTERIZE)
+        ax.set_ylabel(f"{cls.capitalize()} (s)")
+        ax.grid(True, alpha=0.3)
+    axes[0, 0].legend(loc='upper right', ncol=len(STAGE_NAMES))
+    axes[-1, 0].set_xlabel("Time (s)")
+    fig.tight_layout()
+    return save_figure(out_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='將每個封包的系統時間拆解為各管線階段並找出主導階段')
+    parser.add_argument('--csv', default='merged_performance_att_1hrs_1tm_pq_rev.csv',
+                        help='merge_2.5.py 產生的合併 CSV (預設: merged_performance_att_1hrs_1tm_pq_rev.csv)')
+    parser.add_argument('--window', type=float, default=10.0, help='時間窗口長度，秒 (預設: 10)')
+    parser.add_argument('--out-dir', default='Result', help='輸出目錄 (預設: Result)')
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.csv):
+        raise FileNotFoundError(f"找不到檔案：{args.csv}")
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    df = pd.read_csv(args.csv)
+    stages = compute_stages(df)
+    print(f"讀入 {len(df)} 筆，已轉發並可拆解 {len(stages)} 筆")
+
+    plt.rcParams.update({
+        'axes.labelsize': 20,
+        'legend.fontsize': 16,
+        'xtick.labelsize': 18,
+        'ytick.labelsize': 18
+    })
+
+    class_summary, per_packet = summarize_by_class(stages)
+    print("\n=== 各優先級平均階段延遲 (ms) 與佔比 ===")
+    for cls, row in class_summary.iterrows():
+        parts = ", ".join(f"{name}={row[('mean_s', name)] * 1000:.3f}ms ({row[('share_pct', name)]:.1f}%)"
+                          for name in STAGE_NAMES)
+        print(f"{cls:<9} total={row[('mean_s', 'total')] * 1000:.3f}ms | {parts}")
+        print(f"          主導階段: {row[('dominant', 'stage')]}")
+    print("\n=== 各封包主導階段分佈 (%) ===")
+    print(per_packet.round(1).to_string())
+
+    window_summary = summarize_by_window(stages, args.window)
+    dominant_share = window_summary.groupby(level='class')['dominant'].value_counts(normalize=True) * 100
+    print(f"\n=== {args.window:g}s 窗口主導階段比例 (%) ===")
+    print(dominant_share.unstack(fill_value=0.0).round(1).to_string())
+
+    class_summary.to_csv(os.path.join(args.out_dir, 'stage_latency_by_class.csv'))
+    window_summary.to_csv(os.path.join(args.out_dir, 'stage_latency_by_window.csv'))
+
+    waterfall_path = plot_waterfall(class_summary, os.path.join(args.out_dir, 'stage_latency_waterfall.svg'))
+    area_path = plot_stacked_area(window_summary, os.path.join(args.out_dir, 'stage_latency_area.svg'))
+
+    print("\n分析完成！")
+    print(f"圖表已保存為: {waterfall_path}")
+    print(f"圖表已保存為: {area_path}")
+
+
+if __name__ == "__main__":
+    main()
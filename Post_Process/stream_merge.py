@@ -0,0 +1,290 @@
+import argparse
+import os
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+import pandas as pd
+
+from log_tail import LogTailer
+
+PLUGIN_LOG = '/home/jason/mqtt-edge/logs/edge_plugin.csv'
+FORWARDER_LOG = '/home/jason/mqtt-edge/logs/forwarder_performance.csv'
+
+# 與 merge_2.5.py 相同：排除前後 2.5 分鐘
+CUTOFF_SEC = 2.5 * 60
+
+# 轉發器的配對鍵；merge_2.5.py 合併後只保留插件的 ip / packet_count
+FORWARDER_KEYS = ('original_ip', 'packet_count')
+
+
+class StreamingJoiner:
+    """Left-join plugin rows to forwarder rows on (ip, packet_count) as both logs grow.
+
+    Produces the same rows, in the same order, as merge_2.5.py would on the
+    finished logs:
+      * plugin rows are emitted in file order, each with its forwarder match
+        or empty forwarder columns (drop / never forwarded / expired);
+      * a row is only emitted once its timestamps are older than the newest
+        recv_ts minus the cutoff, so the final upper-cutoff trim never has to
+        retract anything — the rows still held at the end are exactly the
+        ones merge_2.5.py would cut off;
+      * the lower cutoff is the smallest recv_ts seen plus the cutoff and is
+        applied when a row is emitted, so a worker that logs its first rows
+        late still moves it back as merge_2.5.py's min() would.
+    The forwarder columns are whatever the forwarder log's header lists
+    (minus the join keys), suffixed with _fwd where they clash with a plugin
+    column, as pd.merge does.
+    Both pending tables are bounded; the oldest entries are evicted first.
+    The held rows are bounded too: past max_held the oldest row is emitted
+    right away (counted in held_overflow), trading exactness at the upper
+    cutoff for memory.
+    """
+
+    def __init__(self, cutoff_sec=CUTOFF_SEC, match_timeout=30.0, max_pending=100000, max_held=1000000):
+        self.cutoff_sec = cutoff_sec
+        self.match_timeout = match_timeout
+        self.max_pending = max_pending
+        self.max_held = max_held
+        self.plugin_header = None
+        self.forwarder_header = None
+        self.min_recv = np.inf
+        self.max_recv = -np.inf
+        self.held = deque()                 # 依插件檔案順序等待輸出的列
+        self.waiting = OrderedDict()        # (ip, count) -> 等待轉發器資料的插件列
+        self.fwd_pending = OrderedDict()    # (ip, count) -> 比插件列先到的轉發器列
+        self.overflow = []                  # 超過 max_held 而提前輸出的列
+        self.stats = {'plugin_rows': 0, 'forwarder_rows': 0, 'matched': 0, 'unmatched_expired': 0,
+                      'forwarder_expired': 0, 'evicted': 0, 'emitted': 0, 'cut_lower': 0, 'cut_upper': 0,
+                      'held_overflow': 0}
+
+    @property
+    def lower_cutoff(self):
+        return self.min_recv + self.cutoff_sec
+
+    def add_plugin_row(self, row):
+        self.stats['plugin_rows'] += 1
+        if self.plugin_header is None:
+            self.plugin_header = list(row.keys())
+        try:
+            recv = float(row['recv_ts'])
+        except ValueError:
+            return
+        self.min_recv = min(self.min_recv, recv)
+        self.max_recv = max(self.max_recv, recv)
+
+        key = (row['ip'], row['packet_count'])
+        entry = {'row': row, 'key': key, 'recv': recv, 'fwd': None, 'ready': row.get('action') == 'drop'}
+        fwd = self.fwd_pending.pop(key, None)
+        if fwd is not None:
+            entry['fwd'], entry['ready'] = fwd, True
+            self.stats['matched'] += 1
+        elif not entry['ready']:
+            self.waiting[key] = entry
+            if len(self.waiting) > self.max_pending:
+                _, old = self.waiting.popitem(last=False)
+                old['ready'] = True
+                self.stats['evicted'] += 1
+        self.held.append(entry)
+        if len(self.held) > self.max_held:
+            old = self.held.popleft()
+            if not old['ready']:
+                self.waiting.pop(old['key'], None)
+            self.overflow.append(old)
+            self.stats['held_overflow'] += 1
+
+    def add_forwarder_row(self, row):
+        self.stats['forwarder_rows'] += 1
+        if self.forwarder_header is None:
+            self.forwarder_header = list(row.keys())
+        try:
+            orig = float(row['original_timestamp'])
+        except ValueError:
+            return
+        row = dict(row)
+        row['_orig'] = orig
+        row['_seen'] = self.max_recv
+        key = (row['original_ip'], row['packet_count'])
+        entry = self.waiting.pop(key, None)
+        if entry is not None:
+            entry['fwd'], entry['ready'] = row, True
+            self.stats['matched'] += 1
+            return
+        self.fwd_pending[key] = row
+        if len(self.fwd_pending) > self.max_pending:
+            self.fwd_pending.popitem(last=False)
+            self.stats['evicted'] += 1
+
+    def _expire(self):
+        horizon = self.max_recv - self.match_timeout
+        while self.waiting:
+            key, entry = next(iter(self.waiting.items()))
+            if entry['recv'] >= horizon:
+                break
+            self.waiting.popitem(last=False)
+            entry['ready'] = True
+            self.stats['unmatched_expired'] += 1
+        while self.fwd_pending:
+            key, row = next(iter(self.fwd_pending.items()))
+            if row['_seen'] >= horizon:
+                break
+            self.fwd_pending.popitem(last=False)
+            self.stats['forwarder_expired'] += 1
+
+    def _cut_lower(self, entries):
+        """Drop the rows at or below the lower cutoff, and forwarder matches below it."""
+        lower = self.lower_cutoff
+        out = []
+        for entry in entries:
+            if entry['recv'] <= lower:
+                self.stats['cut_lower'] += 1
+                continue
+            if entry['fwd'] is not None and entry['fwd']['_orig'] <= lower:
+                entry['fwd'] = None
+            out.append(entry)
+        return out
+
+    def drain(self):
+        """Pop every held row that can no longer be affected by the upper cutoff."""
+        self._expire()
+        safe = self.max_recv - self.cutoff_sec
+        out, self.overflow = self.overflow, []
+        while self.held:
+            entry = self.held[0]
+            if not entry['ready'] or entry['recv'] >= safe:
+                break
+            if entry['fwd'] is not None and entry['fwd']['_orig'] >= safe:
+                break
+            out.append(self.held.popleft())
+        out = self._cut_lower(out)
+        self.stats['emitted'] += len(out)
+        return out
+
+    def finish(self):
+        """End of run: apply the real upper cutoff to whatever is still held."""
+        upper = self.max_recv - self.cutoff_sec
+        out = self._cut_lower(self.overflow)
+        self.overflow = []
+        for entry in self._cut_lower(self.held):
+            if entry['recv'] >= upper:
+                self.stats['cut_upper'] += 1
+                continue
+            if entry['fwd'] is not None and entry['fwd']['_orig'] >= upper:
+                entry['fwd'] = None
+            out.append(entry)
+        self.held.clear()
+        self.waiting.clear()
+        self.fwd_pending.clear()
+        self.stats['emitted'] += len(out)
+        return out
+
+    def forwarder_columns(self):
+        """[(forwarder column, output column)] in forwarder header order."""
+        return [(col, col + '_fwd' if col in self.plugin_header else col)
+                for col in self.forwarder_header or [] if col not in FORWARDER_KEYS]
+
+    def to_frame(self, entries):
+        columns = self.forwarder_columns()
+        records = []
+        for entry in entries:
+            rec = dict(entry['row'])
+            fwd = entry['fwd'] or {}
+            for col, out in columns:
+                rec[out] = fwd.get(col)
+            rec['read_ts'] = fwd.get('original_timestamp')
+            records.append(rec)
+        df = pd.DataFrame.from_records(records, columns=self.plugin_header + [out for _, out in columns] + ['read_ts'])
+        # 與 merge_2.5.py 的輸出格式一致
+        df['recv_ts'] = pd.to_datetime(pd.to_numeric(df['recv_ts']), unit='s')
+        df['read_ts'] = pd.to_datetime(pd.to_numeric(df['read_ts']), unit='s')
+        return df
+
+
+class DatasetWriter:
+    """Append merged batches to one CSV, or to numbered Parquet parts in a directory."""
+
+    def __init__(self, path, fmt='csv'):
+        self.path = path
+        self.fmt = fmt
+        self.parts = 0
+        self.rows = 0
+        if fmt == 'parquet':
+            os.makedirs(path, exist_ok=True)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def append(self, df):
+        if df.empty:
+            return
+        if self.fmt == 'parquet':
+            df.to_parquet(os.path.join(self.path, f'part-{self.parts:05d}.parquet'), index=False)
+        else:
+            df.to_csv(self.path, mode='a', header=self.rows == 0, index=False)
+        self.parts += 1
+        self.rows += len(df)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='實驗進行中即時合併插件與轉發器日誌（等同 merge_2.5.py 的串流版本）')
+    parser.add_argument('--plugin-log', default=PLUGIN_LOG, help=f'插件 CSV (預設: {PLUGIN_LOG})')
+    parser.add_argument('--forwarder-log', default=FORWARDER_LOG, help=f'轉發器 CSV (預設: {FORWARDER_LOG})')
+    parser.add_argument('--output', '-o', default='merged_performance.csv',
+                        help='輸出 CSV，或 --format parquet 時的輸出目錄 (預設: merged_performance.csv)')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv',
+                        help='輸出格式；parquet 需安裝 pyarrow (預設: csv)')
+    parser.add_argument('--cutoff', type=float, default=CUTOFF_SEC, help='前後排除秒數 (預設: 150)')
+    parser.add_argument('--match-timeout', type=float, default=30.0,
+                        help='插件列等待轉發器資料的最長秒數 (預設: 30)')
+    parser.add_argument('--max-pending', type=int, default=100000, help='每個待配對表的上限 (預設: 100000)')
+    parser.add_argument('--max-held', type=int, default=1000000,
+                        help='等待輸出的插件列上限，超過時最舊的列提前輸出 (預設: 1000000)')
+    parser.add_argument('--interval', type=float, default=1.0, help='輪詢與寫出間隔，秒 (預設: 1)')
+    parser.add_argument('--idle-exit', type=float, default=0,
+                        help='兩份日誌皆無新資料超過此秒數即結束並套用尾端截斷 (預設: 0 = 直到 Ctrl-C)')
+    parser.add_argument('--once', action='store_true', help='只處理目前檔案內容後結束（實驗結束後使用）')
+    args = parser.parse_args()
+
+    joiner = StreamingJoiner(args.cutoff, args.match_timeout, args.max_pending, args.max_held)
+    writer = DatasetWriter(args.output, args.format)
+    plugin_tail = LogTailer(args.plugin_log)
+    fwd_tail = LogTailer(args.forwarder_log)
+
+    print(f"串流合併 {args.plugin_log} + {args.forwarder_log} -> {args.output}")
+    last_data = time.monotonic()
+    try:
+        while True:
+            # 插件日誌先讀，讓轉發器列多半能直接配對
+            plugin_rows = plugin_tail.poll()
+            for row in plugin_rows:
+                joiner.add_plugin_row(row)
+            fwd_rows = fwd_tail.poll()
+            if joiner.forwarder_header is None and fwd_tail.header:
+                # 轉發器日誌只有標頭時也要輸出相同的欄位
+                joiner.forwarder_header = list(fwd_tail.header)
+            for row in fwd_rows:
+                joiner.add_forwarder_row(row)
+
+            ready = joiner.drain()
+            if ready:
+                writer.append(joiner.to_frame(ready))
+
+            if plugin_rows or fwd_rows:
+                last_data = time.monotonic()
+                continue
+            if args.once or (args.idle_exit and time.monotonic() - last_data > args.idle_exit):
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+    tail = joiner.finish()
+    if tail and joiner.plugin_header:
+        writer.append(joiner.to_frame(tail))
+
+    print(f"Merged rows written: {writer.rows} ({writer.parts} batches)")
+    print("統計: " + ", ".join(f"{k}={v}" for k, v in joiner.stats.items()))
+    print(f"Merged file saved to: {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Unpack the batched envelopes published by pq_forwarder --batch-high/--batch-low.
+
+Batched records arrive on forwarded/batch as one JSON envelope per MQTT message:
+
+    {"v": 1, "forwarder_ip": "...", "class": "HIGH", "batch_ts": 1700000000.123456,
+     "fields": ["ip", "count", "timestamp", "priority", "forward_timestamp"],
+     "records": [["10.0.0.1", 5, 1700000000.101, "high", 1700000000.102], ...]}
+
+unpack() turns an envelope back into the per-record dicts that unbatched
+forwarding publishes on forwarded/data (ip, count, timestamp, priority,
+forwarder_ip, forward_timestamp), each with its own timestamps, plus
+batch_ts/batch_size/batch_seq. Single records pass through unchanged, so a
+consumer can subscribe to forwarded/# and treat both alike.
+
+CLI: decode a capture (one payload per line, e.g. `mosquitto_sub -t 'forwarded/#'
+> capture.jsonl`) into a CSV, or subscribe live with --broker (needs paho-mqtt).
+"""
+import argparse
+import json
+import os
+import time
+
+import pandas as pd
+
+ENVELOPE_VERSION = 1
+RECORD_COLUMNS = ['ip', 'count', 'timestamp', 'priority', 'forwarder_ip', 'forward_timestamp',
+                  'batch_ts', 'batch_size', 'batch_seq', 'receive_ts']
+
+
+def is_envelope(msg):
+    return isinstance(msg, dict) and 'records' in msg and 'fields' in msg
+
+
+def unpack(payload, receive_ts=None):
+    """List of per-record dicts from one MQTT payload (envelope or single record)."""
+    msg = json.loads(payload) if isinstance(payload, (bytes, str)) else payload
+    if not is_envelope(msg):
+        return [dict(msg, batch_ts=None, batch_size=1, batch_seq=0, receive_ts=receive_ts)]
+    if msg.get('v') != ENVELOPE_VERSION:
+        raise ValueError(f"unsupported envelope version {msg.get('v')!r}")
+    fields = msg['fields']
+    size = len(msg['records'])
+    return [dict(zip(fields, rec), forwarder_ip=msg.get('forwarder_ip'), batch_ts=msg.get('batch_ts'),
+                 batch_size=size, batch_seq=i, receive_ts=receive_ts)
+            for i, rec in enumerate(msg['records'])]
+
+
+def records_frame(payloads):
+    """DataFrame of all records in an iterable of payloads (or (payload, receive_ts) pairs)."""
+    rows = []
+    for item in payloads:
+        payload, receive_ts = item if isinstance(item, tuple) else (item, None)
+        rows.extend(unpack(payload, receive_ts))
+    return pd.DataFrame(rows, columns=RECORD_COLUMNS)
+
+
+def read_capture(path):
+    """Records of a capture file with one JSON payload per line; unparsable lines are skipped."""
+    payloads, invalid = [], 0
+    with open(path, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                payloads.append(json.loads(line))
+            except ValueError:
+                invalid += 1
+    df = records_frame(payloads)
+    df.attrs['messages'] = len(payloads)
+    df.attrs['invalid'] = invalid
+    return df
+
+
+def summarize(df, messages):
+    print(f"{messages} MQTT messages -> {len(df)} records "
+          f"({len(df) / max(messages, 1):.1f} records/message)")
+    if not len(df):
+        return
+    batched = df[df['batch_size'] > 1]
+    if len(batched):
+        # 每筆記錄在 envelope 中等待的時間：取出 (forward_timestamp) 到封裝發布 (batch_ts)
+        hold = (batched['batch_ts'] - batched['forward_timestamp']) * 1000.0
+        for prio, h in hold.groupby(batched['priority']):
+            print(f"  {prio}: batching delay mean {h.mean():.2f} ms, p99 {h.quantile(0.99):.2f} ms, "
+                  f"max {h.max():.2f} ms")
+
+
+def subscribe(broker, topic, output, duration):
+    try:
+        import paho.mqtt.client as mqtt
+    except ImportError:
+        raise SystemExit("--broker 需要 paho-mqtt：pip install paho-mqtt")
+    host, _, port = broker.partition(':')
+    received = []
+
+    def on_message(client, userdata, message):
+        received.append((message.payload, time.time()))
+
+    client = mqtt.Client()
+    client.on_message = on_message
+    client.connect(host, int(port or 1883))
+    client.subscribe(topic, qos=1)
+    client.loop_start()
+    try:
+        time.sleep(duration)
+    except KeyboardInterrupt:
+        pass
+    client.loop_stop()
+    client.disconnect()
+    df = records_frame(received)
+    summarize(df, len(received))
+    if output:
+        df.to_csv(output, index=False, float_format='%.6f')
+        print(f"已輸出 CSV: {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='拆解轉發器的批次 envelope，還原逐筆記錄與時間戳')
+    parser.add_argument('capture', nargs='*', help='每行一個 MQTT payload 的擷取檔')
+    parser.add_argument('--output', '-o', help='將所有記錄輸出為 CSV')
+    parser.add_argument('--broker', help='直接訂閱主 broker，例如 192.168.254.139:1884')
+    parser.add_argument('--topic', default='forwarded/#', help='訂閱的主題 (預設: forwarded/#)')
+    parser.add_argument('--duration', type=float, default=60.0, help='訂閱秒數 (預設: 60)')
+    args = parser.parse_args()
+
+    if args.broker:
+        subscribe(args.broker, args.topic, args.output, args.duration)
+        return
+    if not args.capture:
+        parser.error('需要擷取檔或 --broker')
+
+    frames = []
+    for path in args.capture:
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"找不到檔案：{path}")
+        df = read_capture(path)
+        print(f"{path}: invalid={df.attrs['invalid']}")
+        summarize(df, df.attrs['messages'])
+        frames.append(df)
+
+    if args.output:
+        pd.concat(frames, ignore_index=True).to_csv(args.output, index=False, float_format='%.6f')
+        print(f"已輸出 CSV: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
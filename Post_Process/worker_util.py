@@ -0,0 +1,111 @@
+import argparse
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from live_monitor import kingman
+from stage_latency import to_epoch
+
+
+def scv(x):
+    x = np.asarray(x, dtype=np.float64)
+    return float(x.var(ddof=1) / x.mean() ** 2) if x.size > 1 and x.mean() > 0 else float('nan')
+
+
+def erlang_c(c, a):
+    """Probability that an arrival waits in M/M/c with offered load a = λ·E[S]."""
+    rho = a / c
+    if rho >= 1:
+        return 1.0
+    term, total = 1.0, 1.0
+    for k in range(1, c):
+        term *= a / k
+        total += term
+    last = term * a / c / (1 - rho)
+    return last / (total + last)
+
+
+def allen_cunneen(c, lam, es, ca2, cs2):
+    """G/G/c mean waiting time: Erlang-C wait scaled by (Ca² + Cs²) / 2."""
+    if lam * es >= c:
+        return float('inf')
+    return erlang_c(c, lam * es) / (c / es - lam) * (ca2 + cs2) / 2
+
+
+def load_plugin_log(path):
+    df = pd.read_csv(path)
+    for col in ('recv_ts', 'service_start_ts', 'service_end_ts'):
+        df[col] = to_epoch(df[col])
+    if 'worker_id' not in df:
+        # 舊版插件只有單一處理執行緒
+        df['worker_id'] = 0
+    df = df.dropna(subset=['recv_ts', 'service_start_ts', 'service_end_ts'])
+    return df.sort_values('recv_ts').reset_index(drop=True)
+
+
+def worker_table(df):
+    """Per-worker arrivals, utilization and mean wait in the receive queue."""
+    span = df['service_end_ts'].max() - df['recv_ts'].min()
+    rows = []
+    for wid, g in df.groupby('worker_id'):
+        service = g['service_end_ts'] - g['service_start_ts']
+        wait = g['service_start_ts'] - g['recv_ts']
+        rows.append({'worker_id': wid, 'n': len(g), 'ips': g['ip'].nunique(),
+                     'lambda': len(g) / span, 'E[S]_ms': service.mean() * 1000,
+                     'util_%': service.sum() / span * 100,
+                     'Wq_ms': wait.mean() * 1000, 'Wq_p99_ms': wait.quantile(0.99) * 1000})
+    return pd.DataFrame(rows).set_index('worker_id')
+
+
+def predictions(df, c=None):
+    """Measured mean receive-queue wait vs M/G/1, shared-queue M/G/c and IP-partitioned models."""
+    c = c or int(df['worker_id'].nunique())
+    span = df['service_end_ts'].max() - df['recv_ts'].min()
+    service = (df['service_end_ts'] - df['service_start_ts']).to_numpy()
+    lam, es, cs2 = len(df) / span, service.mean(), scv(service)
+    ca2 = scv(np.diff(df['recv_ts'].to_numpy()))
+
+    # 依 IP hash 分割後每個 worker 是獨立的 G/G/1，整體等待為依到達率加權
+    partitioned = 0.0
+    for _, g in df.groupby('worker_id'):
+        s = (g['service_end_ts'] - g['service_start_ts']).to_numpy()
+        w = kingman(len(g) / span, s.mean(), scv(np.diff(g['recv_ts'].to_numpy())), scv(s))[1]
+        partitioned += len(g) / len(df) * w
+
+    measured = (df['service_start_ts'] - df['recv_ts']).mean()
+    return {
+        'workers': c, 'lambda': lam, 'E[S]': es, 'Ca2': ca2, 'Cs2': cs2,
+        'measured': measured,
+        'M/G/1 (one worker)': kingman(lam, es, ca2, cs2)[1],
+        f'M/G/{c} (shared queue)': allen_cunneen(c, lam, es, ca2, cs2),
+        f'{c} x G/G/1 (IP hash)': partitioned,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='插件處理 worker 使用率，以及 M/G/1 與 M/G/c 等待時間比較')
+    parser.add_argument('--csv', default='merged_performance_att_1hrs_1tm_pq_rev.csv',
+                        help='插件 CSV 或合併 CSV (預設: merged_performance_att_1hrs_1tm_pq_rev.csv)')
+    parser.add_argument('--workers', '-c', type=int, default=None,
+                        help='plugin_opt_workers 設定值；沒有分到 IP 的 worker 不會出現在日誌中 (預設: 日誌中的 worker 數)')
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.csv):
+        raise FileNotFoundError(f"找不到檔案：{args.csv}")
+    df = load_plugin_log(args.csv)
+
+    print("=== 各 worker ===")
+    print(worker_table(df).round(3).to_string())
+
+    pred = predictions(df, args.workers)
+    print(f"\n=== 接收佇列平均等待 (workers={pred['workers']}, λ={pred['lambda']:.2f}/s, "
+          f"E[S]={pred['E[S]'] * 1000:.3f}ms, Ca²={pred['Ca2']:.3f}, Cs²={pred['Cs2']:.3f}) ===")
+    for name in list(pred)[5:]:
+        w = pred[name]
+        print(f"{name:<26}{w * 1000:>12.3f} ms" if math.isfinite(w) else f"{name:<26}{'unstable':>12}")
+
+
+if __name__ == "__main__":
+    main()
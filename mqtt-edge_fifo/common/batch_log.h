@@ -0,0 +1,133 @@
+// batch_log.h
+// Buffered log writer shared by the edge plugin and the forwarder.
+//
+// Records are appended to an in-memory buffer and written to the file with a
+// single write(2) when the buffer passes flush_bytes or when flush_interval
+// seconds have passed since the last flush, instead of one fprintf + fflush
+// per record. The same writer handles text (CSV lines) and fixed-width binary
+// records; see log_records.h for the binary layout.
+
+#ifndef EDGE_BATCH_LOG_H
+#define EDGE_BATCH_LOG_H
+
+#include <stdarg.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/time.h>
+
+#define BATCH_LOG_DEFAULT_BUFFER   (64 * 1024)
+#define BATCH_LOG_DEFAULT_INTERVAL 0.2
+
+typedef struct BatchLog {
+    int       fd;
+    char     *buf;
+    size_t    cap;
+    size_t    len;
+    size_t    flush_bytes;     // 緩衝區超過此大小即寫出
+    double    flush_interval;  // 距上次寫出超過此秒數即寫出
+    double    last_flush;
+    uint64_t  records;
+    uint64_t  flushes;
+    uint64_t  write_errors;
+} BatchLog;
+
+static inline double batch_log_now(void) {
+    struct timeval tv;
+    gettimeofday(&tv, NULL);
+    return tv.tv_sec + tv.tv_usec / 1e6;
+}
+
+static inline int batch_log_open(BatchLog *log, const char *path, size_t buffer_bytes, double flush_interval) {
+    memset(log, 0, sizeof(*log));
+    log->fd = open(path, O_WRONLY | O_CREAT | O_TRUNC, 0644);
+    if (log->fd < 0) return -1;
+    log->cap = buffer_bytes ? buffer_bytes : BATCH_LOG_DEFAULT_BUFFER;
+    log->buf = malloc(log->cap);
+    if (!log->buf) {
+        close(log->fd);
+        log->fd = -1;
+        return -1;
+    }
+    log->flush_bytes = log->cap / 2;
+    log->flush_interval = flush_interval > 0 ? flush_interval : BATCH_LOG_DEFAULT_INTERVAL;
+    log->last_flush = batch_log_now();
+    return 0;
+}
+
+static inline int batch_log_flush(BatchLog *log) {
+    size_t off = 0;
+    while (off < log->len) {
+        ssize_t n = write(log->fd, log->buf + off, log->len - off);
+        if (n < 0) {
+            if (errno == EINTR) continue;
+            log->write_errors++;
+            break;
+        }
+        off += (size_t)n;
+    }
+    log->len = 0;
+    log->flushes++;
+    log->last_flush = batch_log_now();
+    return off > 0 ? 0 : -1;
+}
+
+// 依大小或時間決定是否寫出；now <= 0 時自行取得時間
+static inline void batch_log_maybe_flush(BatchLog *log, double now) {
+    if (log->len == 0) return;
+    if (log->len >= log->flush_bytes) {
+        batch_log_flush(log);
+        return;
+    }
+    if (now <= 0) now = batch_log_now();
+    if (now - log->last_flush >= log->flush_interval) batch_log_flush(log);
+}
+
+static inline int batch_log_append(BatchLog *log, const void *data, size_t len) {
+    if (log->fd < 0) return -1;
+    if (log->len + len > log->cap) batch_log_flush(log);
+    if (len > log->cap) {
+        // 單筆超過整個緩衝區，直接寫出
+        ssize_t n = write(log->fd, data, len);
+        log->records++;
+        return n == (ssize_t)len ? 0 : -1;
+    }
+    memcpy(log->buf + log->len, data, len);
+    log->len += len;
+    log->records++;
+    return 0;
+}
+
+// 檔頭（CSV 欄位列或二進位檔頭）立即寫出，不計入 records
+static inline int batch_log_write_header(BatchLog *log, const void *data, size_t len) {
+    if (batch_log_append(log, data, len) != 0) return -1;
+    log->records--;
+    return batch_log_flush(log);
+}
+
+__attribute__((format(printf, 2, 3)))
+static inline int batch_log_printf(BatchLog *log, const char *fmt, ...) {
+    char line[1024];
+    va_list ap;
+    va_start(ap, fmt);
+    int n = vsnprintf(line, sizeof(line), fmt, ap);
+    va_end(ap);
+    if (n < 0) return -1;
+    if ((size_t)n >= sizeof(line)) n = sizeof(line) - 1;
+    return batch_log_append(log, line, (size_t)n);
+}
+
+static inline void batch_log_close(BatchLog *log) {
+    if (log->fd < 0) return;
+    batch_log_flush(log);
+    close(log->fd);
+    log->fd = -1;
+    free(log->buf);
+    log->buf = NULL;
+}
+
+#endif // EDGE_BATCH_LOG_H
@@ -0,0 +1,240 @@
+// decision_shm.h
+// Shared-memory decision table and delta ring between the policy server
+// (API/pq.py with POLICY_SHM=on) and the edge plugin
+// (plugin_opt_decision_source shm). API/decision_shm.py is the Python side
+// and must be updated together with these structs.
+//
+// Decision table: the server is the only writer; the plugin maps it
+// read-only and looks IPs up without any lock or system call. Open
+// addressing (FNV-1a of the IP string, linear probing), slots are never
+// moved or freed until the server resets the table (generation + 1). Every
+// slot is a seqlock: the writer makes seq odd, writes the fields, makes it
+// even again; a reader copies the slot and retries while seq was odd or
+// changed. A reset clears used slots through the same seqlock, so seq never
+// goes back to a value a reader may still hold. heartbeat_ts lets the plugin tell a live server from a stale table.
+//
+// Delta ring: one-way ring of DeltaReport from the plugin (single producer,
+// callers serialise) to the server (single consumer). head and tail live on
+// separate cache lines; a full ring never blocks the edge, the report is
+// dropped and counted. The server moves head only after it has applied the
+// reports, so a producer that falls back to HTTP can first wait for head to
+// pass its own last report.
+
+#ifndef EDGE_DECISION_SHM_H
+#define EDGE_DECISION_SHM_H
+
+#include <stdint.h>
+#include <string.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sched.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+
+#define DECISION_SHM_TABLE_PATH "/dev/shm/edge_decisions"
+#define DECISION_SHM_RING_PATH  "/dev/shm/edge_deltas"
+#define DECISION_SHM_MAGIC      "EDGEDEC1"
+#define DELTA_RING_MAGIC        "EDGEDLT1"
+#define DECISION_SHM_VERSION    1
+#define DECISION_SHM_READ_RETRIES 1000
+
+enum { DECISION_NONE = 0, DECISION_DROP, DECISION_LOW, DECISION_HIGH };
+
+typedef struct DecisionShmHeader {
+    char     magic[8];
+    uint32_t version;
+    uint32_t slot_count;       // 2 的次方
+    uint32_t slot_size;
+    uint32_t _pad;
+    uint64_t generation;       // server 每次清空決策表時 +1
+    double   heartbeat_ts;     // server 消費 delta ring 時定期更新
+    uint32_t writer_pid;
+    char     _reserved[20];
+} DecisionShmHeader;
+
+typedef struct DecisionSlot {
+    uint32_t seq;              // seqlock：奇數 = 寫入中
+    uint8_t  action;           // DECISION_*
+    uint8_t  _pad[3];
+    double   trust;
+    double   p_value;
+    double   updated_ts;
+    char     ip[48];           // 空字串 = 未使用
+} DecisionSlot;
+
+typedef struct DeltaRingHeader {
+    char     magic[8];
+    uint32_t version;
+    uint32_t capacity;         // 2 的次方
+    uint32_t record_size;
+    char     _pad0[44];
+    uint64_t head;             // 消費者 (server) 寫入，回報處理完才前進
+    char     _pad1[56];
+    uint64_t tail;             // 生產者 (plugin) 寫入
+    uint64_t dropped;          // ring 已滿而丟棄的回報
+    char     _pad2[48];
+} DeltaRingHeader;
+
+typedef struct DeltaReport {
+    double   recv_ts;
+    double   delta;
+    uint64_t packet_count;
+    char     ip[48];
+} DeltaReport;
+
+_Static_assert(sizeof(DecisionShmHeader) == 64, "DecisionShmHeader layout changed");
+_Static_assert(sizeof(DecisionSlot) == 80, "DecisionSlot layout changed");
+_Static_assert(sizeof(DeltaRingHeader) == 192, "DeltaRingHeader layout changed");
+_Static_assert(sizeof(DeltaReport) == 72, "DeltaReport layout changed");
+
+typedef struct DecisionShm {
+    DecisionShmHeader *hdr;
+    DecisionSlot      *slots;
+    uint32_t           mask;
+    size_t             map_size;
+} DecisionShm;
+
+typedef struct DeltaRing {
+    DeltaRingHeader *hdr;
+    DeltaReport     *recs;
+    uint64_t         mask;
+    size_t           map_size;
+} DeltaRing;
+
+typedef struct DecisionView {
+    int    action;
+    double trust;
+    double p_value;
+    double updated_ts;
+} DecisionView;
+
+static inline uint32_t decision_shm_hash(const char *ip) {
+    uint32_t h = 2166136261u;
+    for (const unsigned char *c = (const unsigned char *)ip; *c; c++) {
+        h ^= *c;
+        h *= 16777619u;
+    }
+    return h;
+}
+
+static inline void *decision_shm_map(const char *path, int writable, size_t *size) {
+    int fd = open(path, writable ? O_RDWR : O_RDONLY);
+    if (fd < 0) return NULL;
+    struct stat st;
+    void *p = MAP_FAILED;
+    if (fstat(fd, &st) == 0 && st.st_size > 0) {
+        p = mmap(NULL, st.st_size, PROT_READ | (writable ? PROT_WRITE : 0), MAP_SHARED, fd, 0);
+        *size = st.st_size;
+    }
+    close(fd);
+    return p == MAP_FAILED ? NULL : p;
+}
+
+// 0 = 成功；檔案不存在或格式不符時回傳 -1
+static inline int decision_shm_open(DecisionShm *t, const char *path) {
+    memset(t, 0, sizeof(*t));
+    void *p = decision_shm_map(path, 0, &t->map_size);
+    if (!p) return -1;
+    DecisionShmHeader *h = p;
+    if (t->map_size < sizeof(*h) || memcmp(h->magic, DECISION_SHM_MAGIC, 8) != 0 ||
+        h->version != DECISION_SHM_VERSION || h->slot_size != sizeof(DecisionSlot) ||
+        t->map_size < sizeof(*h) + (size_t)h->slot_count * sizeof(DecisionSlot)) {
+        munmap(p, t->map_size);
+        return -1;
+    }
+    t->hdr = h;
+    t->slots = (DecisionSlot *)(h + 1);
+    t->mask = h->slot_count - 1;
+    return 0;
+}
+
+static inline void decision_shm_close(DecisionShm *t) {
+    if (t->hdr) munmap(t->hdr, t->map_size);
+    t->hdr = NULL;
+}
+
+static inline double decision_shm_heartbeat(const DecisionShm *t) {
+    return *(volatile const double *)&t->hdr->heartbeat_ts;
+}
+
+// 1 = 找到，0 = 表中沒有此 IP，-1 = slot 持續在寫入中（重試 DECISION_SHM_READ_RETRIES 次仍不一致）
+static inline int decision_shm_lookup(const DecisionShm *t, const char *ip, DecisionView *out) {
+    uint32_t h = decision_shm_hash(ip);
+    for (uint32_t i = 0; i <= t->mask; i++) {
+        const DecisionSlot *s = &t->slots[(h + i) & t->mask];
+        DecisionSlot copy;
+        int tries = 0;
+        for (;;) {
+            uint32_t s1 = __atomic_load_n(&s->seq, __ATOMIC_ACQUIRE);
+            if (!(s1 & 1)) {
+                memcpy(&copy, s, sizeof(copy));
+                __atomic_thread_fence(__ATOMIC_ACQUIRE);
+                if (__atomic_load_n(&s->seq, __ATOMIC_RELAXED) == s1) break;
+            }
+            if (++tries >= DECISION_SHM_READ_RETRIES) return -1;
+            if (tries % 64 == 0) sched_yield();   // writer 可能在寫入途中被排程出去
+        }
+        if (copy.ip[0] == '\0') return 0;
+        if (strncmp(copy.ip, ip, sizeof(copy.ip)) == 0) {
+            out->action = copy.action;
+            out->trust = copy.trust;
+            out->p_value = copy.p_value;
+            out->updated_ts = copy.updated_ts;
+            return 1;
+        }
+    }
+    return 0;
+}
+
+static inline const char *decision_action_name(int action) {
+    switch (action) {
+        case DECISION_DROP: return "drop";
+        case DECISION_LOW:  return "low";
+        case DECISION_HIGH: return "high";
+        default:            return "";
+    }
+}
+
+static inline int delta_ring_open(DeltaRing *r, const char *path) {
+    memset(r, 0, sizeof(*r));
+    void *p = decision_shm_map(path, 1, &r->map_size);
+    if (!p) return -1;
+    DeltaRingHeader *h = p;
+    if (r->map_size < sizeof(*h) || memcmp(h->magic, DELTA_RING_MAGIC, 8) != 0 ||
+        h->version != DECISION_SHM_VERSION || h->record_size != sizeof(DeltaReport) ||
+        r->map_size < sizeof(*h) + (size_t)h->capacity * sizeof(DeltaReport)) {
+        munmap(p, r->map_size);
+        return -1;
+    }
+    r->hdr = h;
+    r->recs = (DeltaReport *)(h + 1);
+    r->mask = h->capacity - 1;
+    return 0;
+}
+
+static inline void delta_ring_close(DeltaRing *r) {
+    if (r->hdr) munmap(r->hdr, r->map_size);
+    r->hdr = NULL;
+}
+
+// 呼叫者需保證同時只有一個生產者。回傳 1 = 已寫入，0 = ring 已滿（計入 dropped）
+static inline int delta_ring_push(DeltaRing *r, const char *ip, double delta, double recv_ts,
+                                  uint64_t packet_count)
+{
+    uint64_t head = __atomic_load_n(&r->hdr->head, __ATOMIC_ACQUIRE);
+    uint64_t tail = r->hdr->tail;
+    if (tail - head > r->mask) {
+        __atomic_store_n(&r->hdr->dropped, r->hdr->dropped + 1, __ATOMIC_RELAXED);
+        return 0;
+    }
+    DeltaReport *rec = &r->recs[tail & r->mask];
+    rec->recv_ts = recv_ts;
+    rec->delta = delta;
+    rec->packet_count = packet_count;
+    memset(rec->ip, 0, sizeof(rec->ip));
+    strncpy(rec->ip, ip, sizeof(rec->ip) - 1);
+    __atomic_store_n(&r->hdr->tail, tail + 1, __ATOMIC_RELEASE);
+    return 1;
+}
+
+#endif // EDGE_DECISION_SHM_H
@@ -0,0 +1,55 @@
+// fifo_record.h
+// Fixed-size binary record for the HIGH/LOW FIFOs (optional alternative to
+// the JSON lines written by write_to_fifo).
+//
+// Every record is written with a single write(2) of sizeof(FifoRecord)
+// bytes, which is far below PIPE_BUF, so concurrent writers never interleave
+// and the pipe only ever holds whole records. The forwarder can then read
+// many records with one read(2) and use them in place, with no line
+// splitting or JSON parsing. Post_Process/fifo_decode.py has the matching
+// NumPy dtype.
+
+#ifndef EDGE_FIFO_RECORD_H
+#define EDGE_FIFO_RECORD_H
+
+#include <limits.h>
+#include <stdint.h>
+#include <string.h>
+
+#define FIFO_RECORD_MAGIC   0xED6E
+#define FIFO_RECORD_VERSION 1
+
+enum { FIFO_PRIORITY_LOW = 0, FIFO_PRIORITY_HIGH = 1 };
+
+typedef struct FifoRecord {
+    uint16_t magic;        // FIFO_RECORD_MAGIC，用於檢查讀取是否對齊
+    uint8_t  version;
+    uint8_t  priority;     // FIFO_PRIORITY_LOW / FIFO_PRIORITY_HIGH
+    uint32_t _reserved;
+    uint64_t count;        // per-IP packet_count
+    double   timestamp;    // service_end_ts（寫入 FIFO 的時間）
+    char     ip[48];
+} FifoRecord;
+
+_Static_assert(sizeof(FifoRecord) == 72, "FifoRecord layout changed");
+_Static_assert(sizeof(FifoRecord) <= PIPE_BUF, "FifoRecord must fit in one atomic pipe write");
+
+static inline void fifo_record_init(FifoRecord *r, const char *ip, uint64_t count, double ts, int priority) {
+    memset(r, 0, sizeof(*r));
+    r->magic = FIFO_RECORD_MAGIC;
+    r->version = FIFO_RECORD_VERSION;
+    r->priority = (uint8_t)priority;
+    r->count = count;
+    r->timestamp = ts;
+    strncpy(r->ip, ip, sizeof(r->ip) - 1);
+}
+
+static inline int fifo_record_valid(const FifoRecord *r) {
+    return r->magic == FIFO_RECORD_MAGIC && r->version == FIFO_RECORD_VERSION;
+}
+
+static inline const char *fifo_priority_name(int priority) {
+    return priority == FIFO_PRIORITY_HIGH ? "high" : "low";
+}
+
+#endif // EDGE_FIFO_RECORD_H
@@ -0,0 +1,286 @@
+// ip_table.h
+// Fixed-capacity per-IP state table for the edge plugin (packet_count for
+// on_message, last_time for the delta computed by the processor workers).
+//
+// Keys are packed binary addresses (IPv4 stored as IPv4-mapped IPv6, so
+// every key is 16 bytes) instead of 64-byte strings. The table is split
+// into stripes, each with its own mutex, hash buckets, preallocated entries
+// and LRU list; a message only locks the stripe its address hashes to.
+// All memory is allocated in ip_table_init(), so a spoofed-source flood
+// cannot grow it: when a stripe is full its least recently seen entry is
+// evicted, and with a TTL an entry not seen for ttl seconds is treated as a
+// new IP. Entries that stay keep exactly the old packet_count / last_time
+// behaviour. Evictions, expirations and lock contention are counted.
+
+#ifndef EDGE_IP_TABLE_H
+#define EDGE_IP_TABLE_H
+
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+#include <pthread.h>
+#include <arpa/inet.h>
+
+typedef struct IpKey {
+    uint8_t b[16];
+} IpKey;
+
+typedef struct IpTableEntry {
+    IpKey    key;
+    double   last_time;       // processor：上一則訊息的 recv_ts
+    double   last_seen;       // on_message：LRU 與 TTL 依據
+    uint64_t packet_count;
+    int32_t  next;            // bucket 鏈結，或 free list
+    int32_t  lru_prev;
+    int32_t  lru_next;
+} IpTableEntry;
+
+typedef struct IpTableStripe {
+    pthread_mutex_t mutex;
+    IpTableEntry   *entries;
+    int32_t        *buckets;
+    uint32_t        bucket_mask;
+    uint32_t        capacity;
+    uint32_t        used;
+    int32_t         free_head;
+    int32_t         lru_head;     // 最近使用
+    int32_t         lru_tail;     // 最久未使用，滿時先淘汰
+    uint64_t        lookups;
+    uint64_t        inserts;
+    uint64_t        evictions;    // 容量已滿而淘汰
+    uint64_t        expirations;  // 超過 TTL 未出現，視為新 IP
+    uint64_t        contended;    // 取鎖時 stripe 已被其他執行緒持有
+} __attribute__((aligned(64))) IpTableStripe;
+
+typedef struct IpTable {
+    IpTableStripe *stripes;
+    uint32_t       stripe_mask;
+    size_t         capacity;
+    double         ttl;           // 秒，0 = 不過期
+} IpTable;
+
+typedef struct IpTableStats {
+    size_t   entries;
+    size_t   capacity;
+    uint64_t lookups;
+    uint64_t inserts;
+    uint64_t evictions;
+    uint64_t expirations;
+    uint64_t contended;
+} IpTableStats;
+
+// 常見的 dotted-quad 直接解析，避免每則訊息都經過 inet_pton；格式不符時回傳 0
+static inline int ip_parse_v4(const char *ip, uint8_t out[4]) {
+    for (int i = 0; i < 4; i++) {
+        unsigned v = 0, n = 0;
+        while (*ip >= '0' && *ip <= '9') {
+            v = v * 10 + (unsigned)(*ip++ - '0');
+            if (++n > 3 || v > 255) return 0;
+        }
+        if (n == 0 || *ip++ != (i < 3 ? '.' : '\0')) return 0;
+        out[i] = (uint8_t)v;
+    }
+    return 1;
+}
+
+// inet_pton 無法解析的位址（例如非 IP 的連線）以字串雜湊填入，前綴 00fe 落在保留的 0000::/8，不會與實際位址重疊
+static inline void ip_key_from_str(IpKey *k, const char *ip) {
+    memset(k, 0, sizeof(*k));
+    if (ip_parse_v4(ip, &k->b[12])) {
+        k->b[10] = 0xff;
+        k->b[11] = 0xff;
+        return;
+    }
+    memset(k, 0, sizeof(*k));
+    if (inet_pton(AF_INET6, ip, k->b) == 1) return;
+    uint64_t h1 = 14695981039346656037ull, h2 = 1099511628211ull;
+    for (const unsigned char *c = (const unsigned char *)ip; *c; c++) {
+        h1 = (h1 ^ *c) * 1099511628211ull;
+        h2 = (h2 ^ *c) * 14695981039346656037ull;
+    }
+    memcpy(&k->b[0], &h1, 8);
+    memcpy(&k->b[8], &h2, 8);
+    k->b[0] = 0x00;
+    k->b[1] = 0xfe;
+}
+
+// 16 bytes 併成兩個 64-bit 字後以 splitmix64 finalizer 混合，高位元選 stripe、低位元選 bucket
+static inline uint64_t ip_key_hash(const IpKey *k) {
+    uint64_t lo, hi;
+    memcpy(&lo, &k->b[0], 8);
+    memcpy(&hi, &k->b[8], 8);
+    uint64_t h = lo * 0x9e3779b97f4a7c15ull ^ hi;
+    h ^= h >> 30;
+    h *= 0xbf58476d1ce4e5b9ull;
+    h ^= h >> 27;
+    h *= 0x94d049bb133111ebull;
+    return h ^ (h >> 31);
+}
+
+static inline uint32_t ip_table_pow2(uint32_t n) {
+    uint32_t c = 1;
+    while (c < n) c <<= 1;
+    return c;
+}
+
+static inline void ip_table_destroy(IpTable *t) {
+    if (!t->stripes) return;
+    for (uint32_t i = 0; i <= t->stripe_mask; i++) {
+        free(t->stripes[i].entries);
+        free(t->stripes[i].buckets);
+        pthread_mutex_destroy(&t->stripes[i].mutex);
+    }
+    free(t->stripes);
+    t->stripes = NULL;
+}
+
+static inline int ip_table_init(IpTable *t, size_t capacity, uint32_t stripes, double ttl) {
+    memset(t, 0, sizeof(*t));
+    stripes = ip_table_pow2(stripes ? stripes : 1);
+    if (capacity < stripes) capacity = stripes;
+    uint32_t per_stripe = (uint32_t)((capacity + stripes - 1) / stripes);
+    void *mem = NULL;
+    if (posix_memalign(&mem, 64, stripes * sizeof(IpTableStripe)) != 0) return -1;
+    memset(mem, 0, stripes * sizeof(IpTableStripe));
+    t->stripes = mem;
+    t->stripe_mask = stripes - 1;
+    t->capacity = (size_t)per_stripe * stripes;
+    t->ttl = ttl;
+    for (uint32_t i = 0; i < stripes; i++) {
+        IpTableStripe *s = &t->stripes[i];
+        uint32_t nbuckets = ip_table_pow2(per_stripe);
+        pthread_mutex_init(&s->mutex, NULL);
+        s->entries = calloc(per_stripe, sizeof(IpTableEntry));
+        s->buckets = malloc(nbuckets * sizeof(int32_t));
+        if (!s->entries || !s->buckets) {
+            t->stripe_mask = i;    // 只釋放已初始化的前 i + 1 段
+            ip_table_destroy(t);
+            return -1;
+        }
+        memset(s->buckets, 0xff, nbuckets * sizeof(int32_t));
+        s->bucket_mask = nbuckets - 1;
+        s->capacity = per_stripe;
+        for (uint32_t j = 0; j < per_stripe; j++) {
+            s->entries[j].next = j + 1 < per_stripe ? (int32_t)(j + 1) : -1;
+        }
+        s->free_head = 0;
+        s->lru_head = s->lru_tail = -1;
+    }
+    return 0;
+}
+
+static inline IpTableStripe *ip_table_lock(IpTable *t, uint64_t h) {
+    IpTableStripe *s = &t->stripes[(h >> 40) & t->stripe_mask];
+    if (pthread_mutex_trylock(&s->mutex) != 0) {
+        pthread_mutex_lock(&s->mutex);
+        s->contended++;
+    }
+    return s;
+}
+
+static inline int32_t ip_stripe_find(IpTableStripe *s, const IpKey *k, uint64_t h) {
+    s->lookups++;
+    for (int32_t i = s->buckets[h & s->bucket_mask]; i >= 0; i = s->entries[i].next) {
+        if (memcmp(&s->entries[i].key, k, sizeof(*k)) == 0) return i;
+    }
+    return -1;
+}
+
+static inline void ip_stripe_lru_unlink(IpTableStripe *s, int32_t i) {
+    IpTableEntry *e = &s->entries[i];
+    if (e->lru_prev >= 0) s->entries[e->lru_prev].lru_next = e->lru_next; else s->lru_head = e->lru_next;
+    if (e->lru_next >= 0) s->entries[e->lru_next].lru_prev = e->lru_prev; else s->lru_tail = e->lru_prev;
+}
+
+static inline void ip_stripe_lru_front(IpTableStripe *s, int32_t i) {
+    IpTableEntry *e = &s->entries[i];
+    e->lru_prev = -1;
+    e->lru_next = s->lru_head;
+    if (s->lru_head >= 0) s->entries[s->lru_head].lru_prev = i; else s->lru_tail = i;
+    s->lru_head = i;
+}
+
+// 把 LRU 尾端的 entry 移出 bucket 與 LRU，回傳可重用的索引
+static inline int32_t ip_stripe_evict_tail(IpTableStripe *s) {
+    int32_t i = s->lru_tail;
+    IpTableEntry *e = &s->entries[i];
+    int32_t *link = &s->buckets[ip_key_hash(&e->key) & s->bucket_mask];
+    while (*link != i) link = &s->entries[*link].next;
+    *link = e->next;
+    ip_stripe_lru_unlink(s, i);
+    s->used--;
+    return i;
+}
+
+// on_message：找到或建立此 IP 的 entry，packet_count 加一並回傳
+static inline uint64_t ip_table_count(IpTable *t, const IpKey *k, double now) {
+    uint64_t h = ip_key_hash(k);
+    IpTableStripe *s = ip_table_lock(t, h);
+    int32_t i = ip_stripe_find(s, k, h);
+    IpTableEntry *e;
+    if (i >= 0) {
+        e = &s->entries[i];
+        if (t->ttl > 0 && now - e->last_seen > t->ttl) {
+            // 太久沒出現：與新 IP 相同，packet_count 從 1 開始、delta 為 0
+            s->expirations++;
+            e->packet_count = 0;
+            e->last_time = now;
+        }
+        ip_stripe_lru_unlink(s, i);
+    } else {
+        if (s->free_head >= 0) {
+            i = s->free_head;
+            s->free_head = s->entries[i].next;
+        } else {
+            IpTableEntry *tail = &s->entries[s->lru_tail];
+            if (t->ttl > 0 && now - tail->last_seen > t->ttl) s->expirations++;
+            else s->evictions++;
+            i = ip_stripe_evict_tail(s);
+        }
+        e = &s->entries[i];
+        e->key = *k;
+        e->last_time = now;
+        e->packet_count = 0;
+        e->next = s->buckets[h & s->bucket_mask];
+        s->buckets[h & s->bucket_mask] = i;
+        s->used++;
+        s->inserts++;
+    }
+    e->last_seen = now;
+    uint64_t count = ++e->packet_count;
+    ip_stripe_lru_front(s, i);
+    pthread_mutex_unlock(&s->mutex);
+    return count;
+}
+
+// processor：回傳 1 並以 *delta 取得與上一則訊息的間隔，last_time 更新為 recv_ts；
+// entry 已被淘汰時回傳 0（delta 維持 0，與找不到 IP 時相同）
+static inline int ip_table_swap_time(IpTable *t, const IpKey *k, double recv_ts, double *delta) {
+    uint64_t h = ip_key_hash(k);
+    IpTableStripe *s = ip_table_lock(t, h);
+    int32_t i = ip_stripe_find(s, k, h);
+    if (i >= 0) {
+        *delta = recv_ts - s->entries[i].last_time;
+        s->entries[i].last_time = recv_ts;
+    }
+    pthread_mutex_unlock(&s->mutex);
+    return i >= 0;
+}
+
+static inline void ip_table_get_stats(IpTable *t, IpTableStats *out) {
+    memset(out, 0, sizeof(*out));
+    out->capacity = t->capacity;
+    for (uint32_t i = 0; i <= t->stripe_mask; i++) {
+        IpTableStripe *s = &t->stripes[i];
+        pthread_mutex_lock(&s->mutex);
+        out->entries += s->used;
+        out->lookups += s->lookups;
+        out->inserts += s->inserts;
+        out->evictions += s->evictions;
+        out->expirations += s->expirations;
+        out->contended += s->contended;
+        pthread_mutex_unlock(&s->mutex);
+    }
+}
+
+#endif // EDGE_IP_TABLE_H
@@ -0,0 +1,87 @@
+// log_records.h
+// Fixed-width binary log records (optional alternative to the CSV logs).
+//
+// File layout: one 32-byte BinLogHeader followed by back-to-back records of
+// header.record_size bytes, little-endian, no separators. A record is only
+// ever appended whole, so a reader can take floor((size - 32) / record_size)
+// records even while the file is still growing.
+//
+// The fields and their order mirror the CSV columns; Post_Process/binlog.py
+// holds the matching NumPy dtypes and must be updated together with these
+// structs (bump BINLOG_VERSION when a layout changes).
+
+#ifndef EDGE_LOG_RECORDS_H
+#define EDGE_LOG_RECORDS_H
+
+#include <stdint.h>
+#include <string.h>
+
+#define BINLOG_MAGIC   "EDGEBIN1"
+#define BINLOG_VERSION 5
+
+typedef struct BinLogHeader {
+    char     magic[8];      // BINLOG_MAGIC
+    uint32_t version;
+    uint32_t record_size;
+    char     kind[16];      // "plugin" / "forwarder"
+} BinLogHeader;
+
+// edge_plugin.csv 的二進位版本
+typedef struct PluginLogRecord {
+    uint64_t packet_count;
+    double   recv_ts;
+    double   service_start_ts;
+    double   api_start_ts;
+    double   api_end_ts;
+    double   service_end_ts;
+    double   delta;
+    double   p_value;
+    double   trust;
+    double   actual_api_time_ms;
+    double   wait_time_ms;
+    double   total_service_time_ms;
+    int32_t  worker_id;
+    char     action[8];
+    char     ip[46];        // INET6_ADDRSTRLEN
+    uint8_t  cache_hit;     // 1 = 決策未等待同步 API（decision cache 或共享記憶體決策表）
+    char     _pad[5];
+} PluginLogRecord;
+
+// forwarder_performance.csv 的二進位版本
+typedef struct ForwarderLogRecord {
+    double   enqueue_ts;
+    double   start_forward_ts;
+    double   end_forward_ts;
+    double   original_timestamp;
+    double   forward_duration_ms;
+    double   send_ts;           // publish 返回時間
+    double   ack_ts;            // PUBACK 時間；同步模式或失敗時為 0
+    uint64_t packet_count;
+    int32_t  forward_success;   // 1 = SUCCESS, 0 = FAILED
+    char     priority[8];
+    char     original_ip[46];
+    char     _pad[2];
+    int32_t  conn_id;           // 多連線模式的連線編號，單一連線為 0
+    int32_t  batch_size;        // 同一個 envelope 內的記錄數，未批次為 1
+    char     _pad2[4];
+} ForwarderLogRecord;
+
+_Static_assert(sizeof(BinLogHeader) == 32, "BinLogHeader layout changed");
+_Static_assert(sizeof(PluginLogRecord) == 160, "PluginLogRecord layout changed");
+_Static_assert(sizeof(ForwarderLogRecord) == 136, "ForwarderLogRecord layout changed");
+
+static inline void binlog_header_init(BinLogHeader *h, const char *kind, uint32_t record_size) {
+    memset(h, 0, sizeof(*h));
+    memcpy(h->magic, BINLOG_MAGIC, sizeof(h->magic));
+    h->version = BINLOG_VERSION;
+    h->record_size = record_size;
+    strncpy(h->kind, kind, sizeof(h->kind) - 1);
+}
+
+// 複製字串到固定寬度欄位（不足補 0，過長截斷）
+static inline void binlog_copy_str(char *dst, size_t size, const char *src) {
+    memset(dst, 0, size);
+    if (src) strncpy(dst, src, size - 1);
+}
+
+#endif // EDGE_LOG_RECORDS_H
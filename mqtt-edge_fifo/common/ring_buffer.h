@@ -0,0 +1,219 @@
+// ring_buffer.h
+// Bounded, preallocated multi-producer / single-consumer queue of fixed-size
+// records, shared by the edge plugin and the forwarder.
+//
+// All slots are allocated once in ring_init(), so memory use is constant for
+// the whole run no matter how many messages pass through. When the ring is
+// full the configured overflow policy decides what happens:
+//   RING_DROP_NEWEST  reject the record being pushed (tail drop)
+//   RING_DROP_OLDEST  overwrite the oldest queued record
+//   RING_BLOCK        wait until the consumer frees a slot (or the ring is closed)
+// Every outcome is counted so the loss can be reported next to the latency data.
+//
+// Producers and the consumer hold the mutex only for a memcpy of one record;
+// the condition variables let an idle consumer sleep instead of polling.
+
+#ifndef EDGE_RING_BUFFER_H
+#define EDGE_RING_BUFFER_H
+
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+#include <strings.h>
+#include <time.h>
+#include <pthread.h>
+
+typedef enum {
+    RING_DROP_NEWEST = 0,
+    RING_DROP_OLDEST,
+    RING_BLOCK
+} ring_overflow_t;
+
+// ring_push() 回傳值
+enum {
+    RING_OK = 0,
+    RING_DROPPED,    // 佇列已滿，新紀錄被丟棄
+    RING_REPLACED,   // 佇列已滿，覆蓋最舊的紀錄
+    RING_CLOSED      // 佇列已關閉
+};
+
+typedef struct RingStats {
+    uint64_t pushed;
+    uint64_t popped;
+    uint64_t dropped_newest;
+    uint64_t dropped_oldest;
+    uint64_t blocked;          // 生產者因 RING_BLOCK 等待的次數
+    size_t   depth;
+    size_t   high_watermark;
+    size_t   capacity;
+} RingStats;
+
+typedef struct RingBuffer {
+    unsigned char   *slots;
+    size_t           elem_size;
+    size_t           capacity;   // 2 的次方
+    size_t           mask;
+    size_t           head;       // 下一個要取出的位置
+    size_t           count;
+    ring_overflow_t  overflow;
+    int              closed;
+    pthread_mutex_t  mutex;
+    pthread_cond_t   not_empty;
+    pthread_cond_t   not_full;
+    RingStats        stats;
+} RingBuffer;
+
+static inline size_t ring_round_pow2(size_t n) {
+    size_t c = 1;
+    while (c < n) c <<= 1;
+    return c;
+}
+
+static inline void ring_deadline(struct timespec *ts, long timeout_us) {
+    clock_gettime(CLOCK_REALTIME, ts);
+    ts->tv_sec  += timeout_us / 1000000;
+    ts->tv_nsec += (timeout_us % 1000000) * 1000;
+    if (ts->tv_nsec >= 1000000000) {
+        ts->tv_sec++;
+        ts->tv_nsec -= 1000000000;
+    }
+}
+
+static inline int ring_init(RingBuffer *rb, size_t capacity, size_t elem_size, ring_overflow_t overflow) {
+    memset(rb, 0, sizeof(*rb));
+    rb->capacity  = ring_round_pow2(capacity ? capacity : 1);
+    rb->mask      = rb->capacity - 1;
+    rb->elem_size = elem_size;
+    rb->overflow  = overflow;
+    rb->slots     = calloc(rb->capacity, elem_size);
+    if (!rb->slots) return -1;
+    rb->stats.capacity = rb->capacity;
+    pthread_mutex_init(&rb->mutex, NULL);
+    pthread_cond_init(&rb->not_empty, NULL);
+    pthread_cond_init(&rb->not_full, NULL);
+    return 0;
+}
+
+static inline void ring_destroy(RingBuffer *rb) {
+    if (!rb->slots) return;
+    free(rb->slots);
+    rb->slots = NULL;
+    pthread_mutex_destroy(&rb->mutex);
+    pthread_cond_destroy(&rb->not_empty);
+    pthread_cond_destroy(&rb->not_full);
+}
+
+// 喚醒所有等待中的生產者與消費者；之後的 push 回傳 RING_CLOSED，pop 仍可取完剩餘紀錄
+static inline void ring_close(RingBuffer *rb) {
+    pthread_mutex_lock(&rb->mutex);
+    rb->closed = 1;
+    pthread_cond_broadcast(&rb->not_empty);
+    pthread_cond_broadcast(&rb->not_full);
+    pthread_mutex_unlock(&rb->mutex);
+}
+
+static inline int ring_push(RingBuffer *rb, const void *item) {
+    int result = RING_OK;
+
+    pthread_mutex_lock(&rb->mutex);
+    if (rb->count == rb->capacity && rb->overflow == RING_BLOCK && !rb->closed) {
+        rb->stats.blocked++;
+        while (rb->count == rb->capacity && !rb->closed) {
+            pthread_cond_wait(&rb->not_full, &rb->mutex);
+        }
+    }
+    if (rb->closed) {
+        pthread_mutex_unlock(&rb->mutex);
+        return RING_CLOSED;
+    }
+    if (rb->count == rb->capacity) {
+        if (rb->overflow == RING_DROP_OLDEST) {
+            rb->head = (rb->head + 1) & rb->mask;
+            rb->count--;
+            rb->stats.dropped_oldest++;
+            result = RING_REPLACED;
+        } else {
+            rb->stats.dropped_newest++;
+            pthread_mutex_unlock(&rb->mutex);
+            return RING_DROPPED;
+        }
+    }
+
+    size_t tail = (rb->head + rb->count) & rb->mask;
+    memcpy(rb->slots + tail * rb->elem_size, item, rb->elem_size);
+    rb->count++;
+    rb->stats.pushed++;
+    if (rb->count > rb->stats.high_watermark) rb->stats.high_watermark = rb->count;
+    pthread_cond_signal(&rb->not_empty);
+    pthread_mutex_unlock(&rb->mutex);
+    return result;
+}
+
+// 取出最多 max 筆；佇列為空時最多等待 timeout_us 微秒。回傳取出的筆數
+static inline size_t ring_pop_batch(RingBuffer *rb, void *out, size_t max, long timeout_us) {
+    pthread_mutex_lock(&rb->mutex);
+    if (rb->count == 0 && !rb->closed && timeout_us > 0) {
+        struct timespec deadline;
+        ring_deadline(&deadline, timeout_us);
+        while (rb->count == 0 && !rb->closed) {
+            if (pthread_cond_timedwait(&rb->not_empty, &rb->mutex, &deadline) != 0) break;
+        }
+    }
+
+    size_t n = rb->count < max ? rb->count : max;
+    for (size_t i = 0; i < n; i++) {
+        memcpy((unsigned char *)out + i * rb->elem_size,
+               rb->slots + ((rb->head + i) & rb->mask) * rb->elem_size, rb->elem_size);
+    }
+    rb->head = (rb->head + n) & rb->mask;
+    rb->count -= n;
+    rb->stats.popped += n;
+    if (n > 0) pthread_cond_broadcast(&rb->not_full);
+    pthread_mutex_unlock(&rb->mutex);
+    return n;
+}
+
+static inline int ring_pop(RingBuffer *rb, void *out, long timeout_us) {
+    return ring_pop_batch(rb, out, 1, timeout_us) == 1;
+}
+
+// 單一生產者可先確認有空位再取出資料，避免 push 時阻塞或丟棄
+static inline int ring_has_room(RingBuffer *rb) {
+    pthread_mutex_lock(&rb->mutex);
+    int room = rb->count < rb->capacity;
+    pthread_mutex_unlock(&rb->mutex);
+    return room;
+}
+
+// 已關閉且取完：消費者可以結束
+static inline int ring_is_drained(RingBuffer *rb) {
+    pthread_mutex_lock(&rb->mutex);
+    int drained = rb->closed && rb->count == 0;
+    pthread_mutex_unlock(&rb->mutex);
+    return drained;
+}
+
+static inline void ring_get_stats(RingBuffer *rb, RingStats *out) {
+    pthread_mutex_lock(&rb->mutex);
+    *out = rb->stats;
+    out->depth = rb->count;
+    pthread_mutex_unlock(&rb->mutex);
+}
+
+static inline ring_overflow_t ring_overflow_parse(const char *name, ring_overflow_t fallback) {
+    if (!name) return fallback;
+    if (strcasecmp(name, "drop_newest") == 0 || strcasecmp(name, "drop-newest") == 0) return RING_DROP_NEWEST;
+    if (strcasecmp(name, "drop_oldest") == 0 || strcasecmp(name, "drop-oldest") == 0) return RING_DROP_OLDEST;
+    if (strcasecmp(name, "block") == 0) return RING_BLOCK;
+    return fallback;
+}
+
+static inline const char *ring_overflow_name(ring_overflow_t overflow) {
+    switch (overflow) {
+        case RING_DROP_OLDEST: return "drop_oldest";
+        case RING_BLOCK:       return "block";
+        default:               return "drop_newest";
+    }
+}
+
+#endif // EDGE_RING_BUFFER_H
@@ -0,0 +1,256 @@
+// trace_log.h
+// Leveled, sampled logging for the edge plugin and the forwarder
+// (API/tracelog.py is the policy server side with the same levels).
+//
+// The hot path never blocks and never takes a lock: a line below the current
+// level costs one load and a compare; an emitted line is formatted straight
+// into a slot of a preallocated ring (slots are reserved with a CAS on tail),
+// and a sink thread copies finished slots into one buffer and writes it to
+// stdout with a single write(2). When the ring is full the line is dropped
+// and counted instead of waiting for the terminal or the pipe.
+//
+// Levels: error < warn < info < debug < trace. Per-message lines (one message
+// followed through the pipeline) are traced when the level is trace, or for
+// one message in sample_n; the choice is made once per message with
+// trace_log_sample() so all its lines appear together.
+//
+// Level and sample rate can be changed at runtime: when control_path is set
+// the sink thread checks the file once a second and applies "<level> [N]".
+
+#ifndef EDGE_TRACE_LOG_H
+#define EDGE_TRACE_LOG_H
+
+#include <stdarg.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <strings.h>
+#include <unistd.h>
+#include <pthread.h>
+#include <sys/stat.h>
+
+#define TRACE_LOG_DEFAULT_SLOTS 4096
+#define TRACE_LOG_LINE_MAX      240     // 超過的部分截斷
+#define TRACE_LOG_IDLE_US       5000    // ring 為空時 sink 執行緒的等待
+#define TRACE_LOG_CONTROL_SEC   1.0
+
+enum { LOGLVL_ERROR = 0, LOGLVL_WARN, LOGLVL_INFO, LOGLVL_DEBUG, LOGLVL_TRACE };
+
+typedef struct TraceSlot {
+    uint64_t seq;                       // 寫完後設為 位置 + 1，sink 依此判斷可讀
+    uint32_t len;
+    uint32_t _pad;
+    char     line[TRACE_LOG_LINE_MAX];
+} TraceSlot;
+
+typedef struct TraceLog {
+    TraceSlot      *slots;
+    uint64_t        mask;
+    uint64_t        tail __attribute__((aligned(64)));     // 生產者以 CAS 預約
+    uint64_t        head __attribute__((aligned(64)));     // sink 執行緒
+    int             level __attribute__((aligned(64)));
+    uint32_t        sample_n;           // 0 = 不抽樣
+    uint64_t        msg_seq;            // 抽樣計數
+    uint64_t        written;
+    uint64_t        dropped;            // ring 已滿而丟棄的行數
+    uint64_t        truncated;
+    uint64_t        writes;             // write(2) 次數
+    int             fd;
+    char            control_path[256];
+    time_t          control_mtime;
+    pthread_t       thread;
+    volatile int    running;
+    int             started;
+    char           *out;
+    size_t          out_cap;
+} TraceLog;
+
+static inline const char *trace_log_level_name(int level) {
+    static const char *names[] = {"error", "warn", "info", "debug", "trace"};
+    return level >= LOGLVL_ERROR && level <= LOGLVL_TRACE ? names[level] : "?";
+}
+
+static inline int trace_log_parse_level(const char *name, int fallback) {
+    for (int l = LOGLVL_ERROR; l <= LOGLVL_TRACE; l++) {
+        if (strcasecmp(name, trace_log_level_name(l)) == 0) return l;
+    }
+    if (strcasecmp(name, "warning") == 0) return LOGLVL_WARN;
+    return fallback;
+}
+
+static inline int trace_log_init(TraceLog *log, size_t slots, int fd) {
+    memset(log, 0, sizeof(*log));
+    size_t cap = 1;
+    while (cap < (slots ? slots : TRACE_LOG_DEFAULT_SLOTS)) cap <<= 1;
+    log->slots = calloc(cap, sizeof(TraceSlot));
+    log->out_cap = 64 * 1024;
+    log->out = malloc(log->out_cap);
+    if (!log->slots || !log->out) {
+        free(log->slots);
+        free(log->out);
+        log->slots = NULL;
+        return -1;
+    }
+    log->mask = cap - 1;
+    log->level = LOGLVL_INFO;
+    log->fd = fd;
+    return 0;
+}
+
+static inline void trace_log_set(TraceLog *log, int level, uint32_t sample_n) {
+    __atomic_store_n(&log->level, level, __ATOMIC_RELAXED);
+    __atomic_store_n(&log->sample_n, sample_n, __ATOMIC_RELAXED);
+}
+
+static inline int trace_log_enabled(TraceLog *log, int level) {
+    return level <= __atomic_load_n(&log->level, __ATOMIC_RELAXED);
+}
+
+// 每則訊息呼叫一次：1 = 追蹤此訊息的所有行
+static inline int trace_log_sample(TraceLog *log) {
+    if (__atomic_load_n(&log->level, __ATOMIC_RELAXED) >= LOGLVL_TRACE) return 1;
+    uint32_t n = __atomic_load_n(&log->sample_n, __ATOMIC_RELAXED);
+    if (n == 0) return 0;
+    return __atomic_fetch_add(&log->msg_seq, 1, __ATOMIC_RELAXED) % n == 0;
+}
+
+// 不檢查等級（由 TLOG 巨集或呼叫者判斷）。回傳 0 = ring 已滿，此行被丟棄
+static inline int trace_log_vprintf(TraceLog *log, const char *fmt, va_list ap) {
+    uint64_t tail = __atomic_load_n(&log->tail, __ATOMIC_RELAXED);
+    for (;;) {
+        uint64_t head = __atomic_load_n(&log->head, __ATOMIC_ACQUIRE);
+        if (tail - head > log->mask) {
+            __atomic_fetch_add(&log->dropped, 1, __ATOMIC_RELAXED);
+            return 0;
+        }
+        if (__atomic_compare_exchange_n(&log->tail, &tail, tail + 1, 1,
+                                        __ATOMIC_ACQ_REL, __ATOMIC_RELAXED)) break;
+    }
+    TraceSlot *s = &log->slots[tail & log->mask];
+    int n = vsnprintf(s->line, sizeof(s->line), fmt, ap);
+    if (n < 0) n = 0;
+    if ((size_t)n >= sizeof(s->line)) {
+        n = sizeof(s->line) - 1;
+        s->line[n - 1] = '\n';
+        __atomic_fetch_add(&log->truncated, 1, __ATOMIC_RELAXED);
+    }
+    s->len = (uint32_t)n;
+    __atomic_store_n(&s->seq, tail + 1, __ATOMIC_RELEASE);
+    return 1;
+}
+
+static inline int trace_log_printf(TraceLog *log, const char *fmt, ...) __attribute__((format(printf, 2, 3)));
+static inline int trace_log_printf(TraceLog *log, const char *fmt, ...) {
+    va_list ap;
+    va_start(ap, fmt);
+    int ok = trace_log_vprintf(log, fmt, ap);
+    va_end(ap);
+    return ok;
+}
+
+// 等級不足時不格式化，也不碰 ring
+#define TLOG(log, lvl, ...) \
+    do { if (trace_log_enabled((log), (lvl))) trace_log_printf((log), __VA_ARGS__); } while (0)
+
+static inline void trace_log_write_all(TraceLog *log, size_t len) {
+    size_t off = 0;
+    while (off < len) {
+        ssize_t w = write(log->fd, log->out + off, len - off);
+        if (w <= 0) break;
+        off += (size_t)w;
+    }
+    log->writes++;
+}
+
+// 把已完成的行寫出，回傳處理的行數
+static inline size_t trace_log_drain(TraceLog *log) {
+    size_t lines = 0, len = 0;
+    uint64_t head = log->head;
+    for (;;) {
+        TraceSlot *s = &log->slots[head & log->mask];
+        if (__atomic_load_n(&s->seq, __ATOMIC_ACQUIRE) != head + 1) break;
+        if (len + s->len > log->out_cap) {
+            trace_log_write_all(log, len);
+            len = 0;
+        }
+        memcpy(log->out + len, s->line, s->len);
+        len += s->len;
+        head++;
+        __atomic_store_n(&log->head, head, __ATOMIC_RELEASE);
+        lines++;
+    }
+    if (len) trace_log_write_all(log, len);
+    log->written += lines;
+    return lines;
+}
+
+// 控制檔內容："<level> [sample_n]"，例如 "info 1000"；檔案修改時才重新讀取
+static inline void trace_log_check_control(TraceLog *log) {
+    struct stat st;
+    if (!log->control_path[0] || stat(log->control_path, &st) != 0) return;
+    if (st.st_mtime == log->control_mtime) return;
+    log->control_mtime = st.st_mtime;
+    FILE *f = fopen(log->control_path, "r");
+    if (!f) return;
+    char name[16] = {0};
+    unsigned n = __atomic_load_n(&log->sample_n, __ATOMIC_RELAXED);
+    int fields = fscanf(f, "%15s %u", name, &n);
+    fclose(f);
+    if (fields < 1) return;
+    int level = trace_log_parse_level(name, log->level);
+    trace_log_set(log, level, n);
+    trace_log_printf(log, "[LOG] level=%s, trace_sample=%u (from %s)\n",
+                     trace_log_level_name(level), n, log->control_path);
+}
+
+static inline void *trace_log_thread_fn(void *arg) {
+    TraceLog *log = arg;
+    double since_control = TRACE_LOG_CONTROL_SEC;
+    while (__atomic_load_n(&log->running, __ATOMIC_ACQUIRE)) {
+        if (since_control >= TRACE_LOG_CONTROL_SEC) {
+            trace_log_check_control(log);
+            since_control = 0.0;
+        }
+        if (trace_log_drain(log) == 0) {
+            usleep(TRACE_LOG_IDLE_US);
+            since_control += TRACE_LOG_IDLE_US / 1e6;
+        }
+    }
+    trace_log_drain(log);
+    return NULL;
+}
+
+static inline int trace_log_start(TraceLog *log, const char *control_path) {
+    if (control_path && control_path[0]) {
+        snprintf(log->control_path, sizeof(log->control_path), "%s", control_path);
+    }
+    log->running = 1;
+    if (pthread_create(&log->thread, NULL, trace_log_thread_fn, log) != 0) {
+        log->running = 0;
+        return -1;
+    }
+    log->started = 1;
+    return 0;
+}
+
+// 停止 sink 執行緒並寫出剩餘的行；未啟動時直接在呼叫者的執行緒寫出
+static inline void trace_log_stop(TraceLog *log) {
+    if (log->started) {
+        __atomic_store_n(&log->running, 0, __ATOMIC_RELEASE);
+        pthread_join(log->thread, NULL);
+        log->started = 0;
+    } else if (log->slots) {
+        trace_log_drain(log);
+    }
+}
+
+static inline void trace_log_destroy(TraceLog *log) {
+    trace_log_stop(log);
+    free(log->slots);
+    free(log->out);
+    log->slots = NULL;
+    log->out = NULL;
+}
+
+#endif // EDGE_TRACE_LOG_H
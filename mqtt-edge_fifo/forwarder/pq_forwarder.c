@@ -3,10 +3,40 @@
  * 優先處理 HIGH priority FIFO，然後處理 LOW priority FIFO
  *
  * 編譯:
- *   gcc -o dual_fifo_forwarder dual_fifo_forwarder.c -lpaho-mqtt3c -ljson-c -lpthread
+ *   gcc -I../common -o dual_fifo_forwarder pq_forwarder.c -lpaho-mqtt3c -ljson-c -lpthread
  *
  * 執行:
- *   sudo ip netns exec ns_forwarder ./dual_fifo_forwarder
+ *   sudo ip netns exec ns_forwarder ./dual_fifo_forwarder [--fifo-format json|binary]
+ *        [--log-format csv|binary] [--log-flush-ms N] [--window N] [--loop epoll|busy]
+ *        [--sched strict|wrr|drr|aging] [--weights H:L] [--quantum H:L] [--max-low-wait-ms N]
+ *        [--connections N] [--high-connections K] [--batch-high N[:MS]] [--batch-low N[:MS]]
+ *        [--log-level error|warn|info|debug|trace] [--trace-sample N] [--log-control PATH]
+ *
+ * --connections N (N >= 2) 以 N 條連線平行發布，每條連線一個執行緒、各自同步發布：
+ * 前 K 條（--high-connections，預設 1）專供 HIGH，其餘給 LOW；同一類別內以來源 IP
+ * 雜湊選擇連線，因此同一來源的訊息順序不變。
+ *
+ * --batch-high / --batch-low N[:MS] 把該類別最多 N 筆記錄、或第一筆等待 MS 毫秒後
+ * 封裝成一個 envelope 發布到 forwarded/batch（MS 省略或為 0 時，該類別的 FIFO 排空即發布）。
+ * 格式見 batch_add()；Post_Process/unbatch.py 可拆回逐筆記錄。
+ *
+ * 主迴圈以 epoll 等待 FIFO 可讀，喚醒後依排程規則（--sched）排空兩個 FIFO，
+ * 兩個 FIFO 都以 read() 批次讀取。--loop busy 保留舊的忙碌輪詢，用於比較閒置 CPU 與延遲。
+ *
+ * 排程規則：
+ *   strict  HIGH 有資料就先處理 HIGH（預設）
+ *   wrr     加權輪詢，每輪最多 H 則 HIGH、L 則 LOW
+ *   drr     差額輪詢，每輪 HIGH / LOW 各增加 H / L 位元組的額度
+ *   aging   strict，但 LOW 隊首等待超過 --max-low-wait-ms 時與 HIGH 交替處理
+ *
+ * --window N (N >= 1) 啟用非同步發布：最多 N 則 QoS 1 訊息同時在途，
+ * 由 delivered 回調在收到 PUBACK 時記錄結束時間；每個空出的視窗位置
+ * 都先取 HIGH，HIGH 沒有資料才取 LOW。
+ *
+ * 主控台輸出經 common/trace_log.h 的 ring 由背景執行緒寫出，不佔用轉發時間。
+ * 逐則訊息的 Processing / SENT / SUCCESS / Logged 行只在 --log-level trace 或
+ * --trace-sample N（每 N 則抽一則）時輸出；執行中可改寫 --log-control 指定的檔案
+ * （內容如 "debug 100"）調整等級與抽樣。
  */
 
 #include <stdio.h>
@@ -18,35 +48,204 @@
 #include <fcntl.h>
 #include <errno.h>
 #include <signal.h>
-#include <sys/select.h>
+#include <pthread.h>
+#include <sys/epoll.h>
+#include <sys/resource.h>
+#include <getopt.h>
 #include <json-c/json.h>
 #include "MQTTClient.h"
+#include "batch_log.h"
+#include "log_records.h"
+#include "fifo_record.h"
+#include "ring_buffer.h"
+#include "trace_log.h"
 
 #define HIGH_FIFO_PATH   "/home/jason/mqtt-edge/forwarder/high_priority_queue.fifo"
 #define LOW_FIFO_PATH    "/home/jason/mqtt-edge/forwarder/low_priority_queue.fifo"
 #define MAIN_BROKER_HOST "tcp://192.168.254.139:1884"
 #define CLIENT_ID        "dual_fifo_forwarder"
 #define CSV_PATH         "/home/jason/mqtt-edge/logs/forwarder_performance.csv"
+#define BIN_LOG_PATH     "/home/jason/mqtt-edge/logs/forwarder_performance.bin"
+#define CSV_HEADER       "enqueue_ts,start_forward_ts,end_forward_ts,original_ip,packet_count,original_timestamp,forward_result,forward_duration_ms,priority,send_ts,ack_ts,enqueue_to_send_ms,send_to_ack_ms,queue_wait_ms,conn_id,batch_size\n"
 #define TOPIC            "forwarded/data"
+#define BATCH_TOPIC      "forwarded/batch"
+#define BATCH_MAX        1024   // 每個 envelope 最多的記錄數
+#define BATCH_RECORD_MAX 160    // 每筆記錄在 envelope 中的最大長度
 #define QOS              1
-#define BUF_SIZE         4096
+#define FIFO_READ_BATCH  64     // 每次 read() 最多取出的 FifoRecord 數（json 模式為同樣大小的位元組緩衝）
+#define FORWARDER_IP     "192.168.100.2"
+#define MAX_WINDOW       1024   // --window 上限
+#define DRAIN_TIMEOUT_SEC 2.0   // 結束時等待在途訊息確認的時間
+#define MAX_CONNECTIONS  32     // --connections 上限
+#define CONN_QUEUE_SIZE  256    // 每條發布連線的待發佇列長度
+#define PAYLOAD_MAX      512
 
 static volatile int running = 1;
 static int publish_failures = 0;
 static size_t high_processed = 0;
 static size_t low_processed = 0;
 
+// 日誌：批次寫出（依大小或時間），可選二進位格式 (common/log_records.h)
+static int    log_binary = 0;
+static double log_flush_interval = BATCH_LOG_DEFAULT_INTERVAL;
+
+// FIFO 格式：json = 每行一個 JSON；binary = 固定大小 FifoRecord (common/fifo_record.h)
+static int fifo_binary = 0;
+
+// 日誌由主迴圈與 delivered 回調（Paho 背景執行緒）共同寫入
+static pthread_mutex_t log_mutex = PTHREAD_MUTEX_INITIALIZER;
+
+// 非同步發布：0 = 同步（原本的行為），N = 在途視窗大小
+static int window = 0;
+
+// 主控台日誌：等級與逐則追蹤抽樣（common/trace_log.h）；msg_traced 為主迴圈目前處理的訊息是否追蹤
+static TraceLog edge_log;
+static int msg_traced = 0;
+
+// 多連線平行發布：主迴圈依排程取出訊息，放入對應連線的佇列，由各連線的執行緒發布
+typedef struct PublishJob {
+    double   enqueue_ts;
+    double   orig_ts;
+    uint64_t packet_count;
+    int      payloadlen;
+    int      traced;
+    char     msg_priority[8];
+    char     ip[48];
+    char     payload[PAYLOAD_MAX];
+} PublishJob;
+
+typedef struct PublisherConn {
+    int          id;
+    int          high;        // 1 = 專供 HIGH
+    MQTTClient   client;
+    MQTTClient_connectOptions conn_opts;
+    RingBuffer   queue;       // PublishJob
+    pthread_t    thread;
+    BatchLog    *log;
+    uint64_t     published;
+    uint64_t     failures;
+    double       busy_sec;    // publish 呼叫的總時間
+} PublisherConn;
+
+static int connections = 0;        // 0 = 單一連線
+static int high_connections = 1;
+static PublisherConn conns[MAX_CONNECTIONS];
+static pthread_mutex_t stats_mutex = PTHREAD_MUTEX_INITIALIZER;  // high/low_processed、publish_failures
+static pthread_mutex_t pool_mutex = PTHREAD_MUTEX_INITIALIZER;
+static pthread_cond_t pool_space = PTHREAD_COND_INITIALIZER;     // 任一連線佇列取出訊息時通知
+
+// 批次封裝：每個類別各自累積記錄，達到筆數或等待時間上限時發布成一個 envelope
+typedef struct BatchEntry {
+    double   enqueue_ts;
+    double   orig_ts;
+    uint64_t packet_count;
+    char     msg_priority[8];
+    char     ip[48];
+} BatchEntry;
+
+typedef struct Batcher {
+    int         max_records;  // 0 = 不批次
+    double      max_wait;     // 第一筆加入後最多等待的秒數；0 = FIFO 排空即發布
+    int         n;
+    double      first_ts;
+    char       *body;         // records 陣列的內容
+    size_t      len;
+    BatchEntry *entries;
+    uint64_t    envelopes;
+    uint64_t    records;
+} Batcher;
+
+static Batcher batchers[2];
+
+// 一則已送出、尚未收到 PUBACK 的訊息
+typedef struct InFlight {
+    int      used;
+    int      high;
+    MQTTClient_deliveryToken token;
+    double   enqueue_ts;
+    double   start_forward_ts;
+    double   send_ts;
+    double   orig_ts;
+    uint64_t packet_count;
+    int      traced;
+    char     msg_priority[8];
+    char     ip[48];
+} InFlight;
+
+static InFlight inflight[MAX_WINDOW];
+static int inflight_count = 0;
+static int inflight_peak = 0;
+static uint64_t acked = 0;
+static uint64_t ack_lost = 0;
+static pthread_mutex_t inflight_mutex = PTHREAD_MUTEX_INITIALIZER;
+static pthread_cond_t inflight_cond = PTHREAD_COND_INITIALIZER;
+
+// PUBACK 可能在 MQTTClient_publishMessage 返回、token 登記之前就到達：
+// delivered 找不到 token 時先記在這裡，publish_and_log 登記前再對帳。
+// 只採用發布之後才收到的確認（ack_ts >= 發布時間），因此被覆寫或殘留的舊項目不會誤配
+typedef struct EarlyAck {
+    MQTTClient_deliveryToken token;
+    double   ack_ts;          // 0 = 空位
+} EarlyAck;
+
+static EarlyAck early_acks[MAX_WINDOW];
+static int early_ack_next = 0;
+
+// 主迴圈：epoll = 等待 FIFO 可讀；busy = 不斷輪詢（舊行為，僅供比較）
+static int loop_busy = 0;
+
+// FIFO 讀取緩衝：一次 read() 取出多筆記錄（binary）或多行（json），再逐筆交給處理迴圈
+typedef struct FifoReader {
+    int        fd;
+    union {
+        FifoRecord recs[FIFO_READ_BATCH];
+        char       text[FIFO_READ_BATCH * sizeof(FifoRecord)];
+    };
+    size_t     bytes;      // 緩衝中的位元組數
+    size_t     next;       // 下一筆要處理的記錄（json 模式為位元組位置）
+    uint64_t   reads;
+    uint64_t   records;
+    uint64_t   invalid;
+    uint64_t   errors;     // EAGAIN 以外的 read() 錯誤
+    const char *head;      // 已 peek、尚未取走的隊首訊息（指向緩衝內）
+} FifoReader;
+
+enum { CLASS_HIGH = 0, CLASS_LOW = 1 };
+
+// 排程規則：決定下一則訊息從哪個 FIFO 取出
+typedef enum { SCHED_STRICT, SCHED_WRR, SCHED_DRR, SCHED_AGING } SchedKind;
+
+typedef struct Scheduler {
+    SchedKind kind;
+    int       weight[2];       // wrr：每輪 HIGH / LOW 最多各取幾則
+    size_t    quantum[2];      // drr：每輪 HIGH / LOW 增加的額度（位元組）
+    double    max_low_wait;    // aging：LOW 隊首等待超過此秒數即與 HIGH 交替
+    int       cur;             // wrr / drr 目前服務的類別
+    int       credit;          // wrr 目前類別剩餘的則數
+    size_t    deficit[2];      // drr 額度
+    int       visited;         // drr：本次造訪已加過額度
+    int       last_aged;       // aging：上一則是逾時提前處理的 LOW
+    uint64_t  aged;            // aging：逾時提前處理的 LOW 則數
+} Scheduler;
+
+static Scheduler sched = {
+    .kind = SCHED_STRICT,
+    .weight = {4, 1},
+    .quantum = {1024, 256},
+    .max_low_wait = 0.1,
+};
+
+// 每類的排隊時間：寫入 FIFO（original_timestamp）到轉發器取出（enqueue_ts）
+static double wait_sum[2];
+static double wait_max[2];
+static uint64_t wait_n[2];
+
 // 連線丟失回調
 void connection_lost(void *context, char *cause) {
-    printf("Connection lost: %s\n", cause ? cause : "unknown");
+    TLOG(&edge_log, LOGLVL_WARN, "Connection lost: %s\n", cause ? cause : "unknown");
     // 不立即退出，嘗試重連
 }
 
-// 訊息傳遞回調
-void delivered(void *context, MQTTClient_deliveryToken dt) {
-    // QoS 1 傳遞確認
-}
-
 // 信號處理器
 static void signal_handler(int signum) {
     printf("\nReceived signal %d, shutting down...\n", signum);
@@ -90,15 +289,550 @@ void get_forwarder_ip(char *ip_buf, size_t buf_size) {
     }
 }
 
-// 處理單個訊息
-int process_message(MQTTClient client, const char *line, const char *priority, FILE *csv) {
+// 寫入一筆轉發記錄（由主迴圈依大小或時間寫出）
+// send_ts：publish 呼叫返回的時間；ack_ts：收到 PUBACK 的時間（同步模式或失敗時為 0）
+static void log_forward(BatchLog *log, double enqueue_ts, double start_forward_ts,
+                        double send_ts, double ack_ts, const char *orig_ip,
+                        uint64_t packet_count, double orig_ts, int success,
+                        const char *msg_priority, int conn_id, int batch_size, int traced) {
+    double end_forward_ts = ack_ts > 0 ? ack_ts : send_ts;
+    double forward_duration_ms = (end_forward_ts - start_forward_ts) * 1000.0;
+    // 從寫入 FIFO（original_timestamp）到送出；沒有原始時間時改用轉發器取出的時間
+    double enqueued = orig_ts > 0 ? orig_ts : enqueue_ts;
+    double enqueue_to_send_ms = (send_ts - enqueued) * 1000.0;
+    
+    pthread_mutex_lock(&log_mutex);
+    if (log_binary) {
+        ForwarderLogRecord rec;
+        memset(&rec, 0, sizeof(rec));
+        rec.enqueue_ts = enqueue_ts;
+        rec.start_forward_ts = start_forward_ts;
+        rec.end_forward_ts = end_forward_ts;
+        rec.original_timestamp = orig_ts;
+        rec.forward_duration_ms = forward_duration_ms;
+        rec.send_ts = send_ts;
+        rec.ack_ts = ack_ts;
+        rec.packet_count = packet_count;
+        rec.forward_success = success;
+        rec.conn_id = conn_id;
+        rec.batch_size = batch_size;
+        binlog_copy_str(rec.priority, sizeof(rec.priority), msg_priority);
+        binlog_copy_str(rec.original_ip, sizeof(rec.original_ip), orig_ip);
+        batch_log_append(log, &rec, sizeof(rec));
+    } else {
+        // 沒有 PUBACK 或原始時間的欄位留空
+        char ack[24] = "", send_to_ack[24] = "", queue_wait[24] = "";
+        if (ack_ts > 0) {
+            snprintf(ack, sizeof(ack), "%.6f", ack_ts);
+            snprintf(send_to_ack, sizeof(send_to_ack), "%.3f", (ack_ts - send_ts) * 1000.0);
+        }
+        if (orig_ts > 0) snprintf(queue_wait, sizeof(queue_wait), "%.3f", (enqueue_ts - orig_ts) * 1000.0);
+        batch_log_printf(log, "%.6f,%.6f,%.6f,%s,%llu,%.6f,%s,%.3f,%s,%.6f,%s,%.3f,%s,%s,%d,%d\n",
+                         enqueue_ts, start_forward_ts, end_forward_ts,
+                         orig_ip, (unsigned long long)packet_count, orig_ts,
+                         success ? "SUCCESS" : "FAILED", forward_duration_ms, msg_priority,
+                         send_ts, ack, enqueue_to_send_ms, send_to_ack, queue_wait, conn_id, batch_size);
+    }
+    pthread_mutex_unlock(&log_mutex);
+    
+    if (traced) {
+        trace_log_printf(&edge_log, "  -> Logged: Duration=%.3fms, Priority=%s\n",
+                         forward_duration_ms, msg_priority);
+    }
+}
+
+static void count_forwarded(int high) {
+    if (high) {
+        high_processed++;
+    } else {
+        low_processed++;
+    }
+}
+
+// 訊息傳遞回調：QoS 1 傳遞確認（PUBACK），在 Paho 背景執行緒中執行
+// 非同步模式下以 token 找出在途訊息，記錄確認時間並釋出視窗位置
+void delivered(void *context, MQTTClient_deliveryToken dt) {
+    if (window <= 0) return;
+    double ack_ts = now_sec();
+    InFlight done;
+    int found = 0;
+    
+    pthread_mutex_lock(&inflight_mutex);
+    for (int i = 0; i < window; i++) {
+        if (inflight[i].used && inflight[i].token == dt) {
+            done = inflight[i];
+            inflight[i].used = 0;
+            inflight_count--;
+            acked++;
+            count_forwarded(done.high);
+            found = 1;
+            break;
+        }
+    }
+    if (!found) {
+        early_acks[early_ack_next].token = dt;
+        early_acks[early_ack_next].ack_ts = ack_ts;
+        early_ack_next = (early_ack_next + 1) % MAX_WINDOW;
+    }
+    pthread_cond_signal(&inflight_cond);
+    pthread_mutex_unlock(&inflight_mutex);
+    
+    if (!found) return;
+    if (done.traced) {
+        trace_log_printf(&edge_log, "  -> SUCCESS: %s priority acknowledged by main broker\n",
+                         done.high ? "HIGH" : "LOW");
+    }
+    log_forward((BatchLog *)context, done.enqueue_ts, done.start_forward_ts, done.send_ts, ack_ts,
+                done.ip, done.packet_count, done.orig_ts, 1, done.msg_priority, 0, 1, done.traced);
+}
+
+// 等待視窗出現空位，最多 timeout_sec 秒；有空位時回傳 1
+static int inflight_wait_slot(double timeout_sec) {
+    pthread_mutex_lock(&inflight_mutex);
+    if (inflight_count >= window && timeout_sec > 0) {
+        double deadline = now_sec() + timeout_sec;
+        struct timespec ts;
+        ts.tv_sec = (time_t)deadline;
+        ts.tv_nsec = (long)((deadline - (double)ts.tv_sec) * 1e9);
+        while (inflight_count >= window) {
+            if (pthread_cond_timedwait(&inflight_cond, &inflight_mutex, &ts) != 0) break;
+        }
+    }
+    int free_slot = inflight_count < window;
+    pthread_mutex_unlock(&inflight_mutex);
+    return free_slot;
+}
+
+// 連線中斷（clean session 不會重送）或結束時仍未確認的訊息一律記為 FAILED
+static int inflight_fail_all(BatchLog *log) {
+    InFlight lost[MAX_WINDOW];
+    int n = 0;
+    
+    pthread_mutex_lock(&inflight_mutex);
+    for (int i = 0; i < window; i++) {
+        if (inflight[i].used) {
+            lost[n++] = inflight[i];
+            inflight[i].used = 0;
+        }
+    }
+    inflight_count = 0;
+    ack_lost += n;
+    pthread_cond_broadcast(&inflight_cond);
+    pthread_mutex_unlock(&inflight_mutex);
+    
+    for (int i = 0; i < n; i++) {
+        log_forward(log, lost[i].enqueue_ts, lost[i].start_forward_ts, lost[i].send_ts, 0,
+                    lost[i].ip, lost[i].packet_count, lost[i].orig_ts, 0, lost[i].msg_priority, 0, 1,
+                    lost[i].traced);
+    }
+    publish_failures += n;
+    return n;
+}
+
+// 與插件 ip_hash 相同的 FNV-1a
+static uint32_t ip_hash(const char *ip) {
+    uint32_t h = 2166136261u;
+    for (const unsigned char *c = (const unsigned char *)ip; *c; c++) {
+        h ^= *c;
+        h *= 16777619u;
+    }
+    return h;
+}
+
+// 同一類別內以 IP 雜湊選擇連線，同一來源的訊息永遠走同一條連線
+static PublisherConn *pool_target(int high, const char *ip) {
+    int first = high ? 0 : high_connections;
+    int count = high ? high_connections : connections - high_connections;
+    return &conns[first + ip_hash(ip) % count];
+}
+
+// 等待任一連線佇列取出訊息，最多 timeout_sec 秒
+static void pool_wait_space(double timeout_sec) {
+    double deadline = now_sec() + timeout_sec;
+    struct timespec ts;
+    ts.tv_sec = (time_t)deadline;
+    ts.tv_nsec = (long)((deadline - (double)ts.tv_sec) * 1e9);
+    pthread_mutex_lock(&pool_mutex);
+    pthread_cond_timedwait(&pool_space, &pool_mutex, &ts);
+    pthread_mutex_unlock(&pool_mutex);
+}
+
+static int pool_submit(const char *payload, int payloadlen, const char *orig_ip, uint64_t packet_count,
+                       double orig_ts, const char *msg_priority, const char *priority, double enqueue_ts,
+                       double start_forward_ts) {
+    PublishJob job;
+    PublisherConn *c = pool_target(strcmp(priority, "HIGH") == 0, orig_ip);
+    if (payloadlen >= PAYLOAD_MAX) {
+        // 放不進 PublishJob 的訊息不會送出，同樣記一筆 FAILED，日誌才不會少一列
+        TLOG(&edge_log, LOGLVL_WARN, "  -> FAILED: %s payload too large (%d bytes)\n", priority, payloadlen);
+        pthread_mutex_lock(&stats_mutex);
+        c->failures++;
+        publish_failures++;
+        pthread_mutex_unlock(&stats_mutex);
+        log_forward(c->log, enqueue_ts, start_forward_ts, now_sec(), 0, orig_ip, packet_count,
+                    orig_ts, 0, msg_priority, c->id, 1, msg_traced);
+        return 0;
+    }
+    job.enqueue_ts = enqueue_ts;
+    job.orig_ts = orig_ts;
+    job.packet_count = packet_count;
+    job.payloadlen = payloadlen;
+    job.traced = msg_traced;
+    binlog_copy_str(job.msg_priority, sizeof(job.msg_priority), msg_priority);
+    binlog_copy_str(job.ip, sizeof(job.ip), orig_ip);
+    memcpy(job.payload, payload, payloadlen);
+    // 主迴圈只在目標佇列有空位時才取出訊息（forward_next），這裡不會阻塞
+    return ring_push(&c->queue, &job) == RING_OK;
+}
+
+static void *publisher_thread_fn(void *arg) {
+    PublisherConn *c = (PublisherConn *)arg;
+    PublishJob job;
+    
+    for (;;) {
+        if (!ring_pop(&c->queue, &job, 100000)) {
+            if (ring_is_drained(&c->queue)) break;
+            continue;
+        }
+        pthread_mutex_lock(&pool_mutex);
+        pthread_cond_signal(&pool_space);
+        pthread_mutex_unlock(&pool_mutex);
+        
+        if (!MQTTClient_isConnected(c->client)) {
+            TLOG(&edge_log, LOGLVL_WARN, "Connection %d lost, attempting to reconnect...\n", c->id);
+            int reconnect_rc = MQTTClient_connect(c->client, &c->conn_opts);
+            if (reconnect_rc != MQTTCLIENT_SUCCESS) {
+                TLOG(&edge_log, LOGLVL_ERROR, "Connection %d: reconnection failed (code: %d)\n", c->id, reconnect_rc);
+            }
+        }
+        
+        MQTTClient_message pubmsg = MQTTClient_message_initializer;
+        pubmsg.payload = job.payload;
+        pubmsg.payloadlen = job.payloadlen;
+        pubmsg.qos = QOS;
+        pubmsg.retained = 0;
+        
+        MQTTClient_deliveryToken token;
+        double start_forward_ts = now_sec();
+        int rc = MQTTClient_publishMessage(c->client, TOPIC, &pubmsg, &token);
+        double send_ts = now_sec();
+        c->busy_sec += send_ts - start_forward_ts;
+        
+        pthread_mutex_lock(&stats_mutex);
+        if (rc == MQTTCLIENT_SUCCESS) {
+            c->published++;
+            count_forwarded(c->high);
+        } else {
+            c->failures++;
+            publish_failures++;
+        }
+        pthread_mutex_unlock(&stats_mutex);
+        
+        log_forward(c->log, job.enqueue_ts, start_forward_ts, send_ts, 0, job.ip, job.packet_count,
+                    job.orig_ts, rc == MQTTCLIENT_SUCCESS, job.msg_priority, c->id, 1, job.traced);
+    }
+    return NULL;
+}
+
+static int pool_start(BatchLog *log) {
+    for (int i = 0; i < connections; i++) {
+        PublisherConn *c = &conns[i];
+        char client_id[64];
+        snprintf(client_id, sizeof(client_id), "%s_%d", CLIENT_ID, i);
+        c->id = i;
+        c->high = i < high_connections;
+        c->log = log;
+        MQTTClient_connectOptions conn_opts = MQTTClient_connectOptions_initializer;
+        conn_opts.keepAliveInterval = 20;
+        conn_opts.cleansession = 1;
+        conn_opts.connectTimeout = 10;
+        c->conn_opts = conn_opts;
+        
+        MQTTClient_create(&c->client, MAIN_BROKER_HOST, client_id, MQTTCLIENT_PERSISTENCE_NONE, NULL);
+        MQTTClient_setCallbacks(c->client, NULL, connection_lost, NULL, delivered);
+        int rc = MQTTClient_connect(c->client, &c->conn_opts);
+        if (rc != MQTTCLIENT_SUCCESS) {
+            fprintf(stderr, "Connection %d failed to connect to broker (code: %d)\n", i, rc);
+            return -1;
+        }
+        if (ring_init(&c->queue, CONN_QUEUE_SIZE, sizeof(PublishJob), RING_BLOCK) != 0 ||
+            pthread_create(&c->thread, NULL, publisher_thread_fn, c) != 0) {
+            perror("publisher");
+            return -1;
+        }
+        printf("Connection %d (%s) connected as %s\n", i, c->high ? "HIGH" : "LOW", client_id);
+    }
+    return 0;
+}
+
+// 結束：各連線送完佇列中的訊息後斷線，輸出每條連線的統計
+static void pool_stop(double wall) {
+    for (int i = 0; i < connections; i++) ring_close(&conns[i].queue);
+    for (int i = 0; i < connections; i++) {
+        PublisherConn *c = &conns[i];
+        pthread_join(c->thread, NULL);
+        MQTTClient_disconnect(c->client, 1000);
+        MQTTClient_destroy(&c->client);
+        
+        RingStats st;
+        ring_get_stats(&c->queue, &st);
+        uint64_t n = c->published + c->failures;
+        printf("Connection %d (%s): published=%llu, failures=%llu, %.1f msg/s, "
+               "mean publish %.3f ms, busy %.1f%%, queue high watermark %zu/%zu\n",
+               i, c->high ? "HIGH" : "LOW", (unsigned long long)c->published,
+               (unsigned long long)c->failures, wall > 0 ? c->published / wall : 0.0,
+               n ? c->busy_sec / n * 1000.0 : 0.0, wall > 0 ? c->busy_sec / wall * 100.0 : 0.0,
+               st.high_watermark, st.capacity);
+        ring_destroy(&c->queue);
+    }
+}
+
+// 發布一則訊息並寫入日誌
+// 非同步模式下成功送出的訊息放入在途表，由 delivered 回調記錄
+static int publish_and_log(MQTTClient client, const char *payload, int payloadlen,
+                           const char *orig_ip, uint64_t packet_count, double orig_ts,
+                           const char *msg_priority, const char *priority,
+                           double enqueue_ts, double start_forward_ts, BatchLog *log) {
+    // 使用 Paho 發布訊息
+    MQTTClient_message pubmsg = MQTTClient_message_initializer;
+    pubmsg.payload = (char *)payload;
+    pubmsg.payloadlen = payloadlen;
+    pubmsg.qos = QOS;
+    pubmsg.retained = 0;
+    
+    if (connections > 0) {
+        return pool_submit(payload, payloadlen, orig_ip, packet_count, orig_ts,
+                           msg_priority, priority, enqueue_ts, start_forward_ts);
+    }
+    
+    int high = strcmp(priority, "HIGH") == 0;
+    MQTTClient_deliveryToken token;
+    
+    if (window > 0) {
+        // 發布時不持有 inflight_mutex（delivered 也要這把鎖）；
+        // 登記前就到達的 PUBACK 由 delivered 暫存在 early_acks
+        double publish_ts = now_sec();
+        int rc = MQTTClient_publishMessage(client, TOPIC, &pubmsg, &token);
+        double send_ts = now_sec();
+        if (rc == MQTTCLIENT_SUCCESS) {
+            double ack_ts = 0;
+            pthread_mutex_lock(&inflight_mutex);
+            for (int i = 0; i < MAX_WINDOW; i++) {
+                if (early_acks[i].ack_ts >= publish_ts && early_acks[i].token == token) {
+                    // 確認早於 publish 返回時，以返回時間為確認時間（避免負的確認延遲）
+                    ack_ts = early_acks[i].ack_ts > send_ts ? early_acks[i].ack_ts : send_ts;
+                    early_acks[i].ack_ts = 0;
+                    break;
+                }
+            }
+            if (ack_ts > 0) {
+                acked++;
+                count_forwarded(high);
+                pthread_mutex_unlock(&inflight_mutex);
+                if (msg_traced) {
+                    trace_log_printf(&edge_log, "  -> SUCCESS: %s priority acknowledged by main broker\n", priority);
+                }
+                log_forward(log, enqueue_ts, start_forward_ts, send_ts, ack_ts, orig_ip, packet_count,
+                            orig_ts, 1, msg_priority, 0, 1, msg_traced);
+                return 1;
+            }
+            for (int i = 0; i < window; i++) {
+                if (inflight[i].used) continue;
+                InFlight *f = &inflight[i];
+                f->used = 1;
+                f->high = high;
+                f->token = token;
+                f->enqueue_ts = enqueue_ts;
+                f->start_forward_ts = start_forward_ts;
+                f->send_ts = send_ts;
+                f->orig_ts = orig_ts;
+                f->packet_count = packet_count;
+                f->traced = msg_traced;
+                binlog_copy_str(f->msg_priority, sizeof(f->msg_priority), msg_priority);
+                binlog_copy_str(f->ip, sizeof(f->ip), orig_ip);
+                break;
+            }
+            int in_flight = ++inflight_count;
+            if (in_flight > inflight_peak) inflight_peak = in_flight;
+            pthread_mutex_unlock(&inflight_mutex);
+            if (msg_traced) {
+                trace_log_printf(&edge_log, "  -> SENT: %s priority in flight (%d/%d)\n",
+                                 priority, in_flight, window);
+            }
+            return 1;
+        }
+        
+        publish_failures++;
+        TLOG(&edge_log, LOGLVL_WARN, "  -> FAILED: Could not forward %s priority (code: %d)\n", priority, rc);
+        log_forward(log, enqueue_ts, start_forward_ts, send_ts, 0, orig_ip, packet_count,
+                    orig_ts, 0, msg_priority, 0, 1, msg_traced);
+        return 0;
+    }
+    
+    int rc = MQTTClient_publishMessage(client, TOPIC, &pubmsg, &token);
+    double end_forward_ts = now_sec();
+    
+    if (rc == MQTTCLIENT_SUCCESS) {
+        if (msg_traced) trace_log_printf(&edge_log, "  -> SUCCESS: Forwarded %s priority to main broker\n", priority);
+        count_forwarded(high);
+    } else {
+        publish_failures++;
+        TLOG(&edge_log, LOGLVL_WARN, "  -> FAILED: Could not forward %s priority (code: %d)\n", priority, rc);
+        
+        // 檢查連線狀態
+        if (!MQTTClient_isConnected(client)) {
+            TLOG(&edge_log, LOGLVL_WARN, "  -> Connection lost, will attempt reconnect\n");
+        }
+    }
+    
+    log_forward(log, enqueue_ts, start_forward_ts, end_forward_ts, 0, orig_ip, packet_count,
+                orig_ts, rc == MQTTCLIENT_SUCCESS, msg_priority, 0, 1, msg_traced);
+    
+    return (rc == MQTTCLIENT_SUCCESS) ? 1 : 0;
+}
+
+static int batch_parse(const char *arg, Batcher *b) {
+    double ms = 0.0;
+    if (sscanf(arg, "%d:%lf", &b->max_records, &ms) < 1 ||
+        b->max_records < 1 || b->max_records > BATCH_MAX || ms < 0) {
+        return -1;
+    }
+    b->max_wait = ms / 1000.0;
+    return 0;
+}
+
+static int batch_init(Batcher *b) {
+    if (b->max_records <= 1) {
+        b->max_records = 0;
+        return 0;
+    }
+    b->body = malloc((size_t)b->max_records * BATCH_RECORD_MAX);
+    b->entries = calloc(b->max_records, sizeof(BatchEntry));
+    return b->body && b->entries ? 0 : -1;
+}
+
+// 發布累積的記錄；每筆記錄各自寫一行日誌（batch_size 欄位為 envelope 內的筆數）
+static int batch_flush(MQTTClient client, int cls, BatchLog *log) {
+    Batcher *b = &batchers[cls];
+    if (b->n == 0) return 0;
+    
+    static char envelope[BATCH_MAX * BATCH_RECORD_MAX + 256];
+    double start_forward_ts = now_sec();
+    int len = snprintf(envelope, sizeof(envelope),
+        "{\"v\":1,\"forwarder_ip\":\"%s\",\"class\":\"%s\",\"batch_ts\":%.6f,"
+        "\"fields\":[\"ip\",\"count\",\"timestamp\",\"priority\",\"forward_timestamp\"],"
+        "\"records\":[%.*s]}",
+        FORWARDER_IP, cls == CLASS_HIGH ? "HIGH" : "LOW", start_forward_ts,
+        (int)b->len, b->body);
+    
+    MQTTClient_message pubmsg = MQTTClient_message_initializer;
+    pubmsg.payload = envelope;
+    pubmsg.payloadlen = len;
+    pubmsg.qos = QOS;
+    pubmsg.retained = 0;
+    
+    MQTTClient_deliveryToken token;
+    int rc = MQTTClient_publishMessage(client, BATCH_TOPIC, &pubmsg, &token);
+    double send_ts = now_sec();
+    
+    if (rc == MQTTCLIENT_SUCCESS) {
+        TLOG(&edge_log, LOGLVL_DEBUG, "  -> SUCCESS: Forwarded %s envelope with %d records\n",
+             cls == CLASS_HIGH ? "HIGH" : "LOW", b->n);
+        b->envelopes++;
+        b->records += b->n;
+        for (int i = 0; i < b->n; i++) count_forwarded(cls == CLASS_HIGH);
+    } else {
+        publish_failures++;
+        TLOG(&edge_log, LOGLVL_WARN, "  -> FAILED: Could not forward %s envelope (code: %d)\n",
+             cls == CLASS_HIGH ? "HIGH" : "LOW", rc);
+    }
+    
+    for (int i = 0; i < b->n; i++) {
+        BatchEntry *e = &b->entries[i];
+        log_forward(log, e->enqueue_ts, start_forward_ts, send_ts, 0, e->ip, e->packet_count,
+                    e->orig_ts, rc == MQTTCLIENT_SUCCESS, e->msg_priority, 0, b->n, 0);
+    }
+    b->n = 0;
+    b->len = 0;
+    return rc == MQTTCLIENT_SUCCESS;
+}
+
+// 把一筆記錄加入該類別的 envelope：records 中每筆是與 fields 對應的陣列
+//   ["ip", count, timestamp, "priority", forward_timestamp]
+// forward_timestamp 為轉發器取出該筆記錄的時間，拆封後可還原每筆的時間戳
+static int batch_add(MQTTClient client, int cls, const char *ip, uint64_t count, double orig_ts,
+                     const char *msg_priority, double enqueue_ts, BatchLog *log) {
+    Batcher *b = &batchers[cls];
+    int len = snprintf(b->body + b->len, BATCH_RECORD_MAX, "%s[\"%s\",%llu,%.6f,\"%s\",%.6f]",
+                       b->n > 0 ? "," : "", ip, (unsigned long long)count, orig_ts,
+                       msg_priority, enqueue_ts);
+    if (len <= 0 || len >= BATCH_RECORD_MAX) return 0;
+    
+    BatchEntry *e = &b->entries[b->n];
+    e->enqueue_ts = enqueue_ts;
+    e->orig_ts = orig_ts;
+    e->packet_count = count;
+    binlog_copy_str(e->msg_priority, sizeof(e->msg_priority), msg_priority);
+    binlog_copy_str(e->ip, sizeof(e->ip), ip);
+    if (b->n == 0) b->first_ts = enqueue_ts;
+    b->len += (size_t)len;
+    b->n++;
+    
+    if (b->n >= b->max_records) return batch_flush(client, cls, log);
+    return 1;
+}
+
+static const char *fifo_reader_peek(FifoReader *rd);
+
+// 發布已到等待上限的 envelope；max_wait 為 0 的類別在自己的 FIFO 排空時發布，
+// 不必等另一個類別也排空（持續的 LOW 流量不會卡住 HIGH envelope）。rd 為 NULL = 兩個 FIFO 都已排空
+static void batch_flush_due(MQTTClient client, BatchLog *log, FifoReader *rd[2]) {
+    double now = now_sec();
+    for (int c = CLASS_HIGH; c <= CLASS_LOW; c++) {
+        Batcher *b = &batchers[c];
+        if (b->n == 0) continue;
+        if (b->max_wait > 0 ? now - b->first_ts >= b->max_wait
+                            : rd == NULL || fifo_reader_peek(rd[c]) == NULL) {
+            batch_flush(client, c, log);
+        }
+    }
+}
+
+// 距離最早一個 envelope 到期的毫秒數；沒有等待中的 envelope 時回傳 -1
+static int batch_next_due_ms(void) {
+    double now = now_sec();
+    int best = -1;
+    for (int c = CLASS_HIGH; c <= CLASS_LOW; c++) {
+        Batcher *b = &batchers[c];
+        if (b->n == 0 || b->max_wait <= 0) continue;
+        double left = b->first_ts + b->max_wait - now;
+        int ms = left > 0 ? (int)(left * 1000.0) + 1 : 0;
+        if (best < 0 || ms < best) best = ms;
+    }
+    return best;
+}
+
+static void note_queue_wait(const char *priority, double enqueue_ts, double orig_ts) {
+    if (orig_ts <= 0) return;
+    int c = strcmp(priority, "HIGH") == 0 ? CLASS_HIGH : CLASS_LOW;
+    double d = enqueue_ts - orig_ts;
+    wait_sum[c] += d;
+    if (d > wait_max[c]) wait_max[c] = d;
+    wait_n[c]++;
+}
+
+// 處理單個訊息（JSON 行）
+int process_message(MQTTClient client, const char *line, const char *priority, BatchLog *log) {
     if (!line || strlen(line) == 0) return 0;
     
     double enqueue_ts = now_sec();
     double start_forward_ts = now_sec();
     
-    printf("[%s] Processing %s priority message\n", 
-           priority, strcmp(priority, "HIGH") == 0 ? "HIGH" : "LOW");
+    msg_traced = trace_log_sample(&edge_log);
+    if (msg_traced) {
+        trace_log_printf(&edge_log, "[%s] Processing %s priority message\n",
+                         priority, strcmp(priority, "HIGH") == 0 ? "HIGH" : "LOW");
+    }
     
     // 解析 JSON
     struct json_object *jobj = json_tokener_parse(line);
@@ -124,62 +858,394 @@ int process_message(MQTTClient client, const char *line, const char *priority, F
         }
         
         // 增強 JSON（添加轉發器資訊）
-        json_object_object_add(jobj, "forwarder_ip", json_object_new_string("192.168.100.2"));
+        json_object_object_add(jobj, "forwarder_ip", json_object_new_string(FORWARDER_IP));
         json_object_object_add(jobj, "forward_timestamp", json_object_new_double(start_forward_ts));
         
         payload = json_object_to_json_string(jobj);
     } else {
-        printf("  -> WARNING: Invalid JSON, forwarding raw message\n");
+        TLOG(&edge_log, LOGLVL_WARN, "  -> WARNING: Invalid JSON, forwarding raw message\n");
     }
     
-    // 使用 Paho 發布訊息
-    MQTTClient_message pubmsg = MQTTClient_message_initializer;
-    pubmsg.payload = (char *)payload;
-    pubmsg.payloadlen = (int)strlen(payload);
-    pubmsg.qos = QOS;
-    pubmsg.retained = 0;
+    note_queue_wait(priority, enqueue_ts, orig_ts);
+    int cls = strcmp(priority, "HIGH") == 0 ? CLASS_HIGH : CLASS_LOW;
+    if (jobj && batchers[cls].max_records > 0) {
+        // 批次模式：只取欄位放入 envelope；無法解析的行仍逐筆原樣轉發
+        int ok = batch_add(client, cls, orig_ip, (uint64_t)packet_count, orig_ts, msg_priority,
+                           enqueue_ts, log);
+        json_object_put(jobj);
+        return ok;
+    }
+    int ok = publish_and_log(client, payload, (int)strlen(payload), orig_ip, (uint64_t)packet_count,
+                             orig_ts, msg_priority, priority, enqueue_ts, start_forward_ts, log);
     
-    MQTTClient_deliveryToken token;
-    int rc = MQTTClient_publishMessage(client, TOPIC, &pubmsg, &token);
-    double end_forward_ts = now_sec();
+    if (jobj) json_object_put(jobj);
+    return ok;
+}
+
+// 處理單個 FifoRecord（binary 模式）：欄位直接取用，payload 以 snprintf 組成，不經過 json-c
+int process_record(MQTTClient client, const FifoRecord *r, const char *priority, BatchLog *log) {
+    double enqueue_ts = now_sec();
+    double start_forward_ts = enqueue_ts;
+    const char *msg_priority = fifo_priority_name(r->priority);
     
-    const char *fwd_res = "FAILED";
-    if (rc == MQTTCLIENT_SUCCESS) {
-        fwd_res = "SUCCESS";
-        printf("  -> SUCCESS: Forwarded %s priority to main broker\n", priority);
+    msg_traced = trace_log_sample(&edge_log);
+    if (msg_traced) trace_log_printf(&edge_log, "[%s] Processing %s priority record\n", priority, priority);
+    
+    int cls = strcmp(priority, "HIGH") == 0 ? CLASS_HIGH : CLASS_LOW;
+    if (batchers[cls].max_records > 0) {
+        note_queue_wait(priority, enqueue_ts, r->timestamp);
+        return batch_add(client, cls, r->ip, r->count, r->timestamp, msg_priority, enqueue_ts, log);
+    }
+    
+    char payload[256];
+    int len = snprintf(payload, sizeof(payload),
+        "{\"ip\":\"%s\",\"count\":%llu,\"timestamp\":%.6f,\"priority\":\"%s\","
+        "\"forwarder_ip\":\"%s\",\"forward_timestamp\":%.6f}",
+        r->ip, (unsigned long long)r->count, r->timestamp, msg_priority, FORWARDER_IP, start_forward_ts);
+    if (len <= 0 || len >= (int)sizeof(payload)) return 0;
+    
+    note_queue_wait(priority, enqueue_ts, r->timestamp);
+    return publish_and_log(client, payload, len, r->ip, r->count, r->timestamp,
+                           msg_priority, priority, enqueue_ts, start_forward_ts, log);
+}
+
+// 取得下一筆 FifoRecord；緩衝用完時以一次 read() 批次補充。沒有資料時回傳 NULL
+static const FifoRecord *fifo_reader_next(FifoReader *rd) {
+    size_t have = rd->bytes / sizeof(FifoRecord);
+    if (rd->next >= have) {
+        // 保留不足一筆的殘餘位元組（正常情況下寫入是原子的，不會發生）
+        size_t rest = rd->bytes - have * sizeof(FifoRecord);
+        if (rest > 0) memmove(rd->recs, (char *)rd->recs + have * sizeof(FifoRecord), rest);
+        rd->bytes = rest;
+        rd->next = 0;
         
-        if (strcmp(priority, "HIGH") == 0) {
-            high_processed++;
-        } else {
-            low_processed++;
+        ssize_t n = read(rd->fd, (char *)rd->recs + rest, sizeof(rd->recs) - rest);
+        if (n <= 0) {
+            if (n < 0 && errno != EAGAIN && errno != EWOULDBLOCK && errno != EINTR) rd->errors++;
+            return NULL;
+        }
+        rd->reads++;
+        rd->bytes += (size_t)n;
+        if (rd->bytes < sizeof(FifoRecord)) return NULL;
+    }
+    
+    const FifoRecord *r = &rd->recs[rd->next++];
+    if (!fifo_record_valid(r)) {
+        // 失去對齊：丟棄緩衝內容，下次 read() 重新開始
+        rd->invalid++;
+        rd->bytes = 0;
+        rd->next = 0;
+        return NULL;
+    }
+    rd->records++;
+    return r;
+}
+
+// json 模式：從緩衝取出下一行（不含換行符）；緩衝中沒有完整的行時以一次 read() 補充
+static char *fifo_reader_next_line(FifoReader *rd) {
+    for (;;) {
+        char *start = rd->text + rd->next;
+        char *nl = memchr(start, '\n', rd->bytes - rd->next);
+        if (nl) {
+            *nl = '\0';
+            rd->next = (size_t)(nl - rd->text) + 1;
+            if (nl == start) continue;  // 空行
+            rd->records++;
+            return start;
         }
-    } else {
-        publish_failures++;
-        printf("  -> FAILED: Could not forward %s priority (code: %d)\n", priority, rc);
         
-        // 檢查連線狀態
-        if (!MQTTClient_isConnected(client)) {
-            printf("  -> Connection lost, will attempt reconnect\n");
+        // 把不完整的行移到緩衝開頭
+        size_t rest = rd->bytes - rd->next;
+        if (rest == sizeof(rd->text)) {
+            // 整個緩衝都沒有換行符：丟棄這一行
+            rd->invalid++;
+            rest = 0;
+        } else if (rest > 0 && rd->next > 0) {
+            memmove(rd->text, start, rest);
+        }
+        rd->bytes = rest;
+        rd->next = 0;
+        
+        ssize_t n = read(rd->fd, rd->text + rest, sizeof(rd->text) - rest);
+        if (n <= 0) {
+            if (n < 0 && errno != EAGAIN && errno != EWOULDBLOCK && errno != EINTR) rd->errors++;
+            return NULL;
         }
+        rd->reads++;
+        rd->bytes += (size_t)n;
+    }
+}
+
+// 查看隊首訊息但不取走；沒有資料時回傳 NULL
+static const char *fifo_reader_peek(FifoReader *rd) {
+    if (!rd->head) {
+        rd->head = fifo_binary ? (const char *)fifo_reader_next(rd) : fifo_reader_next_line(rd);
+    }
+    return rd->head;
+}
+
+// 隊首訊息的大小（drr 額度以位元組計）
+static size_t head_size(const FifoReader *rd) {
+    return fifo_binary ? sizeof(FifoRecord) : strlen(rd->head);
+}
+
+// 隊首訊息寫入 FIFO 的時間；json 行只取出 timestamp 欄位，不做完整解析
+static double head_timestamp(const FifoReader *rd) {
+    if (fifo_binary) return ((const FifoRecord *)rd->head)->timestamp;
+    const char *p = strstr(rd->head, "\"timestamp\":");
+    return p ? strtod(p + strlen("\"timestamp\":"), NULL) : 0.0;
+}
+
+static int sched_parse(const char *name, SchedKind *kind) {
+    if (strcmp(name, "strict") == 0) *kind = SCHED_STRICT;
+    else if (strcmp(name, "wrr") == 0) *kind = SCHED_WRR;
+    else if (strcmp(name, "drr") == 0) *kind = SCHED_DRR;
+    else if (strcmp(name, "aging") == 0) *kind = SCHED_AGING;
+    else return -1;
+    return 0;
+}
+
+static const char *sched_name(SchedKind kind) {
+    switch (kind) {
+        case SCHED_WRR:   return "wrr";
+        case SCHED_DRR:   return "drr";
+        case SCHED_AGING: return "aging";
+        default:          return "strict";
+    }
+}
+
+// 隊首訊息的來源 IP（多連線模式以此選擇連線，須與 process_message 取得的 ip 一致）
+static void head_ip(const FifoReader *rd, char *ip, size_t size) {
+    if (fifo_binary) {
+        binlog_copy_str(ip, size, ((const FifoRecord *)rd->head)->ip);
+        return;
+    }
+    binlog_copy_str(ip, size, "unknown");
+    const char *p = strstr(rd->head, "\"ip\":\"");
+    if (!p) return;
+    p += strlen("\"ip\":\"");
+    const char *end = strchr(p, '"');
+    if (end && (size_t)(end - p) < size) {
+        memcpy(ip, p, end - p);
+        ip[end - p] = '\0';
+    }
+}
+
+// 類別 c 有隊首訊息，且多連線模式下該訊息的目標連線佇列還有空位
+static int class_ready(FifoReader *rd[2], int c) {
+    if (!fifo_reader_peek(rd[c])) return 0;
+    if (connections == 0) return 1;
+    char ip[48];
+    head_ip(rd[c], ip, sizeof(ip));
+    return ring_has_room(&pool_target(c == CLASS_HIGH, ip)->queue);
+}
+
+// 選出下一則要處理的類別（CLASS_HIGH / CLASS_LOW）；沒有可處理的訊息時回傳 -1
+static int sched_pick(Scheduler *s, FifoReader *rd[2]) {
+    switch (s->kind) {
+    case SCHED_WRR:
+        // 目前類別還有則數且有資料就繼續，否則換另一類並重設其則數
+        for (int tries = 0; tries < 3; tries++) {
+            if (s->credit > 0 && class_ready(rd, s->cur)) {
+                s->credit--;
+                return s->cur;
+            }
+            s->cur ^= 1;
+            s->credit = s->weight[s->cur];
+        }
+        return -1;
+        
+    case SCHED_DRR:
+        if (!class_ready(rd, CLASS_HIGH) && !class_ready(rd, CLASS_LOW)) return -1;
+        // 每次造訪加一次額度；隊首放得進額度就處理，否則換另一類。空佇列的額度歸零
+        for (;;) {
+            int c = s->cur;
+            if (!class_ready(rd, c)) {
+                s->deficit[c] = 0;
+            } else {
+                if (!s->visited) {
+                    s->deficit[c] += s->quantum[c];
+                    s->visited = 1;
+                }
+                size_t size = head_size(rd[c]);
+                if (size <= s->deficit[c]) {
+                    s->deficit[c] -= size;
+                    return c;
+                }
+            }
+            s->visited = 0;
+            s->cur ^= 1;
+        }
+        
+    case SCHED_AGING: {
+        // LOW 隊首逾時時與 HIGH 交替，避免 LOW 積壓全部逾時後反過來壓住 HIGH
+        int low = class_ready(rd, CLASS_LOW);
+        int high = class_ready(rd, CLASS_HIGH);
+        if (low && !(high && s->last_aged)) {
+            double ts = head_timestamp(rd[CLASS_LOW]);
+            if (ts > 0 && now_sec() - ts >= s->max_low_wait) {
+                s->last_aged = 1;
+                s->aged++;
+                return CLASS_LOW;
+            }
+        }
+        s->last_aged = 0;
+        if (high) return CLASS_HIGH;
+        return low ? CLASS_LOW : -1;
     }
     
-    double forward_duration_ms = (end_forward_ts - start_forward_ts) * 1000.0;
-    
-    // 寫入 CSV
-    fprintf(csv, "%.6f,%.6f,%.6f,%s,%d,%.6f,%s,%.3f,%s\n",
-            enqueue_ts, start_forward_ts, end_forward_ts,
-            orig_ip, packet_count, orig_ts,
-            fwd_res, forward_duration_ms, msg_priority);
-    fflush(csv);
-    
-    printf("  -> Logged to CSV: Duration=%.3fms, Priority=%s\n", 
-           forward_duration_ms, msg_priority);
+    default:
+        if (class_ready(rd, CLASS_HIGH)) return CLASS_HIGH;
+        if (class_ready(rd, CLASS_LOW)) return CLASS_LOW;
+        return -1;
+    }
+}
+
+// 依排程從兩個 FIFO 取一則訊息並轉發；都沒有資料時回傳 0
+static int forward_next(MQTTClient client, FifoReader *rd[2], BatchLog *log) {
+    int c = sched_pick(&sched, rd);
+    if (c < 0) return 0;
     
-    if (jobj) json_object_put(jobj);
-    return (rc == MQTTCLIENT_SUCCESS) ? 1 : 0;
+    // 取走隊首；訊息內容在下一次 peek 補充緩衝之前都有效
+    const char *head = rd[c]->head;
+    rd[c]->head = NULL;
+    const char *priority = c == CLASS_HIGH ? "HIGH" : "LOW";
+    if (fifo_binary) {
+        process_record(client, (const FifoRecord *)head, priority, log);
+    } else {
+        process_message(client, head, priority, log);
+    }
+    return 1;
 }
 
-int main() {
+static double cpu_sec(void) {
+    struct rusage ru;
+    getrusage(RUSAGE_SELF, &ru);
+    return ru.ru_utime.tv_sec + ru.ru_utime.tv_usec / 1e6 + ru.ru_stime.tv_sec + ru.ru_stime.tv_usec / 1e6;
+}
+
+static void usage(const char *prog) {
+    fprintf(stderr,
+            "Usage: %s [options]\n"
+            "  --fifo-format json|binary  record format written by the plugin (default: json)\n"
+            "  --log-format csv|binary  forwarder log format (default: csv)\n"
+            "  --log-flush-ms N         flush the log buffer at least every N ms (default: 200)\n"
+            "  --window N               asynchronous publishing with up to N unacknowledged\n"
+            "                           messages (default: 0 = synchronous, max %d)\n"
+            "  --loop epoll|busy        wait for the FIFOs with epoll, or spin (default: epoll)\n"
+            "  --sched strict|wrr|drr|aging  HIGH/LOW scheduling discipline (default: strict)\n"
+            "  --weights H:L            wrr messages per round (default: 4:1)\n"
+            "  --quantum H:L            drr bytes per round (default: 1024:256)\n"
+            "  --max-low-wait-ms N      aging: LOW wait that triggers alternation (default: 100)\n"
+            "  --connections N          publish over N parallel connections (default: 0 = one, max %d)\n"
+            "  --high-connections K     connections reserved for HIGH (default: 1)\n"
+            "  --batch-high N[:MS]      pack up to N HIGH records (or MS ms) per envelope on %s\n"
+            "  --batch-low N[:MS]       same for LOW; MS 0 = publish when that class's FIFO is drained\n"
+            "  --log-level LEVEL        error|warn|info|debug|trace (default: info; trace = every message)\n"
+            "  --trace-sample N         trace 1 in N messages below level trace (default: 0 = off)\n"
+            "  --log-control PATH       re-read \"LEVEL [N]\" from PATH when it changes\n",
+            prog, MAX_WINDOW, MAX_CONNECTIONS, BATCH_TOPIC);
+}
+
+int main(int argc, char **argv) {
+    static const struct option long_opts[] = {
+        {"fifo-format",  required_argument, NULL, 'r'},
+        {"log-format",   required_argument, NULL, 'f'},
+        {"log-flush-ms", required_argument, NULL, 'F'},
+        {"window",       required_argument, NULL, 'w'},
+        {"loop",         required_argument, NULL, 'l'},
+        {"sched",        required_argument, NULL, 's'},
+        {"weights",      required_argument, NULL, 'W'},
+        {"quantum",      required_argument, NULL, 'Q'},
+        {"max-low-wait-ms", required_argument, NULL, 'A'},
+        {"connections",  required_argument, NULL, 'c'},
+        {"high-connections", required_argument, NULL, 'k'},
+        {"batch-high",   required_argument, NULL, 'B'},
+        {"batch-low",    required_argument, NULL, 'b'},
+        {"log-level",    required_argument, NULL, 'L'},
+        {"trace-sample", required_argument, NULL, 'T'},
+        {"log-control",  required_argument, NULL, 'C'},
+        {"help",         no_argument,       NULL, 'h'},
+        {NULL, 0, NULL, 0}
+    };
+    int opt;
+    int log_level = LOGLVL_INFO;
+    unsigned trace_sample = 0;
+    const char *log_control = NULL;
+    while ((opt = getopt_long(argc, argv, "h", long_opts, NULL)) != -1) {
+        switch (opt) {
+            case 'r': fifo_binary = strcmp(optarg, "binary") == 0; break;
+            case 'f': log_binary = strcmp(optarg, "binary") == 0; break;
+            case 'F': log_flush_interval = atof(optarg) / 1000.0; break;
+            case 'w': window = atoi(optarg); break;
+            case 'l': loop_busy = strcmp(optarg, "busy") == 0; break;
+            case 'L':
+                log_level = trace_log_parse_level(optarg, -1);
+                if (log_level < 0) {
+                    usage(argv[0]);
+                    return 1;
+                }
+                break;
+            case 'T': trace_sample = strtoul(optarg, NULL, 10); break;
+            case 'C': log_control = optarg; break;
+            case 's':
+                if (sched_parse(optarg, &sched.kind) != 0) {
+                    usage(argv[0]);
+                    return 1;
+                }
+                break;
+            case 'W':
+                if (sscanf(optarg, "%d:%d", &sched.weight[CLASS_HIGH], &sched.weight[CLASS_LOW]) != 2 ||
+                    sched.weight[CLASS_HIGH] < 1 || sched.weight[CLASS_LOW] < 1) {
+                    fprintf(stderr, "--weights expects H:L with both >= 1\n");
+                    return 1;
+                }
+                break;
+            case 'Q':
+                if (sscanf(optarg, "%zu:%zu", &sched.quantum[CLASS_HIGH], &sched.quantum[CLASS_LOW]) != 2 ||
+                    sched.quantum[CLASS_HIGH] < 1 || sched.quantum[CLASS_LOW] < 1) {
+                    fprintf(stderr, "--quantum expects H:L with both >= 1\n");
+                    return 1;
+                }
+                break;
+            case 'A': sched.max_low_wait = atof(optarg) / 1000.0; break;
+            case 'c': connections = atoi(optarg); break;
+            case 'k': high_connections = atoi(optarg); break;
+            case 'B':
+            case 'b':
+                if (batch_parse(optarg, &batchers[opt == 'B' ? CLASS_HIGH : CLASS_LOW]) != 0) {
+                    fprintf(stderr, "--batch-high/--batch-low expect N[:MS] with 1 <= N <= %d\n", BATCH_MAX);
+                    return 1;
+                }
+                break;
+            default:  usage(argv[0]); return opt == 'h' ? 0 : 1;
+        }
+    }
+    if (window < 0 || window > MAX_WINDOW) {
+        fprintf(stderr, "--window must be between 0 and %d\n", MAX_WINDOW);
+        return 1;
+    }
+    if (connections == 1) connections = 0;
+    if (connections < 0 || connections > MAX_CONNECTIONS ||
+        (connections > 0 && (high_connections < 1 || high_connections >= connections))) {
+        fprintf(stderr, "--connections must be between 2 and %d, with 1 <= --high-connections < N\n",
+                MAX_CONNECTIONS);
+        return 1;
+    }
+    if (connections > 0 && window > 0) {
+        fprintf(stderr, "--window and --connections cannot be combined\n");
+        return 1;
+    }
+    if (batch_init(&batchers[CLASS_HIGH]) != 0 || batch_init(&batchers[CLASS_LOW]) != 0) {
+        perror("batch");
+        return 1;
+    }
+    int batching = batchers[CLASS_HIGH].max_records > 0 || batchers[CLASS_LOW].max_records > 0;
+    if (batching && (connections > 0 || window > 0)) {
+        fprintf(stderr, "--batch-high/--batch-low only work with a single synchronous connection\n");
+        return 1;
+    }
+
     // 設定信號處理器
     signal(SIGINT, signal_handler);
     signal(SIGTERM, signal_handler);
@@ -199,26 +1265,33 @@ int main() {
     printf("Forwarder IP: %s\n", forwarder_ip);
     printf("Target: %s\n", MAIN_BROKER_HOST);
     
-    // 準備日誌目錄和 CSV 檔案
+    // 準備日誌目錄和日誌檔案
     system("mkdir -p /home/jason/mqtt-edge/logs");
-    FILE *csv = fopen(CSV_PATH, "w");
-    if (!csv) {
-        perror("fopen CSV");
+    const char *log_path = log_binary ? BIN_LOG_PATH : CSV_PATH;
+    BatchLog fwd_log;
+    if (batch_log_open(&fwd_log, log_path, BATCH_LOG_DEFAULT_BUFFER, log_flush_interval) != 0) {
+        perror("open log");
         return 1;
     }
-    fprintf(csv, "enqueue_ts,start_forward_ts,end_forward_ts,original_ip,packet_count,original_timestamp,forward_result,forward_duration_ms,priority\n");
-    fflush(csv);
-    printf("Created/Reset CSV file: %s\n", CSV_PATH);
+    if (log_binary) {
+        BinLogHeader hdr;
+        binlog_header_init(&hdr, "forwarder", sizeof(ForwarderLogRecord));
+        batch_log_write_header(&fwd_log, &hdr, sizeof(hdr));
+    } else {
+        batch_log_write_header(&fwd_log, CSV_HEADER, strlen(CSV_HEADER));
+    }
+    printf("Created/Reset log file: %s (%s, flush every %.0fms)\n",
+           log_path, log_binary ? "binary" : "csv", fwd_log.flush_interval * 1000.0);
     
     // 檢查 FIFO 檔案
     if (access(HIGH_FIFO_PATH, F_OK) != 0) {
         fprintf(stderr, "ERROR: HIGH FIFO not found: %s\n", HIGH_FIFO_PATH);
-        fclose(csv);
+        batch_log_close(&fwd_log);
         return 1;
     }
     if (access(LOW_FIFO_PATH, F_OK) != 0) {
         fprintf(stderr, "ERROR: LOW FIFO not found: %s\n", LOW_FIFO_PATH);
-        fclose(csv);
+        batch_log_close(&fwd_log);
         return 1;
     }
     
@@ -226,23 +1299,37 @@ int main() {
     printf("HIGH Priority: %s\n", HIGH_FIFO_PATH);
     printf("LOW Priority: %s\n", LOW_FIFO_PATH);
     
-    // 初始化 Paho MQTT
-    MQTTClient client;
-    MQTTClient_create(&client, MAIN_BROKER_HOST, CLIENT_ID,
-                      MQTTCLIENT_PERSISTENCE_NONE, NULL);
-    MQTTClient_setCallbacks(client, NULL, connection_lost, NULL, delivered);
-    
+    // 初始化 Paho MQTT（多連線模式下由 pool_start 建立各連線）
+    MQTTClient client = NULL;
     MQTTClient_connectOptions conn_opts = MQTTClient_connectOptions_initializer;
     conn_opts.keepAliveInterval = 20;
     conn_opts.cleansession = 1;
     conn_opts.connectTimeout = 10;
     
     printf("Connecting to broker...\n");
-    int connect_rc = MQTTClient_connect(client, &conn_opts);
-    if (connect_rc != MQTTCLIENT_SUCCESS) {
-        fprintf(stderr, "Failed to connect to broker (code: %d)\n", connect_rc);
-        fclose(csv);
-        return 1;
+    if (connections > 0) {
+        printf("Parallel publishing: %d connections (%d HIGH, %d LOW)\n",
+               connections, high_connections, connections - high_connections);
+        if (pool_start(&fwd_log) != 0) {
+            batch_log_close(&fwd_log);
+            return 1;
+        }
+    } else {
+        MQTTClient_create(&client, MAIN_BROKER_HOST, CLIENT_ID,
+                          MQTTCLIENT_PERSISTENCE_NONE, NULL);
+        MQTTClient_setCallbacks(client, &fwd_log, connection_lost, NULL, delivered);
+        if (window > 0) {
+            // reliable = 1 時 Paho 一次只允許一則在途訊息
+            conn_opts.reliable = 0;
+            conn_opts.maxInflightMessages = window;
+            printf("Asynchronous publishing, window=%d\n", window);
+        }
+        int connect_rc = MQTTClient_connect(client, &conn_opts);
+        if (connect_rc != MQTTCLIENT_SUCCESS) {
+            fprintf(stderr, "Failed to connect to broker (code: %d)\n", connect_rc);
+            batch_log_close(&fwd_log);
+            return 1;
+        }
     }
     printf("Connected to broker successfully\n");
     
@@ -253,124 +1340,242 @@ int main() {
     
     if (high_fd < 0 || low_fd < 0) {
         perror("open FIFO");
-        fclose(csv);
+        batch_log_close(&fwd_log);
         return 1;
     }
     
-    // 設為非阻塞模式用於 select
+    // 設為非阻塞模式，由 epoll 等待可讀
     int flags_high = fcntl(high_fd, F_GETFL);
     int flags_low = fcntl(low_fd, F_GETFL);
     fcntl(high_fd, F_SETFL, flags_high | O_NONBLOCK);
     fcntl(low_fd, F_SETFL, flags_low | O_NONBLOCK);
     
-    FILE *high_file = fdopen(high_fd, "r");
-    FILE *low_file = fdopen(low_fd, "r");
+    // 自己保留一個寫入端：插件關閉或重開 FIFO 時不會出現 EOF / EPOLLHUP，
+    // 否則 epoll 會不斷回報可讀而退化成忙碌迴圈
+    int high_keep_fd = open(HIGH_FIFO_PATH, O_WRONLY | O_NONBLOCK);
+    int low_keep_fd = open(LOW_FIFO_PATH, O_WRONLY | O_NONBLOCK);
     
-    if (!high_file || !low_file) {
-        perror("fdopen");
-        fclose(csv);
-        return 1;
+    // 兩種格式都直接對 fd 批次 read()
+    static FifoReader high_reader, low_reader;
+    high_reader.fd = high_fd;
+    low_reader.fd = low_fd;
+    
+    int epfd = -1;
+    if (!loop_busy) {
+        epfd = epoll_create1(0);
+        struct epoll_event ev = {0};
+        ev.events = EPOLLIN;
+        ev.data.fd = high_fd;
+        int rc_high = epfd >= 0 ? epoll_ctl(epfd, EPOLL_CTL_ADD, high_fd, &ev) : -1;
+        ev.data.fd = low_fd;
+        int rc_low = epfd >= 0 ? epoll_ctl(epfd, EPOLL_CTL_ADD, low_fd, &ev) : -1;
+        if (rc_high != 0 || rc_low != 0) {
+            perror("epoll");
+            batch_log_close(&fwd_log);
+            return 1;
+        }
     }
+    // 閒置時的 epoll 逾時：依日誌寫出間隔定期醒來寫出日誌、檢查連線
+    int wait_ms = (int)(fwd_log.flush_interval * 1000.0);
+    if (wait_ms < 1) wait_ms = 1;
     
-    printf("FIFO files opened successfully\n");
+    printf("FIFO files opened successfully (%s records, %s loop)\n",
+           fifo_binary ? "binary" : "json", loop_busy ? "busy" : "epoll");
+    printf("Scheduling: %s (weights %d:%d, quantum %zu:%zu, max LOW wait %.0fms)\n",
+           sched_name(sched.kind), sched.weight[CLASS_HIGH], sched.weight[CLASS_LOW],
+           sched.quantum[CLASS_HIGH], sched.quantum[CLASS_LOW], sched.max_low_wait * 1000.0);
+    for (int c = CLASS_HIGH; c <= CLASS_LOW; c++) {
+        if (batchers[c].max_records > 0) {
+            printf("%s batching: up to %d records or %.0fms per envelope on %s\n",
+                   c == CLASS_HIGH ? "HIGH" : "LOW", batchers[c].max_records,
+                   batchers[c].max_wait * 1000.0, BATCH_TOPIC);
+        }
+    }
+    FifoReader *readers[2] = { &high_reader, &low_reader };
+    sched.cur = CLASS_HIGH;
+    sched.credit = sched.weight[CLASS_HIGH];
     
+    if (trace_log_init(&edge_log, TRACE_LOG_DEFAULT_SLOTS, STDOUT_FILENO) != 0) {
+        fprintf(stderr, "Failed to allocate trace log\n");
+        return 1;
+    }
+    trace_log_set(&edge_log, log_level, trace_sample);
+    char trace_desc[48];
+    if (log_level >= LOGLVL_TRACE) snprintf(trace_desc, sizeof(trace_desc), "every message");
+    else if (trace_sample > 0) snprintf(trace_desc, sizeof(trace_desc), "1 in %u messages", trace_sample);
+    else snprintf(trace_desc, sizeof(trace_desc), "off");
+    printf("Log level: %s, per-message trace: %s%s%s\n", trace_log_level_name(log_level), trace_desc,
+           log_control ? ", control file: " : "", log_control ? log_control : "");
     printf("Starting priority processing loop...\n");
+    fflush(stdout);
+    if (trace_log_start(&edge_log, log_control) != 0) {
+        fprintf(stderr, "Failed to start trace log thread\n");
+        return 1;
+    }
     
-    char high_buf[BUF_SIZE];
-    char low_buf[BUF_SIZE];
     size_t total_messages = 0;
+    uint64_t wakeups = 0;
+    uint64_t idle_timeouts = 0;
+    double start_wall = now_sec();
+    double start_cpu = cpu_sec();
     
     // 主要處理迴圈
-    size_t debug_cycle = 0;
     while (running) {
-        int processed_this_cycle = 0;
-        debug_cycle++;
-        
-        // 首先檢查 HIGH priority FIFO
-        errno = 0;
-        if (fgets(high_buf, sizeof(high_buf), high_file)) {
-            // 移除換行符
-            size_t len = strlen(high_buf);
-            if (len > 0 && high_buf[len-1] == '\n') {
-                high_buf[len-1] = '\0';
+        // 依排程規則排空兩個 FIFO
+        // 非同步模式下視窗已滿時最多等 1ms 讓 PUBACK 釋出位置
+        int window_full = 0;
+        while (running) {
+            if (window > 0 && !inflight_wait_slot(0.001)) {
+                window_full = 1;
+                break;
             }
+            if (!forward_next(client, readers, &fwd_log)) break;
+            total_messages++;
+            if (batching) batch_flush_due(client, &fwd_log, readers);
             
-            if (strlen(high_buf) > 0) {
-                process_message(client, high_buf, "HIGH", csv);
-                total_messages++;
-                processed_this_cycle = 1;
-            }
-        } else {
-            // 偵錯：記錄 HIGH FIFO 讀取失敗
-            if (debug_cycle % 1000 == 0) {  // 每1000個週期記錄一次
-                if (errno != 0 && errno != EAGAIN && errno != EWOULDBLOCK) {
-                    printf("[DEBUG] HIGH FIFO read error: %s\n", strerror(errno));
-                }
+            // 定期顯示統計資訊
+            if (total_messages % 50 == 0) {
+                TLOG(&edge_log, LOGLVL_INFO, "Processed %zu total messages (HIGH: %zu, LOW: %zu, Failures: %d)\n",
+                     total_messages, high_processed, low_processed, publish_failures);
             }
+            if (publish_failures > 100) break;
         }
         
-        // 檢查 LOW priority FIFO（無論 HIGH 是否有資料都檢查）
-        errno = 0;
-        if (fgets(low_buf, sizeof(low_buf), low_file)) {
-            // 移除換行符
-            size_t len = strlen(low_buf);
-            if (len > 0 && low_buf[len-1] == '\n') {
-                low_buf[len-1] = '\0';
-            }
-            
-            if (strlen(low_buf) > 0) {
-                process_message(client, low_buf, "LOW", csv);
-                total_messages++;
-                processed_this_cycle = 1;
-            }
-        } else {
-            // 偵錯：記錄 LOW FIFO 讀取失敗
-            if (debug_cycle % 1000 == 0) {  // 每1000個週期記錄一次
-                if (errno != 0 && errno != EAGAIN && errno != EWOULDBLOCK) {
-                    printf("[DEBUG] LOW FIFO read error: %s\n", strerror(errno));
-                }
-            }
-        }
+        if (batching) batch_flush_due(client, &fwd_log, NULL);
         
-        // 檢查連線狀態和重連
-        if (!MQTTClient_isConnected(client)) {
-            printf("Connection lost, attempting to reconnect...\n");
+        pthread_mutex_lock(&log_mutex);
+        batch_log_maybe_flush(&fwd_log, 0);
+        pthread_mutex_unlock(&log_mutex);
+        
+        // 檢查連線狀態和重連（多連線模式下由各發布執行緒處理）
+        if (connections == 0 && !MQTTClient_isConnected(client)) {
+            TLOG(&edge_log, LOGLVL_WARN, "Connection lost, attempting to reconnect...\n");
+            if (window > 0) {
+                int lost = inflight_fail_all(&fwd_log);
+                if (lost > 0) TLOG(&edge_log, LOGLVL_WARN, "%d in-flight messages lost with the connection\n", lost);
+            }
             int reconnect_rc = MQTTClient_connect(client, &conn_opts);
             if (reconnect_rc == MQTTCLIENT_SUCCESS) {
-                printf("Reconnected successfully\n");
+                TLOG(&edge_log, LOGLVL_INFO, "Reconnected successfully\n");
             } else {
-                fprintf(stderr, "Reconnection failed (code: %d)\n", reconnect_rc);
+                TLOG(&edge_log, LOGLVL_ERROR, "Reconnection failed (code: %d)\n", reconnect_rc);
             }
         }
         
-        // 定期顯示統計資訊
-        if (total_messages % 50 == 0 && total_messages > 0) {
-            printf("Processed %zu total messages (HIGH: %zu, LOW: %zu, Failures: %d)\n",
-                   total_messages, high_processed, low_processed, publish_failures);
-        }
-        
-        // 如果這個週期沒有處理任何訊息，稍微暫停避免 CPU 忙碌等待
-        //if (!processed_this_cycle) {
-        //    usleep(1000); // 1ms（select 已經有超時，這裡可以更短）
-        //}
-        
         // 失敗保護
         if (publish_failures > 100) {
             fprintf(stderr, "Too many publish failures (%d), exiting\n", publish_failures);
             break;
         }
+        
+        // 緩衝中可能還有資料（視窗已滿），不能等 fd 可讀
+        if (window_full || loop_busy || !running) continue;
+        
+        // 多連線模式：隊首訊息的目標連線佇列已滿，等待任一連線取出訊息
+        if (connections > 0 && (high_reader.head || low_reader.head)) {
+            pool_wait_space(0.001);
+            continue;
+        }
+        
+        // 兩個 FIFO 都空了：睡到任一個可讀或逾時
+        // 有 envelope 在等待時，最晚在它到期時醒來發布
+        int timeout_ms = wait_ms;
+        int due_ms = batching ? batch_next_due_ms() : -1;
+        if (due_ms >= 0 && due_ms < timeout_ms) timeout_ms = due_ms;
+        
+        struct epoll_event events[2];
+        int nev = epoll_wait(epfd, events, 2, timeout_ms);
+        if (nev < 0 && errno != EINTR) {
+            perror("epoll_wait");
+            break;
+        }
+        wakeups++;
+        if (nev == 0) idle_timeouts++;
     }
     
     // 清理資源
     printf("Shutting down gracefully...\n");
+    if (window > 0) {
+        // 等待在途訊息確認後再斷線，逾時仍未確認者於斷線後記為 FAILED
+        double deadline = now_sec() + DRAIN_TIMEOUT_SEC;
+        while (now_sec() < deadline) {
+            pthread_mutex_lock(&inflight_mutex);
+            int pending = inflight_count;
+            pthread_mutex_unlock(&inflight_mutex);
+            if (pending == 0) break;
+            usleep(1000);
+        }
+    }
+    if (connections > 0) pool_stop(now_sec() - start_wall);
+    if (batching) {
+        batch_flush(client, CLASS_HIGH, &fwd_log);
+        batch_flush(client, CLASS_LOW, &fwd_log);
+    }
+    trace_log_stop(&edge_log);
+    printf("Trace log: lines=%llu in %llu writes, dropped=%llu, truncated=%llu\n",
+           (unsigned long long)edge_log.written, (unsigned long long)edge_log.writes,
+           (unsigned long long)edge_log.dropped, (unsigned long long)edge_log.truncated);
     printf("Final statistics: Total=%zu, HIGH=%zu, LOW=%zu, Failures=%d\n",
            total_messages, high_processed, low_processed, publish_failures);
     
-    fclose(high_file);
-    fclose(low_file);
-    MQTTClient_disconnect(client, 1000);
-    MQTTClient_destroy(&client);
-    fclose(csv);
+    double wall = now_sec() - start_wall;
+    double cpu = cpu_sec() - start_cpu;
+    printf("CPU: %.3fs over %.1fs wall, %.2f us CPU/message, %.1f messages/s\n",
+           cpu, wall, total_messages ? cpu / total_messages * 1e6 : 0.0,
+           wall > 0 ? total_messages / wall : 0.0);
+    printf("FIFO reads: HIGH %llu %s in %llu reads (%llu invalid, %llu errors), "
+           "LOW %llu %s in %llu reads (%llu invalid, %llu errors)\n",
+           (unsigned long long)high_reader.records, fifo_binary ? "records" : "lines",
+           (unsigned long long)high_reader.reads, (unsigned long long)high_reader.invalid,
+           (unsigned long long)high_reader.errors,
+           (unsigned long long)low_reader.records, fifo_binary ? "records" : "lines",
+           (unsigned long long)low_reader.reads, (unsigned long long)low_reader.invalid,
+           (unsigned long long)low_reader.errors);
+    if (!loop_busy) {
+        printf("Loop: %llu epoll wakeups (%llu idle timeouts of %dms)\n",
+               (unsigned long long)wakeups, (unsigned long long)idle_timeouts, wait_ms);
+    }
+    for (int c = CLASS_HIGH; c <= CLASS_LOW; c++) {
+        if (wait_n[c] == 0) continue;
+        printf("%s queue wait (FIFO write -> dequeue): mean %.3f ms, max %.3f ms over %llu messages\n",
+               c == CLASS_HIGH ? "HIGH" : "LOW", wait_sum[c] / wait_n[c] * 1e3, wait_max[c] * 1e3,
+               (unsigned long long)wait_n[c]);
+    }
+    for (int c = CLASS_HIGH; c <= CLASS_LOW; c++) {
+        Batcher *b = &batchers[c];
+        if (b->max_records == 0) continue;
+        printf("%s batching: %llu records in %llu envelopes (mean %.1f per envelope, %.1f envelopes/s)\n",
+               c == CLASS_HIGH ? "HIGH" : "LOW", (unsigned long long)b->records,
+               (unsigned long long)b->envelopes, b->envelopes ? (double)b->records / b->envelopes : 0.0,
+               wall > 0 ? b->envelopes / wall : 0.0);
+        free(b->body);
+        free(b->entries);
+    }
+    if (sched.kind == SCHED_AGING) {
+        printf("Aging: %llu LOW messages promoted after %.0fms\n",
+               (unsigned long long)sched.aged, sched.max_low_wait * 1000.0);
+    }
+    
+    if (epfd >= 0) close(epfd);
+    close(high_fd);
+    close(low_fd);
+    if (high_keep_fd >= 0) close(high_keep_fd);
+    if (low_keep_fd >= 0) close(low_keep_fd);
+    
+    if (client) {
+        MQTTClient_disconnect(client, 1000);
+        MQTTClient_destroy(&client);
+    }
+    if (window > 0) {
+        inflight_fail_all(&fwd_log);
+        printf("Async: window=%d, peak in-flight=%d, acked=%llu, lost=%llu\n",
+               window, inflight_peak, (unsigned long long)acked, (unsigned long long)ack_lost);
+    }
+    printf("Log: records=%llu, flushes=%llu, write_errors=%llu\n",
+           (unsigned long long)fwd_log.records, (unsigned long long)fwd_log.flushes,
+           (unsigned long long)fwd_log.write_errors);
+    batch_log_close(&fwd_log);
+    trace_log_destroy(&edge_log);
     
     printf("Shutdown complete\n");
     return 0;
@@ -1,11 +1,11 @@
 // time_delta_edge_plugin_dual_fifo.c
 // Mosquitto v5 plugin for Edge Broker with Three-Stage Pipeline:
 //  Stage 1: on_message -> receive_queue (minimal processing, record real recv_ts)
-//  Stage 2: processor_thread -> call policy API -> HIGH_FIFO or LOW_FIFO (based on action)
+//  Stage 2: processor workers (IP hash) -> call policy API -> HIGH_FIFO or LOW_FIFO (based on action)
 //  Stage 3: external forwarder reads respective FIFO and forwards to main broker
 //
 // Compile with:
-// gcc -Wall -fPIC -shared \
+// gcc -Wall -fPIC -shared -I../common \
 //   time_delta_edge_plugin_dual_fifo.c \
 //   -o time_delta_edge_plugin.so \
 //   $(pkg-config --cflags --libs libmosquitto libcurl json-c) \
@@ -23,50 +23,165 @@
 #include <curl/curl.h>
 #include <json-c/json.h>
 #include "uthash.h"
+#include "ring_buffer.h"
+#include "batch_log.h"
+#include "log_records.h"
+#include "fifo_record.h"
+#include "decision_shm.h"
+#include "ip_table.h"
+#include "trace_log.h"
 #include <mosquitto.h>
 #include <mosquitto_plugin.h>
 #include <mosquitto_broker.h>
 
 #define POLICY_URL   "http://192.168.254.191:5000/policy"
 #define LOG_PATH     "/home/jason/mqtt-edge/logs/edge_plugin.csv"
+#define BIN_LOG_PATH "/home/jason/mqtt-edge/logs/edge_plugin.bin"
+#define PLUGIN_CSV_HEADER "packet_count,recv_ts,service_start_ts,api_start_ts,api_end_ts,service_end_ts,ip,delta,p_value,trust,packet_count_dup,action,actual_api_time_ms,wait_time_ms,total_service_time_ms,worker_id,cache_hit\n"
 #define HIGH_FIFO_PATH "/home/jason/mqtt-edge/forwarder/high_priority_queue.fifo"
 #define LOW_FIFO_PATH  "/home/jason/mqtt-edge/forwarder/low_priority_queue.fifo"
-#define CLEANUP_INTERVAL 1000000
 #define PROCESS_DELAY_MICROSEC 10000
 #define COND_WAIT_TIMEOUT_MICROSEC 500000
 #define FIXED_SERVICE_TIME_MS 0.0
+#define MAX_WORKERS 16
+#define WORKER_STATS_INTERVAL_SEC 10.0
+#define DEFAULT_RECEIVE_QUEUE_SIZE 65536
+#define DEFAULT_CSV_QUEUE_SIZE     65536
+#define CSV_WRITER_BATCH           256
+#define CSV_WRITER_MIN_WAIT_US     1000   // log_flush_ms 0 時寫入執行緒仍以此間隔等待，不空轉
+#define DEFAULT_REFRESH_QUEUE_SIZE 65536
+#define DEFAULT_CACHE_MAX_ENTRIES  65536  // 每個 worker 的決策快取上限
+#define CACHE_EVICT_SCAN           32     // 快取滿時從最早加入的項目起最多檢查幾筆
+#define SHM_ATTACH_INTERVAL_SEC    1.0
+#define SHM_ORDER_POLL_MICROSEC    100    // 等待 server 處理完 ring 中回報時的輪詢間隔
+#define DEFAULT_IP_TABLE_SIZE      65536
+#define DEFAULT_IP_TABLE_STRIPES   64
 
-// per-IP state + packet_count
-struct ip_entry {
-    char      ip[64];
-    double    last_time;
-    uint64_t  packet_count;
-    UT_hash_handle hh;
-};
-static struct ip_entry *ip_table = NULL;
-static pthread_mutex_t   ip_table_mutex;
+// per-IP state + packet_count：固定容量、分段上鎖、以二進位位址為 key (common/ip_table.h)
+// 容量滿時淘汰最久未出現的 IP；plugin_opt_ip_ttl_sec > 0 時超過 TTL 未出現的 IP 視為新 IP
+static IpTable ip_table;
+static size_t  ip_table_size = DEFAULT_IP_TABLE_SIZE;
+static int     ip_table_stripes = DEFAULT_IP_TABLE_STRIPES;
+static double  ip_table_ttl = 0.0;
+
+// 日誌等級與抽樣追蹤 (common/trace_log.h)：熱路徑只寫入預先配置的 ring，由 sink 執行緒批次寫到 stdout
+// 每則訊息的 [MSG]/[receive]/[API]/[POLICY]/[FIFO] 行只在 log_level trace 或每 trace_sample 則抽一則時輸出
+static TraceLog edge_log;
+static int      log_level = LOGLVL_INFO;
+static uint32_t trace_sample = 0;
+static size_t   trace_ring_size = TRACE_LOG_DEFAULT_SLOTS;
+static char     log_control_path[256] = "";
 
-// 雙 FIFO 支援
+// 雙 FIFO 支援（多個 worker 共用，寫入與重新開啟以 fifo_mutex 保護）
 static int high_fifo_fd = -1;
 static int low_fifo_fd = -1;
+static pthread_mutex_t fifo_mutex;
+// plugin_opt_fifo_format binary：寫入固定大小的 FifoRecord (common/fifo_record.h) 取代 JSON 行
+static int fifo_binary = 0;
+
+// logging：由 CSV 寫入執行緒獨佔，依大小或時間批次寫出
+// plugin_opt_log_format binary 時改寫 edge_plugin.bin (common/log_records.h)
+static BatchLog plugin_log = { .fd = -1 };
+static int      log_binary = 0;
+static size_t   log_buffer_bytes = BATCH_LOG_DEFAULT_BUFFER;
+static double   log_flush_interval = BATCH_LOG_DEFAULT_INTERVAL;
+
+// ===== Decision cache：per-IP 決策快取 + 非同步更新 =====
+// plugin_opt_decision_cache on 時，信任度明確的 IP（trust >= cache_trust_high 的 high/low，
+// 或 trust <= cache_trust_low 的 drop）在 TTL 內直接使用快取的決策，worker 不必等待 API。
+// 該則訊息的 (ip, delta) 仍依序交給 worker 專屬的 refresher 執行緒送到 API，
+// 因此 API/pq.py 的 trust 狀態與未快取時完全相同；回應會立即更新快取（例如 trust 掉到門檻以下變成 drop）。
+// TTL 只限制 API 沒有回應時快取決策能沿用多久。
+typedef struct DecisionEntry {
+    char     ip[64];
+    char     action[16];
+    double   trust;
+    double   p_value;
+    double   expires_ts;     // 0 = 不可由快取提供
+    uint32_t pending;        // 已使用快取決策、尚未送到 API 的更新數
+    UT_hash_handle hh;
+} DecisionEntry;
+
+typedef struct RefreshJob {
+    char   ip[64];
+    double delta;
+} RefreshJob;
+
+static int    decision_cache_enabled = 0;
+static double cache_ttl_trusted = 1.0;    // 秒 (plugin_opt_cache_ttl_trusted_ms)
+static double cache_ttl_hostile = 5.0;    // 秒 (plugin_opt_cache_ttl_hostile_ms)
+static double cache_trust_high  = 0.95;
+static double cache_trust_low   = 0.05;
+static size_t refresh_queue_size = DEFAULT_REFRESH_QUEUE_SIZE;
+static size_t cache_max_entries = DEFAULT_CACHE_MAX_ENTRIES;
 
-// logging
-static FILE *log_file = NULL;
-static pthread_mutex_t log_mutex;
+// ===== Shared-memory decision table (plugin_opt_decision_source shm) =====
+// API/pq.py (POLICY_SHM=on) 把每個 IP 目前的 action/trust 發布到共享記憶體決策表 (common/decision_shm.h)，
+// worker 以 seqlock 無鎖讀取，不經任何 IPC 往返；每則訊息的 delta 經單向 delta ring 回報給 server 計分，
+// trust 與排名仍完全由 server 計算。表中還沒有的 IP（第一則訊息）、尚未連上或 heartbeat 逾時時
+// 改走原本的同步 HTTP 呼叫。
+static int             decision_source_shm = 0;
+static char            shm_table_path[128] = DECISION_SHM_TABLE_PATH;
+static char            shm_ring_path[128]  = DECISION_SHM_RING_PATH;
+static double          shm_stale_sec = 1.0;       // plugin_opt_shm_stale_ms
+static DecisionShm     shm_table;
+static DeltaRing       shm_ring;
+static int             shm_attached = 0;
+static double          shm_last_attach_ts = 0.0;
+static pthread_mutex_t shm_mutex;                 // delta ring 的唯一生產者 + attach
 
 // ===== Stage 1: Receive Queue (minimal data, fast enqueue) =====
+// 預先配置的有界環形佇列 (common/ring_buffer.h)，記憶體用量不隨實驗長度成長；
+// 佇列滿時依 plugin_opt_overflow 處理 (drop_newest / drop_oldest / block)
 typedef struct ReceiveNode {
     char                ip[64];
+    IpKey               key;            // on_message 已轉好的二進位位址
     double              recv_ts;        // 真正的接收時間
     uint64_t            packet_count;   // 在 on_message 中已計算好
-    struct ReceiveNode *next;
+    int                 traced;         // 此訊息是否輸出逐則追蹤
 } ReceiveNode;
 
-static ReceiveNode *receive_head = NULL;
-static ReceiveNode *receive_tail = NULL;
-static ReceiveNode *receive_current_pos = NULL;
-static pthread_mutex_t receive_mutex;
-static pthread_cond_t  receive_cond;
+// 每個處理 worker 擁有自己的接收佇列；同一 IP 永遠分到同一個 worker (IP hash)，
+// 因此 per-IP 的處理順序與 ip_table 的 delta 計算不受平行化影響。
+// worker 數量由 mosquitto.conf 的 plugin_opt_workers 設定（預設 1 = 原本的 M/G/1）。
+typedef struct ProcessorWorker {
+    int              id;
+    pthread_t        thread;
+    RingBuffer       receive_ring;
+    uint64_t         processed;
+    double           start_ts;
+    double           busy_sec;          // 累計服務時間 (service_start -> service_end)
+    double           window_start_ts;   // 目前統計視窗
+    double           window_busy_sec;
+    uint64_t         window_processed;
+    // decision cache：同一 IP 只由同一個 worker 處理，快取依 worker 分開，
+    // 只與該 worker 的 refresher 共用 cache_mutex
+    DecisionEntry   *cache;
+    pthread_mutex_t  cache_mutex;
+    pthread_cond_t   cache_cond;        // refresher 送完一則更新時通知
+    RingBuffer       refresh_ring;      // RING_BLOCK：API 更新不可遺漏
+    pthread_t        refresh_thread;
+    uint64_t         cache_hits;
+    uint64_t         cache_misses;
+    uint64_t         cache_evictions;   // 快取已滿而移除的項目
+    uint64_t         refreshes;         // 以下由 refresher 在 cache_mutex 下更新
+    uint64_t         refresh_failures;
+    uint64_t         refresh_changes;   // API 回應與已使用的快取決策不同
+    // plugin_opt_decision_source shm
+    uint64_t         shm_hits;
+    uint64_t         shm_misses;        // 表中沒有此 IP，改走 HTTP
+    uint64_t         shm_stale;         // 未連上或 server heartbeat 逾時，改走 HTTP
+    uint64_t         shm_contended;     // slot 持續寫入中，使用預設決策
+    uint64_t         shm_dropped;       // delta ring 已滿而遺失的回報
+    uint64_t         shm_order_waits;   // 改走 HTTP 前等待 server 處理完先前回報的次數
+    uint64_t         shm_order_timeouts;
+    uint64_t         shm_last_tail;     // 此 worker 最後一則回報之後的 ring 位置；0 = 沒有待處理的回報
+} ProcessorWorker;
+
+static ProcessorWorker workers[MAX_WORKERS];
+static int             worker_count = 1;
+static size_t          receive_queue_size = DEFAULT_RECEIVE_QUEUE_SIZE;
+static ring_overflow_t receive_overflow = RING_DROP_NEWEST;
 
 // ===== 批次 CSV 寫入機制 =====
 typedef struct CSVRecord {
@@ -84,29 +199,27 @@ typedef struct CSVRecord {
     double actual_api_time_ms;
     double wait_time_ms;
     double total_service_time_ms;
-    struct CSVRecord *next;
+    int worker_id;
+    int cache_hit;
 } CSVRecord;
 
-static CSVRecord *csv_queue_head = NULL;
-static CSVRecord *csv_queue_tail = NULL;
-static pthread_mutex_t csv_queue_mutex;
-static pthread_cond_t csv_queue_cond;
+// CSV 記錄同樣使用有界環形佇列；預設 block，讓日誌完整（寫入執行緒落後時 worker 會等待）
+static RingBuffer      csv_ring;
+static size_t          csv_queue_size = DEFAULT_CSV_QUEUE_SIZE;
+static ring_overflow_t csv_overflow = RING_BLOCK;
 static pthread_t csv_writer_thread;
-static int csv_writer_running = 0;
 
-// background thread for processing
-static pthread_t processor_thread;
+// background threads for processing
 static int       threads_running = 0;
-static int       process_counter = 0;
 
 // 快速入隊 CSV 記錄（不阻塞處理流程）
 static void enqueue_csv_record(uint64_t packet_count, double recv_ts, double service_start_ts,
                                double api_start_ts, double api_end_ts, double service_end_ts,
                                const char *ip, double delta, double p_value, double trust,
                                const char *action, double actual_api_time_ms, double wait_time_ms,
-                               double total_service_time_ms) {
-    CSVRecord *record = malloc(sizeof(*record));
-    if (!record) return;
+                               double total_service_time_ms, int worker_id, int cache_hit) {
+    CSVRecord rec;
+    CSVRecord *record = &rec;
     
     record->packet_count = packet_count;
     record->recv_ts = recv_ts;
@@ -124,80 +237,76 @@ static void enqueue_csv_record(uint64_t packet_count, double recv_ts, double ser
     record->actual_api_time_ms = actual_api_time_ms;
     record->wait_time_ms = wait_time_ms;
     record->total_service_time_ms = total_service_time_ms;
-    record->next = NULL;
+    record->worker_id = worker_id;
+    record->cache_hit = cache_hit;
     
-    pthread_mutex_lock(&csv_queue_mutex);
-    if (!csv_queue_tail) {
-        csv_queue_head = csv_queue_tail = record;
-    } else {
-        csv_queue_tail->next = record;
-        csv_queue_tail = record;
+    if (ring_push(&csv_ring, record) == RING_DROPPED) {
+        TLOG(&edge_log, LOGLVL_DEBUG, "[CSV] queue full, record dropped: ip=%s, packet_count=%llu\n",
+               ip, (unsigned long long)packet_count);
+    }
+}
+
+static void write_log_record(const CSVRecord *r) {
+    if (log_binary) {
+        PluginLogRecord b;
+        memset(&b, 0, sizeof(b));
+        b.packet_count = r->packet_count;
+        b.recv_ts = r->recv_ts;
+        b.service_start_ts = r->service_start_ts;
+        b.api_start_ts = r->api_start_ts;
+        b.api_end_ts = r->api_end_ts;
+        b.service_end_ts = r->service_end_ts;
+        b.delta = r->delta;
+        b.p_value = r->p_value;
+        b.trust = r->trust;
+        b.actual_api_time_ms = r->actual_api_time_ms;
+        b.wait_time_ms = r->wait_time_ms;
+        b.total_service_time_ms = r->total_service_time_ms;
+        b.worker_id = r->worker_id;
+        b.cache_hit = (uint8_t)r->cache_hit;
+        binlog_copy_str(b.action, sizeof(b.action), r->action);
+        binlog_copy_str(b.ip, sizeof(b.ip), r->ip);
+        batch_log_append(&plugin_log, &b, sizeof(b));
+        return;
     }
-    pthread_cond_signal(&csv_queue_cond);
-    pthread_mutex_unlock(&csv_queue_mutex);
+    batch_log_printf(&plugin_log,
+        "%llu,%.6f,%.6f,%.6f,%.6f,%.6f,%s,%.6f,%.4f,%.3f,%llu,%s,%.3f,%.3f,%.3f,%d,%d\n",
+        (unsigned long long)r->packet_count,
+        r->recv_ts,
+        r->service_start_ts,
+        r->api_start_ts,
+        r->api_end_ts,
+        r->service_end_ts,
+        r->ip,
+        r->delta,
+        r->p_value,
+        r->trust,
+        (unsigned long long)r->packet_count,
+        r->action,
+        r->actual_api_time_ms,
+        r->wait_time_ms,
+        r->total_service_time_ms,
+        r->worker_id,
+        r->cache_hit
+    );
 }
 
 // CSV 寫入執行緒（背景批次處理）
+// 一次取出最多 CSV_WRITER_BATCH 筆，寫入緩衝後依大小或時間寫出檔案；
+// 直到 csv_ring 關閉且清空才結束：worker 收尾時產生的記錄（以及 block 模式下
+// 等在 ring_push 的 worker）都會被寫出，cleanup 的 pthread_join 才能返回
 static void *csv_writer_thread_fn(void *arg) {
-    CSVRecord *current_pos = NULL;
+    static CSVRecord batch[CSV_WRITER_BATCH];
+    long wait_us = (long)(log_flush_interval * 1e6);
+    if (wait_us < CSV_WRITER_MIN_WAIT_US) wait_us = CSV_WRITER_MIN_WAIT_US;
     
-    while (csv_writer_running) {
-        pthread_mutex_lock(&csv_queue_mutex);
-        
-        int has_new_record = 0;
-        if (current_pos == NULL) {
-            current_pos = csv_queue_head;
-            has_new_record = (current_pos != NULL);
-        } else if (current_pos->next) {
-            current_pos = current_pos->next;
-            has_new_record = 1;
-        }
-        
-        if (has_new_record) {
-            CSVRecord record_data = *current_pos;
-            pthread_mutex_unlock(&csv_queue_mutex);
-            
-            pthread_mutex_lock(&log_mutex);
-            if (log_file) {
-                fprintf(log_file,
-                    "%llu,%.6f,%.6f,%.6f,%.6f,%.6f,%s,%.6f,%.4f,%.3f,%llu,%s,%.3f,%.3f,%.3f\n",
-                    record_data.packet_count,
-                    record_data.recv_ts,
-                    record_data.service_start_ts,
-                    record_data.api_start_ts,
-                    record_data.api_end_ts,
-                    record_data.service_end_ts,
-                    record_data.ip,
-                    record_data.delta,
-                    record_data.p_value,
-                    record_data.trust,
-                    record_data.packet_count,
-                    record_data.action,
-                    record_data.actual_api_time_ms,
-                    record_data.wait_time_ms,
-                    record_data.total_service_time_ms
-                );
-                fflush(log_file);
-            }
-            pthread_mutex_unlock(&log_mutex);
-            
-        } else {
-            struct timespec timeout;
-            struct timeval now;
-            gettimeofday(&now, NULL);
-            timeout.tv_sec = now.tv_sec;
-            timeout.tv_nsec = (now.tv_usec + 100000) * 1000;
-            if (timeout.tv_nsec >= 1000000000) {
-                timeout.tv_sec++;
-                timeout.tv_nsec -= 1000000000;
-            }
-            pthread_cond_timedwait(&csv_queue_cond, &csv_queue_mutex, &timeout);
-            pthread_mutex_unlock(&csv_queue_mutex);
-        }
-        
-        if (has_new_record) {
-            usleep(1000);
+    for (;;) {
+        size_t n = ring_pop_batch(&csv_ring, batch, CSV_WRITER_BATCH, wait_us);
+        for (size_t i = 0; i < n; i++) {
+            write_log_record(&batch[i]);
         }
+        batch_log_maybe_flush(&plugin_log, 0);
+        if (n == 0 && ring_is_drained(&csv_ring)) break;
     }
     return NULL;
 }
@@ -208,64 +317,117 @@ static double now_sec(){
     return tv.tv_sec + tv.tv_usec/1e6;
 }
 
-// curl write callback
+// FNV-1a，用於把 IP 固定分配到同一個 worker
+static uint32_t ip_hash(const char *ip) {
+    uint32_t h = 2166136261u;
+    for (const unsigned char *c = (const unsigned char *)ip; *c; c++) {
+        h ^= *c;
+        h *= 16777619u;
+    }
+    return h;
+}
+
+// ===== Policy API client：長連線 (HTTP keep-alive) + 預先建好的請求 =====
+// 每個處理執行緒持有一個 PolicyClient；CURL easy handle 在多次請求間重用，
+// libcurl 會保留與 policy server 的 TCP 連線，不需每則訊息重新握手。
+#define POLICY_REQUEST_FMT "{\"ip\":\"%s\",\"time_delta\":%.6f}"
+
+typedef struct PolicyClient {
+    CURL              *curl;
+    struct curl_slist *headers;
+    char               request[160];
+    char               response[512];
+    size_t             response_len;
+    uint64_t           requests;
+    uint64_t           failures;
+} PolicyClient;
+
+// curl write callback（寫入 PolicyClient 的固定大小緩衝區）
 static size_t curl_write_cb(char *ptr, size_t size, size_t nmemb, void *ud){
+    PolicyClient *pc = ud;
     size_t total_size = size * nmemb;
-    size_t current_len = strlen((char*)ud);
-    size_t remaining = 255 - current_len;
-    
-    if (total_size > remaining) {
-        total_size = remaining;
+    size_t remaining = sizeof(pc->response) - 1 - pc->response_len;
+    size_t copy = total_size < remaining ? total_size : remaining;
+
+    memcpy(pc->response + pc->response_len, ptr, copy);
+    pc->response_len += copy;
+    pc->response[pc->response_len] = '\0';
+    return total_size;  // 多餘的部分直接丟棄，不中斷傳輸
+}
+
+static int policy_client_init(PolicyClient *pc) {
+    memset(pc, 0, sizeof(*pc));
+    pc->curl = curl_easy_init();
+    if (!pc->curl) {
+        TLOG(&edge_log, LOGLVL_ERROR, "[API] Failed to initialize CURL\n");
+        return -1;
     }
-    
-    strncat((char*)ud, ptr, total_size);
-    return total_size;
+
+    pc->headers = curl_slist_append(NULL, "Content-Type: application/json");
+    pc->headers = curl_slist_append(pc->headers, "Connection: keep-alive");
+    pc->headers = curl_slist_append(pc->headers, "Expect:");
+
+    curl_easy_setopt(pc->curl, CURLOPT_URL,           POLICY_URL);
+    curl_easy_setopt(pc->curl, CURLOPT_HTTPHEADER,    pc->headers);
+    curl_easy_setopt(pc->curl, CURLOPT_POSTFIELDS,    pc->request);
+    curl_easy_setopt(pc->curl, CURLOPT_WRITEFUNCTION, curl_write_cb);
+    curl_easy_setopt(pc->curl, CURLOPT_WRITEDATA,     pc);
+    curl_easy_setopt(pc->curl, CURLOPT_TIMEOUT,       2L);
+    curl_easy_setopt(pc->curl, CURLOPT_NOSIGNAL,      1L);
+    curl_easy_setopt(pc->curl, CURLOPT_TCP_NODELAY,   1L);
+    curl_easy_setopt(pc->curl, CURLOPT_TCP_KEEPALIVE, 1L);
+    curl_easy_setopt(pc->curl, CURLOPT_FORBID_REUSE,  0L);
+    curl_easy_setopt(pc->curl, CURLOPT_MAXCONNECTS,   1L);
+    return 0;
+}
+
+static void policy_client_cleanup(PolicyClient *pc) {
+    if (pc->curl) curl_easy_cleanup(pc->curl);
+    if (pc->headers) curl_slist_free_all(pc->headers);
+    TLOG(&edge_log, LOGLVL_INFO, "[API] Policy client closed: requests=%llu, failures=%llu\n",
+           (unsigned long long)pc->requests, (unsigned long long)pc->failures);
+    pc->curl = NULL;
+    pc->headers = NULL;
 }
 
 // call policy API, return action, trust, p_value
-static int call_policy_api(const char *ip, double delta,
+static int call_policy_api(PolicyClient *pc, const char *ip, double delta,
                            char *out_action,
                            double *out_trust,
-                           double *out_pval)
+                           double *out_pval,
+                           int traced)
 {
-    printf("[API] Calling policy API for IP=%s, Delta=%.6f\n", ip, delta);
+    if (traced) trace_log_printf(&edge_log, "[API] Calling policy API for IP=%s, Delta=%.6f\n", ip, delta);
     
-    CURL *curl = curl_easy_init();
-    if(!curl) {
-        printf("[API] Failed to initialize CURL\n");
+    if (!pc->curl && policy_client_init(pc) != 0) {
+        return -1;
+    }
+
+    int body_len = snprintf(pc->request, sizeof(pc->request), POLICY_REQUEST_FMT, ip, delta);
+    if (body_len <= 0 || body_len >= (int)sizeof(pc->request)) {
+        TLOG(&edge_log, LOGLVL_WARN, "[API] Request too long for IP=%s\n", ip);
         return -1;
     }
     
-    json_object *jreq = json_object_new_object();
-    json_object_object_add(jreq,"ip",json_object_new_string(ip));
-    json_object_object_add(jreq,"time_delta",json_object_new_double(delta));
-    const char *body = json_object_to_json_string(jreq);
-    
-    printf("[API] Request: %s\n", body);
-
-    char response[256] = {0};
-    struct curl_slist *hdrs = curl_slist_append(NULL,"Content-Type: application/json");
-    curl_easy_setopt(curl, CURLOPT_URL,        POLICY_URL);
-    curl_easy_setopt(curl, CURLOPT_HTTPHEADER, hdrs);
-    curl_easy_setopt(curl, CURLOPT_POSTFIELDS, body);
-    curl_easy_setopt(curl, CURLOPT_WRITEFUNCTION, curl_write_cb);
-    curl_easy_setopt(curl, CURLOPT_WRITEDATA,     response);
-    curl_easy_setopt(curl, CURLOPT_TIMEOUT,    2);
-    CURLcode res = curl_easy_perform(curl);
-    curl_slist_free_all(hdrs);
-    curl_easy_cleanup(curl);
-    json_object_put(jreq);
+    if (traced) trace_log_printf(&edge_log, "[API] Request: %s\n", pc->request);
+
+    pc->response_len = 0;
+    pc->response[0] = '\0';
+    curl_easy_setopt(pc->curl, CURLOPT_POSTFIELDSIZE, (long)body_len);
+    CURLcode res = curl_easy_perform(pc->curl);
+    pc->requests++;
     
     if(res != CURLE_OK) {
-        printf("[API] Request failed: %s\n", curl_easy_strerror(res));
+        pc->failures++;
+        TLOG(&edge_log, LOGLVL_WARN, "[API] Request failed: %s\n", curl_easy_strerror(res));
         return -1;
     }
     
-    printf("[API] Response: %s\n", response);
+    if (traced) trace_log_printf(&edge_log, "[API] Response: %s\n", pc->response);
 
-    json_object *r = json_tokener_parse(response);
+    json_object *r = json_tokener_parse(pc->response);
     if(!r) {
-        printf("[API] Invalid JSON response\n");
+        TLOG(&edge_log, LOGLVL_WARN, "[API] Invalid JSON response\n");
         return -1;
     }
     
@@ -280,155 +442,466 @@ static int call_policy_api(const char *ip, double delta,
         *out_trust = json_object_get_double(jt);
         *out_pval  = json_object_get_double(jp);
         
-        // 可選：讀取 high_threshold (如果存在)
-        json_object *jht;
-        double high_threshold = 0.0;
-        if(json_object_object_get_ex(r,"high_threshold",&jht)) {
-            high_threshold = json_object_get_double(jht);
+        if (traced) {
+            // 可選：讀取 high_threshold (如果存在)
+            json_object *jht;
+            double high_threshold = 0.0;
+            if(json_object_object_get_ex(r,"high_threshold",&jht)) {
+                high_threshold = json_object_get_double(jht);
+            }
+            trace_log_printf(&edge_log, "[API] *** DECISION *** Action=%s, Trust=%.3f, P_value=%.6f, High_threshold=%.3f\n",
+                             action_str, *out_trust, *out_pval, high_threshold);
         }
         
-        printf("[API] *** DECISION *** Action=%s, Trust=%.3f, P_value=%.6f, High_threshold=%.3f\n", 
-               action_str, *out_trust, *out_pval, high_threshold);
-        
         json_object_put(r);
         return 0;
     }
     
-    printf("[API] No 'action' field in response\n");
+    TLOG(&edge_log, LOGLVL_WARN, "[API] No 'action' field in response\n");
     json_object_put(r);
     return -1;
 }
 
 // 根據 action 寫入對應的 FIFO，包含錯誤處理和重試
-static void write_to_fifo(const char *action, const char *ip, uint64_t count, double enqueue_ts) {
-    int target_fd = -1;
+static void write_to_fifo(const char *action, const char *ip, uint64_t count, double enqueue_ts, int traced) {
+    int *fd_slot = NULL;
     const char *fifo_type = "";
     const char *fifo_path = "";
     
     if (strcmp(action, "high") == 0) {
-        target_fd = high_fifo_fd;
+        fd_slot = &high_fifo_fd;
         fifo_type = "HIGH";
         fifo_path = HIGH_FIFO_PATH;
     } else if (strcmp(action, "low") == 0) {
-        target_fd = low_fifo_fd;
+        fd_slot = &low_fifo_fd;
         fifo_type = "LOW";
         fifo_path = LOW_FIFO_PATH;
     } else {
-        printf("[FIFO] Unknown action '%s', skipping FIFO write\n", action);
-        return;
-    }
-    
-    if (target_fd == -1) {
-        printf("[FIFO] %s FIFO not available, skipping write\n", fifo_type);
+        TLOG(&edge_log, LOGLVL_WARN, "[FIFO] Unknown action '%s', skipping FIFO write\n", action);
         return;
     }
     
     char buffer[256];
-    int len = snprintf(buffer, sizeof(buffer),
-        "{\"ip\":\"%s\",\"count\":%llu,\"timestamp\":%.6f,\"priority\":\"%s\"}\n",
-        ip, (unsigned long long)count, enqueue_ts, action);
+    int len;
+    if (fifo_binary) {
+        FifoRecord rec;
+        fifo_record_init(&rec, ip, count, enqueue_ts,
+                         fd_slot == &high_fifo_fd ? FIFO_PRIORITY_HIGH : FIFO_PRIORITY_LOW);
+        memcpy(buffer, &rec, sizeof(rec));
+        len = sizeof(rec);
+    } else {
+        len = snprintf(buffer, sizeof(buffer),
+            "{\"ip\":\"%s\",\"count\":%llu,\"timestamp\":%.6f,\"priority\":\"%s\"}\n",
+            ip, (unsigned long long)count, enqueue_ts, action);
+    }
     
     if (len > 0 && len < sizeof(buffer)) {
+        pthread_mutex_lock(&fifo_mutex);
+        int target_fd = *fd_slot;
+        if (target_fd == -1) {
+            pthread_mutex_unlock(&fifo_mutex);
+            TLOG(&edge_log, LOGLVL_DEBUG, "[FIFO] %s FIFO not available, skipping write\n", fifo_type);
+            return;
+        }
         ssize_t written = write(target_fd, buffer, len);
         if (written == len) {
-            printf("[FIFO] Written to %s FIFO: %s", fifo_type, buffer);
+            if (!traced) {
+                // 只追蹤抽樣到的訊息
+            } else if (fifo_binary) {
+                trace_log_printf(&edge_log, "[FIFO] Written to %s FIFO: binary record ip=%s count=%llu\n",
+                                 fifo_type, ip, (unsigned long long)count);
+            } else {
+                trace_log_printf(&edge_log, "[FIFO] Written to %s FIFO: %.*s", fifo_type, len, buffer);
+            }
         } else if (written < 0) {
             if (errno == EPIPE) {
-                printf("[FIFO] %s FIFO broken pipe - reader disconnected, attempting to reopen\n", fifo_type);
+                TLOG(&edge_log, LOGLVL_WARN, "[FIFO] %s FIFO broken pipe - reader disconnected, attempting to reopen\n", fifo_type);
                 // 嘗試重新開啟 FIFO
                 close(target_fd);
                 int new_fd = open(fifo_path, O_WRONLY | O_NONBLOCK);
                 if (new_fd != -1) {
-                    if (strcmp(action, "high") == 0) {
-                        high_fifo_fd = new_fd;
-                    } else {
-                        low_fifo_fd = new_fd;
-                    }
-                    printf("[FIFO] %s FIFO reopened successfully\n", fifo_type);
+                    *fd_slot = new_fd;
+                    TLOG(&edge_log, LOGLVL_INFO, "[FIFO] %s FIFO reopened successfully\n", fifo_type);
                 } else {
-                    printf("[FIFO] %s FIFO reopen failed: %s\n", fifo_type, strerror(errno));
-                    if (strcmp(action, "high") == 0) {
-                        high_fifo_fd = -1;
-                    } else {
-                        low_fifo_fd = -1;
-                    }
+                    TLOG(&edge_log, LOGLVL_WARN, "[FIFO] %s FIFO reopen failed: %s\n", fifo_type, strerror(errno));
+                    *fd_slot = -1;
                 }
             } else {
-                printf("[FIFO] %s FIFO write error: %s\n", fifo_type, strerror(errno));
+                TLOG(&edge_log, LOGLVL_WARN, "[FIFO] %s FIFO write error: %s\n", fifo_type, strerror(errno));
             }
         } else {
-            printf("[FIFO] %s FIFO partial write: %zd/%d bytes\n", fifo_type, written, len);
+            TLOG(&edge_log, LOGLVL_WARN, "[FIFO] %s FIFO partial write: %zd/%d bytes\n", fifo_type, written, len);
         }
+        pthread_mutex_unlock(&fifo_mutex);
     }
 }
 
-// cleanup old processed nodes
-static void cleanup_old_receive_nodes() {
-    if(!receive_head || !receive_current_pos) return;
-    
-    double now = now_sec();
-    ReceiveNode *prev = NULL;
-    ReceiveNode *curr = receive_head;
-    
-    while(curr && curr != receive_current_pos) {
-        if(now - curr->recv_ts > 300.0) {  // 5分鐘前的節點
-            if(prev) {
-                prev->next = curr->next;
-            } else {
-                receive_head = curr->next;
+// 依 trust 決定快取時間；信任度不明確的 IP 不快取，每則訊息仍同步詢問 API
+static double cache_ttl_for(const char *action, double trust) {
+    if (strcmp(action, "drop") == 0) {
+        return trust <= cache_trust_low ? cache_ttl_hostile : 0.0;
+    }
+    if (strcmp(action, "high") == 0 || strcmp(action, "low") == 0) {
+        return trust >= cache_trust_high ? cache_ttl_trusted : 0.0;
+    }
+    return 0.0;
+}
+
+// 以下 cache_* 函式呼叫時需持有 w->cache_mutex
+static void cache_store(DecisionEntry *d, const char *action, double trust, double p_val, double now) {
+    strncpy(d->action, action, sizeof(d->action)-1);
+    d->action[sizeof(d->action)-1] = '\0';
+    d->trust = trust;
+    d->p_value = p_val;
+    double ttl = cache_ttl_for(action, trust);
+    d->expires_ts = ttl > 0 ? now + ttl : 0.0;
+}
+
+// 移除一筆沒有待送更新的項目：在最早加入的 CACHE_EVICT_SCAN 筆中優先選已過期的，
+// 否則選其中最早的。有 pending 的項目保留，cache_lookup 未命中時要靠它等待更新送完
+static int cache_evict(ProcessorWorker *w, double now) {
+    DecisionEntry *d, *tmp, *victim = NULL;
+    int scanned = 0;
+    HASH_ITER(hh, w->cache, d, tmp) {
+        if (++scanned > CACHE_EVICT_SCAN) break;
+        if (d->pending > 0) continue;
+        if (d->expires_ts <= now) {
+            victim = d;
+            break;
+        }
+        if (!victim) victim = d;
+    }
+    if (!victim) return 0;
+    HASH_DEL(w->cache, victim);
+    free(victim);
+    w->cache_evictions++;
+    return 1;
+}
+
+// 不再可由快取提供、也沒有待送更新的項目直接移除，表中只留下有用的 IP
+static void cache_release(ProcessorWorker *w, DecisionEntry *d) {
+    if (d->expires_ts > 0 || d->pending > 0) return;
+    HASH_DEL(w->cache, d);
+    free(d);
+}
+
+static DecisionEntry *cache_entry(ProcessorWorker *w, const char *ip, double now) {
+    DecisionEntry *d = NULL;
+    HASH_FIND_STR(w->cache, ip, d);
+    if (!d) {
+        if (HASH_COUNT(w->cache) >= cache_max_entries && !cache_evict(w, now)) return NULL;
+        d = calloc(1, sizeof(*d));
+        if (!d) return NULL;
+        strncpy(d->ip, ip, sizeof(d->ip)-1);
+        HASH_ADD_STR(w->cache, ip, d);
+    }
+    return d;
+}
+
+// 命中時回傳 1 並填入快取的決策，這則訊息的 API 更新交給 refresher。
+// 未命中時先等 refresher 送完此 IP 尚未送出的更新，之後的同步呼叫才不會插隊，
+// API 收到的 delta 順序與未快取時相同。
+static int cache_lookup(ProcessorWorker *w, const char *ip, double delta, double now,
+                        char *out_action, double *out_trust, double *out_pval)
+{
+    pthread_mutex_lock(&w->cache_mutex);
+    DecisionEntry *d = NULL;
+    HASH_FIND_STR(w->cache, ip, d);
+    if (d && d->expires_ts > now) {
+        memcpy(out_action, d->action, sizeof(d->action));
+        *out_trust = d->trust;
+        *out_pval = d->p_value;
+        d->pending++;
+        pthread_mutex_unlock(&w->cache_mutex);
+
+        RefreshJob job;
+        memcpy(job.ip, d->ip, sizeof(job.ip));
+        job.delta = delta;
+        if (ring_push(&w->refresh_ring, &job) != RING_OK) {
+            TLOG(&edge_log, LOGLVL_WARN, "[CACHE] refresh queue closed, update lost: ip=%s\n", ip);
+            pthread_mutex_lock(&w->cache_mutex);
+            d->pending--;
+            pthread_cond_broadcast(&w->cache_cond);
+            pthread_mutex_unlock(&w->cache_mutex);
+        }
+        w->cache_hits++;
+        return 1;
+    }
+    while (d && d->pending > 0) {
+        pthread_cond_wait(&w->cache_cond, &w->cache_mutex);
+        HASH_FIND_STR(w->cache, ip, d);   // 等待期間 refresher 可能已移除此項目
+    }
+    pthread_mutex_unlock(&w->cache_mutex);
+    w->cache_misses++;
+    return 0;
+}
+
+// 同步呼叫 API 成功後更新快取（API 失敗時的預設決策不快取）；
+// 不可快取的決策（ttl 0）不新增項目，已有的項目改為不可用並在沒有待送更新時移除
+static void cache_update(ProcessorWorker *w, const char *ip, const char *action,
+                         double trust, double p_val, double now)
+{
+    pthread_mutex_lock(&w->cache_mutex);
+    DecisionEntry *d = NULL;
+    if (cache_ttl_for(action, trust) > 0) {
+        d = cache_entry(w, ip, now);
+        if (d) cache_store(d, action, trust, p_val, now);
+    } else {
+        HASH_FIND_STR(w->cache, ip, d);
+        if (d) {
+            cache_store(d, action, trust, p_val, now);
+            cache_release(w, d);
+        }
+    }
+    pthread_mutex_unlock(&w->cache_mutex);
+}
+
+// refresher：依序把快取命中的訊息送到 API，並以回應更新快取；
+// 有自己的 PolicyClient（獨立的 keep-alive 連線），不佔用 worker 的連線
+static void *refresh_thread_fn(void *arg) {
+    ProcessorWorker *w = arg;
+    PolicyClient policy_client;
+    policy_client_init(&policy_client);
+
+    for (;;) {
+        RefreshJob job;
+        if (!ring_pop(&w->refresh_ring, &job, COND_WAIT_TIMEOUT_MICROSEC)) {
+            if (ring_is_drained(&w->refresh_ring)) break;
+            continue;
+        }
+        char action[16] = {0};
+        double trust = 0, p_val = 0;
+        int ok = call_policy_api(&policy_client, job.ip, job.delta, action, &trust, &p_val, 0) == 0;
+        double now = now_sec();
+
+        pthread_mutex_lock(&w->cache_mutex);
+        DecisionEntry *d = NULL;
+        HASH_FIND_STR(w->cache, job.ip, d);
+        if (d) {
+            if (d->pending > 0) d->pending--;
+            if (ok) {
+                if (strcmp(d->action, action) != 0) {
+                    w->refresh_changes++;
+                    TLOG(&edge_log, LOGLVL_DEBUG, "[CACHE] Worker=%d, IP=%s decision changed %s -> %s (trust=%.3f)\n",
+                         w->id, job.ip, d->action, action, trust);
+                }
+                cache_store(d, action, trust, p_val, now);
             }
-            ReceiveNode *to_free = curr;
-            curr = curr->next;
-            free(to_free);
-            printf("[cleanup] cleaned up old receive node\n");
+            cache_release(w, d);
+        }
+        w->refreshes++;
+        if (!ok) w->refresh_failures++;
+        pthread_cond_broadcast(&w->cache_cond);
+        pthread_mutex_unlock(&w->cache_mutex);
+    }
+
+    policy_client_cleanup(&policy_client);
+    return NULL;
+}
+
+static void report_cache_stats(ProcessorWorker *w) {
+    uint64_t lookups = w->cache_hits + w->cache_misses;
+    RingStats rs;
+    ring_get_stats(&w->refresh_ring, &rs);
+    pthread_mutex_lock(&w->cache_mutex);
+    TLOG(&edge_log, LOGLVL_INFO, "[CACHE %d] hits=%llu, misses=%llu, hit_rate=%.1f%%, entries=%u/%zu, evictions=%llu, "
+           "refreshes=%llu, refresh_failures=%llu, decision_changes=%llu, refresh_queue=%zu/%zu (max %zu), blocked=%llu\n",
+           w->id, (unsigned long long)w->cache_hits, (unsigned long long)w->cache_misses,
+           lookups ? w->cache_hits * 100.0 / lookups : 0.0, HASH_COUNT(w->cache), cache_max_entries,
+           (unsigned long long)w->cache_evictions,
+           (unsigned long long)w->refreshes, (unsigned long long)w->refresh_failures,
+           (unsigned long long)w->refresh_changes, rs.depth, rs.capacity, rs.high_watermark,
+           (unsigned long long)rs.blocked);
+    pthread_mutex_unlock(&w->cache_mutex);
+}
+
+// 開啟 server 建立的決策表與 delta ring；server 晚於 broker 啟動時每秒重試一次
+static int shm_attach(double now) {
+    pthread_mutex_lock(&shm_mutex);
+    if (!shm_attached && now - shm_last_attach_ts >= SHM_ATTACH_INTERVAL_SEC) {
+        shm_last_attach_ts = now;
+        if (decision_shm_open(&shm_table, shm_table_path) == 0 &&
+            delta_ring_open(&shm_ring, shm_ring_path) == 0) {
+            TLOG(&edge_log, LOGLVL_INFO, "[SHM] Attached: table %s (%u slots, generation %llu), ring %s (%llu reports)\n",
+                   shm_table_path, shm_table.mask + 1, (unsigned long long)shm_table.hdr->generation,
+                   shm_ring_path, (unsigned long long)shm_ring.mask + 1);
+            __atomic_store_n(&shm_attached, 1, __ATOMIC_RELEASE);
         } else {
-            prev = curr;
-            curr = curr->next;
+            TLOG(&edge_log, LOGLVL_INFO, "[SHM] Decision table not available (%s / %s), using policy API\n",
+                   shm_table_path, shm_ring_path);
+            decision_shm_close(&shm_table);
+            delta_ring_close(&shm_ring);
+        }
+    }
+    pthread_mutex_unlock(&shm_mutex);
+    return __atomic_load_n(&shm_attached, __ATOMIC_ACQUIRE);
+}
+
+// 由決策表取得決策並回報 delta。回傳 0 時呼叫端改走同步 HTTP
+// 改走 HTTP 前，等 server 處理完此 worker 已經由 ring 送出的回報（server 處理完才移動 head）。
+// 同一 IP 只由同一個 worker 處理，因此 HTTP 帶的 delta 不會排到該 IP 較早的回報之前。
+// server 在 shm_stale_sec 內都沒有處理（已停止）時放棄等待，之後不再為這些回報等待
+static void shm_wait_reported(ProcessorWorker *w) {
+    if (w->shm_last_tail == 0) return;
+    uint64_t target = w->shm_last_tail;
+    w->shm_last_tail = 0;
+    if (__atomic_load_n(&shm_ring.hdr->head, __ATOMIC_ACQUIRE) >= target) return;
+
+    w->shm_order_waits++;
+    double deadline = now_sec() + shm_stale_sec;
+    while (__atomic_load_n(&shm_ring.hdr->head, __ATOMIC_ACQUIRE) < target) {
+        if (now_sec() > deadline) {
+            w->shm_order_timeouts++;
+            TLOG(&edge_log, LOGLVL_WARN, "[SHM] Worker=%d: server did not apply queued reports within %.0fms, "
+                 "HTTP fallback may be applied out of order\n", w->id, shm_stale_sec * 1000.0);
+            return;
+        }
+        usleep(SHM_ORDER_POLL_MICROSEC);
+    }
+}
+
+static int shm_decide(ProcessorWorker *w, const ReceiveNode *rn, double delta, double now,
+                      char *out_action, double *out_trust, double *out_pval)
+{
+    if (!__atomic_load_n(&shm_attached, __ATOMIC_ACQUIRE) && !shm_attach(now)) {
+        w->shm_stale++;
+        return 0;
+    }
+    if (now - decision_shm_heartbeat(&shm_table) > shm_stale_sec) {
+        w->shm_stale++;
+        shm_wait_reported(w);
+        return 0;
+    }
+
+    DecisionView v;
+    int found = decision_shm_lookup(&shm_table, rn->ip, &v);
+    if (found == 0 || (found == 1 && v.action == DECISION_NONE)) {
+        w->shm_misses++;
+        shm_wait_reported(w);
+        return 0;
+    }
+    if (found == 1) {
+        strcpy(out_action, decision_action_name(v.action));
+        *out_trust = v.trust;
+        *out_pval = v.p_value;
+        w->shm_hits++;
+    } else {
+        // IP 已在表中，delta 仍須經 ring 送出才不會與先前的回報亂序
+        TLOG(&edge_log, LOGLVL_DEBUG, "[SHM] Slot for IP=%s kept changing, using default: low\n", rn->ip);
+        strcpy(out_action, "low");
+        *out_trust = 1.0;
+        *out_pval = 0.0;
+        w->shm_contended++;
+    }
+
+    pthread_mutex_lock(&shm_mutex);
+    int pushed = delta_ring_push(&shm_ring, rn->ip, delta, rn->recv_ts, rn->packet_count);
+    if (pushed) w->shm_last_tail = shm_ring.hdr->tail;
+    pthread_mutex_unlock(&shm_mutex);
+    if (!pushed) {
+        // 遺失的 delta 不會計入 API 的 trust；第 1、2、4、8... 次記 WARN，總數見 [SHM] 統計
+        w->shm_dropped++;
+        if ((w->shm_dropped & (w->shm_dropped - 1)) == 0) {
+            TLOG(&edge_log, LOGLVL_WARN, "[SHM] Worker=%d: delta ring full, %llu report(s) dropped (ip=%s, packet_count=%llu)\n",
+                 w->id, (unsigned long long)w->shm_dropped, rn->ip, (unsigned long long)rn->packet_count);
         }
     }
+    return 1;
+}
+
+static void report_shm_stats(ProcessorWorker *w) {
+    uint64_t lookups = w->shm_hits + w->shm_misses + w->shm_stale + w->shm_contended;
+    uint64_t depth = 0, dropped = 0;
+    if (__atomic_load_n(&shm_attached, __ATOMIC_ACQUIRE)) {
+        depth = shm_ring.hdr->tail - __atomic_load_n(&shm_ring.hdr->head, __ATOMIC_ACQUIRE);
+        dropped = shm_ring.hdr->dropped;
+    }
+    TLOG(&edge_log, w->shm_dropped || w->shm_order_timeouts ? LOGLVL_WARN : LOGLVL_INFO,
+         "[SHM %d] hits=%llu (%.1f%%), misses=%llu, stale=%llu, contended=%llu, order_waits=%llu (timeouts=%llu), "
+           "delta_ring depth=%llu, dropped=%llu (this worker %llu)\n",
+           w->id, (unsigned long long)w->shm_hits, lookups ? w->shm_hits * 100.0 / lookups : 0.0,
+           (unsigned long long)w->shm_misses, (unsigned long long)w->shm_stale,
+           (unsigned long long)w->shm_contended, (unsigned long long)w->shm_order_waits,
+           (unsigned long long)w->shm_order_timeouts, (unsigned long long)depth, (unsigned long long)dropped,
+           (unsigned long long)w->shm_dropped);
+}
+
+static void report_ip_table_stats(void) {
+    IpTableStats st;
+    ip_table_get_stats(&ip_table, &st);
+    TLOG(&edge_log, LOGLVL_INFO, "[IPTABLE] entries=%zu/%zu, inserts=%llu, evictions=%llu, expirations=%llu, "
+           "lookups=%llu, contended=%llu (%.3f%%)\n",
+           st.entries, st.capacity, (unsigned long long)st.inserts, (unsigned long long)st.evictions,
+           (unsigned long long)st.expirations, (unsigned long long)st.lookups,
+           (unsigned long long)st.contended, st.lookups ? st.contended * 100.0 / st.lookups : 0.0);
 }
 
-// ===== Stage 2: Processor Thread (receive_queue -> policy API -> fixed service time -> dual FIFO) =====
+// worker 使用率：視窗內累計服務時間 / 視窗長度
+static void report_worker_stats(ProcessorWorker *w, double now, int final) {
+    double window = now - w->window_start_ts;
+    if (!final && window < WORKER_STATS_INTERVAL_SEC) return;
+
+    double util = window > 0 ? w->window_busy_sec / window * 100.0 : 0.0;
+    double total = now - w->start_ts;
+    double total_util = total > 0 ? w->busy_sec / total * 100.0 : 0.0;
+    RingStats rs;
+    ring_get_stats(&w->receive_ring, &rs);
+    TLOG(&edge_log, LOGLVL_INFO, "[WORKER %d] processed=%llu (+%llu), util=%.1f%% (window %.1fs), overall=%.1f%%, "
+           "queue=%zu/%zu (max %zu), dropped_newest=%llu, dropped_oldest=%llu, blocked=%llu\n",
+           w->id, (unsigned long long)w->processed, (unsigned long long)w->window_processed,
+           util, window, total_util, rs.depth, rs.capacity, rs.high_watermark,
+           (unsigned long long)rs.dropped_newest, (unsigned long long)rs.dropped_oldest,
+           (unsigned long long)rs.blocked);
+    if (decision_cache_enabled) report_cache_stats(w);
+    if (decision_source_shm) report_shm_stats(w);
+    if (w->id == 0 && !final) report_ip_table_stats();     // 結束時由 cleanup 輸出一次
+
+    w->window_start_ts = now;
+    w->window_busy_sec = 0.0;
+    w->window_processed = 0;
+}
+
+// ===== Stage 2: Processor Workers (receive_queue -> policy API -> fixed service time -> dual FIFO) =====
 static void *processor_thread_fn(void *arg) {
+    ProcessorWorker *w = arg;
+    PolicyClient policy_client;
+    policy_client_init(&policy_client);
+    w->start_ts = w->window_start_ts = now_sec();
+
     while(threads_running) {
-        pthread_mutex_lock(&receive_mutex);
+        ReceiveNode current_data;
         
-        int has_new_data = 0;
-        if (receive_current_pos == NULL) {
-            receive_current_pos = receive_head;
-            has_new_data = (receive_current_pos != NULL);
-        } else if (receive_current_pos->next) {
-            receive_current_pos = receive_current_pos->next;
-            has_new_data = 1;
-        }
-        
-        if (has_new_data) {
-            ReceiveNode current_data = *receive_current_pos;
-            pthread_mutex_unlock(&receive_mutex);
+        if (ring_pop(&w->receive_ring, &current_data, COND_WAIT_TIMEOUT_MICROSEC)) {
             
             // M/D/1 服務開始
             double service_start_ts = now_sec();
             
+            int traced = current_data.traced;
+
             // 計算 delta
             double delta = 0.0;
-            pthread_mutex_lock(&ip_table_mutex);
-            struct ip_entry *e = NULL;
-            HASH_FIND_STR(ip_table, current_data.ip, e);
-            if (e) {
-                delta = current_data.recv_ts - e->last_time;
-                e->last_time = current_data.recv_ts;
-            }
-            pthread_mutex_unlock(&ip_table_mutex);
+            ip_table_swap_time(&ip_table, &current_data.key, current_data.recv_ts, &delta);
             
-            // 調用 policy API
+            // 調用 policy API（啟用決策快取時，命中則直接使用快取決策，API 更新非同步送出）
             double api_start_ts = now_sec();
             char action[16] = {0};
             double trust = 0, p_val = 0;
-            if (call_policy_api(current_data.ip, delta, action, &trust, &p_val) != 0) {
-                printf("[API] Failed to get policy, using default: low\n");
+            int cache_hit = 0;
+            if (decision_source_shm) {
+                cache_hit = shm_decide(w, &current_data, delta, api_start_ts, action, &trust, &p_val);
+            } else if (decision_cache_enabled) {
+                cache_hit = cache_lookup(w, current_data.ip, delta, api_start_ts, action, &trust, &p_val);
+            }
+            if (cache_hit) {
+                if (traced) trace_log_printf(&edge_log, "[%s] hit: IP=%s, Action=%s, Trust=%.3f\n",
+                                             decision_source_shm ? "SHM" : "CACHE", current_data.ip, action, trust);
+            } else if (call_policy_api(&policy_client, current_data.ip, delta, action, &trust, &p_val, traced) != 0) {
+                TLOG(&edge_log, LOGLVL_WARN, "[API] Failed to get policy, using default: low\n");
                 strcpy(action, "low");
                 trust = 1.0;
                 p_val = 0.0;
+            } else if (decision_cache_enabled && !decision_source_shm) {
+                cache_update(w, current_data.ip, action, trust, p_val, now_sec());
             }
             double api_end_ts = now_sec();
             
@@ -448,50 +921,44 @@ static void *processor_thread_fn(void *arg) {
             double service_end_ts = now_sec();
             double actual_service_time_ms = (service_end_ts - service_start_ts) * 1000.0;
             
-            printf("[POLICY] *** SUMMARY *** IP=%s, Delta=%.6f, Action=%s, Service_Time=%.3fms\n", 
-                   current_data.ip, delta, action, actual_service_time_ms);
+            if (traced) {
+                trace_log_printf(&edge_log, "[POLICY] *** SUMMARY *** Worker=%d, IP=%s, Delta=%.6f, Action=%s, Service_Time=%.3fms\n",
+                                 w->id, current_data.ip, delta, action, actual_service_time_ms);
+            }
             
             // 根據 action 決定處理方式
             if (strcmp(action, "drop") == 0) {
-                printf("[DROP] *** MESSAGE DROPPED *** IP=%s will not be forwarded\n", current_data.ip);
+                if (traced) trace_log_printf(&edge_log, "[DROP] *** MESSAGE DROPPED *** IP=%s will not be forwarded\n", current_data.ip);
             } else if (strcmp(action, "high") == 0) {
-                printf("[HIGH] *** HIGH PRIORITY *** IP=%s -> HIGH FIFO\n", current_data.ip);
-                write_to_fifo(action, current_data.ip, current_data.packet_count, service_end_ts);
+                if (traced) trace_log_printf(&edge_log, "[HIGH] *** HIGH PRIORITY *** IP=%s -> HIGH FIFO\n", current_data.ip);
+                write_to_fifo(action, current_data.ip, current_data.packet_count, service_end_ts, traced);
             } else if (strcmp(action, "low") == 0) {
-                printf("[LOW] *** LOW PRIORITY *** IP=%s -> LOW FIFO\n", current_data.ip);
-                write_to_fifo(action, current_data.ip, current_data.packet_count, service_end_ts);
+                if (traced) trace_log_printf(&edge_log, "[LOW] *** LOW PRIORITY *** IP=%s -> LOW FIFO\n", current_data.ip);
+                write_to_fifo(action, current_data.ip, current_data.packet_count, service_end_ts, traced);
             } else {
-                printf("[UNKNOWN] *** UNKNOWN ACTION '%s' *** IP=%s, treating as LOW priority\n", 
-                       action, current_data.ip);
-                write_to_fifo("low", current_data.ip, current_data.packet_count, service_end_ts);
+                TLOG(&edge_log, LOGLVL_WARN, "[UNKNOWN] *** UNKNOWN ACTION '%s' *** IP=%s, treating as LOW priority\n",
+                     action, current_data.ip);
+                write_to_fifo("low", current_data.ip, current_data.packet_count, service_end_ts, traced);
             }
             
             // 記錄到主要 CSV 日誌
             enqueue_csv_record(current_data.packet_count, current_data.recv_ts, service_start_ts,
                               api_start_ts, api_end_ts, service_end_ts, current_data.ip, delta,
-                              p_val, trust, action, actual_api_time_ms, wait_time_ms, actual_service_time_ms);
-            
-            // 定期清理
-            if (++process_counter % CLEANUP_INTERVAL == 0) {
-                pthread_mutex_lock(&receive_mutex);
-                cleanup_old_receive_nodes();
-                pthread_mutex_unlock(&receive_mutex);
-            }
+                              p_val, trust, action, actual_api_time_ms, wait_time_ms, actual_service_time_ms,
+                              w->id, cache_hit);
             
+            w->processed++;
+            w->window_processed++;
+            w->busy_sec += service_end_ts - service_start_ts;
+            w->window_busy_sec += service_end_ts - service_start_ts;
+            report_worker_stats(w, service_end_ts, 0);
         } else {
-            struct timespec timeout;
-            struct timeval now;
-            gettimeofday(&now, NULL);
-            timeout.tv_sec = now.tv_sec;
-            timeout.tv_nsec = (now.tv_usec + COND_WAIT_TIMEOUT_MICROSEC) * 1000;
-            if (timeout.tv_nsec >= 1000000000) {
-                timeout.tv_sec++;
-                timeout.tv_nsec -= 1000000000;
-            }
-            pthread_cond_timedwait(&receive_cond, &receive_mutex, &timeout);
-            pthread_mutex_unlock(&receive_mutex);
+            report_worker_stats(w, now_sec(), 0);
         }
     }
+
+    report_worker_stats(w, now_sec(), 1);
+    policy_client_cleanup(&policy_client);
     return NULL;
 }
 
@@ -504,50 +971,40 @@ static int on_message_callback(int event, void *event_data, void *userdata){
     const char *ip = mosquitto_client_address(msg->client);
     if (!ip) return MOSQ_ERR_INVAL;
 
-    printf("[MSG] Received from %s: %.*s\n", 
-           ip, msg->payloadlen, (char*)msg->payload);
-
-    // 快速更新 IP 表並獲取 packet_count
-    pthread_mutex_lock(&ip_table_mutex);
-    struct ip_entry *e = NULL;
-    HASH_FIND_STR(ip_table, ip, e);
-    if (!e) {
-        e = calloc(1, sizeof(*e));
-        if (!e) {
-            pthread_mutex_unlock(&ip_table_mutex);
-            return MOSQ_ERR_NOMEM;
-        }
-        strncpy(e->ip, ip, sizeof(e->ip)-1);
-        e->last_time = recv_ts;
-        e->packet_count = 0;
-        HASH_ADD_STR(ip_table, ip, e);
-    }
-    e->packet_count++;
-    uint64_t seq = e->packet_count;
-    pthread_mutex_unlock(&ip_table_mutex);
-
-    // 立即入隊到接收隊列
-    ReceiveNode *rn = malloc(sizeof(*rn));
-    if (!rn) return MOSQ_ERR_NOMEM;
+    // 是否追蹤此訊息在此決定一次，worker 依 ReceiveNode.traced 輸出後續各行
+    int traced = trace_log_sample(&edge_log);
+    if (traced) {
+        trace_log_printf(&edge_log, "[MSG] Received from %s: %.*s\n",
+                         ip, msg->payloadlen, (char*)msg->payload);
+    }
+
+    // 快速更新 IP 表並獲取 packet_count（只鎖住此 IP 所屬的 stripe）
+    IpKey key;
+    ip_key_from_str(&key, ip);
+    uint64_t seq = ip_table_count(&ip_table, &key, recv_ts);
+
+    // 立即入隊到該 IP 所屬 worker 的接收隊列
+    ProcessorWorker *w = &workers[ip_hash(ip) % worker_count];
+    ReceiveNode rn;
     
-    strncpy(rn->ip, ip, sizeof(rn->ip)-1);
-    rn->ip[sizeof(rn->ip)-1] = '\0';
-    rn->recv_ts = recv_ts;
-    rn->packet_count = seq;
-    rn->next = NULL;
+    strncpy(rn.ip, ip, sizeof(rn.ip)-1);
+    rn.ip[sizeof(rn.ip)-1] = '\0';
+    rn.key = key;
+    rn.recv_ts = recv_ts;
+    rn.packet_count = seq;
+    rn.traced = traced;
     
-    pthread_mutex_lock(&receive_mutex);
-    if (!receive_tail) {
-        receive_head = receive_tail = rn;
-    } else {
-        receive_tail->next = rn;
-        receive_tail = rn;
+    int pushed = ring_push(&w->receive_ring, &rn);
+    if (pushed == RING_DROPPED || pushed == RING_CLOSED) {
+        TLOG(&edge_log, LOGLVL_DEBUG, "[receive] queue full, dropped: ip=%s, packet_count=%llu, worker=%d\n",
+             ip, (unsigned long long)seq, w->id);
+        return MOSQ_ERR_ACL_DENIED;
     }
-    pthread_cond_signal(&receive_cond);
-    pthread_mutex_unlock(&receive_mutex);
 
-    printf("[receive] enqueued: ip=%s, packet_count=%llu, recv_ts=%.6f\n",
-           ip, (unsigned long long)seq, recv_ts);
+    if (traced) {
+        trace_log_printf(&edge_log, "[receive] enqueued: ip=%s, packet_count=%llu, recv_ts=%.6f, worker=%d\n",
+                         ip, (unsigned long long)seq, recv_ts, w->id);
+    }
 
     return MOSQ_ERR_ACL_DENIED;
 }
@@ -566,12 +1023,138 @@ int mosquitto_plugin_init(mosquitto_plugin_id_t *identifier,
 {
     printf("[PLUGIN] Initializing three-stage DUAL FIFO plugin...\n");
     
-    pthread_mutex_init(&ip_table_mutex, NULL);
-    pthread_mutex_init(&log_mutex,     NULL);
-    pthread_mutex_init(&receive_mutex, NULL);
-    pthread_mutex_init(&csv_queue_mutex, NULL);
-    pthread_cond_init(&receive_cond,   NULL);
-    pthread_cond_init(&csv_queue_cond, NULL);
+    // plugin_opt_*：worker 數量、佇列大小與溢出策略
+    for (int i = 0; i < option_count; i++) {
+        if (strcmp(options[i].key, "workers") == 0) {
+            worker_count = atoi(options[i].value);
+        } else if (strcmp(options[i].key, "queue_size") == 0) {
+            receive_queue_size = strtoul(options[i].value, NULL, 10);
+        } else if (strcmp(options[i].key, "overflow") == 0) {
+            receive_overflow = ring_overflow_parse(options[i].value, receive_overflow);
+        } else if (strcmp(options[i].key, "csv_queue_size") == 0) {
+            csv_queue_size = strtoul(options[i].value, NULL, 10);
+        } else if (strcmp(options[i].key, "csv_overflow") == 0) {
+            csv_overflow = ring_overflow_parse(options[i].value, csv_overflow);
+        } else if (strcmp(options[i].key, "fifo_format") == 0) {
+            fifo_binary = strcmp(options[i].value, "binary") == 0;
+        } else if (strcmp(options[i].key, "log_format") == 0) {
+            log_binary = strcmp(options[i].value, "binary") == 0;
+        } else if (strcmp(options[i].key, "log_flush_ms") == 0) {
+            log_flush_interval = atof(options[i].value) / 1000.0;
+        } else if (strcmp(options[i].key, "log_buffer_kb") == 0) {
+            log_buffer_bytes = strtoul(options[i].value, NULL, 10) * 1024;
+        } else if (strcmp(options[i].key, "decision_cache") == 0) {
+            decision_cache_enabled = strcmp(options[i].value, "on") == 0;
+        } else if (strcmp(options[i].key, "cache_ttl_trusted_ms") == 0) {
+            cache_ttl_trusted = atof(options[i].value) / 1000.0;
+        } else if (strcmp(options[i].key, "cache_ttl_hostile_ms") == 0) {
+            cache_ttl_hostile = atof(options[i].value) / 1000.0;
+        } else if (strcmp(options[i].key, "cache_trust_high") == 0) {
+            cache_trust_high = atof(options[i].value);
+        } else if (strcmp(options[i].key, "cache_trust_low") == 0) {
+            cache_trust_low = atof(options[i].value);
+        } else if (strcmp(options[i].key, "refresh_queue_size") == 0) {
+            refresh_queue_size = strtoul(options[i].value, NULL, 10);
+        } else if (strcmp(options[i].key, "cache_max_entries") == 0) {
+            cache_max_entries = strtoul(options[i].value, NULL, 10);
+        } else if (strcmp(options[i].key, "decision_source") == 0) {
+            decision_source_shm = strcmp(options[i].value, "shm") == 0;
+        } else if (strcmp(options[i].key, "shm_table") == 0) {
+            snprintf(shm_table_path, sizeof(shm_table_path), "%s", options[i].value);
+        } else if (strcmp(options[i].key, "shm_ring") == 0) {
+            snprintf(shm_ring_path, sizeof(shm_ring_path), "%s", options[i].value);
+        } else if (strcmp(options[i].key, "shm_stale_ms") == 0) {
+            shm_stale_sec = atof(options[i].value) / 1000.0;
+        } else if (strcmp(options[i].key, "ip_table_size") == 0) {
+            ip_table_size = strtoul(options[i].value, NULL, 10);
+        } else if (strcmp(options[i].key, "ip_table_stripes") == 0) {
+            ip_table_stripes = atoi(options[i].value);
+        } else if (strcmp(options[i].key, "ip_ttl_sec") == 0) {
+            ip_table_ttl = atof(options[i].value);
+        } else if (strcmp(options[i].key, "log_level") == 0) {
+            log_level = trace_log_parse_level(options[i].value, log_level);
+        } else if (strcmp(options[i].key, "trace_sample") == 0) {
+            trace_sample = strtoul(options[i].value, NULL, 10);
+        } else if (strcmp(options[i].key, "trace_ring_size") == 0) {
+            trace_ring_size = strtoul(options[i].value, NULL, 10);
+        } else if (strcmp(options[i].key, "log_control") == 0) {
+            snprintf(log_control_path, sizeof(log_control_path), "%s", options[i].value);
+        }
+    }
+    if (worker_count < 1) worker_count = 1;
+    if (worker_count > MAX_WORKERS) worker_count = MAX_WORKERS;
+    if (receive_queue_size < 1) receive_queue_size = DEFAULT_RECEIVE_QUEUE_SIZE;
+    if (csv_queue_size < 1) csv_queue_size = DEFAULT_CSV_QUEUE_SIZE;
+    if (refresh_queue_size < 1) refresh_queue_size = DEFAULT_REFRESH_QUEUE_SIZE;
+    if (cache_max_entries < 1) cache_max_entries = DEFAULT_CACHE_MAX_ENTRIES;
+    if (ip_table_size < 1) ip_table_size = DEFAULT_IP_TABLE_SIZE;
+    if (ip_table_stripes < 1) ip_table_stripes = DEFAULT_IP_TABLE_STRIPES;
+    if (decision_source_shm && decision_cache_enabled) {
+        printf("[PLUGIN] decision_source shm: decision cache disabled\n");
+        decision_cache_enabled = 0;
+    }
+    
+    if (trace_log_init(&edge_log, trace_ring_size, STDOUT_FILENO) != 0) {
+        printf("[PLUGIN] Error: Failed to allocate trace log\n");
+        return MOSQ_ERR_NOMEM;
+    }
+    trace_log_set(&edge_log, log_level, trace_sample);
+    if (ip_table_init(&ip_table, ip_table_size, ip_table_stripes, ip_table_ttl) != 0) {
+        printf("[PLUGIN] Error: Failed to allocate IP table\n");
+        return MOSQ_ERR_NOMEM;
+    }
+    pthread_mutex_init(&fifo_mutex,    NULL);
+    pthread_mutex_init(&shm_mutex,     NULL);
+    if (ring_init(&csv_ring, csv_queue_size, sizeof(CSVRecord), csv_overflow) != 0) {
+        printf("[PLUGIN] Error: Failed to allocate CSV queue\n");
+        return MOSQ_ERR_NOMEM;
+    }
+    for (int i = 0; i < worker_count; i++) {
+        memset(&workers[i], 0, sizeof(workers[i]));
+        workers[i].id = i;
+        if (ring_init(&workers[i].receive_ring, receive_queue_size, sizeof(ReceiveNode), receive_overflow) != 0) {
+            printf("[PLUGIN] Error: Failed to allocate receive queue for worker %d\n", i);
+            return MOSQ_ERR_NOMEM;
+        }
+        if (decision_cache_enabled) {
+            pthread_mutex_init(&workers[i].cache_mutex, NULL);
+            pthread_cond_init(&workers[i].cache_cond, NULL);
+            if (ring_init(&workers[i].refresh_ring, refresh_queue_size, sizeof(RefreshJob), RING_BLOCK) != 0) {
+                printf("[PLUGIN] Error: Failed to allocate refresh queue for worker %d\n", i);
+                return MOSQ_ERR_NOMEM;
+            }
+        }
+    }
+    if (ip_table_ttl > 0) {
+        printf("[PLUGIN] IP table: %zu entries in %u stripes, TTL %.1f s\n",
+               ip_table.capacity, ip_table.stripe_mask + 1, ip_table_ttl);
+    } else {
+        printf("[PLUGIN] IP table: %zu entries in %u stripes, TTL off\n",
+               ip_table.capacity, ip_table.stripe_mask + 1);
+    }
+    char trace_desc[48];
+    if (log_level >= LOGLVL_TRACE) snprintf(trace_desc, sizeof(trace_desc), "every message");
+    else if (trace_sample > 0) snprintf(trace_desc, sizeof(trace_desc), "1 in %u messages", trace_sample);
+    else snprintf(trace_desc, sizeof(trace_desc), "off");
+    printf("[PLUGIN] Log level: %s, per-message trace: %s, trace ring: %llu lines%s%s\n",
+           trace_log_level_name(log_level), trace_desc, (unsigned long long)edge_log.mask + 1,
+           log_control_path[0] ? ", control file: " : "", log_control_path);
+    printf("[PLUGIN] FIFO record format: %s\n", fifo_binary ? "binary (72-byte FifoRecord)" : "json");
+    printf("[PLUGIN] Processor workers: %d, receive queue: %zu x %d (%s), CSV queue: %zu (%s)\n",
+           worker_count, workers[0].receive_ring.capacity, worker_count, ring_overflow_name(receive_overflow),
+           csv_ring.capacity, ring_overflow_name(csv_overflow));
+    if (decision_cache_enabled) {
+        printf("[PLUGIN] Decision cache: on (trust >= %.2f: %.0fms, drop with trust <= %.2f: %.0fms, "
+               "refresh queue: %zu, max %zu entries per worker)\n", cache_trust_high, cache_ttl_trusted * 1000.0,
+               cache_trust_low, cache_ttl_hostile * 1000.0, workers[0].refresh_ring.capacity, cache_max_entries);
+    } else {
+        printf("[PLUGIN] Decision cache: off\n");
+    }
+    if (decision_source_shm) {
+        printf("[PLUGIN] Decision source: shared memory (%s, %s, stale after %.0fms)\n",
+               shm_table_path, shm_ring_path, shm_stale_sec * 1000.0);
+        shm_attach(now_sec());
+    }
     curl_global_init(CURL_GLOBAL_ALL);
 
     // 確保目錄存在
@@ -579,12 +1162,19 @@ int mosquitto_plugin_init(mosquitto_plugin_id_t *identifier,
     system("mkdir -p /home/jason/mqtt-edge/forwarder");
 
     // 開啟日誌文件
-    log_file = fopen(LOG_PATH,"w");
-    if(log_file){
-        fprintf(log_file,
-          "packet_count,recv_ts,service_start_ts,api_start_ts,api_end_ts,service_end_ts,ip,delta,p_value,trust,packet_count_dup,action,actual_api_time_ms,wait_time_ms,total_service_time_ms\n");
-        fflush(log_file);
-        printf("[PLUGIN] Log file opened: %s\n", LOG_PATH);
+    const char *log_path = log_binary ? BIN_LOG_PATH : LOG_PATH;
+    if (batch_log_open(&plugin_log, log_path, log_buffer_bytes, log_flush_interval) == 0) {
+        if (log_binary) {
+            BinLogHeader hdr;
+            binlog_header_init(&hdr, "plugin", sizeof(PluginLogRecord));
+            batch_log_write_header(&plugin_log, &hdr, sizeof(hdr));
+        } else {
+            batch_log_write_header(&plugin_log, PLUGIN_CSV_HEADER, strlen(PLUGIN_CSV_HEADER));
+        }
+        printf("[PLUGIN] Log file opened: %s (%s, flush every %.0fms or %zuKB)\n", log_path,
+               log_binary ? "binary" : "csv", plugin_log.flush_interval * 1000.0, plugin_log.flush_bytes / 1024);
+    } else {
+        printf("[PLUGIN] Warning: cannot open log file %s: %s\n", log_path, strerror(errno));
     }
 
     // 建立雙 FIFO
@@ -618,12 +1208,24 @@ int mosquitto_plugin_init(mosquitto_plugin_id_t *identifier,
         printf("[PLUGIN] LOW FIFO opened: %s\n", LOW_FIFO_PATH);
     }
 
+    fflush(stdout);
+    if (trace_log_start(&edge_log, log_control_path) != 0) {
+        printf("[PLUGIN] Error: Failed to create trace log thread\n");
+        return MOSQ_ERR_UNKNOWN;
+    }
+
     threads_running = 1;
-    csv_writer_running = 1;
     
-    if (pthread_create(&processor_thread, NULL, processor_thread_fn, NULL) != 0) {
-        printf("[PLUGIN] Error: Failed to create processor thread\n");
-        return MOSQ_ERR_UNKNOWN;
+    for (int i = 0; i < worker_count; i++) {
+        if (pthread_create(&workers[i].thread, NULL, processor_thread_fn, &workers[i]) != 0) {
+            printf("[PLUGIN] Error: Failed to create processor worker %d\n", i);
+            return MOSQ_ERR_UNKNOWN;
+        }
+        if (decision_cache_enabled &&
+            pthread_create(&workers[i].refresh_thread, NULL, refresh_thread_fn, &workers[i]) != 0) {
+            printf("[PLUGIN] Error: Failed to create refresh thread for worker %d\n", i);
+            return MOSQ_ERR_UNKNOWN;
+        }
     }
     
     if (pthread_create(&csv_writer_thread, NULL, csv_writer_thread_fn, NULL) != 0) {
@@ -634,7 +1236,8 @@ int mosquitto_plugin_init(mosquitto_plugin_id_t *identifier,
     mosquitto_callback_register(identifier,
       MOSQ_EVT_MESSAGE, on_message_callback, NULL, NULL);
 
-    printf("[PLUGIN] initialized with three-stage dual FIFO pipeline (receive -> process -> HIGH/LOW FIFO)\n");
+    printf("[PLUGIN] initialized with three-stage dual FIFO pipeline (receive -> %d processor(s) -> HIGH/LOW FIFO)\n",
+           worker_count);
     fflush(stdout);
     return MOSQ_ERR_SUCCESS;
 }
@@ -646,13 +1249,41 @@ int mosquitto_plugin_cleanup(void *userdata,
     printf("[PLUGIN] Cleaning up...\n");
     
     threads_running = 0;
-    csv_writer_running = 0;
     
-    pthread_cond_signal(&receive_cond);
-    pthread_cond_signal(&csv_queue_cond);
-    
-    pthread_join(processor_thread, NULL);
+    for (int i = 0; i < worker_count; i++) {
+        ring_close(&workers[i].receive_ring);
+    }
+    for (int i = 0; i < worker_count; i++) {
+        pthread_join(workers[i].thread, NULL);
+    }
+    // worker 結束後不再有快取命中；refresher 先把剩餘的 API 更新送完
+    if (decision_cache_enabled) {
+        for (int i = 0; i < worker_count; i++) {
+            ring_close(&workers[i].refresh_ring);
+        }
+        for (int i = 0; i < worker_count; i++) {
+            pthread_join(workers[i].refresh_thread, NULL);
+            report_cache_stats(&workers[i]);
+        }
+    }
+    if (decision_source_shm) {
+        for (int i = 0; i < worker_count; i++) {
+            report_shm_stats(&workers[i]);
+        }
+        decision_shm_close(&shm_table);
+        delta_ring_close(&shm_ring);
+        shm_attached = 0;
+    }
+    // worker 都結束後才關閉 CSV 佇列，寫入執行緒會先寫完剩餘記錄
+    ring_close(&csv_ring);
     pthread_join(csv_writer_thread, NULL);
+    
+    RingStats rs;
+    ring_get_stats(&csv_ring, &rs);
+    printf("[PLUGIN] CSV queue: written=%llu, max depth=%zu/%zu, dropped_newest=%llu, dropped_oldest=%llu, blocked=%llu\n",
+           (unsigned long long)rs.popped, rs.high_watermark, rs.capacity,
+           (unsigned long long)rs.dropped_newest, (unsigned long long)rs.dropped_oldest,
+           (unsigned long long)rs.blocked);
 
     // 關閉雙 FIFO
     if (high_fifo_fd != -1) {
@@ -664,35 +1295,39 @@ int mosquitto_plugin_cleanup(void *userdata,
         low_fifo_fd = -1;
     }
 
-    // free receive queue
-    ReceiveNode *rn;
-    while((rn=receive_head)){
-        receive_head = rn->next;
-        free(rn);
+    // free receive / csv queues
+    for (int i = 0; i < worker_count; i++) {
+        ring_destroy(&workers[i].receive_ring);
+        if (decision_cache_enabled) {
+            DecisionEntry *d, *dtmp;
+            HASH_ITER(hh, workers[i].cache, d, dtmp) {
+                HASH_DEL(workers[i].cache, d);
+                free(d);
+            }
+            ring_destroy(&workers[i].refresh_ring);
+            pthread_mutex_destroy(&workers[i].cache_mutex);
+            pthread_cond_destroy(&workers[i].cache_cond);
+        }
     }
+    ring_destroy(&csv_ring);
 
-    // free csv queue
-    CSVRecord *cr;
-    while((cr=csv_queue_head)){
-        csv_queue_head = cr->next;
-        free(cr);
-    }
+    printf("[PLUGIN] Log: records=%llu, flushes=%llu, write_errors=%llu\n",
+           (unsigned long long)plugin_log.records, (unsigned long long)plugin_log.flushes,
+           (unsigned long long)plugin_log.write_errors);
+    batch_log_close(&plugin_log);
 
-    if(log_file) fclose(log_file);
+    report_ip_table_stats();
+    ip_table_destroy(&ip_table);
 
-    // free ip_table
-    struct ip_entry *e,*tmp;
-    HASH_ITER(hh, ip_table, e, tmp){
-        HASH_DEL(ip_table,e);
-        free(e);
-    }
+    fflush(stdout);
+    trace_log_stop(&edge_log);
+    printf("[PLUGIN] Trace log: lines=%llu in %llu writes, dropped=%llu, truncated=%llu\n",
+           (unsigned long long)edge_log.written, (unsigned long long)edge_log.writes,
+           (unsigned long long)edge_log.dropped, (unsigned long long)edge_log.truncated);
+    trace_log_destroy(&edge_log);
 
-    pthread_mutex_destroy(&ip_table_mutex);
-    pthread_mutex_destroy(&log_mutex);
-    pthread_mutex_destroy(&receive_mutex);
-    pthread_mutex_destroy(&csv_queue_mutex);
-    pthread_cond_destroy(&receive_cond);
-    pthread_cond_destroy(&csv_queue_cond);
+    pthread_mutex_destroy(&fifo_mutex);
+    pthread_mutex_destroy(&shm_mutex);
     
     curl_global_cleanup();
     printf("[PLUGIN] cleanup done\n");
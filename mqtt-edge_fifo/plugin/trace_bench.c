@@ -0,0 +1,123 @@
+// trace_bench.c
+// Cost per message of the plugin's per-message console lines: the old
+// printf() of every line against common/trace_log.h at each level / sample
+// rate. The lines go to stdout, so run it with stdout pointed at what the
+// broker really writes to; results are printed on stderr.
+//
+// Cost is process CPU time per message, sink thread included (the ring is
+// drained before the clock stops). Without a rate the producers run flat
+// out and the ring drops most traced lines; with a rate (messages/s per
+// thread) the sink keeps up as it would at the broker's real load.
+//
+//   make bench
+//   ./trace_bench [messages] [threads] [rate] > /dev/null
+//   ./trace_bench 200000 4 > /tmp/trace.out
+//   ./trace_bench 50000 1 20000 | cat > /dev/null   (pipe, like mosquitto -v | tee)
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+#include "trace_log.h"
+
+static TraceLog edge_log;
+static long messages = 200000;
+static double rate = 0.0;
+
+static double clock_sec(clockid_t id) {
+    struct timespec ts;
+    clock_gettime(id, &ts);
+    return ts.tv_sec + ts.tv_nsec / 1e9;
+}
+
+// 依 rate 控制送出速度：每 100 則檢查一次進度
+static void pace(long i, double t0) {
+    if (rate <= 0.0 || i % 100 != 99) return;
+    double ahead = (i + 1) / rate - (clock_sec(CLOCK_MONOTONIC) - t0);
+    if (ahead > 0) usleep((useconds_t)(ahead * 1e6));
+}
+
+// 與插件一則訊息相同的 9 行（[MSG] ... [FIFO]）
+#define MESSAGE_LINES(out, ...) do { \
+    out(__VA_ARGS__ "[MSG] Received from %s: %.*s\n", ip, 5, "hello"); \
+    out(__VA_ARGS__ "[receive] enqueued: ip=%s, packet_count=%ld, recv_ts=%.6f, worker=%d\n", ip, i, ts, id); \
+    out(__VA_ARGS__ "[API] Calling policy API for IP=%s, Delta=%.6f\n", ip, 0.987654); \
+    out(__VA_ARGS__ "[API] Request: {\"ip\":\"%s\",\"time_delta\":%.6f}\n", ip, 0.987654); \
+    out(__VA_ARGS__ "[API] Response: {\"action\":\"high\",\"trust\":%.4f,\"p_value\":%.6f}\n", 0.98, 0.75); \
+    out(__VA_ARGS__ "[API] *** DECISION *** Action=%s, Trust=%.3f, P_value=%.6f, High_threshold=%.3f\n", \
+        "high", 0.98, 0.75, 0.9); \
+    out(__VA_ARGS__ "[POLICY] *** SUMMARY *** Worker=%d, IP=%s, Delta=%.6f, Action=%s, Service_Time=%.3fms\n", \
+        id, ip, 0.987654, "high", 1.234); \
+    out(__VA_ARGS__ "[HIGH] *** HIGH PRIORITY *** IP=%s -> HIGH FIFO\n", ip); \
+    out(__VA_ARGS__ "[FIFO] Written to %s FIFO: {\"ip\":\"%s\",\"count\":%ld}\n", "HIGH", ip, i); \
+} while (0)
+
+#define TRACE_OUT(...) trace_log_printf(&edge_log, __VA_ARGS__)
+
+static void *run_printf(void *arg) {
+    int id = (int)(long)arg;
+    char ip[32];
+    snprintf(ip, sizeof(ip), "10.0.%d.1", id);
+    double t0 = clock_sec(CLOCK_MONOTONIC);
+    for (long i = 0; i < messages; i++) {
+        double ts = i * 0.001;
+        MESSAGE_LINES(printf);
+        pace(i, t0);
+    }
+    return NULL;
+}
+
+static void *run_trace(void *arg) {
+    int id = (int)(long)arg;
+    char ip[32];
+    snprintf(ip, sizeof(ip), "10.0.%d.1", id);
+    double t0 = clock_sec(CLOCK_MONOTONIC);
+    for (long i = 0; i < messages; i++) {
+        double ts = i * 0.001;
+        if (trace_log_sample(&edge_log)) MESSAGE_LINES(TRACE_OUT);
+        pace(i, t0);
+    }
+    return NULL;
+}
+
+// 回傳每則訊息的 CPU 時間 (us)，包含寫出剩餘內容的時間
+static double run(void *(*fn)(void *), int threads, int traced) {
+    pthread_t th[64];
+    double t0 = clock_sec(CLOCK_PROCESS_CPUTIME_ID);
+    if (traced) trace_log_start(&edge_log, NULL);
+    for (long i = 0; i < threads; i++) pthread_create(&th[i], NULL, fn, (void *)i);
+    for (int i = 0; i < threads; i++) pthread_join(th[i], NULL);
+    if (traced) trace_log_stop(&edge_log);
+    else fflush(stdout);
+    return (clock_sec(CLOCK_PROCESS_CPUTIME_ID) - t0) / (messages * threads) * 1e6;
+}
+
+int main(int argc, char **argv) {
+    if (argc > 1) messages = atol(argv[1]);
+    int threads = argc > 2 ? atoi(argv[2]) : 1;
+    if (threads < 1) threads = 1;
+    if (threads > 64) threads = 64;
+    if (argc > 3) rate = atof(argv[3]);
+
+    double base = run(run_printf, threads, 0);
+    fprintf(stderr, "%ld messages x %d threads at %s, 9 lines per traced message, CPU time incl. sink\n",
+            messages, threads, rate > 0 ? argv[3] : "full speed");
+    fprintf(stderr, "%-24s %8.3f us/message (100.0%% of printf)\n", "printf (before)", base);
+
+    static const struct { int level; unsigned sample; const char *label; } cases[] = {
+        {LOGLVL_INFO, 0, "info, no trace"},
+        {LOGLVL_INFO, 1000, "info, sample 1/1000"},
+        {LOGLVL_INFO, 100, "info, sample 1/100"},
+        {LOGLVL_INFO, 10, "info, sample 1/10"},
+        {LOGLVL_TRACE, 0, "trace (every message)"},
+    };
+    for (size_t c = 0; c < sizeof(cases) / sizeof(cases[0]); c++) {
+        if (trace_log_init(&edge_log, TRACE_LOG_DEFAULT_SLOTS, STDOUT_FILENO) != 0) return 1;
+        trace_log_set(&edge_log, cases[c].level, cases[c].sample);
+        double us = run(run_trace, threads, 1);
+        trace_log_destroy(&edge_log);
+        fprintf(stderr, "%-24s %8.3f us/message (%5.1f%% of printf)  %llu lines in %llu writes, %llu dropped\n",
+                cases[c].label, us, us / base * 100.0, (unsigned long long)edge_log.written,
+                (unsigned long long)edge_log.writes, (unsigned long long)edge_log.dropped);
+    }
+    return 0;
+}